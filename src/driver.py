@@ -1,17 +1,34 @@
 import argparse
 import logging
+import os
+import sys
+import time
 from lib.publisher import Publisher
 from lib.subscriber import Subscriber
 from lib.broker import Broker
+from lib.relay import Relay
+from lib.reconnect import ReconnectPolicy, TIERS
+from lib.expiry import parse_topic_ttls
+from lib.scheduler import parse_topic_options
+from lib.barrier import READY, DONE, STAGES, wait_barrier, remove_barrier
+from lib.zookeeper_client import wait_for_zookeeper
+from lib.local_cluster import LocalCluster
+from lib.transport import Transport, IpcTransport
 
 def create_publisher_with_zookeeper(publisher):
     """ Method to handle creation of publisher using zookeeper coordination"""
     publisher.connect_zk()
     publisher.start_session()
-    publisher.get_znode_value()
-    publisher.update_broker_info()
-    publisher.watch_znode_data_change()
+    if publisher.use_directory:
+        # Subscribers find us in the topic directory; no broker needed
+        publisher.configure()
+    else:
+        publisher.get_znode_value()
+        publisher.update_broker_info()
+        publisher.watch_znode_data_change()
+    publisher.signal_barrier(READY)
     publisher.publish()
+    publisher.signal_barrier(DONE)
     # Will call if not running indefinitely
     publisher.disconnect()
 
@@ -24,7 +41,9 @@ def create_publisher_without_zookeeper(publisher):
 
 def create_publishers(count=1, topics=[], broker_address='127.0.0.1',
     sleep_period=1, bind_port=5556, indefinite=False, max_event_count=15,
-    zookeeper_hosts=['127.0.0.1:2181'],verbose=False):
+    zookeeper_hosts=['127.0.0.1:2181'], ttl=None, payload_size=0, heartbeat_interval=None,
+    use_directory=False, reconnect={}, broker_heartbeats={}, zk_namespace=None, barrier=None,
+    transport=None, verbose=False):
     """ Method to create a set of publishers.
     In order to run multiple subscribers simultaneously,
     need to use multiprocessing library, because Publisher.publish() will block for i in range(count)
@@ -45,6 +64,15 @@ def create_publishers(count=1, topics=[], broker_address='127.0.0.1',
             indefinite=indefinite,
             max_event_count=max_event_count,
             zookeeper_hosts=zookeeper_hosts,
+            ttl=ttl,
+            payload_size=payload_size,
+            heartbeat_interval=heartbeat_interval,
+            use_directory=use_directory,
+            reconnect_policy=ReconnectPolicy(tier=TIERS['pub'], **reconnect),
+            **broker_heartbeats,
+            zk_namespace=zk_namespace,
+            barrier=barrier,
+            transport=transport,
             verbose=verbose
         )
         try:
@@ -60,11 +88,18 @@ def create_subscriber_with_zookeeper(subscriber):
     """ Method to handle creation of a subscriber using ZooKeeper coordination """
     subscriber.connect_zk()
     subscriber.start_session()
-    subscriber.get_znode_value()
-    subscriber.update_broker_info()
-    subscriber.watch_znode_data_change()
+    if subscriber.use_directory:
+        # Publishers are found in the topic directory; no broker needed
+        subscriber.configure()
+    else:
+        subscriber.get_znode_value()
+        subscriber.update_broker_info()
+        subscriber.watch_znode_data_change()
+    subscriber.signal_barrier(READY)
     subscriber.notify()
     subscriber.write_stored_messages()
+    # Only now is the data file complete; disconnect() exits
+    subscriber.signal_barrier(DONE)
     # Will call if not running indefinitely
     subscriber.disconnect()
 
@@ -77,7 +112,9 @@ def create_subscriber_without_zookeeper(subscriber):
 
 def create_subscribers(count=1, filename=None, broker_address='127.0.0.1',
      centralized=False, topics=[], indefinite=False, max_event_count=15,
-     zookeeper_hosts=['127.0.0.1:2181'],verbose=False):
+     zookeeper_hosts=['127.0.0.1:2181'], topic_ttls={}, heartbeat_interval=None,
+     replay_from_offsets={}, replay_from_times={}, use_relay=False, use_directory=False, reconnect={},
+     broker_heartbeats={}, zk_namespace=None, barrier=None, transport=None, verbose=False):
     """ Method to create a set of subscribers. In order to run multiple subscribers simultaneously,
     need to use multiprocessing library, because Subscriber.listen() will block for i in range(count)
     if run sequentially. E.g. subscriber 2 on the same host will not ever get to listen for updates
@@ -92,6 +129,17 @@ def create_subscribers(count=1, filename=None, broker_address='127.0.0.1',
             indefinite=indefinite,
             max_event_count=max_event_count,
             zookeeper_hosts=zookeeper_hosts,
+            topic_ttls=topic_ttls,
+            heartbeat_interval=heartbeat_interval,
+            replay_from_offsets=replay_from_offsets,
+            replay_from_times=replay_from_times,
+            use_relay=use_relay,
+            use_directory=use_directory,
+            reconnect_policy=ReconnectPolicy(tier=TIERS['sub'], **reconnect),
+            **broker_heartbeats,
+            zk_namespace=zk_namespace,
+            barrier=barrier,
+            transport=transport,
             verbose=verbose
         )
         try:
@@ -107,6 +155,44 @@ def create_subscribers(count=1, filename=None, broker_address='127.0.0.1',
             subs[i].write_stored_messages()
     return subs
 
+def create_relay_with_zookeeper(relay):
+    """ Method to handle creation of a relay using ZooKeeper coordination """
+    relay.connect_zk()
+    relay.start_session()
+    relay.get_znode_value()
+    relay.update_broker_info()
+    relay.watch_znode_data_change()
+    relay.signal_barrier(READY)
+    relay.event_loop()
+    relay.signal_barrier(DONE)
+    # Will call if not running indefinitely
+    relay.disconnect()
+
+def create_relay(topics=[], port=5580, indefinite=False, max_event_count=15,
+    zookeeper_hosts=['127.0.0.1:2181'], heartbeat_interval=None, reconnect={}, broker_heartbeats={},
+    zk_namespace=None, barrier=None, transport=None, verbose=False):
+    """ Method to create a relay re-publishing the broker's topics to its own subscribers """
+    relay = Relay(
+        topics=topics,
+        port=port,
+        indefinite=indefinite,
+        max_event_count=max_event_count,
+        zookeeper_hosts=zookeeper_hosts,
+        heartbeat_interval=heartbeat_interval,
+        reconnect_policy=ReconnectPolicy(tier=TIERS['relay'], **reconnect),
+        **broker_heartbeats,
+        zk_namespace=zk_namespace,
+        barrier=barrier,
+        transport=transport,
+        verbose=verbose
+    )
+    try:
+        create_relay_with_zookeeper(relay)
+    except KeyboardInterrupt:
+        # If you interrupt/cancel a relay, be sure to withdraw it and tell the broker
+        relay.disconnect()
+    return relay
+
 def create_broker_with_zookeeper(broker):
     """ Method to handle creation of broker using zookeeper coordination
     Args:
@@ -126,7 +212,14 @@ def create_broker_without_zookeeper(broker):
 
 def create_broker(indefinite=False, centralized=False, pub_reg_port=5555,
     sub_reg_port=5556, autokill=None, max_event_count=15, zookeeper_hosts=['127.0.0.1:2181'],
-    verbose=False):
+    conflate_topics=[], conflation_hwm=1, topic_ttls={}, topic_priorities={}, topic_weights={},
+    slow_consumer_policy=None, lane_hwm=100, lane_backlog=1000, rate_limit=None,
+    topic_rate_limits={}, rate_limit_burst=1.0, max_clients=None, max_topics=None,
+    max_sockets=None, control_share=1.0, retry_after=1.0, client_timeout=None,
+    idle_topic_timeout=None, log_dir=None, log_topics=[], log_segment_bytes=64 * 1024 * 1024,
+    log_retention=None, log_retention_bytes=None, log_fsync_interval=0.05, replay_port=5557,
+    replication_mode=None, replication_port=5558, replication_ack_timeout=1.0, zk_session_timeout=10.0,
+    zk_namespace=None, barrier=None, transport=None, verbose=False):
     broker = Broker(
         centralized=centralized,
         indefinite=indefinite,
@@ -135,6 +228,38 @@ def create_broker(indefinite=False, centralized=False, pub_reg_port=5555,
         max_event_count=max_event_count,
         autokill=autokill,
         zookeeper_hosts=zookeeper_hosts,
+        conflate_topics=conflate_topics,
+        conflation_hwm=conflation_hwm,
+        topic_ttls=topic_ttls,
+        topic_priorities=topic_priorities,
+        topic_weights=topic_weights,
+        slow_consumer_policy=slow_consumer_policy,
+        lane_hwm=lane_hwm,
+        lane_backlog=lane_backlog,
+        rate_limit=rate_limit,
+        topic_rate_limits=topic_rate_limits,
+        rate_limit_burst=rate_limit_burst,
+        max_clients=max_clients,
+        max_topics=max_topics,
+        max_sockets=max_sockets,
+        control_share=control_share,
+        retry_after=retry_after,
+        client_timeout=client_timeout,
+        idle_topic_timeout=idle_topic_timeout,
+        log_dir=log_dir,
+        log_topics=log_topics,
+        log_segment_bytes=log_segment_bytes,
+        log_retention=log_retention,
+        log_retention_bytes=log_retention_bytes,
+        log_fsync_interval=log_fsync_interval,
+        replay_port=replay_port,
+        replication_mode=replication_mode,
+        replication_port=replication_port,
+        replication_ack_timeout=replication_ack_timeout,
+        zk_session_timeout=zk_session_timeout,
+        zk_namespace=zk_namespace,
+        barrier=barrier,
+        transport=transport,
         verbose=verbose
     )
     try:
@@ -155,10 +280,57 @@ if __name__ == "__main__":
         help='pass this followed by an integer N to create N subscribers on this host')
     parser.add_argument('--broker', type=int,
         help='pass this followed by 1 to create 1 (max) broker on this host')
+    parser.add_argument('--relay', type=int,
+        help=('pass this followed by 1 to create 1 (max) relay on this host, re-publishing '
+        'the centralized broker\'s topics (-t) to the subscribers assigned to it'))
+    parser.add_argument('--relay_port', type=int, default=5580,
+        help='Optional with --relay. Port on which the relay publishes to its subscribers')
+    parser.add_argument('--use_relay', action='store_true',
+        help=('Optional with --subscriber --centralized. Receive topics from the least loaded '
+        'relay serving them (assigned through ZooKeeper) instead of from the broker'))
+    parser.add_argument('--use_directory', action='store_true',
+        help=('Optional with --publisher or --subscriber (not --centralized). Discover '
+        'publishers through the ZooKeeper topic directory (/topics) instead of the broker'))
 
     ## new argument for ZooKeeper
     parser.add_argument('-z', '--zookeeper_hosts', action='append',
         help=('zookeeper hosts and the port. Typical are 127.0.0.1:2181 for localhosts'))
+    parser.add_argument('--zk_namespace', type=str,
+        help=('Namespace of this pub/sub system on the ZooKeeper ensemble; all of its znodes live '
+        'under /<namespace>. Give every entity of a system the same namespace to run several '
+        'systems on one ensemble at once'))
+    parser.add_argument('--barrier', type=str,
+        help=('Barrier znode of a run orchestrated by a test driver, e.g. /barriers/run-1; the '
+        'entities signal ready and done below it (see lib/barrier.py)'))
+    parser.add_argument('--wait_zookeeper', action='store_true',
+        help=('Create no entity; wait until ZooKeeper answers (at most --barrier_timeout seconds) '
+        'and exit with status 0, or 1 if it did not'))
+    parser.add_argument('--wait_barrier', choices=STAGES,
+        help=('Create no entity; wait until --barrier_count entities reached this stage of '
+        '--barrier (at most --barrier_timeout seconds) and exit with status 0, or 1 if they did not'))
+    parser.add_argument('--barrier_count', type=int, default=1,
+        help='Entities --wait_barrier waits for')
+    parser.add_argument('--barrier_role', choices=['broker', 'publisher', 'subscriber', 'relay'],
+        help='Only count the entities of this role with --wait_barrier (default any)')
+    parser.add_argument('--barrier_timeout', type=float, default=60.0,
+        help='Upper bound in seconds for --wait_zookeeper, --wait_barrier and each stage of --local_cluster')
+    parser.add_argument('--transport', choices=['tcp', 'ipc'], default='tcp',
+        help=('Transport of the ZMQ sockets: tcp:// between hosts, or ipc:// (Unix domain sockets '
+        'in --ipc_dir) between processes of one machine. Give every entity of a system the same one'))
+    parser.add_argument('--host_address', type=str,
+        help=('Address every entity advertises to the others instead of the one of its host, '
+        'e.g. 127.0.0.1 when every entity runs on one machine'))
+    parser.add_argument('--ipc_dir', type=str, default='/tmp/pubsub',
+        help='Optional with --transport ipc. Directory of the Unix domain sockets; one per system')
+    parser.add_argument('--local_cluster', action='store_true',
+        help=('Run a broker, --publisher N publishers and --subscriber M subscribers as threads of '
+        'this process, over inproc:// with an in-memory ZooKeeper (see lib/local_cluster.py); '
+        'no ZooKeeper server or network needed'))
+    parser.add_argument('--profile', action='store_true',
+        help=('Optional with --local_cluster. Profile the entities and print the functions '
+        'with the highest cumulative time'))
+    parser.add_argument('--remove_barrier', action='store_true',
+        help='Create no entity; delete --barrier and every signal below it')
 
     ## For --subscriber; file to write stored messages to only if not using --indefinite
     parser.add_argument('-f', '--filename', type=str, help=(
@@ -198,6 +370,15 @@ if __name__ == "__main__":
         help='(for use with -pub port on which to publish. If not provided with --pub, port 5556 used.')
     parser.add_argument('-s', '--sleep', type=float,
         help='Number of seconds to sleep between publish events. If not provided, 1 second used.')
+    parser.add_argument('--ttl', type=float,
+        help='(for use with -pub) time-to-live in seconds attached to every published event')
+    parser.add_argument('--payload_size', type=int, default=0,
+        help='(for use with -pub) bytes of payload carried by every published event')
+
+    # Optional with --broker and --subscriber; drop messages older than their topic's TTL
+    parser.add_argument('--topic_ttl', action='append',
+        help=('(for use with --broker/--subscriber) per-topic time-to-live as TOPIC=SECONDS; '
+        'expired messages are dropped instead of forwarded/recorded. Can be passed multiple times.'))
 
     #################################################################
     # Required with --broker
@@ -212,12 +393,124 @@ if __name__ == "__main__":
         help=(
             'Optional with --broker. Auto kill a broker after N (--autokill N) seconds '
             '(to test leader election with multiple brokers)'))
+
+    # Optional with --broker --centralized; only the latest message per key is kept
+    # for these topics while their subscribers are behind
+    parser.add_argument('-cf', '--conflate', action='append',
+        help=(
+            'Optional with --broker --centralized. Conflate this topic (keep only the newest '
+            'message per key while subscribers are behind). Can be passed multiple times.'))
+    parser.add_argument('--conflation_hwm', type=int, default=1,
+        help='Per-subscriber high-water mark (messages) after which conflated topics start conflating')
+
+    # Optional with --broker --centralized; scheduling of topics in the forwarding loop
+    parser.add_argument('--topic_priority', action='append',
+        help=('Optional with --broker --centralized. Priority class as TOPIC=N; class 0 is '
+        'forwarded first, default class is 1. Can be passed multiple times.'))
+    parser.add_argument('--topic_weight', action='append',
+        help=('Optional with --broker --centralized. Relative forwarding share within a '
+        'priority class as TOPIC=N (default 1). Can be passed multiple times.'))
+
+    # Optional with --broker --centralized; isolate slow subscribers on their own lanes
+    parser.add_argument('--slow_consumer_policy', choices=['drop-oldest', 'disconnect', 'degrade'],
+        help=('Optional with --broker --centralized. Give each subscriber its own bounded lane and '
+        'apply this policy once a slow subscriber fills it: drop-oldest, disconnect, or degrade '
+        '(keep only the newest message per key until it catches up)'))
+    parser.add_argument('--lane_hwm', type=int, default=100,
+        help='Messages queued per subscriber lane before the subscriber is considered slow')
+    parser.add_argument('--lane_backlog', type=int, default=1000,
+        help='Messages the broker holds for a slow subscriber before applying its policy')
+
+    # Optional with --broker --centralized; token bucket limits on publisher ingress.
+    # Can be replaced at runtime by writing JSON to the /ratelimits znode.
+    parser.add_argument('--rate_limit', type=float,
+        help='Optional with --broker --centralized. Max messages per second accepted from each publisher per topic')
+    parser.add_argument('--topic_rate_limit', action='append',
+        help=('Optional with --broker --centralized. Per-topic limit as TOPIC=MSGS_PER_SEC, '
+        'overrides --rate_limit. Can be passed multiple times.'))
+    parser.add_argument('--rate_limit_burst', type=float, default=1.0,
+        help='Seconds of traffic at the limit a publisher may send back to back (bucket size)')
+
+    # Optional with --broker; admission control for publisher/subscriber registration
+    parser.add_argument('--max_clients', type=int,
+        help='Optional with --broker. Max registered publishers + subscribers; others are told to retry later')
+    parser.add_argument('--max_topics', type=int,
+        help='Optional with --broker. Max distinct topics; registrations adding more are rejected')
+    parser.add_argument('--max_sockets', type=int,
+        help='Optional with --broker. Max sockets the broker may hold open')
+    parser.add_argument('--control_share', type=float, default=1.0,
+        help=('Optional with --broker. Max fraction of broker time spent handling registrations; '
+        'the rest is reserved for forwarding (default 1.0 = no cap)'))
+    parser.add_argument('--retry_after', type=float, default=1.0,
+        help='Optional with --broker. Seconds rejected clients wait before retrying (plus backoff)')
+
+    # Liveness tracking and reclamation of dead clients / idle topics
+    parser.add_argument('--client_timeout', type=float,
+        help=('Optional with --broker. Reclaim publishers/subscribers not heard from '
+        '(registration, heartbeat or published message) for this many seconds'))
+    parser.add_argument('--idle_topic_timeout', type=float,
+        help='Optional with --broker. Close and forget topics idle for this many seconds')
+    parser.add_argument('--heartbeat_interval', type=float,
+        help=('Optional with --publisher/--subscriber. Seconds between heartbeats to the broker; '
+        'use with a broker --client_timeout larger than this'))
+    # Optional with --publisher/--subscriber/--relay; staged reconnection after a broker change
+    parser.add_argument('--reconnect_jitter', type=float, default=0.0,
+        help=('Optional with --publisher/--subscriber/--relay. After a broker change, reconnect '
+        'after a random delay of up to this many seconds'))
+    parser.add_argument('--reconnect_tier_interval', type=float, default=0.0,
+        help=('Optional with --publisher/--subscriber/--relay. Seconds between reconnection tiers '
+        'after a broker change: subscribers and relays reconnect first, publishers this much later'))
+    parser.add_argument('--registration_timeout', type=float,
+        help=('Optional with --publisher/--subscriber/--relay. Seconds to wait for the broker to '
+        'answer a registration before retrying with exponential backoff (default: wait forever)'))
+    # Broker failure detection
+    parser.add_argument('--broker_heartbeat_interval', type=float,
+        help=('Optional with --publisher/--subscriber/--relay. Seconds between ZMTP heartbeats on '
+        'the connection to the broker, so a dead or hung broker is noticed within the heartbeat timeout'))
+    parser.add_argument('--broker_heartbeat_timeout', type=float,
+        help=('Optional with --broker_heartbeat_interval. Seconds without an answer after which the '
+        'broker counts as gone (default: twice the interval)'))
+    parser.add_argument('--zk_session_timeout', type=float, default=10.0,
+        help=('Optional with --broker. ZooKeeper session timeout in seconds; a dead leader\'s /broker '
+        'znode disappears, and a standby takes over, this long after it stopped answering'))
+
+    # Optional with --broker --centralized; durable per-topic message log
+    parser.add_argument('--log_dir', type=str,
+        help='Optional with --broker --centralized. Directory of the durable per-topic message logs')
+    parser.add_argument('--log_topic', action='append',
+        help='Optional with --log_dir. Topic to log; repeat for several (default: every topic)')
+    parser.add_argument('--log_segment_mb', type=int, default=64,
+        help='Optional with --log_dir. Size of a log segment file in MiB')
+    parser.add_argument('--log_retention', type=float,
+        help='Optional with --log_dir. Delete log segments older than this many seconds')
+    parser.add_argument('--log_retention_mb', type=int,
+        help='Optional with --log_dir. Keep at most this many MiB of log per topic')
+    parser.add_argument('--log_fsync_interval', type=float, default=0.05,
+        help='Optional with --log_dir. Max seconds between two flushes of a topic log (group commit)')
+    parser.add_argument('--replay_port', type=int, default=5557,
+        help='Optional with --log_dir. Port on which the broker serves replay requests')
+    parser.add_argument('--replication_mode', choices=['async', 'one'],
+        help=('Optional with --log_dir. Stream the topic logs to standby brokers: async, or one '
+        '(fan out a message only once a standby acknowledged it)'))
+    parser.add_argument('--replication_port', type=int, default=5558,
+        help='Optional with --replication_mode. Port on which the leader streams its logs to standbys')
+    parser.add_argument('--replication_ack_timeout', type=float, default=1.0,
+        help=('Optional with --replication_mode one. Max seconds a message waits for a standby\'s '
+        'acknowledgement before being fanned out anyway'))
+    parser.add_argument('--replay_from_offset', action='append',
+        help=('Optional with --subscriber --centralized. TOPIC=OFFSET; replay the topic\'s logged '
+        'messages from that offset before switching to the live stream. Repeat for several topics'))
+    parser.add_argument('--replay_from_time', action='append',
+        help=('Optional with --subscriber --centralized. TOPIC=UNIX_TIME; replay the topic\'s '
+        'messages logged since that time before switching to the live stream'))
     #################################################################
 
     args = parser.parse_args()
 
     if args.broker and args.broker > 1:
         raise argparse.ArgumentTypeError('Maximum broker count is 1 (one)')
+    if args.relay and args.relay > 1:
+        raise argparse.ArgumentTypeError('Maximum relay count is 1 (one)')
 
     logger = logging.getLogger('driver')
     formatter = logging.Formatter('%(prefix)s - %(message)s')
@@ -232,16 +525,85 @@ if __name__ == "__main__":
     else:
         logger.setLevel(logging.INFO)
 
-    if (args.publisher and args.subscriber) or (args.publisher and args.broker) or \
-        (args.broker and args.subscriber):
+    if not args.local_cluster and len(
+        [role for role in [args.publisher, args.subscriber, args.broker, args.relay] if role]) > 1:
         raise argparse.ArgumentTypeError(
             'Host should have:\n'
             '- only publishers,\n'
-            '- only subscribers, or\n'
-            '- only a broker. \n'
-            'Cannot use mix of --publisher , --subscriber , --broker on single host.'
+            '- only subscribers,\n'
+            '- only a broker, or\n'
+            '- only a relay. \n'
+            'Cannot use mix of --publisher , --subscriber , --broker , --relay on single host.'
             )
 
+    if args.wait_zookeeper or args.wait_barrier or args.remove_barrier:
+        # Orchestration by a test driver (see lib/barrier.py); no entity is created
+        if (args.wait_barrier or args.remove_barrier) and not args.barrier:
+            raise argparse.ArgumentTypeError('--wait_barrier and --remove_barrier need --barrier <path>')
+        hosts = ','.join(args.zookeeper_hosts or ['127.0.0.1:2181'])
+        if args.zk_namespace:
+            hosts += f'/{args.zk_namespace}'
+        started = time.time()
+        try:
+            zk = wait_for_zookeeper(hosts, args.barrier_timeout)
+        except TimeoutError as e:
+            logger.error(str(e), extra=driver_logging_prefix)
+            sys.exit(1)
+        logger.info(f'ZooKeeper at {hosts} answered after {time.time() - started:.2f}s',
+            extra=driver_logging_prefix)
+        reached = True
+        if args.wait_barrier:
+            names = wait_barrier(zk, args.barrier, args.wait_barrier, args.barrier_count,
+                max(0.0, args.barrier_timeout - (time.time() - started)), role=args.barrier_role)
+            reached = len(names) >= args.barrier_count
+            logger.info(f'{len(names)} of {args.barrier_count} entities reached {args.wait_barrier} '
+                f'of {args.barrier} after {time.time() - started:.2f}s', extra=driver_logging_prefix)
+        if args.remove_barrier:
+            remove_barrier(zk, args.barrier)
+        zk.stop()
+        zk.close()
+        sys.exit(0 if reached else 1)
+
+    if args.local_cluster:
+        # The whole system in this process (see lib/local_cluster.py)
+        if not args.topics:
+            raise argparse.ArgumentTypeError('--local_cluster needs a set of topics: -t <topic> [-t <topic> ...]')
+        cluster = LocalCluster(
+            publishers=args.publisher or 1,
+            subscribers=args.subscriber or 1,
+            topics=args.topics,
+            max_event_count=args.max_event_count if args.max_event_count else 15,
+            sleep_period=args.sleep if args.sleep is not None else 0.0,
+            centralized=args.centralized,
+            filename=args.filename,
+            timeout=args.barrier_timeout,
+            profile=args.profile,
+            verbose=args.verbose
+        )
+        elapsed = cluster.run()
+        if elapsed is not None:
+            logger.info(f'{cluster.received_count() / elapsed:.0f} events/s delivered',
+                extra=driver_logging_prefix)
+        if args.profile:
+            cluster.profile_stats().sort_stats('cumulative').print_stats(25)
+        sys.exit(0 if elapsed is not None else 1)
+
+    if args.transport == 'ipc':
+        os.makedirs(args.ipc_dir, exist_ok=True)
+        transport = IpcTransport(args.ipc_dir, host=args.host_address or 'local')
+    else:
+        transport = Transport(host=args.host_address)
+
+    reconnect = {
+        'jitter': args.reconnect_jitter,
+        'tier_interval': args.reconnect_tier_interval,
+        'registration_timeout': args.registration_timeout
+    }
+    broker_heartbeats = {
+        'broker_heartbeat_interval': args.broker_heartbeat_interval,
+        'broker_heartbeat_timeout': args.broker_heartbeat_timeout
+    }
+
     if args.publisher:
         if not args.topics:
             raise argparse.ArgumentTypeError(
@@ -261,6 +623,15 @@ if __name__ == "__main__":
             indefinite=args.indefinite if args.indefinite else False,
             max_event_count=args.max_event_count if args.max_event_count else 15,
             zookeeper_hosts=args.zookeeper_hosts,
+            ttl=args.ttl,
+            payload_size=args.payload_size,
+            heartbeat_interval=args.heartbeat_interval,
+            use_directory=args.use_directory,
+            reconnect=reconnect,
+            broker_heartbeats=broker_heartbeats,
+            zk_namespace=args.zk_namespace,
+            barrier=args.barrier,
+            transport=transport,
             verbose=args.verbose
             )
 
@@ -280,6 +651,10 @@ if __name__ == "__main__":
                 'Cannot write to file (--filename) if using indefinite loop; file write only '
                 'happens at end of finite loop'
                 )
+        if args.use_directory and args.centralized:
+            raise argparse.ArgumentTypeError(
+                '--use_directory only works with direct dissemination (without --centralized)'
+                )
         subscribers = create_subscribers(
             count=args.subscriber,
             filename=args.filename if args.filename else None,
@@ -289,6 +664,19 @@ if __name__ == "__main__":
             indefinite=args.indefinite if args.indefinite else False,
             max_event_count=args.max_event_count if args.max_event_count else 15,
             zookeeper_hosts=args.zookeeper_hosts,
+            topic_ttls=parse_topic_ttls(args.topic_ttl if args.topic_ttl else []),
+            heartbeat_interval=args.heartbeat_interval,
+            replay_from_offsets=parse_topic_options(
+                args.replay_from_offset if args.replay_from_offset else []),
+            replay_from_times=parse_topic_options(
+                args.replay_from_time if args.replay_from_time else [], cast=float),
+            use_relay=args.use_relay,
+            use_directory=args.use_directory,
+            reconnect=reconnect,
+            broker_heartbeats=broker_heartbeats,
+            zk_namespace=args.zk_namespace,
+            barrier=args.barrier,
+            transport=transport,
             verbose=args.verbose
             )
     if args.broker:
@@ -308,5 +696,58 @@ if __name__ == "__main__":
             max_event_count=args.max_event_count if args.max_event_count else 15,
             autokill=autokill,
             zookeeper_hosts=args.zookeeper_hosts,
+            conflate_topics=args.conflate if args.conflate else [],
+            conflation_hwm=args.conflation_hwm,
+            topic_ttls=parse_topic_ttls(args.topic_ttl if args.topic_ttl else []),
+            topic_priorities=parse_topic_options(args.topic_priority if args.topic_priority else []),
+            topic_weights=parse_topic_options(args.topic_weight if args.topic_weight else []),
+            slow_consumer_policy=args.slow_consumer_policy,
+            lane_hwm=args.lane_hwm,
+            lane_backlog=args.lane_backlog,
+            rate_limit=args.rate_limit,
+            topic_rate_limits=parse_topic_options(
+                args.topic_rate_limit if args.topic_rate_limit else [], cast=float),
+            rate_limit_burst=args.rate_limit_burst,
+            max_clients=args.max_clients,
+            max_topics=args.max_topics,
+            max_sockets=args.max_sockets,
+            control_share=args.control_share,
+            retry_after=args.retry_after,
+            client_timeout=args.client_timeout,
+            idle_topic_timeout=args.idle_topic_timeout,
+            log_dir=args.log_dir,
+            log_topics=args.log_topic if args.log_topic else [],
+            log_segment_bytes=args.log_segment_mb * 1024 * 1024,
+            log_retention=args.log_retention,
+            log_retention_bytes=args.log_retention_mb * 1024 * 1024 if args.log_retention_mb else None,
+            log_fsync_interval=args.log_fsync_interval,
+            replay_port=args.replay_port,
+            replication_mode=args.replication_mode,
+            replication_port=args.replication_port,
+            replication_ack_timeout=args.replication_ack_timeout,
+            zk_session_timeout=args.zk_session_timeout,
+            zk_namespace=args.zk_namespace,
+            barrier=args.barrier,
+            transport=transport,
+            verbose=args.verbose
+        )
+    if args.relay:
+        if not args.topics:
+            raise argparse.ArgumentTypeError(
+                'If creating a relay with --relay, you must provide the topics it relays '
+                'with -t <topic> [-t <topic> ...]'
+                )
+        create_relay(
+            topics=args.topics,
+            port=args.relay_port,
+            indefinite=args.indefinite if args.indefinite else False,
+            max_event_count=args.max_event_count if args.max_event_count else 15,
+            zookeeper_hosts=args.zookeeper_hosts,
+            heartbeat_interval=args.heartbeat_interval,
+            reconnect=reconnect,
+            broker_heartbeats=broker_heartbeats,
+            zk_namespace=args.zk_namespace,
+            barrier=args.barrier,
+            transport=transport,
             verbose=args.verbose
         )
@@ -0,0 +1,86 @@
+""" Admission control for the broker's registration (control) path.
+Without limits, a reconnect storm makes the broker accept every registration,
+allocate sockets and ports for each, and (in decentralized mode) run blocking
+notification round trips, until file descriptors run out and forwarding stalls.
+The AdmissionController caps registered clients, topics and sockets, rejects
+what does not fit with a retry-after hint, and caps the share of broker time
+spent on registrations so forwarding keeps running during a storm.
+"""
+import time
+
+class AdmissionController:
+
+    def __init__(self, max_clients=None, max_topics=None, max_sockets=None,
+        control_share=1.0, window=1.0, retry_after=1.0):
+        """ Constructor
+        args:
+        - max_clients (int) - max registered publishers + subscribers; None = unlimited
+        - max_topics (int) - max distinct topics known to the broker; None = unlimited
+        - max_sockets (int) - max sockets the broker may hold open; None = unlimited
+        - control_share (float) - max fraction (0-1] of broker time spent handling
+          registrations per window; registrations beyond it wait in the socket queue
+        - window (float) - length in seconds of the control share accounting window
+        - retry_after (float) - seconds rejected clients are told to wait before retrying
+        """
+        self.max_clients = max_clients
+        self.max_topics = max_topics
+        self.max_sockets = max_sockets
+        self.control_share = control_share
+        self.window = window
+        self.retry_after = retry_after
+        self.window_start = time.time()
+        # Seconds spent on registrations in the current window
+        self.control_time = 0.0
+        self.admitted_count = 0
+        self.rejected_counts = {}
+        self.deferred_count = 0
+
+    def has_budget(self, now=None):
+        """ Return True if registration work may run now without exceeding control_share """
+        if self.control_share >= 1.0:
+            return True
+        now = time.time() if now is None else now
+        if now - self.window_start >= self.window:
+            self.window_start = now
+            self.control_time = 0.0
+        if self.control_time < self.control_share * self.window:
+            return True
+        self.deferred_count += 1
+        return False
+
+    def charge(self, seconds):
+        """ Account for time spent handling one registration """
+        self.control_time += seconds
+
+    def admit(self, new_client, new_topics, new_sockets, clients, topics, sockets):
+        """ Decide whether a registration fits within the configured limits
+        Args:
+        - new_client (bool) - whether the registration adds a client not yet known
+        - new_topics (int) - number of topics the registration would add
+        - new_sockets (int) - number of sockets the registration would open
+        - clients, topics, sockets (int) - current usage
+        Returns None if admitted, otherwise a rejection reason string """
+        reason = None
+        if new_client and self.max_clients is not None and clients + 1 > self.max_clients:
+            reason = 'max_clients'
+        elif self.max_topics is not None and topics + new_topics > self.max_topics:
+            reason = 'max_topics'
+        elif self.max_sockets is not None and sockets + new_sockets > self.max_sockets:
+            reason = 'max_sockets'
+        if reason:
+            self.rejected_counts[reason] = self.rejected_counts.get(reason, 0) + 1
+        else:
+            self.admitted_count += 1
+        return reason
+
+    def rejection(self, reason):
+        """ Return the reply sent to a rejected client """
+        return {'error': f'registration rejected: {reason}', 'retry_after': self.retry_after}
+
+    def stats(self):
+        """ Return admitted, rejected (per reason) and deferred counters """
+        return {
+            'admitted': self.admitted_count,
+            'rejected': dict(self.rejected_counts),
+            'deferred': self.deferred_count
+        }
@@ -0,0 +1,20 @@
+""" Retry delays for clients (re)registering with a broker """
+import random
+
+def backoff_delay(attempt, base=0.1, cap=30.0, retry_after=None, jitter=True):
+    """ Return how long to wait before retry number attempt (0-based)
+    Args:
+    - attempt (int) - number of failed attempts so far
+    - base (float) - delay of the first retry in seconds, doubled on every attempt
+    - cap (float) - max delay in seconds
+    - retry_after (float) - optional delay requested by the broker; always waited
+      in full, with the backoff delay added on top
+    - jitter (bool) - if True, pick the backoff uniformly in [delay/2, delay] so that
+      clients rejected together do not all retry at the same instant
+    """
+    delay = min(cap, base * (2 ** attempt))
+    if jitter:
+        delay = random.uniform(delay / 2, delay)
+    if retry_after is not None:
+        delay += retry_after
+    return delay
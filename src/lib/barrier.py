@@ -0,0 +1,77 @@
+""" ZooKeeper barriers that let a test driver orchestrate a run instead of sleeping
+for a fixed time (after scaffolding/ZooKeeper/BarrierMininet).
+
+A barrier is a znode (e.g. /barriers/<run>) with a child per stage. Every entity
+given the barrier (driver.py --barrier) signals a stage by creating a znode named
+after itself below it:
+- READY: the entity is configured and registered; the leader broker once it leads,
+  publishers before they publish, subscribers before they listen. Ephemeral, so an
+  entity that dies drops out of the count.
+- DONE: the entity finished its work; a subscriber once its data file is written.
+  Persistent, so the signal is not lost when the entity exits right after it.
+The test driver waits for a number of entities to reach a stage (wait_barrier, or
+driver.py --wait_barrier from a Mininet host) and proceeds the moment they have;
+its timeout is an upper bound, not a sleep. Signals are named <role>-<id>, and a
+wait counts the entities of one role only: brokers, publishers and relays signal
+DONE too, so a test waiting for its subscribers' data counts subscriber-* only.
+"""
+import threading
+import time
+from kazoo.exceptions import NodeExistsError, NoNodeError
+
+READY = 'ready'
+DONE = 'done'
+STAGES = [READY, DONE]
+
+def stage_path(barrier, stage):
+    """ Return the znode path below which entities signal a stage of a barrier """
+    return f"{barrier.rstrip('/')}/{stage}"
+
+def signal_barrier(zk, barrier, stage, name):
+    """ Signal that an entity reached a stage of a barrier
+    Args:
+    - zk (KazooClient) - started ZooKeeper client
+    - barrier (str) - barrier znode path
+    - stage (str) - READY or DONE
+    - name (str) - name of the entity, unique within the run
+    """
+    try:
+        zk.create(f'{stage_path(barrier, stage)}/{name}', makepath=True, ephemeral=(stage == READY))
+    except NodeExistsError:
+        # Signalled already (e.g. again after a reconnect)
+        pass
+
+def wait_barrier(zk, barrier, stage, count, timeout=None, role=None):
+    """ Block until count entities reached a stage of a barrier or timeout seconds
+    passed; return the names of the entities that reached it
+    Args:
+    - zk (KazooClient) - started ZooKeeper client
+    - barrier (str) - barrier znode path
+    - stage (str) - READY or DONE
+    - count (int) - number of entities to wait for
+    - timeout (float) - optional upper bound in seconds; None waits forever
+    - role (str) - optional role (broker, publisher, subscriber, relay); only the
+      entities of that role count and are returned
+    """
+    path = stage_path(barrier, stage)
+    zk.ensure_path(path)
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        changed = threading.Event()
+        # One-shot watch, re-armed by the next read
+        names = zk.get_children(path, watch=lambda event: changed.set())
+        if role is not None:
+            names = [name for name in names if name.startswith(f'{role}-')]
+        if len(names) >= count:
+            return names
+        remaining = None if deadline is None else deadline - time.time()
+        if remaining is not None and remaining <= 0:
+            return names
+        changed.wait(remaining)
+
+def remove_barrier(zk, barrier):
+    """ Delete a barrier and every signal below it """
+    try:
+        zk.delete(barrier, recursive=True)
+    except NoNodeError:
+        pass
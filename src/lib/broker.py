@@ -3,6 +3,19 @@ Message Broker to serve as anonymizing middleware between
 publishers and subscribers
 """
 from .zookeeper_client import ZookeeperClient
+from .transport import TCP_TRANSPORT
+from .conflation import ConflationBuffer, conflation_key
+from .expiry import is_expired
+from .scheduler import TopicScheduler
+from .lanes import SubscriberLane
+from .rate_limiter import IngressRateLimiter
+from .admission import AdmissionController
+from .liveness import LivenessTracker, resource_usage
+from .topic_log import TopicLogStore
+from .replication import ReplicationLeader, ReplicationFollower
+from .topic_ids import TopicIdTable
+from .barrier import READY, DONE
+from kazoo.client import KazooState
 import zmq
 import json
 import random
@@ -10,6 +23,7 @@ import logging
 import pickle
 import netifaces
 import sys
+import threading
 import time
 
 
@@ -20,8 +34,17 @@ class Broker(ZookeeperClient):
     #################################################################
     def __init__(self, centralized=False, indefinite=False, max_event_count=15,
         zookeeper_hosts=['127.0.0.1:2181'], pub_reg_port=5555, sub_reg_port=5556, autokill=None,
-        verbose=False):
+        conflate_topics=[], conflation_hwm=1, conflation_max_keys=1024, topic_ttls={},
+        topic_priorities={}, topic_weights={}, slow_consumer_policy=None, lane_hwm=100,
+        lane_backlog=1000, rate_limit=None, topic_rate_limits={}, rate_limit_burst=1.0,
+        max_clients=None, max_topics=None, max_sockets=None, control_share=1.0, retry_after=1.0,
+        client_timeout=None, idle_topic_timeout=None, log_dir=None, log_topics=[],
+        log_segment_bytes=64 * 1024 * 1024, log_retention=None, log_retention_bytes=None,
+        log_fsync_interval=0.05, replay_port=5557, replication_mode=None, replication_port=5558,
+        replication_ack_timeout=1.0, zk_session_timeout=10.0, zk_namespace=None,
+        barrier=None, transport=None, verbose=False):
         self.verbose = verbose
+        self.transport = transport or TCP_TRANSPORT
         self.centralized = centralized
         self.prefix = {'prefix': f'BROKER({id(self)}'}
         self.set_logger()
@@ -53,17 +76,145 @@ class Broker(ZookeeperClient):
         # broker will have a list of sockets for receiving from publisher
         # broker will also have a list of sockets for sending to subscrbier
         self.receive_socket_dict = {}
+        # key = topic, value = set of publisher addresses the topic's receive socket is connected to
+        self.receive_connections = {}
         self.send_socket_dict = {}
         self.send_port_dict = {}
         self.used_ports = []
 
+        # Conflated topics (centralized dissemination only): only the newest message
+        # per key is kept while subscribers of the topic are behind.
+        # key = topic, value = ConflationBuffer holding pending messages for that topic
+        self.conflation_hwm = conflation_hwm
+        self.conflation_buffers = {
+            topic: ConflationBuffer(max_keys=conflation_max_keys) for topic in conflate_topics
+        }
+        # Max number of queued messages drained from a conflated topic per poll event
+        # so one flooding topic cannot monopolize the event loop
+        self.CONFLATION_DRAIN_LIMIT = 1000
+
+        # Per-topic time-to-live in seconds (centralized dissemination only); a 'ttl'
+        # field on a published event overrides it. Expired messages are not forwarded.
+        # key = topic, value = number of expired messages dropped for that topic
+        self.topic_ttls = topic_ttls
+        self.expired_counts = {}
+
+        # Decides how ready topic sockets share the forwarding loop (centralized only):
+        # strict priority between classes, weighted deficit round robin within a class
+        self.scheduler = TopicScheduler(
+            topic_priorities=topic_priorities, topic_weights=topic_weights)
+
+        # Slow consumer isolation (centralized only). If a policy is set, each subscriber
+        # gets its own lane (XPUB socket) for its non-conflated topics instead of sharing
+        # one PUB socket per topic, so a slow subscriber only fills its own bounded queue.
+        # key = subscriber id, value = SubscriberLane
+        self.slow_consumer_policy = slow_consumer_policy
+        self.lane_hwm = lane_hwm
+        self.lane_backlog = lane_backlog
+        self.subscriber_lanes = {}
+        # key = topic, value = list of SubscriberLanes forwarding that topic
+        self.lanes_by_topic = {}
+        # Lanes closed by the disconnect policy, kept for reporting
+        self.disconnected_lanes = {}
+
+        # Token bucket limits on publisher ingress (centralized only), replaceable at
+        # runtime through the JSON value of the rate limit znode
+        self.rate_limiter = IngressRateLimiter(
+            default_rate=rate_limit, topic_rates=topic_rate_limits, burst_seconds=rate_limit_burst)
+        self.rate_limit_znode = '/ratelimits'
+
+        # Admission control on the registration path: limits on clients, topics and
+        # sockets, and a cap on the share of broker time spent on registrations
+        self.admission = AdmissionController(
+            max_clients=max_clients, max_topics=max_topics, max_sockets=max_sockets,
+            control_share=control_share, retry_after=retry_after)
+        # ids of registered publishers and subscribers
+        self.client_ids = set()
+
+        # Reclamation of state left behind by crashed clients and idle topics.
+        # A client is alive while it registers, sends heartbeats or (centralized)
+        # publishes; a topic is active while it carries traffic or live clients.
+        # key = client id, value = {'role': 'pub'|'sub', 'address', 'topics', 'notify_port'}
+        self.client_registrations = {}
+        # key = publisher address as carried in events, value = publisher id
+        self.publisher_ids = {}
+        self.client_liveness = LivenessTracker(timeout=client_timeout)
+        self.topic_activity = LivenessTracker(timeout=idle_topic_timeout)
+        # Seconds between two reclamation passes of the event loop
+        self.RECLAIM_INTERVAL = 1.0
+        self.next_reclaim_time = time.time() + self.RECLAIM_INTERVAL
+        self.reclaimed_clients = 0
+        self.reclaimed_topics = 0
+        # Resource usage before and after the last pass that reclaimed anything
+        self.last_reclamation = None
+
+        # Durable topic logs (centralized only): with a log directory, every forwarded
+        # message of a logged topic (all topics if log_topics is empty) is appended
+        # to that topic's log before fan-out, so it can be replayed later
+        self.topic_logs = None
+        if log_dir:
+            self.topic_logs = TopicLogStore(
+                log_dir, topics=log_topics, segment_bytes=log_segment_bytes,
+                retention_seconds=log_retention, retention_bytes=log_retention_bytes,
+                fsync_interval=log_fsync_interval)
+        # Subscribers fetch logged messages they missed from this ROUTER socket, one
+        # chunk of raw log records (at most REPLAY_CHUNK_BYTES) per request
+        self.replay_port = replay_port
+        self.replay_socket = None
+        self.REPLAY_CHUNK_BYTES = 1024 * 1024
+        # Max replay requests answered per poll event, so replay cannot starve forwarding
+        self.REPLAY_REQUESTS_PER_POLL = 16
+        self.replay_requests = 0
+        self.replayed_messages = 0
+
+        # Log replication (centralized only): the leader streams its topic logs to the
+        # standby brokers over a ROUTER socket on replication_port; standbys append them
+        # to their own logs while waiting in the election, so a new leader resumes from
+        # its replicated copy. replication_mode is one of ReplicationLeader.MODES or None
+        if replication_mode and replication_mode not in ReplicationLeader.MODES:
+            raise ValueError(f'Unknown replication mode <{replication_mode}>; '
+                f'expected one of {ReplicationLeader.MODES}')
+        if replication_mode and not (centralized and self.topic_logs):
+            raise ValueError('Log replication requires centralized dissemination and a log directory')
+        self.replication_mode = replication_mode
+        self.replication_port = replication_port
+        self.replication_ack_timeout = replication_ack_timeout
+        self.replication_socket = None
+        self.replication = None
+        # Standby side: follower thread and the leader replication endpoint it follows
+        self.standby_thread = None
+        self.standby_stop = threading.Event()
+        self.leader_replication_endpoint = None
+        self.standby_follower = None
+
+        # Compact topic IDs handed out at registration and used as the filter frame
+        # of published messages instead of the topic name; the table lives in
+        # ZooKeeper once this broker leads, so IDs survive a failover
+        self.topic_ids = TopicIdTable()
+
         # Initialize configuration for ZooKeeper client
-        super().__init__(zookeeper_hosts=zookeeper_hosts)
+        super().__init__(zookeeper_hosts=zookeeper_hosts, namespace=zk_namespace)
+        # A session of our own: our ephemeral /broker is told apart from another
+        # broker's by its session, so two brokers of a process must not share one
+        self.share_zk_session = False
+        self.barrier = barrier
+        # A leader whose session expires loses its ephemeral /broker to the next
+        # leader, so the session timeout bounds how long clients follow a dead broker
+        self.zk_session_timeout = zk_session_timeout
+        # czxid of our /broker while we lead (see ZookeeperClient.is_new_broker);
+        # fenced once our session expired and another broker may lead
+        self.epoch = None
+        self.fenced = False
+        # kazoo Election we contend in (see zk_run_election)
+        self.election = None
 
         # this is for write into the znode about the broker information
         self.pub_reg_port = pub_reg_port
         self.sub_reg_port = sub_reg_port
         self.znode_value = f"{self.get_host_address()},{self.pub_reg_port},{self.sub_reg_port}"
+        if self.replication_mode:
+            # Standbys find the leader's replication endpoint in the fourth field
+            self.znode_value += f",{self.replication_port}"
         self.info(f"Successfully initialized broker object (BROKER{id(self)})")
 
     def set_logger(self):
@@ -86,29 +237,58 @@ class Broker(ZookeeperClient):
         self.logger.debug(msg, extra=self.prefix)
 
     def leader_function(self):
-        self.debug(f"I am the leader {str(self.zk_instance_id)}")
-        self.debug(f"Create a Znode with my information")
-        if self.zk.exists(self.zk_name):
-            ## FIXME: since znode /broker is ephemeral, then its existence implies liveness of another leader
-            self.debug(f"{self.zk_name} znode exists : only modify the value)")
-            self.modify_znode_value(self.znode_value.encode('utf-8'))
-        else:
-            self.debug(f"{self.zk_name} znode does not exists : create one)")
-            self.create_znode()
+        self.take_leadership()
         # the following does not necessarily change
         self.debug("Configure Myself")
         self.configure()
+        if self.centralized:
+            self.watch_rate_limits()
+        self.signal_barrier(READY)
         try:
             self.event_loop()
             # Reached if not indefinite
+            self.signal_barrier(DONE)
             self.disconnect()
         except KeyboardInterrupt:
             # If you interrupt/cancel a broker, be sure to disconnect/clean all sockets
             self.disconnect()
 
+    def take_leadership(self):
+        """ Take over the coordination state of the previous leader once elected:
+        publish our /broker znode (our epoch) and load the topic ID table """
+        self.debug(f"I am the leader {str(self.zk_instance_id)}")
+        # Stop following the previous leader; its replicated logs are now ours
+        self.stop_standby_replication()
+        self.debug(f"Write my information to {self.zk_name}")
+        # As leader we no longer follow the znode
+        self.unwatch_znode(self.zk_name)
+        # Ephemeral, so it goes with our session and clients never wait on a dead
+        # leader longer than the session timeout; the previous leader's is waited out
+        stat = self.zk_session.create_ephemeral_znode(self.zk_name, self.znode_value.encode('utf-8'))
+        self.epoch = stat.czxid
+        self.info(f"Leading with epoch {self.epoch}")
+        self.zk.add_listener(self.leadership_state_changed)
+        # Hand out the same topic IDs as the previous leaders
+        self.topic_ids.load(self.zk)
+
+    def leadership_state_changed(self, state):
+        """ Session listener of the leader: once the session is lost, /broker and our
+        election lock are gone and another broker may already lead """
+        if state == KazooState.LOST and self.epoch is not None:
+            self.fenced = True
+            # Listeners returning True are removed
+            return True
+
     def zk_run_election(self):
         self.election = self.zk.Election("/electionpath", self.zk_instance_id)
-        self.debug(f"contenders: {self.election.contenders()}")
+        contenders = self.election.contenders()
+        self.debug(f"contenders: {contenders}")
+        if contenders:
+            # Another broker leads; follow its znode while we wait to be elected
+            self.watch_znode(self.zk_name)
+        if self.replication_mode:
+            # Copy the leader's topic logs while waiting to be elected
+            self.start_standby_replication()
         # Blocks until election is won, then calls leader function
         self.election.run(self.leader_function)
 
@@ -116,7 +296,7 @@ class Broker(ZookeeperClient):
         """ Method to perform initial configuration of Broker entity """
         self.debug("Configure Start")
         #  The zmq context
-        self.context = zmq.Context()
+        self.context = self.transport.context()
         # we will use the poller to poll for incoming data
         self.poller = zmq.Poller()
         # these are the sockets we open one for each registration
@@ -137,6 +317,21 @@ class Broker(ZookeeperClient):
         self.debug("Register sockets with a ZMQ poller")
         self.poller.register(self.pub_reg_socket, zmq.POLLIN)
         self.poller.register(self.sub_reg_socket, zmq.POLLIN)
+        if self.centralized and self.topic_logs:
+            self.replay_socket = self.context.socket(zmq.ROUTER)
+            self.setup_replay_port_binding()
+            self.used_ports.append(self.replay_port)
+            self.poller.register(self.replay_socket, zmq.POLLIN)
+        if self.replication_mode:
+            # Resume from the logs on disk (replicated while we were a standby)
+            self.topic_logs.open_all()
+            self.replication_socket = self.context.socket(zmq.ROUTER)
+            self.setup_replication_port_binding()
+            self.used_ports.append(self.replication_port)
+            self.poller.register(self.replication_socket, zmq.POLLIN)
+            self.replication = ReplicationLeader(
+                self.replication_socket, self.topic_logs, mode=self.replication_mode,
+                ack_timeout=self.replication_ack_timeout)
         self.debug("Configure Stop")
 
     def setup_pub_port_reg_binding(self):
@@ -148,7 +343,7 @@ class Broker(ZookeeperClient):
         while not success:
             try:
                 self.debug(f'Attempting bind to port {self.pub_reg_port}')
-                self.pub_reg_socket.bind(f'tcp://*:{self.pub_reg_port}')
+                self.pub_reg_socket.bind(self.transport.bind_endpoint(self.pub_reg_port))
                 success = True
                 self.debug(f'Successful bind to port {self.pub_reg_port}')
             except:
@@ -168,7 +363,7 @@ class Broker(ZookeeperClient):
         while not success:
             try:
                 self.debug(f'Attempting bind to port {self.sub_reg_port}')
-                self.sub_reg_socket.bind(f'tcp://*:{self.sub_reg_port}')
+                self.sub_reg_socket.bind(self.transport.bind_endpoint(self.sub_reg_port))
                 success = True
                 self.debug(f'Successful bind to port {self.sub_reg_port}')
             except:
@@ -179,6 +374,38 @@ class Broker(ZookeeperClient):
                 except Exception as e:
                     self.debug(e)
 
+    def setup_replay_port_binding(self):
+        """
+        Method to bind the replay socket to replay_port. If replay_port already in use,
+        increment and keep trying until success.
+        """
+        success = False
+        while not success:
+            try:
+                self.debug(f'Attempting bind to port {self.replay_port}')
+                self.replay_socket.bind(self.transport.bind_endpoint(self.replay_port))
+                success = True
+                self.debug(f'Successful bind to port {self.replay_port}')
+            except zmq.error.ZMQError:
+                self.error(f'Port {self.replay_port} already in use, attempting next port')
+                self.replay_port += 1
+
+    def setup_replication_port_binding(self):
+        """
+        Method to bind the replication socket to replication_port. If replication_port
+        already in use, increment and keep trying until success.
+        """
+        success = False
+        while not success:
+            try:
+                self.debug(f'Attempting bind to port {self.replication_port}')
+                self.replication_socket.bind(self.transport.bind_endpoint(self.replication_port))
+                success = True
+                self.debug(f'Successful bind to port {self.replication_port}')
+            except zmq.error.ZMQError:
+                self.error(f'Port {self.replication_port} already in use, attempting next port')
+                self.replication_port += 1
+
     def parse_events(self, index):
         """ BOTH CENTRAL AND DECENTRALIZED DISSEMINATION
         Parse events returned by ZMQ poller and handle accordingly
@@ -188,25 +415,58 @@ class Broker(ZookeeperClient):
         Args:
         - index (int) - event index, just used for logging current event loop index
          """
+        if self.fenced:
+            # Step down rather than serve clients alongside the new leader
+            self.error(f"ZooKeeper session lost; stepping down as leader of epoch {self.epoch}")
+            self.disconnect()
         try:
-            # Don't block indefinitely; wait max of .5 second
-            events = dict(self.poller.poll(500))
+            # Don't block indefinitely; wait max of .5 second, or much less if
+            # conflated messages are waiting for their subscribers to catch up, or
+            # standbys are behind or have yet to acknowledge held back messages
+            pending = self.has_pending_conflated() or self.has_pending_lanes() or (
+                self.replication is not None and (self.replication.has_pending() or self.replication.behind))
+            timeout = 10 if pending else 500
+            events = dict(self.poller.poll(timeout))
         except zmq.error.ZMQError as e:
             if 'Socket operation on non-socket' in str(e):
                 self.error(f'Exception with self.poller.poll(): {e}')
                 self.disconnect()
-        if self.pub_reg_socket in events:
-            self.register_pub()
-            if self.centralized:
-                self.update_receive_socket()
-        elif self.sub_reg_socket in events:
-            self.debug(f"Event {index}: subscriber")
-            self.register_sub()
+        registration_ready = self.pub_reg_socket in events or self.sub_reg_socket in events
+        if registration_ready and self.admission.has_budget():
+            started = time.time()
+            if self.pub_reg_socket in events:
+                self.register_pub()
+                if self.centralized:
+                    self.update_receive_socket()
+            else:
+                self.debug(f"Event {index}: subscriber")
+                self.register_sub()
+            self.admission.charge(time.time() - started)
+        elif registration_ready and len(events) == 1:
+            # Out of control-plane budget; registrations stay queued on their sockets.
+            # Nothing else is ready, so avoid spinning on the readable registration socket.
+            time.sleep(0.001)
+        if self.topic_logs:
+            # Group commit of the messages logged since the last flush
+            self.topic_logs.maybe_sync()
+        if time.time() >= self.next_reclaim_time:
+            self.reclaim()
+            if self.topic_logs:
+                self.topic_logs.enforce_retention()
+            self.next_reclaim_time = time.time() + self.RECLAIM_INTERVAL
         # For centralized dissemination, also handle sending
         if self.centralized:
-            for topic in self.receive_socket_dict.keys():
-                if self.receive_socket_dict[topic] in events:
-                    self.send(topic)
+            if self.replay_socket is not None and self.replay_socket in events:
+                self.serve_replay()
+            self.forward(events)
+            if self.replication is not None:
+                self.service_replication(events)
+            # Retry conflated messages that could not be forwarded last time
+            for topic in self.conflation_buffers.keys():
+                self.flush_conflated(topic)
+            # Retry messages held for slow subscribers
+            for lane in list(self.subscriber_lanes.values()):
+                lane.flush()
 
     def event_loop(self):
         """ BOTH CENTRAL AND DECENTRALIZED DISSEMINATION
@@ -247,25 +507,555 @@ class Broker(ZookeeperClient):
         for topic in self.publishers.keys():
             if topic not in self.receive_socket_dict.keys():
                 self.receive_socket_dict[topic] = self.context.socket(zmq.SUB)
+                self.receive_socket_dict[topic].setsockopt(zmq.SUBSCRIBE, self.topic_ids.frame(topic))
                 self.poller.register(self.receive_socket_dict[topic], zmq.POLLIN)
+                self.receive_connections[topic] = set()
             for address in self.publishers[topic]:
+                # Only connect new publishers; connecting an address twice would
+                # duplicate its messages and makes each registration O(publishers)
+                if address in self.receive_connections[topic]:
+                    continue
                 self.debug(f"'Subscribing' to publisher {address}")
-                self.receive_socket_dict[topic].connect(f"tcp://{address}")
-                self.receive_socket_dict[topic].setsockopt_string(zmq.SUBSCRIBE, topic)
+                self.receive_socket_dict[topic].connect(self.transport.endpoint(address))
+                self.receive_connections[topic].add(address)
         # self.debug("Broker Receive Socket: {0:s}".format(str(list(self.receive_socket_dict.keys()))))
 
+    def forward(self, events):
+        """ CENTRALIZED DISSEMINATION
+        Forward the queued messages of every ready topic socket. The topic scheduler
+        decides the order (priority class first, then round robin) and how many
+        messages each topic may forward (deficit round robin by weight) before the
+        broker polls again, so a flooding topic cannot starve the others. Lower
+        classes wait until every higher class has drained.
+        Args:
+        - events (dict) - socket events returned by the ZMQ poller
+        """
+        ready_topics = [
+            topic for topic, socket in self.receive_socket_dict.items() if socket in events
+        ]
+        for topic in self.scheduler.order(ready_topics):
+            if self.scheduler.blocked(topic):
+                break
+            budget = self.scheduler.budget(topic)
+            sent = 0
+            while sent < budget and self.send(topic):
+                sent += 1
+            self.scheduler.charge(topic, sent, drained=sent < budget)
+
     def send(self, topic):
         """ CENTRALIZED DISSEMINATION
         Take a received message for a given topic and forward
         that message to the appropriate set of subscribers using
-        send_socket_dict[topic] """
-        if topic in self.send_socket_dict.keys():
+        send_socket_dict[topic]. Does not block.
+        Returns True if a message was taken off the topic's receive socket """
+        if topic not in self.send_socket_dict.keys() and topic not in self.lanes_by_topic:
+            return False
+        if topic in self.conflation_buffers:
+            # Conflation drains everything queued for the topic at once
+            self.conflate(topic)
+            return False
+        try:
             # received_message = self.receive_socket_dict[topic].recv_string()
-            [topic,received_message] = self.receive_socket_dict[topic].recv_multipart()
-            unpickled_message = pickle.loads(received_message)
-            self.debug(f"Forwarding Msg: <{unpickled_message}>")
+            # The first frame is the topic's ID frame; it is forwarded as-is
+            [topic_frame, received_message] = self.receive_socket_dict[topic].recv_multipart(zmq.NOBLOCK)
+        except zmq.Again:
+            return False
+        unpickled_message = pickle.loads(received_message)
+        if not self.rate_limiter.allow(unpickled_message['publisher'], topic):
+            # Over its ingress limit; drop before doing any forwarding work
+            return True
+        if is_expired(unpickled_message, self.topic_ttls, topic=topic):
+            self.drop_expired(topic)
+            return True
+        self.debug(f"Forwarding Msg: <{unpickled_message}>")
+        self.seen_traffic(unpickled_message['publisher'], topic)
+        frames = self.log_frames([topic_frame, received_message], topic)
+        key = conflation_key(unpickled_message) if topic in self.lanes_by_topic else None
+        if self.replication is not None and self.replication.mode == 'one' and len(frames) > 2:
+            # Fan out once a standby holds the message (see service_replication)
+            self.replication.hold(topic, int(frames[2]), (frames, key))
+        else:
+            self.fan_out(topic, frames, key)
+        return True
+
+    def fan_out(self, topic, frames, key=None):
+        """ CENTRALIZED DISSEMINATION
+        Send a message's frames to the subscribers of topic, through their lanes if
+        the topic uses lanes, otherwise on the topic's send socket """
+        if topic in self.lanes_by_topic:
+            # Copy; the disconnect policy may remove a lane while offering
+            for lane in list(self.lanes_by_topic[topic]):
+                lane.offer(frames, key)
+        elif topic in self.send_socket_dict:
             # self.send_socket_dict[topic].send_string(received_message)
-            self.send_socket_dict[topic.decode('utf8')].send_multipart([topic, received_message])
+            self.send_socket_dict[topic].send_multipart(frames)
+
+    def log_frames(self, frames, topic):
+        """ CENTRALIZED DISSEMINATION
+        Append a message to its topic log (if logged) and return the frames to forward:
+        [topic, message] plus, for logged topics, a third frame with the message's log
+        offset so subscribers can switch from replay to the live stream without gaps or
+        duplicates """
+        if not self.topic_logs:
+            return frames
+        offset = self.topic_logs.append(topic, frames[1])
+        if offset is None:
+            return frames
+        return frames + [b'%d' % offset]
+
+    def service_replication(self, events):
+        """ CENTRALIZED DISSEMINATION
+        Handle standby hellos and acks, fan out the messages they released (or that
+        waited longer than the ack timeout) and stream newly logged records to the standbys """
+        released = []
+        if self.replication_socket in events:
+            released = self.replication.handle_messages()
+        if self.replication.has_pending():
+            released.extend(self.replication.release())
+        for topic, (frames, key) in released:
+            self.fan_out(topic, frames, key)
+        self.replication.stream()
+
+    def start_standby_replication(self):
+        """ Follow the leader's replication endpoint (from the broker znode) in a
+        background thread that appends its stream to our topic logs """
+        def leader_changed(data, stat, event):
+            if self.standby_stop.is_set():
+                # Returning False cancels the watch once we lead
+                return False
+            fields = data.decode('utf-8').split(',') if data else []
+            if len(fields) > 3 and data.decode('utf-8') != self.znode_value:
+                self.leader_replication_endpoint = self.transport.endpoint(fields[0], fields[3])
+            else:
+                self.leader_replication_endpoint = None
+            self.debug(f'Standby replicating from {self.leader_replication_endpoint}')
+        self.watch_znode(self.zk_name, leader_changed)
+        self.standby_thread = threading.Thread(target=self.standby_replication_loop, daemon=True)
+        self.standby_thread.start()
+
+    def standby_replication_loop(self):
+        """ Standby thread: (re)connect to the current leader and append its stream """
+        context = self.transport.context()
+        socket = None
+        endpoint = None
+        while not self.standby_stop.is_set():
+            if self.leader_replication_endpoint != endpoint:
+                if socket is not None:
+                    socket.close(linger=0)
+                    socket = self.standby_follower = None
+                endpoint = self.leader_replication_endpoint
+                if endpoint:
+                    socket = context.socket(zmq.DEALER)
+                    socket.connect(endpoint)
+                    self.standby_follower = ReplicationFollower(socket, self.topic_logs)
+                    self.standby_follower.hello()
+            if self.standby_follower is not None:
+                self.standby_follower.poll(100)
+                self.topic_logs.maybe_sync()
+            else:
+                time.sleep(0.1)
+        self.standby_follower = None
+        context.destroy(linger=0)
+
+    def stop_standby_replication(self):
+        """ Stop the standby thread, e.g. once elected leader """
+        self.standby_stop.set()
+        if self.standby_thread is not None:
+            self.standby_thread.join()
+            self.standby_thread = None
+
+    def get_replication_stats(self):
+        """ Return the leader's per-standby lag and stream counters, or a standby's
+        count of replicated messages """
+        if self.replication is not None:
+            return self.replication.stats()
+        if self.standby_follower is not None:
+            return {'following': self.leader_replication_endpoint,
+                'appended': self.standby_follower.appended_count}
+        return {}
+
+    def conflate(self, topic):
+        """ CENTRALIZED DISSEMINATION
+        Drain the messages currently queued for a conflated topic into its
+        conflation buffer, keeping only the newest message per key, then forward
+        as much of the buffer as the topic's subscribers can accept. The key is the
+        'key' field of the published event if present, otherwise the publisher address. """
+        buffer = self.conflation_buffers[topic]
+        receive_socket = self.receive_socket_dict[topic]
+        for _ in range(self.CONFLATION_DRAIN_LIMIT):
+            try:
+                frames = receive_socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            message = pickle.loads(frames[1])
+            if not self.rate_limiter.allow(message['publisher'], topic):
+                continue
+            if is_expired(message, self.topic_ttls, topic=topic):
+                self.drop_expired(topic)
+                continue
+            self.seen_traffic(message['publisher'], topic)
+            # Every message is logged, even those conflation replaces later
+            buffer.put(conflation_key(message), self.log_frames(frames, topic))
+        self.flush_conflated(topic)
+
+    def flush_conflated(self, topic):
+        """ CENTRALIZED DISSEMINATION
+        Forward pending conflated messages for a topic, oldest key first, until
+        the send socket reports backpressure (a subscriber of the topic is at its
+        high-water mark) or the buffer is empty """
+        buffer = self.conflation_buffers[topic]
+        if topic not in self.send_socket_dict:
+            return
+        while len(buffer):
+            key, frames = buffer.peek()
+            # A message may have expired while waiting for the subscribers
+            if is_expired(pickle.loads(frames[1]), self.topic_ttls, topic=topic):
+                self.drop_expired(topic)
+                buffer.pop(key)
+                continue
+            try:
+                self.send_socket_dict[topic].send_multipart(frames, zmq.NOBLOCK)
+            except zmq.Again:
+                # Subscribers are behind; newer messages will replace this one meanwhile
+                break
+            self.debug(f"Forwarding conflated Msg for key {key}")
+            buffer.pop(key)
+
+    def has_pending_conflated(self):
+        """ Return True if any conflated topic has messages waiting to be forwarded """
+        return any(len(buffer) for buffer in self.conflation_buffers.values())
+
+    def get_conflation_stats(self):
+        """ Return pending/conflated/evicted counters for each conflated topic """
+        return {topic: buffer.stats() for topic, buffer in self.conflation_buffers.items()}
+
+    def count_sockets(self):
+        """ Return the number of sockets currently held open by the broker """
+        return (2 + len(self.receive_socket_dict) + len(self.send_socket_dict)
+            + len(self.notify_sub_sockets) + len(self.subscriber_lanes))
+
+    def admit_registration(self, client_id, topics, new_sockets):
+        """ Check a registration against the admission limits
+        Args:
+        - client_id - id of the registering publisher/subscriber
+        - topics (list) - topics of the registration
+        - new_sockets (int) - sockets the registration opens besides one per new topic
+        Returns None if admitted, otherwise the rejection reply to send """
+        known_topics = set(self.publishers) | set(self.subscribers)
+        new_topics = len([t for t in set(topics) if t not in known_topics])
+        reason = self.admission.admit(
+            new_client=client_id not in self.client_ids,
+            new_topics=new_topics,
+            new_sockets=new_sockets + (new_topics if self.centralized else 0),
+            clients=len(self.client_ids),
+            topics=len(known_topics),
+            sockets=self.count_sockets())
+        if reason:
+            self.debug(f"Rejecting registration of {client_id}: {reason}")
+            return self.admission.rejection(reason)
+        return None
+
+    def get_admission_stats(self):
+        """ Return admitted/rejected/deferred registration counters and current usage """
+        stats = self.admission.stats()
+        stats.update({
+            'clients': len(self.client_ids),
+            'topics': len(set(self.publishers) | set(self.subscribers)),
+            'sockets': self.count_sockets()
+        })
+        return stats
+
+    def seen_traffic(self, publisher, topic):
+        """ CENTRALIZED DISSEMINATION
+        Record that a publisher and a topic are alive because a message was forwarded """
+        if self.topic_activity.enabled:
+            self.topic_activity.touch(topic)
+        if self.client_liveness.enabled and publisher in self.publisher_ids:
+            self.client_liveness.touch(self.publisher_ids[publisher])
+
+    def track_registration(self, client_id, role, address, topics, notify_port=None):
+        """ Remember what a client registered so it can be reclaimed without a
+        disconnect message, and mark the client and its topics alive """
+        registration = self.client_registrations.setdefault(client_id, {
+            'role': role, 'address': address, 'topics': [], 'notify_port': notify_port})
+        registration['topics'] = sorted(set(registration['topics']) | set(topics))
+        if notify_port is not None:
+            registration['notify_port'] = notify_port
+        if role == 'pub':
+            self.publisher_ids[address] = client_id
+        self.client_liveness.touch(client_id)
+        for topic in topics:
+            self.topic_activity.touch(topic)
+
+    def forget_registration(self, client_id):
+        """ Drop the liveness state of a client that disconnected or was reclaimed """
+        registration = self.client_registrations.pop(client_id, None)
+        if registration and registration['role'] == 'pub':
+            self.publisher_ids.pop(registration['address'], None)
+        self.client_liveness.forget(client_id)
+
+    def heartbeat(self, msg):
+        """ Handle a heartbeat from a registered client. The reply asks the client to
+        register again if the broker reclaimed it (or some of its topics) meanwhile.
+        Args:
+        - msg (dict) - {'heartbeat': {'id': client id, 'topics': [...]}}
+        """
+        hb = msg['heartbeat']
+        registration = self.client_registrations.get(hb['id'])
+        if not registration or not set(hb.get('topics', [])) <= set(registration['topics']):
+            self.debug(f"Heartbeat from unknown or reclaimed client {hb['id']}")
+            return json.dumps({'reregister': True})
+        self.client_liveness.touch(hb['id'])
+        for topic in registration['topics']:
+            self.topic_activity.touch(topic)
+        return json.dumps({'heartbeat': 'ok'})
+
+    def reclaim(self, now=None):
+        """ BOTH CENTRAL AND DECENTRALIZED DISSEMINATION
+        Release everything held for clients that stopped sending registrations,
+        heartbeats or messages for longer than the client timeout, then for topics
+        idle for longer than the idle topic timeout. Resource usage before and after
+        is logged and kept in last_reclamation.
+        Returns (reclaimed client ids, reclaimed topics) """
+        dead_clients = self.client_liveness.expired(now)
+        idle_topics = self.topic_activity.expired(now)
+        if not dead_clients and not idle_topics:
+            return [], []
+        before = self.get_resource_usage()
+        for client_id in dead_clients:
+            self.reclaim_client(client_id)
+        for topic in idle_topics:
+            self.reclaim_topic(topic)
+        after = self.get_resource_usage()
+        self.last_reclamation = {
+            'clients': dead_clients, 'topics': idle_topics, 'before': before, 'after': after}
+        self.info(
+            f"Reclaimed {len(dead_clients)} dead clients and {len(idle_topics)} idle topics; "
+            f"usage before: {before}, after: {after}")
+        return dead_clients, idle_topics
+
+    def reclaim_client(self, client_id):
+        """ Remove a dead client exactly as if it had sent a disconnect message """
+        registration = self.client_registrations.get(client_id)
+        if not registration:
+            self.client_liveness.forget(client_id)
+            return
+        self.debug(f"Reclaiming dead client {client_id}: {registration}")
+        msg = {'disconnect': {
+            'id': client_id,
+            'address': registration['address'],
+            'topics': registration['topics'],
+            'notify_port': registration['notify_port']
+        }}
+        try:
+            if registration['role'] == 'pub':
+                self.disconnect_pub(msg)
+            else:
+                self.disconnect_sub(msg)
+        except (KeyError, ValueError) as e:
+            # Partially released state must not keep the client around forever
+            self.error(f"Inconsistent state while reclaiming client {client_id}: {e}")
+            self.client_ids.discard(client_id)
+            self.forget_registration(client_id)
+        self.reclaimed_clients += 1
+
+    def reclaim_topic(self, topic):
+        """ Close the sockets of an idle topic and remove it from the registry and from
+        every client registration. Clients with no topics left are forgotten; clients
+        still alive are asked to register again on their next heartbeat. """
+        self.debug(f"Reclaiming idle topic {topic}")
+        self.topic_activity.forget(topic)
+        self.publishers.pop(topic, None)
+        self.subscribers.pop(topic, None)
+        if topic in self.receive_socket_dict:
+            self.poller.unregister(self.receive_socket_dict[topic])
+            self.receive_socket_dict.pop(topic).close(linger=0)
+        self.receive_connections.pop(topic, None)
+        if topic in self.send_socket_dict:
+            self.send_socket_dict.pop(topic).close(linger=0)
+        self.send_port_dict.pop(topic, None)
+        self.scheduler.forget(topic)
+        if topic in self.conflation_buffers:
+            self.conflation_buffers[topic].clear()
+        if self.topic_logs:
+            # Messages stay on disk; only the open segment files are released
+            self.topic_logs.close_log(topic)
+        for lane in self.lanes_by_topic.pop(topic, []):
+            lane.topics.discard(topic)
+        for client_id, registration in list(self.client_registrations.items()):
+            if topic not in registration['topics']:
+                continue
+            registration['topics'].remove(topic)
+            if not registration['topics']:
+                self.reclaim_client(client_id)
+        self.reclaimed_topics += 1
+
+    def get_resource_usage(self):
+        """ Return the clients, topics and sockets held by the broker along with the
+        open file descriptors and resident memory of the process """
+        usage = {
+            'clients': len(self.client_ids),
+            'topics': len(set(self.publishers) | set(self.subscribers)),
+            'sockets': self.count_sockets()
+        }
+        usage.update(resource_usage())
+        return usage
+
+    def get_reclamation_stats(self):
+        """ Return reclaimed client/topic counters, the number of tracked clients and
+        topics, and resource usage around the last reclamation """
+        return {
+            'reclaimed_clients': self.reclaimed_clients,
+            'reclaimed_topics': self.reclaimed_topics,
+            'tracked_clients': len(self.client_liveness),
+            'tracked_topics': len(self.topic_activity),
+            'last_reclamation': self.last_reclamation
+        }
+
+    def serve_replay(self):
+        """ CENTRALIZED DISSEMINATION
+        Answer pending replay requests without blocking. A request is the JSON
+        {'topic': t, 'from_offset': n} or {'topic': t, 'from_time': unix time}
+        (optionally with 'max_bytes'); the reply is a JSON header with first_offset,
+        count, next_offset and end_offset (the log end when the request was served),
+        followed by one frame of raw log records sent zero-copy from the segment map.
+        Subscribers pull one chunk per request, which also gives flow control. """
+        for _ in range(self.REPLAY_REQUESTS_PER_POLL):
+            try:
+                frames = self.replay_socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            try:
+                header, chunk = self.replay_chunk(json.loads(frames[-1]))
+            except (ValueError, KeyError, TypeError) as e:
+                header, chunk = {'error': f'invalid replay request: {e}'}, b''
+            reply = frames[:-1] + [json.dumps(header).encode('utf8')]
+            if chunk:
+                reply.append(chunk)
+            self.replay_socket.send_multipart(reply, copy=False)
+
+    def replay_chunk(self, request):
+        """ Return (header, raw records) answering one replay request """
+        topic = request['topic']
+        if not self.topic_logs.logs_topic(topic):
+            return {'error': f'topic {topic} is not logged'}, b''
+        log = self.topic_logs.log(topic)
+        if request.get('from_offset') is not None:
+            offset = int(request['from_offset'])
+        elif request.get('from_time') is not None:
+            offset = log.offset_for_time(float(request['from_time']))
+        else:
+            offset = log.start_offset
+        first_offset, count, chunk = log.read_raw(
+            offset, min(request.get('max_bytes', self.REPLAY_CHUNK_BYTES), self.REPLAY_CHUNK_BYTES))
+        self.replay_requests += 1
+        self.replayed_messages += count
+        header = {
+            'topic': topic,
+            'first_offset': first_offset,
+            'count': count,
+            'next_offset': first_offset + count,
+            'end_offset': log.next_offset
+        }
+        return header, chunk
+
+    def get_topic_log_stats(self):
+        """ Return offsets, segments, size and flush count of every topic log """
+        return self.topic_logs.stats() if self.topic_logs else {}
+
+    def watch_rate_limits(self):
+        """ CENTRALIZED DISSEMINATION
+        Watch the rate limit znode so ingress limits can be changed at runtime, e.g.
+        set /ratelimits '{"default": 100, "topics": {"A": 500}, "publishers": {"10.0.0.5:5556": 20}}'
+        Deleting the znode keeps the limits in effect at that moment. """
+        def rate_limits_changed(data, stat, event):
+            if data is None:
+                return
+            try:
+                self.rate_limiter.update_limits_from_json(data.decode('utf-8'))
+                self.info(f"Rate limits updated from {self.rate_limit_znode}: {data.decode('utf-8')}")
+            except (ValueError, AttributeError) as e:
+                self.error(f"Ignoring invalid rate limits in {self.rate_limit_znode}: {e}")
+        self.watch_znode(self.rate_limit_znode, rate_limits_changed)
+
+    def get_rate_limit_stats(self):
+        """ Return allowed/dropped/throttled counters per publisher """
+        return self.rate_limiter.stats()
+
+    def drop_expired(self, topic):
+        """ Count a message of a topic that was dropped because its TTL elapsed """
+        self.expired_counts[topic] = self.expired_counts.get(topic, 0) + 1
+        self.debug(f"Dropped expired message for topic {topic}")
+
+    def get_expired_stats(self):
+        """ Return the number of expired messages dropped per topic """
+        return dict(self.expired_counts)
+
+    def uses_lane(self, topic):
+        """ Return True if a topic is forwarded on per-subscriber lanes """
+        return bool(self.slow_consumer_policy) and topic not in self.conflation_buffers
+
+    def create_lane(self, sub_id, topics):
+        """ CENTRALIZED DISSEMINATION
+        Create a dedicated lane for a subscriber's non-conflated topics and
+        return the port the subscriber should connect to for them """
+        # A re-registering subscriber gets a fresh lane
+        self.remove_lane(sub_id)
+        port = self.get_clear_port()
+        self.used_ports.append(port)
+        socket = self.context.socket(zmq.XPUB)
+        socket.setsockopt(zmq.SNDHWM, self.lane_hwm)
+        socket.setsockopt(zmq.XPUB_NODROP, 1)
+        socket.bind(self.transport.bind_endpoint(port, self.get_host_address()))
+        self.add_lane(SubscriberLane(
+            sub_id, socket, topics=[t for t in topics if self.uses_lane(t)], port=port,
+            policy=self.slow_consumer_policy, max_backlog=self.lane_backlog,
+            on_state_change=self.lane_state_changed))
+        self.debug(f"Subscriber {sub_id} lane is being sent at port {port}")
+        return port
+
+    def add_lane(self, lane):
+        """ Start forwarding a lane's topics to it """
+        self.subscriber_lanes[lane.sub_id] = lane
+        for topic in lane.topics:
+            self.lanes_by_topic.setdefault(topic, []).append(lane)
+
+    def remove_lane(self, sub_id):
+        """ Stop forwarding to a subscriber's lane and release its socket and port """
+        lane = self.subscriber_lanes.pop(sub_id, None)
+        if not lane:
+            return
+        for topic in lane.topics:
+            if lane in self.lanes_by_topic.get(topic, []):
+                self.lanes_by_topic[topic].remove(lane)
+                if not self.lanes_by_topic[topic]:
+                    self.lanes_by_topic.pop(topic)
+        if lane.state != SubscriberLane.DISCONNECTED:
+            lane.close()
+        if lane.port in self.used_ports:
+            self.used_ports.remove(lane.port)
+
+    def lane_state_changed(self, lane, old_state, new_state):
+        """ Report slow consumers and apply the disconnect policy """
+        if new_state == SubscriberLane.HEALTHY:
+            self.info(f"Subscriber {lane.sub_id} caught up ({old_state} -> healthy)")
+        else:
+            self.info(f"Slow consumer: subscriber {lane.sub_id} is {new_state} ({lane.stats()})")
+        if new_state == SubscriberLane.DISCONNECTED:
+            # Keep the lane's final stats for reporting but stop forwarding to it
+            self.remove_lane(lane.sub_id)
+            self.disconnected_lanes[lane.sub_id] = lane
+
+    def has_pending_lanes(self):
+        """ Return True if any subscriber lane holds messages waiting to be forwarded """
+        return any(lane.pending() for lane in self.subscriber_lanes.values())
+
+    def get_slow_consumer_stats(self):
+        """ Return state (healthy/slow/degraded/disconnected), held messages and
+        sent/dropped/blocked counters for every subscriber lane """
+        stats = {sub_id: lane.stats() for sub_id, lane in self.disconnected_lanes.items()}
+        stats.update({sub_id: lane.stats() for sub_id, lane in self.subscriber_lanes.items()})
+        return stats
 
     def get_clear_port(self):
         """ Method to get a clear port that has not been allocated """
@@ -282,22 +1072,29 @@ class Broker(ZookeeperClient):
         topics = dc['topics']
         address = dc['address']
         sub_id = dc['id']
+        self.client_ids.discard(sub_id)
+        self.forget_registration(sub_id)
         if not self.centralized:
             notify_port = dc['notify_port']
-            self.used_ports.remove(notify_port)
+            if notify_port in self.used_ports:
+                self.used_ports.remove(notify_port)
             # Close the notification socket for this subscriber with id as key
-            self.notify_sub_sockets[sub_id].close()
-            self.notify_sub_sockets.pop(sub_id)
+            if sub_id in self.notify_sub_sockets:
+                self.notify_sub_sockets.pop(sub_id).close()
+        else:
+            self.remove_lane(sub_id)
+            self.disconnected_lanes.pop(sub_id, None)
         for t in topics:
             if t in self.subscribers:
                 # if only subscriber to topic, remove topic altogether
                 if len(self.subscribers[t]) == 1:
                     self.subscribers.pop(t)
-                    if self.centralized:
+                    if self.centralized and t in self.send_socket_dict:
                         # Close socket then remove. No other subscribers active for t.
                         self.send_socket_dict[t].close()
                         self.send_socket_dict.pop(t)
-                else:
+                        self.send_port_dict.pop(t, None)
+                elif address in self.subscribers[t]:
                     # Remove just this subscriber
                     self.subscribers[t].remove(address)
                     # No need to update self.send_socket_dict. No outward connections with connect()
@@ -323,14 +1120,26 @@ class Broker(ZookeeperClient):
                 # send response
                 self.sub_reg_socket.send_string(response)
                 return
+            if 'heartbeat' in sub_reg_dict:
+                self.sub_reg_socket.send_string(self.heartbeat(sub_reg_dict))
+                return
 
             topics = sub_reg_dict['topics']
             sub_address = sub_reg_dict['address']
             sub_id = sub_reg_dict['id']
+            # Subscribers behind a relay receive their topics from the relay
+            relayed = self.centralized and bool(sub_reg_dict.get('relay'))
+            # A subscriber gets its own notify socket (decentralized) or lane (if enabled)
+            own_socket = 1 if (not self.centralized or (self.slow_consumer_policy and not relayed)) else 0
+            rejection = self.admit_registration(sub_id, topics, new_sockets=own_socket)
+            if rejection:
+                self.sub_reg_socket.send_string(json.dumps(rejection))
+                return
+            self.client_ids.add(sub_id)
             for topic in topics:
                 if topic not in self.subscribers.keys():
                     self.subscribers[topic] = [sub_address]
-                else:
+                elif sub_address not in self.subscribers[topic]:
                     self.subscribers[topic].append(sub_address)
 
             if not self.centralized:
@@ -338,24 +1147,43 @@ class Broker(ZookeeperClient):
                 # Port must be different for each subscriber since they are each polling
                 # and subscribers steal poll pipeline events from each other.
                 notify_port = self.get_clear_port()
-                msg = {'register_sub': {'notify_port': notify_port}}
+                msg = {'register_sub': {'notify_port': notify_port},
+                    'topic_ids': self.topic_ids.assign(topics)}
+                if sub_id in self.notify_sub_sockets:
+                    # Re-registration; replace the previous notification socket
+                    old_port = self.client_registrations.get(sub_id, {}).get('notify_port')
+                    if old_port in self.used_ports:
+                        self.used_ports.remove(old_port)
+                    self.notify_sub_sockets.pop(sub_id).close(linger=0)
+                self.track_registration(sub_id, 'sub', sub_address, topics, notify_port=notify_port)
                 ## Notify new subscriber about all publishers of topic
                 ## so they can listen directly
                 # Set up a new notify socket on a clear port for this subscriber
                 self.debug("Enabling subscriber notification (about publishers)")
                 self.notify_sub_sockets[sub_id] = self.context.socket(zmq.REQ)
                 self.used_ports.append(notify_port)
-                self.notify_sub_sockets[sub_id].bind(f"tcp://*:{notify_port}")
+                self.notify_sub_sockets[sub_id].bind(self.transport.bind_endpoint(notify_port))
                 self.sub_reg_socket.send_string(json.dumps(msg))
                 self.notify_subscribers(topics=topics, sub_id=sub_id)
             else:
+                self.track_registration(sub_id, 'sub', sub_address, topics)
                 ## Make sure there is a socket for each new topic.
                 self.update_send_socket()
 
-                ## Publish topic messages to subscribers.
-                reply_sub_dict = {}
+                ## Publish topic messages to subscribers. With a slow consumer policy,
+                ## the subscriber's non-conflated topics all come from its own lane.
+                if self.slow_consumer_policy and not relayed:
+                    lane_port = self.create_lane(sub_id, topics)
+                reply_sub_dict = {'topic_ids': self.topic_ids.assign(topics)}
+                if self.replay_socket is not None:
+                    reply_sub_dict['replay_port'] = self.replay_port
                 for topic in sub_reg_dict['topics']:
-                    reply_sub_dict[topic] = self.send_port_dict[topic]
+                    if relayed:
+                        continue
+                    if self.uses_lane(topic):
+                        reply_sub_dict[topic] = lane_port
+                    else:
+                        reply_sub_dict[topic] = self.send_port_dict[topic]
                 self.debug(f"Sending topic/ports: {reply_sub_dict}")
                 self.sub_reg_socket.send_string(json.dumps(reply_sub_dict, indent=4))
 
@@ -415,23 +1243,31 @@ class Broker(ZookeeperClient):
         """ Method to remove data related to a disconnecting publisher """
         self.debug(f"Disconnecting publisher...")
         dc = msg['disconnect']
+        self.client_ids.discard(dc.get('id'))
+        self.forget_registration(dc.get('id'))
         topics = dc['topics']
         address = dc['address']
         for t in topics:
+            if t not in self.publishers:
+                continue
             # If this is the only publisher of a topic, remove the topic from
             # self.publishers and from self.receive_socket_dict
             if len(self.publishers[t]) == 1:
                 self.publishers.pop(t,None)
-                if self.centralized:
+                if self.centralized and t in self.receive_socket_dict:
                     # Close socket then remove. No other publishers active for t.
+                    self.poller.unregister(self.receive_socket_dict[t])
                     self.receive_socket_dict[t].close()
                     self.receive_socket_dict.pop(t)
-            else:
+                    self.receive_connections.pop(t, None)
+                    self.scheduler.forget(t)
+            elif address in self.publishers[t]:
                 # Only remove the single publisher connection from
                 # publisher connections for this topic
                 self.publishers[t].remove(address)
-                if self.centralized:
-                    self.receive_socket_dict[t].disconnect(address)
+                if self.centralized and address in self.receive_connections.get(t, set()):
+                    self.receive_socket_dict[t].disconnect(self.transport.endpoint(address))
+                    self.receive_connections[t].discard(address)
         response = {'disconnect': 'success'}
         return json.dumps(response)
 
@@ -451,11 +1287,21 @@ class Broker(ZookeeperClient):
                 # send response
                 self.pub_reg_socket.send_string(response)
                 return
+            if 'heartbeat' in pub_reg_dict:
+                self.pub_reg_socket.send_string(self.heartbeat(pub_reg_dict))
+                return
             pub_address = pub_reg_dict['address']
+            rejection = self.admit_registration(
+                pub_reg_dict.get('id'), pub_reg_dict['topics'], new_sockets=0)
+            if rejection:
+                self.pub_reg_socket.send_string(json.dumps(rejection))
+                return
+            self.client_ids.add(pub_reg_dict.get('id'))
+            self.track_registration(pub_reg_dict.get('id'), 'pub', pub_address, pub_reg_dict['topics'])
             for topic in pub_reg_dict['topics']:
                 if topic not in self.publishers.keys():
                     self.publishers[topic] = [pub_address]
-                else:
+                elif pub_address not in self.publishers[topic]:
                     self.publishers[topic].append(pub_address)
 
             if not self.centralized:
@@ -464,7 +1310,8 @@ class Broker(ZookeeperClient):
                 # directly to this new publisher.
                 # This starts a while loop on the subscriber.
                 self.notify_subscribers(pub_reg_dict['topics'], pub_address=pub_address)
-            response = {'success': 'registration success'}
+            response = {'success': 'registration success',
+                'topic_ids': self.topic_ids.assign(pub_reg_dict['topics'])}
         except Exception as e:
             response = {'error': f'registration failed due to exception: {e}'}
         self.debug(f"Sending response: {response}")
@@ -475,6 +1322,9 @@ class Broker(ZookeeperClient):
         """ Method to return IP address of current host.
         If using a mininet topology, use netifaces (socket.gethost... fails on mininet hosts)
         Otherwise, local testing without mininet, use localhost 127.0.0.1 """
+        if self.transport.host is not None:
+            # Every entity of a local cluster has the same host name
+            return self.transport.host
         try:
             # Will succeed on mininet. Two interfaces, get second one.
             # Then get AF_INET address family with key = 2
@@ -493,19 +1343,44 @@ class Broker(ZookeeperClient):
         subscriber know the port """
         # Use PUB sockets (one per topic) for sending publish events
         for topic in self.subscribers.keys():
+            if self.uses_lane(topic):
+                # Forwarded on per-subscriber lanes instead
+                continue
             if topic not in self.send_socket_dict.keys():
-                self.send_socket_dict[topic] = self.context.socket(zmq.PUB)
+                self.send_socket_dict[topic] = self.create_send_socket(topic)
                 while True:
                     port = random.randint(10000, 20000)
                     if port not in self.send_port_dict.values():
                         break
                 self.send_port_dict[topic] = port
                 self.debug(f"Topic {topic} is being sent at port {port}")
-                self.send_socket_dict[topic].bind(f"tcp://{self.get_host_address()}:{port}")
+                self.send_socket_dict[topic].bind(self.transport.bind_endpoint(port, self.get_host_address()))
+
+    def create_send_socket(self, topic):
+        """ CENTRALIZED DISSEMINATION
+        Create the socket used to publish a topic to its subscribers. Conflated
+        topics use an XPUB socket that reports backpressure (instead of silently
+        dropping the newest messages) once a subscriber reaches a small high-water
+        mark, so the broker knows when to start conflating. """
+        if topic in self.conflation_buffers:
+            socket = self.context.socket(zmq.XPUB)
+            socket.setsockopt(zmq.SNDHWM, self.conflation_hwm)
+            socket.setsockopt(zmq.XPUB_NODROP, 1)
+        else:
+            socket = self.context.socket(zmq.PUB)
+        return socket
 
     def disconnect(self):
         """ Method to disconnect from the publish/subscribe system by destroying the ZMQ context """
         self.debug("Disconnect")
+        self.stop_standby_replication()
+        if self.topic_logs:
+            self.topic_logs.close()
+        if self.election is not None and self.election.lock.is_acquired:
+            # sys.exit below ends election.run, which frees the election at once; our
+            # /broker must go with it rather than when the server expires our session
+            self.election.lock.release()
+        self.stop_session()
         try:
             self.info("Disconnecting. Destroying ZMQ context..")
             self.context.destroy()
@@ -0,0 +1,69 @@
+""" Conflation buffer used by the broker for topics where only the
+latest value per key matters (e.g. market-style ticks, sensor readings).
+When a conflated topic cannot be forwarded immediately (the subscribers of
+that topic are behind), newer messages replace older pending messages
+with the same key, so both memory and staleness stay bounded by the
+number of distinct keys rather than by the publish rate.
+"""
+from collections import OrderedDict
+
+def conflation_key(message):
+    """ Return the conflation key of a published event: its 'key' field if
+    present, otherwise the address of its publisher """
+    return message.get('key', message['publisher'])
+
+class ConflationBuffer:
+    """ Pending messages for a single conflated topic, at most one per key,
+    kept in the order in which each key was last updated. """
+
+    def __init__(self, max_keys=1024):
+        """ Constructor
+        args:
+        - max_keys (int) - max number of distinct keys held at once; if a new key
+          arrives while full, the pending message of the least recently updated
+          key is dropped so memory stays bounded
+        """
+        self.max_keys = max_keys
+        self.pending = OrderedDict()
+        # Number of pending messages replaced by a newer message with the same key
+        self.conflated_count = 0
+        # Number of pending messages evicted because max_keys was reached
+        self.evicted_count = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def put(self, key, frames):
+        """ Store the newest message for a key, replacing any pending one
+        Args:
+        - key (hashable) - conflation key of the message
+        - frames (list) - multipart message frames to forward later
+        """
+        if key in self.pending:
+            self.conflated_count += 1
+            self.pending.pop(key)
+        elif len(self.pending) >= self.max_keys:
+            self.pending.popitem(last=False)
+            self.evicted_count += 1
+        self.pending[key] = frames
+
+    def peek(self):
+        """ Return (key, frames) of the oldest pending message without removing it """
+        key = next(iter(self.pending))
+        return key, self.pending[key]
+
+    def pop(self, key):
+        """ Remove the pending message for a key once it has been forwarded """
+        return self.pending.pop(key, None)
+
+    def clear(self):
+        """ Drop every pending message (e.g. when the topic is reclaimed) """
+        self.pending.clear()
+
+    def stats(self):
+        """ Return counters describing the state of this buffer """
+        return {
+            'pending': len(self.pending),
+            'conflated': self.conflated_count,
+            'evicted': self.evicted_count
+        }
@@ -0,0 +1,39 @@
+""" Helpers for message time-to-live (TTL). A published event may carry its own
+'ttl' (seconds after its 'publish_time'); otherwise the per-topic TTL configured
+on the broker or subscriber applies. Expired events are dropped instead of being
+forwarded or recorded, so a backlog sheds stale work instead of replaying it.
+Expiry is computed from the publisher's clock, like the latency measurement itself,
+so hosts are expected to have synchronized clocks.
+"""
+import time
+
+def parse_topic_ttls(specs=[]):
+    """ Parse per-topic TTLs given on the command line as TOPIC=SECONDS
+    Args:
+    - specs (list) - list of strings such as ['A=0.5', 'B=2']
+    Returns dict mapping topic to TTL in seconds """
+    topic_ttls = {}
+    for spec in specs:
+        topic, _, seconds = spec.rpartition('=')
+        if not topic:
+            raise ValueError(f'Invalid topic TTL <{spec}>; expected TOPIC=SECONDS')
+        topic_ttls[topic] = float(seconds)
+    return topic_ttls
+
+def is_expired(message, topic_ttls={}, now=None, topic=None):
+    """ Return True if a published event is older than its TTL
+    Args:
+    - message (dict) - unpickled published event with 'publish_time'
+    - topic_ttls (dict) - per-topic TTL in seconds, used when the event has no 'ttl'
+    - now (float) - current time, defaults to time.time()
+    - topic (str) - topic of the event, for events sent with a topic ID frame that
+      do not carry their 'topic'
+    """
+    ttl = message.get('ttl')
+    if ttl is None:
+        ttl = topic_ttls.get(message.get('topic', topic))
+    if ttl is None:
+        return False
+    if now is None:
+        now = time.time()
+    return now - float(message['publish_time']) > ttl
@@ -0,0 +1,147 @@
+""" Per-subscriber delivery lanes used by the centralized broker to detect and
+isolate slow consumers. With a single PUB socket per topic, one slow subscriber
+builds an unbounded-looking queue that cannot be attributed to anyone. A lane is
+a dedicated XPUB socket per subscriber with a small high-water mark and
+XPUB_NODROP, so a full queue surfaces as backpressure on exactly that lane.
+Messages that cannot be delivered are held in a bounded backlog and, once the
+backlog is full, the lane's slow-consumer policy is applied:
+- drop-oldest: discard the oldest backlogged message
+- disconnect: close the lane; the subscriber stops receiving
+- degrade: keep only the newest message per key for that subscriber until it catches up
+"""
+from collections import deque
+import zmq
+from .conflation import ConflationBuffer
+
+class SubscriberLane:
+    HEALTHY = 'healthy'
+    SLOW = 'slow'
+    DEGRADED = 'degraded'
+    DISCONNECTED = 'disconnected'
+    POLICIES = ['drop-oldest', 'disconnect', 'degrade']
+
+    def __init__(self, sub_id, socket, topics=[], port=None, policy='drop-oldest',
+        max_backlog=1000, max_keys=1024, on_state_change=None):
+        """ Constructor
+        args:
+        - sub_id - id of the subscriber served by this lane
+        - socket (zmq.Socket) - XPUB socket dedicated to this subscriber
+        - topics (list) - topics forwarded on this lane
+        - port (int) - port the lane socket is bound to
+        - policy (str) - one of SubscriberLane.POLICIES, applied when the backlog is full
+        - max_backlog (int) - max number of messages held for the subscriber by the broker
+        - max_keys (int) - max number of keys held while degraded
+        - on_state_change (callable) - called as on_state_change(lane, old_state, new_state)
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f'Unknown slow consumer policy <{policy}>; expected one of {self.POLICIES}')
+        self.sub_id = sub_id
+        self.socket = socket
+        self.topics = set(topics)
+        self.port = port
+        self.policy = policy
+        self.max_backlog = max_backlog
+        self.on_state_change = on_state_change
+        self.state = self.HEALTHY
+        # (key, frames) pairs waiting for the subscriber to drain its queue
+        self.backlog = deque()
+        self.degraded_buffer = ConflationBuffer(max_keys=max_keys)
+        self.sent_count = 0
+        self.dropped_count = 0
+        # Number of times this lane hit its high-water mark
+        self.blocked_count = 0
+
+    def set_state(self, state):
+        old_state = self.state
+        self.state = state
+        if old_state != state and self.on_state_change:
+            self.on_state_change(self, old_state, state)
+
+    def pending(self):
+        """ Number of messages held by the broker for this subscriber """
+        return len(self.backlog) + len(self.degraded_buffer)
+
+    def offer(self, frames, key):
+        """ Forward a message to the subscriber, or hold it if the subscriber is behind
+        Args:
+        - frames (list) - multipart message frames
+        - key (hashable) - conflation key of the message, used when degraded
+        """
+        if self.state == self.DISCONNECTED:
+            self.dropped_count += 1
+            return
+        if self.state == self.DEGRADED:
+            self.degraded_buffer.put(key, frames)
+            self.flush()
+            return
+        if self.backlog:
+            # Preserve ordering behind messages already held
+            self.enqueue(key, frames)
+            self.flush()
+            return
+        try:
+            self.socket.send_multipart(frames, zmq.NOBLOCK)
+            self.sent_count += 1
+        except zmq.Again:
+            self.blocked_count += 1
+            self.enqueue(key, frames)
+
+    def enqueue(self, key, frames):
+        """ Hold a message the subscriber could not accept, applying the policy if full """
+        if self.state == self.HEALTHY:
+            self.set_state(self.SLOW)
+        if len(self.backlog) < self.max_backlog:
+            self.backlog.append((key, frames))
+        elif self.policy == 'drop-oldest':
+            self.backlog.popleft()
+            self.dropped_count += 1
+            self.backlog.append((key, frames))
+        elif self.policy == 'disconnect':
+            self.dropped_count += len(self.backlog) + 1
+            self.close()
+        elif self.policy == 'degrade':
+            self.backlog.append((key, frames))
+            while self.backlog:
+                self.degraded_buffer.put(*self.backlog.popleft())
+            self.set_state(self.DEGRADED)
+
+    def flush(self):
+        """ Forward held messages until the subscriber is full again or nothing is held """
+        if self.state == self.DISCONNECTED:
+            return
+        while self.backlog:
+            try:
+                self.socket.send_multipart(self.backlog[0][1], zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            self.backlog.popleft()
+            self.sent_count += 1
+        while len(self.degraded_buffer):
+            key, frames = self.degraded_buffer.peek()
+            try:
+                self.socket.send_multipart(frames, zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            self.degraded_buffer.pop(key)
+            self.sent_count += 1
+        # Caught up
+        self.set_state(self.HEALTHY)
+
+    def close(self):
+        """ Close the lane socket and stop serving the subscriber """
+        self.backlog.clear()
+        self.degraded_buffer.pending.clear()
+        self.socket.close(linger=0)
+        self.set_state(self.DISCONNECTED)
+
+    def stats(self):
+        """ Return state and counters of this lane """
+        return {
+            'state': self.state,
+            'policy': self.policy,
+            'pending': self.pending(),
+            'sent': self.sent_count,
+            'dropped': self.dropped_count + self.degraded_buffer.conflated_count
+                + self.degraded_buffer.evicted_count,
+            'blocked': self.blocked_count
+        }
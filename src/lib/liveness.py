@@ -0,0 +1,122 @@
+""" Liveness tracking used by the broker to reclaim state left behind by clients
+that crashed instead of disconnecting, and by topics nobody uses any more.
+Without it, sockets, ports and registry entries are only released by an explicit
+disconnect message, so a long-running broker accumulates dead entries that cost
+file descriptors and memory and slow down every scan of its topic sockets.
+
+Clients in turn watch their connection to the broker with ZMTP heartbeats
+(enable_heartbeats, PeerMonitor): a broker that died or hangs is noticed within
+the heartbeat timeout instead of when its ZooKeeper session expires.
+"""
+import os
+import resource
+import time
+import zmq
+from zmq.utils.monitor import recv_monitor_message
+
+class LivenessTracker:
+    """ Last time each key (client id or topic) was seen alive """
+
+    def __init__(self, timeout=None):
+        """ Constructor
+        args:
+        - timeout (float) - seconds after which a key that has not been seen is
+          considered dead; None disables tracking
+        """
+        self.timeout = timeout
+        self.last_seen = {}
+
+    def __len__(self):
+        return len(self.last_seen)
+
+    def __contains__(self, key):
+        return key in self.last_seen
+
+    @property
+    def enabled(self):
+        return self.timeout is not None
+
+    def touch(self, key, now=None):
+        """ Record that key was seen alive now """
+        if self.timeout is None:
+            return
+        self.last_seen[key] = time.time() if now is None else now
+
+    def forget(self, key):
+        """ Stop tracking key """
+        self.last_seen.pop(key, None)
+
+    def expired(self, now=None):
+        """ Return the keys not seen for longer than the timeout """
+        if self.timeout is None:
+            return []
+        deadline = (time.time() if now is None else now) - self.timeout
+        return [key for key, seen in self.last_seen.items() if seen < deadline]
+
+def resource_usage():
+    """ Return open file descriptors and resident memory (KiB) of this process.
+    Both come from /proc when available (Linux); elsewhere the open descriptor
+    count is None and memory falls back to the peak resident set size. """
+    try:
+        fds = len(os.listdir('/proc/self/fd'))
+    except OSError:
+        fds = None
+    try:
+        with open('/proc/self/statm') as f:
+            rss_kb = int(f.read().split()[1]) * resource.getpagesize() // 1024
+    except (OSError, IndexError, ValueError):
+        rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'fds': fds, 'rss_kb': rss_kb}
+
+def enable_heartbeats(socket, interval, timeout=None):
+    """ Turn on ZMTP heartbeats on a socket: PING the peer every interval seconds and
+    drop the connection if nothing arrives within timeout seconds of a PING (default
+    2 * interval). The peer is told the same timeout, so it drops us too.
+    Args:
+    - socket (zmq.Socket) - socket to set up, before it connects or binds
+    - interval (float) - seconds between heartbeats
+    - timeout (float) - seconds without traffic after which the connection is dead
+    """
+    timeout = 2 * interval if timeout is None else timeout
+    socket.setsockopt(zmq.HEARTBEAT_IVL, int(interval * 1000))
+    socket.setsockopt(zmq.HEARTBEAT_TIMEOUT, int(timeout * 1000))
+    socket.setsockopt(zmq.HEARTBEAT_TTL, int(timeout * 1000))
+
+class PeerMonitor:
+    """ Watches the connection of a socket to its peer (e.g. a client's registration
+    socket to the broker) through a ZMQ socket monitor; with heartbeats enabled, a
+    dead or unreachable peer shows as a disconnect within the heartbeat timeout """
+
+    def __init__(self, socket):
+        """ Constructor
+        args:
+        - socket (zmq.Socket) - socket to watch, usually before it connects
+        """
+        self.socket = socket.get_monitor_socket(zmq.EVENT_CONNECTED | zmq.EVENT_DISCONNECTED)
+        self.connected = False
+        # Time the connection was lost, None while connected (or never connected)
+        self.lost_at = None
+
+    def lost(self):
+        """ Process pending monitor events; return True once if the peer was lost """
+        lost = False
+        if self.socket.closed:
+            # Closed along with the context of the watched socket
+            return lost
+        while True:
+            try:
+                event = recv_monitor_message(self.socket, zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            if event['event'] == zmq.EVENT_CONNECTED:
+                self.connected = True
+                self.lost_at = None
+                lost = False
+            elif event['event'] == zmq.EVENT_DISCONNECTED and self.connected:
+                self.connected = False
+                self.lost_at = time.time()
+                lost = True
+        return lost
+
+    def close(self):
+        self.socket.close(linger=0)
@@ -0,0 +1,354 @@
+""" A whole publish/subscribe system in one process: a broker, publishers and
+subscribers running as threads, talking over inproc:// (see transport.py) and
+coordinated by an in-memory ZooKeeper ensemble (see memory_zookeeper.py).
+
+Every entity is the unchanged Broker, Publisher and Subscriber class and goes
+through the same steps as when driver.py starts it on a host; only the network
+and the ZooKeeper server are gone. What is left of a message's latency is the
+framework's own cost (serialization, polling, the broker's routing), without the
+noise of the operating system's network stack, and a run takes no ports, no
+processes and no server, so it is fast to repeat and safe to run alongside
+other runs.
+
+The run is orchestrated with the barriers of barrier.py: the broker leads, then
+the subscribers register, then the publishers publish, and the run ends when
+every subscriber received every event, when events were lost (none arrived for
+a while after the publishers finished), or at the timeout.
+"""
+import cProfile
+import logging
+import os
+import pstats
+import threading
+import time
+import uuid
+from .broker import Broker
+from .publisher import Publisher
+from .subscriber import Subscriber
+from .barrier import READY, DONE, wait_barrier
+from .memory_zookeeper import MemoryEnsemble
+from .transport import InprocTransport
+from .zookeeper_client import kazoo_client
+
+class LocalCluster:
+    """ Broker, publishers and subscribers of one pub/sub system as threads of this process """
+    # Registration ports of the broker; inproc:// names, so they collide with nothing
+    PUB_REG_PORT = 5555
+    SUB_REG_PORT = 5556
+    # Publisher i binds FIRST_PUBLISHER_PORT + i
+    FIRST_PUBLISHER_PORT = 6000
+    BARRIER = '/barriers/local-cluster'
+    # Seconds without an event, once the publishers finished, after which the
+    # events still missing count as lost
+    IDLE_TIMEOUT = 1.0
+
+    def __init__(self, publishers=1, subscribers=1, topics=['A'], max_event_count=100,
+        sleep_period=0.0, centralized=False, filename=None, timeout=60.0, profile=False,
+        broker_options={}, publisher_options={}, subscriber_options={}, quiet=False,
+        verbose=False):
+        """ Constructor
+        args:
+        - publishers (int) - number of publishers
+        - subscribers (int) - number of subscribers
+        - topics (list) - topics every publisher publishes and every subscriber subscribes to
+        - max_event_count (int) - events each publisher publishes; each subscriber
+          receives those of every publisher
+        - sleep_period (float) - seconds a publisher sleeps between events
+        - centralized (boolean) - whether events go through the broker or straight
+          from the publishers to the subscribers
+        - filename (str) - optional data file of the subscribers; subscriber i writes
+          <name>-<i><extension> when there are several
+        - timeout (float) - upper bound in seconds of each stage of a run
+        - profile (boolean) - whether to profile every entity's thread (see profile_stats)
+        - broker_options (dict) - further Broker constructor arguments
+        - publisher_options (dict) - further Publisher constructor arguments
+        - subscriber_options (dict) - further Subscriber constructor arguments
+        - quiet (boolean) - whether the entities only log warnings and errors
+        - verbose (boolean) - debug logging for the cluster and its entities
+        """
+        self.publisher_count = publishers
+        self.subscriber_count = subscribers
+        self.topics = topics
+        self.max_event_count = max_event_count
+        self.sleep_period = sleep_period
+        self.centralized = centralized
+        self.filename = filename
+        self.timeout = timeout
+        self.profile = profile
+        self.broker_options = broker_options
+        self.publisher_options = publisher_options
+        self.subscriber_options = subscriber_options
+        self.quiet = quiet
+        self.verbose = verbose
+        # An ensemble and a ZMQ context of our own, so clusters never meet
+        self.name = f'local-cluster-{uuid.uuid4().hex[:8]}'
+        self.zookeeper_hosts = [f'memory://{self.name}']
+        self.transport = InprocTransport()
+        self.broker = None
+        self.publishers = []
+        self.subscribers = []
+        self.threads = []
+        self.profiles = []
+        self.errors = []
+        # Publishers stay connected until the subscribers are done, so their
+        # disconnect never closes the broker's socket with events still queued
+        self.stopping = threading.Event()
+        self.elapsed = None
+        # When each publisher started and finished publishing
+        self.publish_starts = []
+        self.publish_ends = []
+        self.last_received = 0
+        self.last_progress = None
+        self.set_logger()
+
+    def set_logger(self):
+        self.prefix = {'prefix': f'CLUSTER<{self.name}> -'}
+        self.logger = logging.getLogger(f'CLUSTER{id(self)}')
+        self.logger.setLevel(logging.DEBUG if self.verbose else logging.INFO)
+        handler = logging.StreamHandler()
+        formatter = logging.Formatter('%(prefix)s - %(message)s')
+        handler.setFormatter(formatter)
+        self.logger.addHandler(handler)
+
+    def entity_options(self):
+        """ Constructor arguments every entity of the cluster shares """
+        return {
+            'zookeeper_hosts': self.zookeeper_hosts,
+            'barrier': self.BARRIER,
+            'transport': self.transport,
+            'verbose': self.verbose
+        }
+
+    def subscriber_filename(self, i):
+        """ Return the data file of subscriber i, or None """
+        if not self.filename or self.subscriber_count == 1:
+            return self.filename
+        name, extension = os.path.splitext(self.filename)
+        return f'{name}-{i}{extension}'
+
+    def create_entities(self):
+        """ Construct the broker, publishers and subscribers """
+        self.broker = Broker(
+            indefinite=True,
+            centralized=self.centralized,
+            # Stopped by stop_broker once the subscribers are done
+            autokill=self.timeout * 4,
+            pub_reg_port=self.PUB_REG_PORT,
+            sub_reg_port=self.SUB_REG_PORT,
+            **self.entity_options(),
+            **self.broker_options
+        )
+        for i in range(self.subscriber_count):
+            self.subscribers.append(Subscriber(
+                topics=self.topics,
+                filename=self.subscriber_filename(i),
+                centralized=self.centralized,
+                max_event_count=self.publisher_count * self.max_event_count,
+                **self.entity_options(),
+                **self.subscriber_options
+            ))
+        for i in range(self.publisher_count):
+            self.publishers.append(Publisher(
+                topics=self.topics,
+                sleep_period=self.sleep_period,
+                bind_port=self.FIRST_PUBLISHER_PORT + i,
+                max_event_count=self.max_event_count,
+                **self.entity_options(),
+                **self.publisher_options
+            ))
+        if self.quiet and not self.verbose:
+            for entity in [self.broker] + self.subscribers + self.publishers:
+                entity.logger.setLevel(logging.WARNING)
+
+    def run_broker(self, broker):
+        """ Steps of driver.create_broker_with_zookeeper """
+        broker.connect_zk()
+        broker.start_session()
+        # Leads, signals ready, and signals done once stop_broker ends its event loop
+        broker.zk_run_election()
+
+    def run_subscriber(self, subscriber):
+        """ Steps of driver.create_subscriber_with_zookeeper """
+        subscriber.connect_zk()
+        subscriber.start_session()
+        subscriber.get_znode_value()
+        subscriber.update_broker_info()
+        subscriber.watch_znode_data_change()
+        subscriber.signal_barrier(READY)
+        subscriber.notify()
+        if subscriber.filename:
+            subscriber.write_stored_messages()
+        subscriber.signal_barrier(DONE)
+        subscriber.disconnect()
+
+    def run_publisher(self, publisher):
+        """ Steps of driver.create_publisher_with_zookeeper """
+        publisher.connect_zk()
+        publisher.start_session()
+        publisher.get_znode_value()
+        publisher.update_broker_info()
+        publisher.watch_znode_data_change()
+        publisher.signal_barrier(READY)
+        self.publish_starts.append(time.time())
+        publisher.publish()
+        self.publish_ends.append(time.time())
+        publisher.signal_barrier(DONE)
+        self.stopping.wait(self.timeout)
+        publisher.disconnect()
+
+    def start(self, steps, entity):
+        """ Run an entity's steps in a thread of its own """
+        def target():
+            profiler = cProfile.Profile() if self.profile else None
+            try:
+                if profiler:
+                    profiler.runcall(steps, entity)
+                else:
+                    steps(entity)
+            except SystemExit:
+                # Entities exit once disconnected
+                pass
+            except Exception as e:
+                self.errors.append(e)
+                self.error(f'{type(entity).__name__} failed: {e!r}')
+            finally:
+                if profiler:
+                    self.profiles.append(profiler)
+        thread = threading.Thread(target=target, name=f'{self.name}-{type(entity).__name__}', daemon=True)
+        self.threads.append(thread)
+        thread.start()
+        return thread
+
+    def wait(self, zk, stage, entities, kind, stalled=None):
+        """ Wait until every entity in a list reached a stage; raise TimeoutError if
+        not, at the timeout or as soon as stalled() returns True """
+        names = [f'{type(entity).__name__.lower()}-{entity.zk_instance_id}' for entity in entities]
+        started = time.time()
+        count = len(names)
+        while True:
+            remaining = max(0.0, self.timeout - (time.time() - started))
+            if stalled is not None:
+                remaining = min(remaining, self.IDLE_TIMEOUT)
+            reached = wait_barrier(zk, self.BARRIER, stage, count, remaining)
+            missing = set(names) - set(reached)
+            if not missing:
+                self.debug(f'{len(names)} {kind} {stage} after {time.time() - started:.3f}s')
+                return
+            if time.time() - started >= self.timeout or self.errors:
+                raise TimeoutError(f'{len(missing)} of {len(names)} {kind} not {stage} '
+                    f'after {self.timeout}s')
+            if stalled is not None and stalled():
+                raise TimeoutError(f'{len(missing)} of {len(names)} {kind} not {stage}; no event '
+                    f'for {self.IDLE_TIMEOUT}s after the publishers finished')
+            if len(reached) >= count:
+                # Other entities' signals made the count; wait for the next one
+                count = len(reached) + 1
+
+    def stalled(self):
+        """ Whether the publishers finished and no event arrived for IDLE_TIMEOUT seconds """
+        received = self.received_count()
+        if received != self.last_received:
+            self.last_received = received
+            self.last_progress = time.time()
+        return (len(self.publish_ends) == self.publisher_count and
+            time.time() - self.last_progress >= self.IDLE_TIMEOUT)
+
+    def run(self):
+        """ Run the system once: every publisher publishes max_event_count events and
+        every subscriber receives them all. Returns the duration in seconds from the
+        first event published until the last subscriber was done (None if the run
+        timed out) """
+        self.create_entities()
+        zk = kazoo_client(self.zookeeper_hosts[0])
+        zk.start()
+        try:
+            self.start(self.run_broker, self.broker)
+            self.wait(zk, READY, [self.broker], 'broker')
+            for subscriber in self.subscribers:
+                self.start(self.run_subscriber, subscriber)
+            self.wait(zk, READY, self.subscribers, 'subscribers')
+            self.last_progress = time.time()
+            for publisher in self.publishers:
+                self.start(self.run_publisher, publisher)
+            # Lost events end the run early
+            self.wait(zk, DONE, self.subscribers, 'subscribers', stalled=self.stalled)
+            # The publishers registered before they published
+            self.elapsed = time.time() - min(self.publish_starts)
+            self.info(f'{self.received_count()} of {self.expected_count()} events delivered '
+                f'in {self.elapsed:.3f}s')
+        except TimeoutError as e:
+            self.error(f'{e}; {self.received_count()} of {self.expected_count()} events delivered')
+        finally:
+            self.stop()
+            zk.stop()
+            zk.close()
+        return self.elapsed
+
+    def stop_broker(self):
+        """ End the broker's event loop; it signals done and disconnects """
+        if self.broker is not None:
+            self.broker.autokill_time = time.time()
+
+    def stop(self):
+        """ Disconnect every entity, end their sessions and the ensemble """
+        self.stopping.set()
+        # One deadline for all: subscribers still waiting for lost events never finish
+        deadline = time.time() + self.timeout
+        # The clients tell the broker they leave, so it outlives them
+        for thread in self.threads[1:]:
+            thread.join(max(0.0, deadline - time.time()))
+        self.stop_broker()
+        if self.threads:
+            # Leaves its event loop within a poll
+            self.threads[0].join(max(1.0, deadline - time.time()))
+        for entity in [self.broker] + self.subscribers + self.publishers:
+            if entity is not None:
+                entity.stop_session()
+        stuck = [thread.name for thread in self.threads if thread.is_alive()]
+        if stuck:
+            # A subscriber still waiting for lost events keeps its sockets open, and
+            # terminating the context would block on them; its thread is a daemon
+            self.error(f'{len(stuck)} entities did not finish; leaving the ZMQ context open')
+        else:
+            self.transport.shared_context.term()
+        MemoryEnsemble.discard(self.name)
+
+    def expected_count(self):
+        """ Events the subscribers receive in a complete run """
+        return self.subscriber_count * self.publisher_count * self.max_event_count
+
+    def received_count(self):
+        """ Events the subscribers received """
+        return sum(len(subscriber.received_message_list) for subscriber in self.subscribers)
+
+    def publish_rate(self):
+        """ Events the publishers published per second, or None if none finished """
+        if not self.publish_ends:
+            return None
+        duration = max(self.publish_ends) - min(self.publish_starts)
+        return len(self.publish_ends) * self.max_event_count / max(duration, 1e-9)
+
+    def latencies(self):
+        """ Seconds from publishing to receipt of every event the subscribers received """
+        return [message['total_time_seconds'] for subscriber in self.subscribers
+            for message in subscriber.received_message_list]
+
+    def profile_stats(self):
+        """ Return the profiles of every entity's thread merged into one pstats.Stats,
+        or None if not profiling. Threads of the entities' libraries (kazoo's watch
+        callbacks, ZMQ's I/O thread) are not included """
+        if not self.profiles:
+            return None
+        stats = pstats.Stats(self.profiles[0])
+        for profiler in self.profiles[1:]:
+            stats.add(profiler)
+        return stats
+
+    def info(self, msg):
+        self.logger.info(msg, extra=self.prefix)
+
+    def debug(self, msg):
+        self.logger.debug(msg, extra=self.prefix)
+
+    def error(self, msg):
+        self.logger.error(msg, extra=self.prefix)
@@ -0,0 +1,295 @@
+""" In-memory stand-in for a ZooKeeper ensemble, for tests and benchmarks that run
+every entity in one process.
+MemoryKazooClient is a KazooClient whose requests are answered by a MemoryEnsemble
+in the same process instead of being sent to a server. Everything above the wire
+is kazoo's own code, so ZookeeperClient, the Broker election and the clients'
+watch handlers run unchanged, recipes (Election, Lock, ChildrenWatch, DataWatch)
+included. The ensemble keeps what those paths use: a znode tree with stats and
+zxids, persistent, ephemeral and sequential znodes, data and child watches, and
+sessions whose ephemeral znodes go when the session is closed or expired.
+
+Select it with hosts of the form memory://<name>[/<chroot>] (see
+zookeeper_client.kazoo_client); clients using the same name share an ensemble.
+There is no network, no quorum and no session timeout: a session lives until
+its client stops or expire_session() is called.
+"""
+import posixpath
+import threading
+import time
+from collections import defaultdict
+from kazoo.client import KazooClient
+from kazoo.exceptions import (BadVersionError, ConnectionClosedError, NoChildrenForEphemeralsError,
+    NodeExistsError, NoNodeError, NotEmptyError, SessionExpiredError, UnimplementedError)
+from kazoo.protocol.serialization import (Create, Create2, Delete, Exists, GetChildren, GetChildren2,
+    GetData, SetData, Sync)
+from kazoo.protocol.states import Callback, EventType, KeeperState, WatchedEvent, ZnodeStat
+
+MEMORY_SCHEME = 'memory://'
+
+# Create request flags (see kazoo.client.KazooClient.create)
+EPHEMERAL_FLAG = 1
+SEQUENCE_FLAG = 2
+
+class MemoryZnode:
+    """ Data and stat fields of one znode """
+
+    def __init__(self, data, zxid, owner=0):
+        self.data = data
+        self.czxid = self.mzxid = self.pzxid = zxid
+        self.ctime = self.mtime = int(time.time() * 1000)
+        self.version = 0
+        self.cversion = 0
+        # Session id of an ephemeral znode's owner, 0 for persistent znodes
+        self.owner = owner
+        self.children = set()
+
+    def stat(self):
+        return ZnodeStat(self.czxid, self.mzxid, self.ctime, self.mtime, self.version,
+            self.cversion, 0, self.owner, len(self.data), len(self.children), self.pzxid)
+
+class MemoryEnsemble:
+    """ The znode tree, sessions and watches of one in-memory ensemble """
+    # key = ensemble name, value = MemoryEnsemble
+    ensembles = {}
+    ensembles_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, name):
+        """ Return the ensemble called name, creating it on first use """
+        with cls.ensembles_lock:
+            if name not in cls.ensembles:
+                cls.ensembles[name] = cls(name)
+            return cls.ensembles[name]
+
+    @classmethod
+    def discard(cls, name):
+        """ Forget an ensemble; clients still connected keep the old one """
+        with cls.ensembles_lock:
+            cls.ensembles.pop(name, None)
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.RLock()
+        self.zxid = 0
+        self.nodes = {'/': MemoryZnode(b'', 0)}
+        # key = session id, value = MemoryKazooClient
+        self.sessions = {}
+        self.next_session_id = 1
+        # key = path, value = set of session ids; a watch fires once, like ZooKeeper's
+        self.data_watches = defaultdict(set)
+        self.child_watches = defaultdict(set)
+        # key = request type name, value = count
+        self.op_counts = {}
+
+    def connect(self, client):
+        """ Open a session for client and return its id """
+        with self.lock:
+            session_id = self.next_session_id
+            self.next_session_id += 1
+            self.sessions[session_id] = client
+            return session_id
+
+    def close_session(self, session_id):
+        """ End a session: delete its ephemeral znodes and drop its watches """
+        with self.lock:
+            if self.sessions.pop(session_id, None) is None:
+                return
+            for watches in (self.data_watches, self.child_watches):
+                for sessions in watches.values():
+                    sessions.discard(session_id)
+            # Children (sequential lock nodes, directory entries) come before parents
+            for path in sorted((path for path, node in self.nodes.items() if node.owner == session_id),
+                    key=len, reverse=True):
+                self.delete(path)
+
+    def process(self, client, request):
+        """ Apply a request of a session; return kazoo's response for it or raise the
+        KazooException ZooKeeper would answer with. A watch set by the request is
+        registered with both the ensemble and the client before anything can fire it. """
+        with self.lock:
+            name = type(request).__name__
+            self.op_counts[name] = self.op_counts.get(name, 0) + 1
+            if isinstance(request, (Create, Create2)):
+                path, stat = self.create(request.path, request.data, request.flags, client.session_id)
+                return (path, stat) if isinstance(request, Create2) else path
+            if isinstance(request, Delete):
+                node = self.existing(request.path)
+                if request.version != -1 and request.version != node.version:
+                    raise BadVersionError()
+                if node.children:
+                    raise NotEmptyError()
+                self.delete(request.path)
+                return True
+            if isinstance(request, SetData):
+                node = self.existing(request.path)
+                if request.version != -1 and request.version != node.version:
+                    raise BadVersionError()
+                self.zxid += 1
+                node.data = request.data or b''
+                node.mzxid = self.zxid
+                node.mtime = int(time.time() * 1000)
+                node.version += 1
+                self.trigger(request.path, EventType.CHANGED)
+                return node.stat()
+            if isinstance(request, Sync):
+                return request.path
+            if isinstance(request, Exists):
+                node = self.nodes.get(request.path)
+                # exists() watches a missing znode too, to report its creation
+                self.watch(client, request, self.data_watches)
+                return node.stat() if node else None
+            node = self.existing(request.path)
+            if isinstance(request, GetData):
+                self.watch(client, request, self.data_watches)
+                return node.data, node.stat()
+            if isinstance(request, (GetChildren, GetChildren2)):
+                self.watch(client, request, self.child_watches)
+                children = sorted(node.children)
+                return (children, node.stat()) if isinstance(request, GetChildren2) else children
+            raise UnimplementedError()
+
+    def monitor(self):
+        """ Return the ensemble's counts in the format of ZooKeeper's 'mntr' command """
+        with self.lock:
+            watches = sum(len(sessions) for watches in (self.data_watches, self.child_watches)
+                for sessions in watches.values())
+            return (f'zk_num_alive_connections\t{len(self.sessions)}\n'
+                f'zk_watch_count\t{watches}\n'
+                f'zk_znode_count\t{len(self.nodes)}\n')
+
+    def existing(self, path):
+        if path not in self.nodes:
+            raise NoNodeError()
+        return self.nodes[path]
+
+    def create(self, path, data, flags, session_id):
+        parent_path = posixpath.dirname(path)
+        parent = self.existing(parent_path)
+        if parent.owner:
+            raise NoChildrenForEphemeralsError()
+        if flags & SEQUENCE_FLAG:
+            path += '%010d' % parent.cversion
+        if path in self.nodes:
+            raise NodeExistsError()
+        self.zxid += 1
+        node = self.nodes[path] = MemoryZnode(data or b'', self.zxid,
+            owner=session_id if flags & EPHEMERAL_FLAG else 0)
+        parent.children.add(posixpath.basename(path))
+        parent.cversion += 1
+        parent.pzxid = self.zxid
+        self.trigger(path, EventType.CREATED)
+        self.trigger(parent_path, EventType.CHILD)
+        return path, node.stat()
+
+    def delete(self, path):
+        self.zxid += 1
+        self.nodes.pop(path)
+        parent_path = posixpath.dirname(path)
+        parent = self.nodes[parent_path]
+        parent.children.discard(posixpath.basename(path))
+        parent.cversion += 1
+        parent.pzxid = self.zxid
+        self.trigger(path, EventType.DELETED)
+        self.trigger(parent_path, EventType.CHILD)
+
+    def watch(self, client, request, watches):
+        if getattr(request, 'watcher', None) is not None:
+            watches[request.path].add(client.session_id)
+            client.add_watcher(request)
+
+    def trigger(self, path, event_type):
+        """ Fire the watches an event on path sets off """
+        sessions = set()
+        if event_type in (EventType.CREATED, EventType.CHANGED, EventType.DELETED):
+            sessions |= self.data_watches.pop(path, set())
+        if event_type in (EventType.CHILD, EventType.DELETED):
+            sessions |= self.child_watches.pop(path, set())
+        for session_id in sessions:
+            client = self.sessions.get(session_id)
+            if client is not None:
+                client.deliver_event(event_type, path)
+
+class MemoryKazooClient(KazooClient):
+    """ KazooClient connected to an in-memory ensemble instead of a server """
+
+    def __init__(self, hosts, timeout=10.0, **kwargs):
+        """ Constructor
+        args:
+        - hosts (str) - memory://<name>[/<chroot>]
+        - timeout (float) - session timeout, kept for kazoo; sessions only end when
+          stopped or expired
+        """
+        name, _, chroot = hosts[len(MEMORY_SCHEME):].partition('/')
+        super().__init__(hosts=f'{name}/{chroot}' if chroot else name, timeout=timeout, **kwargs)
+        self.ensemble = MemoryEnsemble.get(name)
+        self.session_id = None
+
+    def start_async(self):
+        if self._live.is_set():
+            return self._live
+        self._stopped.clear()
+        self.handler.start()
+        self.session_id = self._session_id = self.ensemble.connect(self)
+        self._session_callback(KeeperState.CONNECTED)
+        return self._live
+
+    def stop(self):
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self.ensemble.close_session(self.session_id)
+        self._session_callback(KeeperState.CLOSED)
+        self.handler.stop()
+
+    def close(self):
+        """ Nothing to release; there is no connection """
+
+    def command(self, cmd=b'ruok'):
+        """ Answer the 'mntr' four letter word from the ensemble; others are not supported """
+        if cmd != b'mntr':
+            raise UnimplementedError()
+        return self.ensemble.monitor()
+
+    def expire_session(self):
+        """ Expire the session as ZooKeeper does after the session timeout: its
+        ephemeral znodes and watches are gone and the client sees LOST. Like kazoo,
+        the client then connects again with a new session (CONNECTED). """
+        self.ensemble.close_session(self.session_id)
+        self._session_callback(KeeperState.EXPIRED_SESSION)
+        if not self._stopped.is_set():
+            self.session_id = self._session_id = self.ensemble.connect(self)
+            self._session_callback(KeeperState.CONNECTED)
+
+    def _call(self, request, async_object):
+        if self._state == KeeperState.EXPIRED_SESSION:
+            async_object.set_exception(SessionExpiredError())
+            return False
+        if self._stopped.is_set() or not self._live.is_set():
+            async_object.set_exception(ConnectionClosedError("Connection has been closed"))
+            return False
+        try:
+            response = self.ensemble.process(self, request)
+        except Exception as e:
+            async_object.set_exception(e)
+        else:
+            async_object.set(response)
+
+    def add_watcher(self, request):
+        """ Register the watcher of a request, as kazoo does on a server response """
+        if isinstance(request, (GetChildren, GetChildren2)):
+            self._child_watchers[request.path].add(request.watcher)
+        else:
+            self._data_watchers[request.path].add(request.watcher)
+
+    def deliver_event(self, event_type, path):
+        """ Hand a watch event to the watchers of path, as kazoo does on a server event """
+        watchers = []
+        if event_type in (EventType.CREATED, EventType.CHANGED, EventType.DELETED):
+            watchers.extend(self._data_watchers.pop(path, []))
+        if event_type in (EventType.CHILD, EventType.DELETED):
+            watchers.extend(self._child_watchers.pop(path, []))
+        if self._stopped.is_set():
+            return
+        event = WatchedEvent(event_type, self._state, self.unchroot(path))
+        for watcher in watchers:
+            self.handler.dispatch_callback(Callback('watch', watcher, (event,)))
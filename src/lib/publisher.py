@@ -1,5 +1,11 @@
 import socket as sock
 from .zookeeper_client import ZookeeperClient
+from .transport import TCP_TRANSPORT
+from .reconnect import ReconnectPolicy, TIERS
+from .topic_ids import topic_frames
+from .topic_directory import advertise_publisher
+from kazoo.client import KazooState
+from kazoo.exceptions import NoNodeError
 import zmq
 import logging
 import time
@@ -20,7 +26,9 @@ class Publisher(ZookeeperClient):
         broker_address='127.0.0.1',
         topics=[], sleep_period=1, bind_port=5556,
         indefinite=False, max_event_count=15,zookeeper_hosts=["127.0.0.1:2181"],
-        verbose=False):
+        ttl=None, payload_size=0, heartbeat_interval=None, use_directory=False, reconnect_policy=None,
+        broker_heartbeat_interval=None, broker_heartbeat_timeout=None, zk_namespace=None,
+        barrier=None, transport=None, verbose=False):
         """ Constructor
         args:
         - broker_address (str) - IP address of broker (port 5556)
@@ -30,8 +38,29 @@ class Publisher(ZookeeperClient):
         - bind_port - port on which to publish information
         - indefinite (boolean) - whether to publish events/updates indefinitely
         - max_event_count (int) - if not (indefinite), max number of events/updates to publish
+        - ttl (float) - optional time-to-live in seconds attached to every published event
+        - payload_size (int) - bytes of payload carried by every published event, so
+          performance tests can load the system with events of a realistic size
+        - heartbeat_interval (float) - optional seconds between heartbeats telling the broker
+          this publisher is alive, so a broker reclaiming dead clients keeps its registration
+        - use_directory (boolean) - advertise the topics in the ZooKeeper topic directory
+          instead of registering with the broker (decentralized dissemination only)
+        - reconnect_policy (ReconnectPolicy) - when to reconnect after a broker change and
+          how to retry registrations; default: at once, waiting for replies forever
+        - broker_heartbeat_interval (float) - optional seconds between ZMTP heartbeats on
+          the connection to the broker; a dead or hung broker is noticed within
+          broker_heartbeat_timeout (default twice the interval) instead of when its
+          ZooKeeper session expires
+        - broker_heartbeat_timeout (float) - seconds without an answer that mean the broker is gone
+        - zk_namespace (str) - optional ZooKeeper namespace of this pub/sub system; every
+          znode lives under /<zk_namespace>, so several systems can share one ensemble
+        - barrier (str) - optional barrier znode of a run orchestrated by a test driver;
+          READY and DONE are signalled below it (see barrier.py)
+        - transport (Transport) - endpoints of the ZMQ sockets (see transport.py);
+          tcp:// by default, inproc:// in a local cluster
         """
         self.verbose = verbose
+        self.transport = transport or TCP_TRANSPORT
         self.id = id(self)
         self.broker_address = broker_address
         # self.own_address = own_address
@@ -40,15 +69,32 @@ class Publisher(ZookeeperClient):
         self.bind_port = bind_port
         self.indefinite = indefinite
         self.max_event_count = max_event_count
+        self.ttl = ttl
+        # Built once; only its size matters. A string, so logged events stay JSON
+        self.payload = 'x' * payload_size if payload_size else None
+        self.heartbeat_interval = heartbeat_interval
+        self.last_heartbeat = time.time()
         self.context = None
         self.broker_reg_socket = None
         self.pub_socket = None
         self.pub_port = None
         self.pub_reg_port = 5555
+        # Filter frame per topic: the compact topic ID handed out by the broker at
+        # registration; topics without one are sent under their name
+        self.topic_frames = {}
+        # Topic directory (see topic_directory.py): our ephemeral znode per topic;
+        # re-created when a lost session comes back
+        self.use_directory = use_directory
+        self.directory_znodes = []
+        self.directory_lost = False
         self.set_logger()
 
         # Set up initial config for ZooKeeper client.
-        super().__init__(zookeeper_hosts)
+        super().__init__(zookeeper_hosts, namespace=zk_namespace)
+        self.barrier = barrier
+        self.reconnect_policy = reconnect_policy or ReconnectPolicy(tier=TIERS['pub'])
+        self.broker_heartbeat_interval = broker_heartbeat_interval
+        self.broker_heartbeat_timeout = broker_heartbeat_timeout
         self.WATCH_FLAG = False
         self.info(f"Successfully initialized publisher object (PUB{id(self)})")
 
@@ -70,24 +116,6 @@ class Publisher(ZookeeperClient):
         handler.setFormatter(formatter)
         self.logger.addHandler(handler)
 
-    def get_znode_value (self):
-        """ ******************* retrieve a znode value  ************************ """
-        try:
-            self.debug ("Checking if {} exists (it better be)".format(self.zk_name))
-            if self.zk.exists (self.zk_name):
-                self.debug ("{} znode indeed exists; get value".format(self.zk_name))
-                # Now acquire the value and stats of that znode
-                #value,stat = self.zk.get (self.zk_name, watch=self.watch)
-                value,stat = self.zk.get (self.zk_name)
-                self.znode_value = value.decode("utf-8")
-                self.debug(("Details of znode {}: value = {}, stat = {}".format (self.zk_name, value, stat)))
-                self.debug(f"Values stored in field znode_value is {self.znode_value}")
-            else:
-                self.debug ("{} znode does not exist, why?".format(self.zk_name))
-        except:
-            self.debug("Exception thrown checking for exists/get: ", sys.exc_info()[0])
-            return
-
     def update_broker_info(self):
         if self.znode_value != None:
             self.debug("Getting broker information from znode_value")
@@ -101,31 +129,39 @@ class Publisher(ZookeeperClient):
         #*****************************************************************
         # This is the watch callback function that is supposed to be invoked
         # when changes get made to the znode of interest. Note that a watch is
-        # effective only once. So the client has to set the watch every time.
-        # To overcome the need for this, Kazoo has come up with a decorator.
-        # Decorators can be of two kinds: watching for data on a znode changing,
-        # and children on a znode changing
-        @self.zk.DataWatch(self.zk_name)
+        # effective only once, so the cached znode watch (see
+        # ZookeeperClient.watch_znode) re-arms it on every event. The watch is shared
+        # with get_znode_value and the new value comes with the event, so following
+        # the broker costs a single read per change.
         def dump_data_change (data, stat, event):
             if event == None:
                 self.WATCH_FLAG = True
                 self.debug("No ZNODE Event - First Watch Call! Initializing publisher...")
+                # Remember the epoch of the broker we start with
+                self.is_new_broker(data, stat)
                 self.configure()
                 self.WATCH_FLAG = False
-            elif event.type == 'CHANGED':
-                self.WATCH_FLAG = True
-                self.debug("ZNODE CHANGED")
-                self.debug("Close all sockets and terminate the context")
-                self.context.destroy()
-                self.debug("Update Broker Information")
-                self.debug(f"Data changed for znode: data={data},stat={stat}")
-                self.get_znode_value()
-                self.update_broker_info()
-                self.debug("Reconfiguring...")
-                self.configure()
-                self.WATCH_FLAG = False
+            elif event.type in ('CHANGED', 'CREATED'):
+                self.debug(f"ZNODE {event.type}")
+                if self.is_new_broker(data, stat):
+                    self.switch_broker(data)
             elif event.type == 'DELETED':
                 self.debug("ZNODE DELETED")
+        self.watch_znode(self.zk_name, dump_data_change)
+
+    def switch_broker(self, data):
+        """ Reconnect to the broker named by a new /broker value """
+        self.WATCH_FLAG = True
+        self.debug("Close all sockets and terminate the context")
+        self.context.destroy()
+        self.debug("Update Broker Information")
+        self.znode_value = data.decode('utf-8')
+        self.update_broker_info()
+        def reconnect():
+            self.debug("Reconfiguring...")
+            self.configure()
+            self.WATCH_FLAG = False
+        self.reconnect_after_broker_change(reconnect)
 
     def configure(self):
         """ Method to perform initial configuration of Publisher """
@@ -133,17 +169,20 @@ class Publisher(ZookeeperClient):
         self.debug("Initializing")
         # first get the context
         self.debug ("Setting the context object" )
-        self.context = zmq.Context()
+        self.context = self.transport.context()
 
-        # now create socket to register with broker
-        self.debug("Connecting to register with broker")
-        self.broker_reg_socket = self.context.socket(zmq.REQ)
-        self.broker_reg_socket.connect(f"tcp://{self.broker_address}:{self.pub_reg_port}")
+        if not self.use_directory:
+            # now create socket to register with broker
+            self.debug("Connecting to register with broker")
+            self.connect_broker_reg_socket()
         # now create socket to publish
         self.pub_socket = self.context.socket(zmq.PUB)
         self.setup_port_binding()
         self.debug(f"Binding at {self.get_host_address()} to publish")
-        self.register_pub()
+        if self.use_directory:
+            self.advertise()
+        else:
+            self.register_pub()
         self.debug("Configure Stop")
 
     def setup_port_binding(self):
@@ -155,7 +194,7 @@ class Publisher(ZookeeperClient):
         while not success:
             try:
                 self.info(f'Attempting bind to port {self.bind_port}')
-                self.pub_socket.bind(f'tcp://*:{self.bind_port}')
+                self.pub_socket.bind(self.transport.bind_endpoint(self.bind_port))
                 success = True
                 self.info(f'Successful bind to port {self.bind_port}')
             except:
@@ -167,26 +206,104 @@ class Publisher(ZookeeperClient):
                     self.debug(e)
         self.debug("Finished loop")
 
+    def connect_broker_reg_socket(self):
+        """ (Re)create the REQ socket registering with the broker """
+        if self.broker_reg_socket is not None:
+            self.broker_reg_socket.close(linger=0)
+        self.broker_reg_socket = self.context.socket(zmq.REQ)
+        self.watch_broker_connection(self.broker_reg_socket)
+        self.broker_reg_socket.connect(self.transport.endpoint(self.broker_address, self.pub_reg_port))
+
     def register_pub(self):
-        """ Method to register this publisher with the broker """
+        """ Method to register this publisher with the broker. If the broker rejects
+        the registration with a retry_after hint (admission control), wait at least
+        that long plus a jittered exponential backoff and try again. Without a reply
+        within the reconnect policy's registration timeout, retry on a new socket
+        after a jittered exponential backoff. """
         self.debug(f"Registering with broker at {self.broker_address}:5555")
         message_dict = {'address': self.get_host_address(), 'topics': self.topics,
             'id': self.id}
         message = json.dumps(message_dict, indent=4)
-        self.debug(f"Sending registration message: {message}")
-        self.broker_reg_socket.send_string(message)
-        self.debug(f"Sent!")
-        received = self.broker_reg_socket.recv_string()
-        received = json.loads(received)
+        attempt = 0
+        while True:
+            self.debug(f"Sending registration message: {message}")
+            self.broker_reg_socket.send_string(message)
+            self.debug(f"Sent!")
+            if not self.reconnect_policy.wait_reply(self.broker_reg_socket):
+                delay = self.reconnect_policy.retry_delay(attempt)
+                self.info(f"No reply to registration; retrying in {delay:.2f}s")
+                self.connect_broker_reg_socket()
+                time.sleep(delay)
+                attempt += 1
+                continue
+            received = self.broker_reg_socket.recv_string()
+            received = json.loads(received)
+            if 'retry_after' not in received:
+                break
+            delay = self.reconnect_policy.retry_delay(attempt, retry_after=received['retry_after'])
+            self.info(f"Registration rejected ({received['error']}); retrying in {delay:.2f}s")
+            time.sleep(delay)
+            attempt += 1
         if 'success' in received:
             self.debug(f"Registration successful: {received}")
+            self.topic_frames = topic_frames(received.get('topic_ids', {}))
         else:
             self.debug(f"Registration failed: {received}")
 
+    def advertise(self):
+        """ Advertise our topics in the topic directory, and again whenever the
+        session (and with it our ephemeral znodes) was lost and comes back """
+        self.zk.add_listener(self.directory_state_changed)
+        self.advertise_topics()
+
+    def advertise_topics(self):
+        address = self.get_host_address()
+        self.directory_znodes = [advertise_publisher(self.zk, topic, address) for topic in self.topics]
+        self.info(f"Advertised {address} in the topic directory")
+
+    def directory_state_changed(self, state):
+        if state == KazooState.LOST:
+            self.directory_lost = True
+        elif state == KazooState.CONNECTED and self.directory_lost:
+            self.directory_lost = False
+            # No ZooKeeper calls from the connection thread
+            self.zk.handler.spawn(self.advertise_topics)
+
+    def withdraw(self):
+        """ Remove our znodes from the topic directory """
+        self.zk.remove_listener(self.directory_state_changed)
+        for path in self.directory_znodes:
+            try:
+                self.zk.delete(path)
+            except NoNodeError:
+                pass
+        self.directory_znodes = []
+
+    def heartbeat(self):
+        """ Tell the broker this publisher is alive. If the broker has reclaimed the
+        registration meanwhile (e.g. after a long pause), register again. """
+        msg = {'heartbeat': {'id': self.id, 'topics': self.topics}}
+        self.broker_reg_socket.send_string(json.dumps(msg))
+        self.last_heartbeat = time.time()
+        if not self.wait_heartbeat_reply():
+            return
+        response = json.loads(self.broker_reg_socket.recv_string())
+        if response.get('reregister'):
+            self.info("Broker no longer knows this publisher; registering again")
+            self.register_pub()
+
+    def heartbeat_due(self):
+        """ Return True if heartbeats are enabled and the next one is due """
+        return (self.heartbeat_interval is not None and self.broker_reg_socket is not None
+            and time.time() - self.last_heartbeat >= self.heartbeat_interval)
+
     def get_host_address(self):
         """ Method to return IP address of current host.
         If using a mininet topology, use netifaces (socket.gethost... fails on mininet hosts)
         Otherwise, local testing without mininet, use localhost 127.0.0.1 """
+        if self.transport.host is not None:
+            # Every entity of a local cluster has the same host name
+            return f'{self.transport.host}:{self.bind_port}'
         try:
             # Will succeed on mininet. Two interfaces, get second one.
             # Then get AF_INET address family with key = 2
@@ -202,15 +319,24 @@ class Publisher(ZookeeperClient):
         """ Method to generate a publish event
         Args:
         - iteration (int) - current publish event iteration for this publisher """
+        # If only N topics, then N+1 publish event will publish first topic over again
+        topic = self.topics[iteration % len(self.topics)]
         event = {
             # Send this to subscriber even if broker is anonymizing so performance can be analyzed.
             'publisher': self.get_host_address(),
-            # If only N topics, then N+1 publish event will publish first topic over again
-            'topic': self.topics[iteration % len(self.topics)],
             'publish_time': time.time()
         }
-        topic = self.topics[iteration % len(self.topics)].encode('utf8')
-        event = [b'%b' % topic, pickle.dumps(event)]
+        if self.ttl is not None:
+            # Broker and subscribers drop the event once it is older than ttl seconds
+            event['ttl'] = self.ttl
+        if self.payload is not None:
+            event['payload'] = self.payload
+        frame = self.topic_frames.get(topic)
+        if frame is None:
+            # No ID assigned; the name is both the filter frame and part of the event
+            event['topic'] = topic
+            frame = topic.encode('utf8')
+        event = [frame, pickle.dumps(event)]
         return event
 
 
@@ -227,10 +353,13 @@ class Publisher(ZookeeperClient):
                     self.debug(f'Sending event: [{event}]')
                     # self.pub_socket.send_string(event)
                     self.pub_socket.send_multipart(event)
+                    if self.heartbeat_due():
+                        self.heartbeat()
+                    self.broker_lost(self.switch_broker)
                     time.sleep(self.sleep_period)
                     i += 1
                 else:
-                    self.debug("SWITCHING BROKER")
+                    self.wait_for_switch()
         else:
             event_count = 0
             while event_count < self.max_event_count:
@@ -239,23 +368,30 @@ class Publisher(ZookeeperClient):
                     event = self.generate_publish_event(iteration=event_count)
                     self.debug(f'Sending event: [{event}]')
                     self.pub_socket.send_multipart(event)
+                    if self.heartbeat_due():
+                        self.heartbeat()
+                    self.broker_lost(self.switch_broker)
                     time.sleep(self.sleep_period)
                     event_count += 1
                 else:
-                    self.debug("SWITCHING BROKER")
+                    self.wait_for_switch()
 
     def disconnect(self):
         """ Method to disconnect from the pub/sub network """
         # Close all sockets associated with this context
         # Tell broker publisher is disconnecting. Remove from storage.
         self.debug("Disconnect")
-        msg = {'disconnect': {'id': self.id, 'address': self.get_host_address(),
-            'topics': self.topics}}
-        self.debug(f"Disconnecting, telling broker: {msg}")
-        self.broker_reg_socket.send_string(json.dumps(msg))
-        # Wait for response
-        response = self.broker_reg_socket.recv_string()
-        self.debug(f"Broker response: {response} ")
+        if self.use_directory:
+            self.debug("Disconnecting, withdrawing from the topic directory")
+            self.withdraw()
+        else:
+            msg = {'disconnect': {'id': self.id, 'address': self.get_host_address(),
+                'topics': self.topics}}
+            self.debug(f"Disconnecting, telling broker: {msg}")
+            self.broker_reg_socket.send_string(json.dumps(msg))
+            # Wait for response
+            response = self.broker_reg_socket.recv_string()
+            self.debug(f"Broker response: {response} ")
         try:
             self.debug(f'Destroying ZMQ context, closing all sockets')
             self.context.destroy()
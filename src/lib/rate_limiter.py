@@ -0,0 +1,112 @@
+""" Token bucket rate limiting of publisher ingress on the centralized broker.
+A publisher running with --sleep 0 can otherwise saturate the broker and raise
+latency for everyone. Each (publisher, topic) pair gets its own bucket; messages
+arriving when the bucket is empty are dropped before any forwarding work is done.
+
+Limits (messages per second) come from the broker's command line and can be
+replaced at runtime by writing JSON to the rate limit znode, e.g.
+    {"default": 100, "topics": {"A": 500}, "publishers": {"10.0.0.5:5556": 20}}
+A publisher-specific limit wins over a topic limit, which wins over the default.
+"""
+import json
+import time
+
+class TokenBucket:
+    """ Classic token bucket refilled continuously at rate tokens per second """
+
+    def __init__(self, rate, burst, now=None):
+        """ Constructor
+        args:
+        - rate (float) - tokens added per second
+        - burst (float) - bucket capacity, i.e. max messages accepted back to back
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.time() if now is None else now
+
+    def consume(self, now):
+        """ Take one token if available; return True if the message is allowed """
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class IngressRateLimiter:
+    """ Per-publisher, per-topic ingress limits with throttle/drop counters """
+
+    def __init__(self, default_rate=None, topic_rates={}, publisher_rates={}, burst_seconds=1.0):
+        """ Constructor
+        args:
+        - default_rate (float) - messages per second allowed per publisher and topic; None = unlimited
+        - topic_rates (dict) - topic -> messages per second, overrides default_rate
+        - publisher_rates (dict) - publisher address -> messages per second, overrides topic_rates
+        - burst_seconds (float) - bucket capacity expressed in seconds of traffic at the limit
+        """
+        self.burst_seconds = burst_seconds
+        self.buckets = {}
+        # key = publisher address, value = {'allowed': n, 'dropped': n, 'throttled': n}
+        self.counters = {}
+        # (publisher, topic) pairs currently over their limit
+        self.throttled = set()
+        self.update_limits({
+            'default': default_rate, 'topics': topic_rates, 'publishers': publisher_rates
+        })
+
+    def update_limits(self, limits):
+        """ Replace all limits; existing buckets are rebuilt lazily with the new rates
+        Args:
+        - limits (dict) - {'default': rate, 'topics': {...}, 'publishers': {...}}
+        """
+        self.default_rate = limits.get('default')
+        self.topic_rates = dict(limits.get('topics', {}))
+        self.publisher_rates = dict(limits.get('publishers', {}))
+        self.buckets.clear()
+        self.enabled = bool(
+            self.default_rate is not None or self.topic_rates or self.publisher_rates)
+
+    def update_limits_from_json(self, data):
+        """ Replace all limits from the JSON value of the rate limit znode """
+        self.update_limits(json.loads(data) if data else {})
+
+    def rate(self, publisher, topic):
+        """ Return the limit applying to a publisher on a topic, or None if unlimited """
+        if publisher in self.publisher_rates:
+            return self.publisher_rates[publisher]
+        return self.topic_rates.get(topic, self.default_rate)
+
+    def allow(self, publisher, topic, now=None):
+        """ Return True if a message from publisher on topic is within its limit
+        Args:
+        - publisher (str) - publisher address carried in the event
+        - topic (str) - topic of the event
+        - now (float) - current time, defaults to time.time()
+        """
+        if not self.enabled:
+            return True
+        counters = self.counters.setdefault(publisher, {'allowed': 0, 'dropped': 0, 'throttled': 0})
+        key = (publisher, topic)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            rate = self.rate(publisher, topic)
+            if rate is None:
+                counters['allowed'] += 1
+                return True
+            bucket = self.buckets[key] = TokenBucket(
+                rate, max(1, rate * self.burst_seconds), now=now)
+        if bucket.consume(time.time() if now is None else now):
+            self.throttled.discard(key)
+            counters['allowed'] += 1
+            return True
+        if key not in self.throttled:
+            # Start of a new throttling episode for this publisher/topic
+            self.throttled.add(key)
+            counters['throttled'] += 1
+        counters['dropped'] += 1
+        return False
+
+    def stats(self):
+        """ Return allowed/dropped/throttled counters per publisher """
+        return {publisher: dict(counters) for publisher, counters in self.counters.items()}
@@ -0,0 +1,60 @@
+""" Staged reconnection of clients after a broker change.
+Every publisher, subscriber and relay watches /broker, so on a failover they all
+see the same CHANGED event and would register with the new leader at the same
+instant, queueing up on its registration sockets. A ReconnectPolicy spreads them
+out instead:
+- jitter: each client waits a random delay in [0, jitter) before reconnecting
+- tiers: clients of tier k wait k * tier_interval on top, so e.g. subscribers
+  (tier 0) are registered before publishers (tier 1) start publishing into topics
+  nobody receives yet
+- registration timeout: a registration without a reply within the timeout (e.g.
+  the new leader is not listening yet) is retried on a fresh socket after an
+  exponential backoff (see backoff.py)
+The default policy reconnects at once and waits for replies forever.
+"""
+import random
+from .backoff import backoff_delay
+
+# Reconnection tier per role; lower tiers reconnect first
+TIERS = {'sub': 0, 'relay': 0, 'pub': 1}
+
+class ReconnectPolicy:
+    """ When a client reconnects to a new broker and how it retries registering """
+
+    def __init__(self, jitter=0.0, tier=0, tier_interval=0.0, registration_timeout=None,
+        backoff_base=0.1, backoff_cap=30.0):
+        """ Constructor
+        args:
+        - jitter (float) - reconnect after a random delay of up to jitter seconds
+        - tier (int) - reconnection tier of the client (see TIERS)
+        - tier_interval (float) - seconds between the start of consecutive tiers
+        - registration_timeout (float) - seconds to wait for the broker's reply to a
+          registration before retrying; None waits forever
+        - backoff_base (float) - delay of the first registration retry, doubled per retry
+        - backoff_cap (float) - max delay between registration retries
+        """
+        self.jitter = jitter
+        self.tier = tier
+        self.tier_interval = tier_interval
+        self.registration_timeout = registration_timeout
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+    def delay(self):
+        """ Return how long to wait after a broker change before reconnecting """
+        delay = self.tier * self.tier_interval
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        return delay
+
+    def retry_delay(self, attempt, retry_after=None):
+        """ Return how long to wait before registration retry number attempt (0-based) """
+        return backoff_delay(attempt, base=self.backoff_base, cap=self.backoff_cap,
+            retry_after=retry_after)
+
+    def wait_reply(self, socket):
+        """ Return True once a reply is waiting on socket, False if the registration
+        timeout passed first """
+        if self.registration_timeout is None:
+            return True
+        return bool(socket.poll(self.registration_timeout * 1000))
@@ -0,0 +1,377 @@
+""" Fan-out relay tier for the centralized broker.
+With thousands of subscribers on a topic, the broker's PUB socket spends its time
+copying every message to every subscriber connection. A relay subscribes to the
+broker on a set of topics, like a single subscriber, and re-publishes the frames
+unchanged to its own group of subscribers. The broker then sends each message
+once per relay instead of once per subscriber, and fan-out capacity grows with
+the number of relays at the cost of one extra hop.
+
+Relays advertise themselves in ZooKeeper as ephemeral znodes under /relays
+(value: JSON with address, port and topics). Subscribers using relays join the
+relay serving all their topics with the fewest members, recording the assignment
+as an ephemeral sequential znode under /relay_members/<relay id>, so assignments
+of dead subscribers disappear and a dead relay's subscribers move elsewhere.
+"""
+from .zookeeper_client import ZookeeperClient
+from .transport import TCP_TRANSPORT
+from .reconnect import ReconnectPolicy, TIERS
+from .topic_ids import topic_frames
+from kazoo.exceptions import NoNodeError
+import zmq
+import json
+import logging
+import netifaces
+import random
+import sys
+import time
+import uuid
+
+RELAYS_PATH = '/relays'
+RELAY_MEMBERS_PATH = '/relay_members'
+
+def choose_relay(zk, topics):
+    """ Return (relay id, relay info) of the relay serving every topic with the
+    fewest assigned subscribers (ties broken at random), or None if no relay fits
+    Args:
+    - zk (KazooClient) - started ZooKeeper client
+    - topics (list) - topics the subscriber wants
+    """
+    candidates = []
+    for relay_id in zk.get_children(RELAYS_PATH) if zk.exists(RELAYS_PATH) else []:
+        try:
+            data, _ = zk.get(f'{RELAYS_PATH}/{relay_id}')
+            members = zk.get_children(f'{RELAY_MEMBERS_PATH}/{relay_id}')
+        except NoNodeError:
+            # Relay went away while we were looking
+            continue
+        info = json.loads(data)
+        if set(topics) <= set(info['topics']):
+            candidates.append((len(members), random.random(), relay_id, info))
+    if not candidates:
+        return None
+    _, _, relay_id, info = min(candidates)
+    return relay_id, info
+
+def join_relay(zk, relay_id):
+    """ Record a subscriber's assignment to a relay; return the member znode path """
+    return zk.create(f'{RELAY_MEMBERS_PATH}/{relay_id}/member-', ephemeral=True,
+        sequence=True, makepath=True)
+
+class Relay(ZookeeperClient):
+    """ Re-publishes the broker's messages for a set of topics to its own subscribers """
+
+    def __init__(self, topics=[], port=5580, zookeeper_hosts=['127.0.0.1:2181'],
+        indefinite=False, max_event_count=15, heartbeat_interval=None, reconnect_policy=None,
+        broker_heartbeat_interval=None, broker_heartbeat_timeout=None, zk_namespace=None,
+        barrier=None, transport=None, verbose=False):
+        """ Constructor
+        args:
+        - topics (list) - topics this relay serves
+        - port (int) - port of the PUB socket subscribers connect to (next free port if taken)
+        - indefinite (boolean) - whether to relay indefinitely
+        - max_event_count (int) - if not indefinite, number of messages to relay
+        - heartbeat_interval (float) - optional seconds between heartbeats to the broker,
+          so a broker reclaiming dead clients keeps the relay's registration
+        - reconnect_policy (ReconnectPolicy) - when to reconnect after a broker change and
+          how to retry registrations; default: at once, waiting for replies forever
+        - broker_heartbeat_interval (float) - optional seconds between ZMTP heartbeats on
+          the connection to the broker; a dead or hung broker is noticed within
+          broker_heartbeat_timeout (default twice the interval) instead of when its
+          ZooKeeper session expires
+        - broker_heartbeat_timeout (float) - seconds without an answer that mean the broker is gone
+        - zk_namespace (str) - optional ZooKeeper namespace of this pub/sub system; every
+          znode lives under /<zk_namespace>, so several systems can share one ensemble
+        - barrier (str) - optional barrier znode of a run orchestrated by a test driver;
+          READY and DONE are signalled below it (see barrier.py)
+        - transport (Transport) - endpoints of the ZMQ sockets (see transport.py);
+          tcp:// by default, inproc:// in a local cluster
+        """
+        self.verbose = verbose
+        self.transport = transport or TCP_TRANSPORT
+        self.topics = topics
+        self.port = port
+        self.indefinite = indefinite
+        self.max_event_count = max_event_count
+        self.heartbeat_interval = heartbeat_interval
+        self.last_heartbeat = time.time()
+        self.relay_id = str(uuid.uuid4())
+        self.id = id(self)
+        self.set_logger()
+        super().__init__(zookeeper_hosts=zookeeper_hosts, namespace=zk_namespace)
+        self.barrier = barrier
+        self.reconnect_policy = reconnect_policy or ReconnectPolicy(tier=TIERS['relay'])
+        self.broker_heartbeat_interval = broker_heartbeat_interval
+        self.broker_heartbeat_timeout = broker_heartbeat_timeout
+        self.broker_address = '127.0.0.1'
+        self.sub_reg_port = 5556
+        self.context = None
+        self.poller = None
+        self.broker_reg_socket = None
+        # PUB socket this relay's subscribers connect to
+        self.pub_socket = None
+        # key = broker endpoint, value = SUB socket receiving the topics published there
+        self.upstream_sockets = {}
+        # Filter frame per topic (topic ID frame assigned by the broker, else the name)
+        self.topic_frames = {}
+        # Max messages moved from one upstream socket per poll, so one busy topic
+        # cannot starve the others
+        self.FORWARD_BATCH = 256
+        self.forwarded_count = 0
+        # flag to prevent race condition between the event loop and the watch
+        # mechanism that replaces the upstream connections
+        self.WATCH_FLAG = False
+        self.info(f"Successfully initialized relay object (RELAY{id(self)})")
+
+    def set_logger(self):
+        self.prefix = {'prefix': f'RELAY{id(self)}<{",".join(self.topics)}>'}
+        self.logger = logging.getLogger(f'RELAY{id(self)}')
+        self.logger.setLevel(logging.DEBUG if self.verbose else logging.INFO)
+        handler = logging.StreamHandler()
+        formatter = logging.Formatter('%(prefix)s - %(message)s')
+        handler.setFormatter(formatter)
+        self.logger.addHandler(handler)
+
+    def info(self, msg):
+        self.logger.info(msg, extra=self.prefix)
+
+    def debug(self, msg):
+        self.logger.debug(msg, extra=self.prefix)
+
+    def error(self, msg):
+        self.logger.error(msg, extra=self.prefix)
+
+    def update_broker_info(self):
+        if self.znode_value != None:
+            self.debug("Getting broker information from znode_value")
+            self.broker_address = self.znode_value.split(",")[0]
+            self.sub_reg_port = self.znode_value.split(",")[2]
+
+    def watch_znode_data_change(self):
+        """ Configure on the first watch call; follow the broker when it changes """
+        def dump_data_change(data, stat, event):
+            if event == None:
+                self.WATCH_FLAG = True
+                # Remember the epoch of the broker we start with
+                self.is_new_broker(data, stat)
+                self.configure()
+                self.WATCH_FLAG = False
+            elif event.type in ('CHANGED', 'CREATED') and self.is_new_broker(data, stat):
+                self.switch_broker(data)
+        self.watch_znode(self.zk_name, dump_data_change)
+
+    def switch_broker(self, data):
+        """ Reconnect upstream to the broker named by a new /broker value """
+        self.WATCH_FLAG = True
+        self.debug("Broker Changed! Reconnecting upstream")
+        self.znode_value = data.decode('utf-8')
+        self.update_broker_info()
+        self.reset_upstream()
+        def reconnect():
+            self.register_with_broker()
+            self.WATCH_FLAG = False
+        self.reconnect_after_broker_change(reconnect)
+
+    def configure(self):
+        """ Method to perform initial configuration of Relay entity """
+        self.debug("Configure Start")
+        self.context = self.transport.context()
+        self.poller = zmq.Poller()
+        self.pub_socket = self.context.socket(zmq.PUB)
+        # A relay exists to absorb fan-out; do not drop on a briefly slow subscriber
+        self.pub_socket.setsockopt(zmq.SNDHWM, 10000)
+        self.setup_port_binding()
+        self.register_with_broker()
+        self.advertise()
+        self.debug("Configure Stop")
+
+    def setup_port_binding(self):
+        """
+        Method to bind the PUB socket to port. If port already in use,
+        increment and keep trying until success.
+        """
+        success = False
+        while not success:
+            try:
+                self.debug(f'Attempting bind to port {self.port}')
+                self.pub_socket.bind(self.transport.bind_endpoint(self.port))
+                success = True
+                self.debug(f'Successful bind to port {self.port}')
+            except zmq.error.ZMQError:
+                self.error(f'Port {self.port} already in use, attempting next port')
+                self.port += 1
+
+    def register_with_broker(self):
+        """ Register with the broker as a subscriber of the relayed topics and connect
+        to the ports it publishes them on. Rejections with a retry_after hint
+        (admission control), and registrations without a reply within the reconnect
+        policy's registration timeout, are retried with jittered exponential backoff. """
+        self.connect_broker_reg_socket()
+        message = json.dumps({'address': self.get_host_address(), 'id': self.id, 'topics': self.topics})
+        attempt = 0
+        while True:
+            self.broker_reg_socket.send_string(message)
+            if not self.reconnect_policy.wait_reply(self.broker_reg_socket):
+                delay = self.reconnect_policy.retry_delay(attempt)
+                self.info(f"No reply to registration; retrying in {delay:.2f}s")
+                self.connect_broker_reg_socket()
+                time.sleep(delay)
+                attempt += 1
+                continue
+            reply = json.loads(self.broker_reg_socket.recv_string())
+            if 'retry_after' not in reply:
+                break
+            delay = self.reconnect_policy.retry_delay(attempt, retry_after=reply['retry_after'])
+            self.info(f"Registration rejected ({reply['error']}); retrying in {delay:.2f}s")
+            time.sleep(delay)
+            attempt += 1
+        self.topic_frames = topic_frames(reply.get('topic_ids', {}))
+        self.connect_upstream({
+            topic: self.transport.endpoint(self.broker_address, reply[topic]) for topic in self.topics
+        })
+        self.info("Registration successful")
+
+    def connect_broker_reg_socket(self):
+        """ (Re)create the REQ socket registering with the broker """
+        if self.broker_reg_socket is not None:
+            self.broker_reg_socket.close(linger=0)
+        self.broker_reg_socket = self.context.socket(zmq.REQ)
+        self.watch_broker_connection(self.broker_reg_socket)
+        self.broker_reg_socket.connect(self.transport.endpoint(self.broker_address, self.sub_reg_port))
+
+    def connect_upstream(self, endpoints):
+        """ Subscribe to each topic at the broker endpoint publishing it
+        Args:
+        - endpoints (dict) - topic -> endpoint, e.g. 'tcp://10.0.0.1:5560'
+        """
+        for topic, endpoint in endpoints.items():
+            if endpoint not in self.upstream_sockets:
+                socket = self.context.socket(zmq.SUB)
+                socket.setsockopt(zmq.RCVHWM, 10000)
+                socket.connect(endpoint)
+                self.poller.register(socket, zmq.POLLIN)
+                self.upstream_sockets[endpoint] = socket
+            self.upstream_sockets[endpoint].setsockopt(
+                zmq.SUBSCRIBE, self.topic_frames.get(topic, topic.encode('utf8')))
+
+    def reset_upstream(self):
+        """ Close the connections to the previous broker """
+        for socket in self.upstream_sockets.values():
+            self.poller.unregister(socket)
+            socket.close(linger=0)
+        self.upstream_sockets.clear()
+
+    def advertise(self):
+        """ Publish this relay under /relays so subscribers can be assigned to it """
+        if self.zk is None:
+            return
+        self.zk.ensure_path(f'{RELAY_MEMBERS_PATH}/{self.relay_id}')
+        info = {'address': self.get_host_address(), 'port': self.port, 'topics': self.topics}
+        self.zk.create(f'{RELAYS_PATH}/{self.relay_id}', json.dumps(info).encode('utf-8'),
+            ephemeral=True, makepath=True)
+        self.info(f"Relaying {self.topics} on port {self.port}")
+
+    def withdraw(self):
+        """ Undo advertise(): remove this relay from /relays, then its members znode
+        (with the assignments left under it), which would otherwise outlive us """
+        if self.zk is None:
+            return
+        try:
+            self.zk.delete(f'{RELAYS_PATH}/{self.relay_id}')
+        except NoNodeError:
+            pass
+        self.zk.delete(f'{RELAY_MEMBERS_PATH}/{self.relay_id}', recursive=True)
+
+    def forward(self, socket):
+        """ Re-publish up to FORWARD_BATCH messages waiting on an upstream socket.
+        Frames (topic, message and log offset, if any) are passed through as-is
+        without copying. Returns the number of messages forwarded """
+        count = 0
+        while count < self.FORWARD_BATCH:
+            try:
+                frames = socket.recv_multipart(zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                break
+            self.pub_socket.send_multipart(frames, copy=False)
+            count += 1
+        self.forwarded_count += count
+        return count
+
+    def heartbeat(self):
+        """ Tell the broker this relay is alive; register again if it was reclaimed """
+        self.broker_reg_socket.send_string(json.dumps({'heartbeat': {'id': self.id, 'topics': self.topics}}))
+        self.last_heartbeat = time.time()
+        if not self.wait_heartbeat_reply():
+            return
+        response = json.loads(self.broker_reg_socket.recv_string())
+        if response.get('reregister'):
+            self.info("Broker no longer knows this relay; registering again")
+            self.reset_upstream()
+            self.register_with_broker()
+
+    def poll_once(self, timeout=500):
+        """ Poll the upstream sockets once and forward what arrived; return the count """
+        forwarded = 0
+        if self.broker_heartbeat_interval is not None:
+            timeout = min(timeout, self.broker_heartbeat_interval * 1000)
+        try:
+            events = dict(self.poller.poll(timeout))
+        except zmq.error.ZMQError as e:
+            # Expected while the broker is being switched out
+            self.error(f"Failed to poll: {str(e)}")
+            return 0
+        for socket in list(self.upstream_sockets.values()):
+            if socket in events:
+                forwarded += self.forward(socket)
+        if (self.heartbeat_interval is not None
+                and time.time() - self.last_heartbeat >= self.heartbeat_interval):
+            self.heartbeat()
+        self.broker_lost(self.switch_broker)
+        return forwarded
+
+    def event_loop(self):
+        """ Relay either indefinitely or until max_event_count messages were relayed """
+        self.debug("Start Event Loop")
+        while self.indefinite or self.forwarded_count < self.max_event_count:
+            if not self.WATCH_FLAG:
+                self.poll_once()
+            else:
+                self.wait_for_switch()
+
+    def get_relay_stats(self):
+        """ Return the number of relayed messages and of subscribers assigned through ZooKeeper """
+        stats = {'relay_id': self.relay_id, 'port': self.port, 'forwarded': self.forwarded_count}
+        if self.zk is not None:
+            try:
+                stats['members'] = len(self.zk.get_children(f'{RELAY_MEMBERS_PATH}/{self.relay_id}'))
+            except NoNodeError:
+                stats['members'] = 0
+        return stats
+
+    def get_host_address(self):
+        """ Method to return IP address of current host (see Subscriber.get_host_address) """
+        if self.transport.host is not None:
+            return self.transport.host
+        try:
+            address = netifaces.ifaddresses(netifaces.interfaces()[-1])[2][0]['addr']
+        except:
+            address = "127.0.0.1"
+        return address
+
+    def disconnect(self):
+        """ Method to leave the pub/sub network: withdraw from /relays, tell the
+        broker and destroy the ZMQ context """
+        self.debug("Disconnect")
+        self.withdraw()
+        if self.broker_reg_socket is not None:
+            msg = {'disconnect': {'id': self.id, 'address': self.get_host_address(),
+                'topics': self.topics, 'notify_port': None}}
+            self.broker_reg_socket.send_string(json.dumps(msg))
+            self.broker_reg_socket.recv_string()
+        try:
+            self.info("Disconnecting. Destroying ZMQ context..")
+            self.context.destroy()
+            exit_code = 0
+        except Exception as e:
+            self.error(f"Failed to destroy context: {e}")
+            exit_code = 1
+        sys.exit(exit_code)
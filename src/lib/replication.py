@@ -0,0 +1,246 @@
+""" Streaming replication of the centralized broker's topic logs from the leader
+to standby brokers, so that a standby elected leader after a failover resumes
+from a copy of the leader's messages instead of starting empty.
+
+The leader binds a ROUTER socket; each standby connects a DEALER socket to it
+and says hello with the next offset of each of its logs. On every pass of its
+event loop the leader then sends each standby the records it does not have yet
+as chunks of raw log bytes read straight from the leader's log ('chunk'), so
+live streaming and catching up a new, slow or reconnecting standby are the same
+operation, batched by the loop. Standbys holding a tail the leader never had are
+told to drop it ('truncate'). Standbys append the chunks as-is, at the leader's
+offsets, and acknowledge cumulatively per topic after every batch they receive,
+so acks are pipelined rather than one round trip per message. Durability modes:
+- async: the leader fans messages out immediately; a failover can lose what
+  the standbys had not received yet
+- one: the leader holds a message back from fan-out until at least one
+  standby acknowledged it (or ack_timeout passed, so a missing standby costs
+  latency, not availability)
+"""
+from collections import deque
+import json
+import time
+import zmq
+from .topic_log import iter_records, RECORD_HEADER
+
+class ReplicationLeader:
+    """ Leader side: streams the topic logs to standbys and tracks their acks """
+    MODES = ['async', 'one']
+
+    def __init__(self, socket, topic_logs, mode='async', ack_timeout=1.0, chunk_bytes=256 * 1024,
+        chunks_per_stream=16):
+        """ Constructor
+        args:
+        - socket (zmq.Socket) - bound ROUTER socket standbys connect to
+        - topic_logs (TopicLogStore) - the leader's topic logs
+        - mode (str) - one of ReplicationLeader.MODES
+        - ack_timeout (float) - in 'one' mode, max seconds a message is held back
+          waiting for a standby's ack before being fanned out anyway
+        - chunk_bytes (int) - max bytes of log records per message to a standby
+        - chunks_per_stream (int) - max chunks sent per standby and topic on each call
+          to stream(), so catching up a standby cannot stall forwarding
+        """
+        if mode not in self.MODES:
+            raise ValueError(f'Unknown replication mode <{mode}>; expected one of {self.MODES}')
+        self.socket = socket
+        # Fail fast instead of silently dropping messages for unknown/disconnected standbys
+        self.socket.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self.topic_logs = topic_logs
+        self.mode = mode
+        self.ack_timeout = ack_timeout
+        self.chunk_bytes = chunk_bytes
+        self.chunks_per_stream = chunks_per_stream
+        # key = standby identity, value = {topic: next offset to send to the standby}
+        self.standbys = {}
+        # key = standby identity, value = {topic: next offset acknowledged by the standby}
+        self.acked = {}
+        # Messages held back from fan-out in 'one' mode
+        # key = topic, value = deque of (offset, time held, item)
+        self.pending = {}
+        # True while some standby is missing records after the last stream()
+        self.behind = False
+        self.streamed_count = 0
+        # Messages fanned out in 'one' mode without any standby acknowledging them
+        self.released_unacked = 0
+
+    def send(self, identity, frames, copy=True):
+        """ Send to a standby without blocking; return False if it cannot take more now """
+        try:
+            self.socket.send_multipart([identity] + frames, zmq.NOBLOCK, copy=copy)
+            return True
+        except zmq.Again:
+            # Standby's queue is full; it is sent the records again from the log later
+            return False
+        except zmq.ZMQError as e:
+            if e.errno == zmq.EHOSTUNREACH:
+                self.remove_standby(identity)
+                return False
+            raise
+
+    def add_standby(self, identity, next_offsets):
+        """ (Re)start streaming to a standby from the offsets it already holds """
+        self.standbys[identity] = {}
+        self.acked[identity] = dict(next_offsets)
+        for topic, log in self.topic_logs.logs.items():
+            standby_next = next_offsets.get(topic, 0)
+            if standby_next > log.next_offset:
+                # The standby holds messages this leader never had
+                self.send(identity, [b'truncate', topic.encode('utf8'), b'%d' % log.next_offset])
+                standby_next = self.acked[identity][topic] = log.next_offset
+            self.standbys[identity][topic] = standby_next
+
+    def remove_standby(self, identity):
+        self.standbys.pop(identity, None)
+        self.acked.pop(identity, None)
+
+    def handle_messages(self):
+        """ Process hellos and acks from standbys without blocking.
+        Returns the held (topic, item) pairs released by acks """
+        released = []
+        while True:
+            try:
+                identity, kind, body = self.socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            if kind == b'hello':
+                self.add_standby(identity, json.loads(body))
+            elif kind == b'ack' and identity in self.acked:
+                acked = self.acked[identity]
+                for topic, next_offset in json.loads(body).items():
+                    acked[topic] = max(acked.get(topic, 0), next_offset)
+                released.extend(self.release())
+        return released
+
+    def stream(self):
+        """ Send every standby the logged records it does not have yet, as chunks of
+        raw log records; returns True if some standby is still behind """
+        self.behind = False
+        for identity in list(self.standbys):
+            for topic, log in self.topic_logs.logs.items():
+                topic_frame = topic.encode('utf8')
+                for _ in range(self.chunks_per_stream):
+                    next_offsets = self.standbys.get(identity)
+                    if next_offsets is None or next_offsets.get(topic, 0) >= log.next_offset:
+                        break
+                    first_offset, count, chunk = log.read_raw(next_offsets.get(topic, 0), self.chunk_bytes)
+                    if not count or not self.send(identity, [b'chunk', topic_frame, chunk], copy=False):
+                        break
+                    next_offsets[topic] = first_offset + count
+                    self.streamed_count += count
+                next_offsets = self.standbys.get(identity)
+                if next_offsets is not None and next_offsets.get(topic, 0) < log.next_offset:
+                    self.behind = True
+        return self.behind
+
+    def hold(self, topic, offset, item):
+        """ 'one' mode: hold an item (e.g. frames to fan out) until a standby acknowledges offset """
+        self.pending.setdefault(topic, deque()).append((offset, time.time(), item))
+
+    def has_pending(self):
+        return any(self.pending.values())
+
+    def release(self, now=None):
+        """ Return the held (topic, item) pairs acknowledged by at least one standby,
+        or held for longer than ack_timeout, in offset order """
+        now = time.time() if now is None else now
+        released = []
+        for topic, queue in self.pending.items():
+            if not queue:
+                continue
+            acked = max((acked.get(topic, 0) for acked in self.acked.values()), default=0)
+            while queue and (queue[0][0] < acked or now - queue[0][1] >= self.ack_timeout):
+                offset, _, item = queue.popleft()
+                if offset >= acked:
+                    self.released_unacked += 1
+                released.append((topic, item))
+        return released
+
+    def stats(self):
+        """ Return per-standby lag (messages not yet acknowledged) and stream counters """
+        lag = {}
+        for identity, acked in self.acked.items():
+            lag[identity.hex()] = {
+                topic: log.next_offset - acked.get(topic, 0)
+                for topic, log in self.topic_logs.logs.items()
+            }
+        return {
+            'mode': self.mode,
+            'standbys': len(self.standbys),
+            'lag': lag,
+            'streamed': self.streamed_count,
+            'held': sum(len(queue) for queue in self.pending.values()),
+            'released_unacked': self.released_unacked
+        }
+
+class ReplicationFollower:
+    """ Standby side: appends the leader's stream to the local topic logs and acknowledges it """
+
+    def __init__(self, socket, topic_logs, hello_interval=1.0):
+        """ Constructor
+        args:
+        - socket (zmq.Socket) - DEALER socket connected to the leader's replication endpoint
+        - topic_logs (TopicLogStore) - the standby's topic logs
+        - hello_interval (float) - say hello again after this many quiet seconds, so a
+          restarted leader (or one that missed the first hello) learns about this standby
+        """
+        self.socket = socket
+        self.topic_logs = topic_logs
+        self.hello_interval = hello_interval
+        self.last_heard = 0
+        self.appended_count = 0
+
+    def hello(self):
+        """ Tell the leader which offsets this standby already holds """
+        self.topic_logs.open_all()
+        self.socket.send_multipart([b'hello', json.dumps(self.topic_logs.next_offsets()).encode('utf8')])
+        self.last_heard = time.time()
+
+    def append_chunk(self, topic, chunk):
+        """ Append a chunk of the leader's raw log records; return the number appended """
+        log = self.topic_logs.log(topic)
+        if RECORD_HEADER.unpack_from(chunk)[0] == log.next_offset:
+            # Usual case: the chunk continues our log, copy it as-is
+            return log.append_raw(chunk)
+        appended = 0
+        for offset, timestamp, payload in iter_records(chunk):
+            appended += self.append(topic, offset, timestamp, payload)
+        return appended
+
+    def append(self, topic, offset, timestamp, payload):
+        """ Append a replicated message at the leader's offset; return 1 if appended """
+        log = self.topic_logs.log(topic)
+        if offset < log.next_offset:
+            # Already held, e.g. streamed again after a hello
+            return 0
+        if offset > log.next_offset:
+            # The leader no longer retains the messages in between
+            log.reset(offset)
+        log.append(payload, timestamp)
+        return 1
+
+    def poll(self, timeout=100):
+        """ Append whatever the leader sent within timeout milliseconds, then acknowledge
+        the touched topics in one cumulative ack. Returns the number of appended messages """
+        if not self.socket.poll(timeout):
+            if time.time() - self.last_heard >= self.hello_interval:
+                self.hello()
+            return 0
+        appended = 0
+        touched = set()
+        while True:
+            try:
+                frames = self.socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            kind, topic = frames[0], frames[1].decode('utf8')
+            if kind == b'chunk':
+                appended += self.append_chunk(topic, frames[2])
+            elif kind == b'truncate':
+                self.topic_logs.log(topic).truncate(int(frames[2]))
+            touched.add(topic)
+        self.last_heard = time.time()
+        self.appended_count += appended
+        if touched:
+            acks = {topic: self.topic_logs.log(topic).next_offset for topic in touched}
+            self.socket.send_multipart([b'ack', json.dumps(acks).encode('utf8')])
+        return appended
@@ -0,0 +1,100 @@
+""" Deficit round robin scheduler used by the centralized broker to decide how
+many messages each ready topic may forward per event loop iteration.
+Topics are grouped into priority classes (lower number = served first) and,
+within a class, share the broker according to their weights, so a single
+flooding topic cannot starve latency-critical topics. Priority is strict: no
+topic of a lower class is served while a higher class still has a backlog.
+"""
+
+def parse_topic_options(specs=[], cast=int):
+    """ Parse per-topic options given on the command line as TOPIC=VALUE
+    Args:
+    - specs (list) - list of strings such as ['A=0', 'B=4']
+    - cast (callable) - type of the value, e.g. int or float
+    Returns dict mapping topic to value """
+    options = {}
+    for spec in specs:
+        topic, _, value = spec.rpartition('=')
+        if not topic:
+            raise ValueError(f'Invalid topic option <{spec}>; expected TOPIC=VALUE')
+        options[topic] = cast(value)
+    return options
+
+class TopicScheduler:
+    """ Deficit round robin across topic sockets, with strict priority between classes """
+
+    def __init__(self, topic_priorities={}, topic_weights={}, default_priority=1,
+        default_weight=1, quantum=8):
+        """ Constructor
+        args:
+        - topic_priorities (dict) - topic -> priority class (0 is served first)
+        - topic_weights (dict) - topic -> relative share within its priority class
+        - default_priority (int) - class of topics not in topic_priorities
+        - default_weight (int) - weight of topics not in topic_weights
+        - quantum (int) - messages credited per round to a topic of weight 1
+        """
+        self.topic_priorities = topic_priorities
+        self.topic_weights = topic_weights
+        self.default_priority = default_priority
+        self.default_weight = default_weight
+        self.quantum = quantum
+        # key = topic, value = unused message credit carried to the next round
+        self.deficits = {}
+        # Rotates the start of each class so equal topics take turns going first
+        self.round = 0
+        # Highest class (lowest number) left with a backlog this round, or None
+        self.backlog_priority = None
+
+    def priority(self, topic):
+        return self.topic_priorities.get(topic, self.default_priority)
+
+    def weight(self, topic):
+        return self.topic_weights.get(topic, self.default_weight)
+
+    def order(self, ready_topics):
+        """ Return the ready topics in the order they should be served this round:
+        by priority class first, then rotated round robin within each class
+        Args:
+        - ready_topics (list) - topics whose receive socket has queued messages
+        """
+        self.round += 1
+        self.backlog_priority = None
+        classes = {}
+        for topic in sorted(ready_topics):
+            classes.setdefault(self.priority(topic), []).append(topic)
+        ordered = []
+        for priority in sorted(classes):
+            topics = classes[priority]
+            start = self.round % len(topics)
+            ordered.extend(topics[start:] + topics[:start])
+        return ordered
+
+    def budget(self, topic):
+        """ Credit a topic with its quantum for this round and return how many
+        messages it may forward """
+        self.deficits[topic] = self.deficits.get(topic, 0) + self.quantum * self.weight(topic)
+        return int(self.deficits[topic])
+
+    def charge(self, topic, sent, drained):
+        """ Charge a topic for the messages it forwarded this round
+        Args:
+        - topic (str) - topic that was served
+        - sent (int) - number of messages forwarded
+        - drained (bool) - True if the topic ran out of queued messages; an idle
+          topic does not bank credit (standard DRR), so it cannot burst later
+        """
+        if drained:
+            self.deficits[topic] = 0
+        else:
+            self.deficits[topic] -= sent
+            if self.backlog_priority is None:
+                self.backlog_priority = self.priority(topic)
+
+    def blocked(self, topic):
+        """ Return True if a higher class than the topic's was left with a backlog this
+        round; the topic (and the rest of the round, in order) then waits """
+        return self.backlog_priority is not None and self.priority(topic) > self.backlog_priority
+
+    def forget(self, topic):
+        """ Drop scheduler state of a topic that no longer has a receive socket """
+        self.deficits.pop(topic, None)
@@ -1,10 +1,19 @@
 import socket as sock
 from .zookeeper_client import ZookeeperClient
+from .transport import TCP_TRANSPORT
+from .expiry import is_expired
+from .reconnect import ReconnectPolicy, TIERS
+from .topic_log import iter_records
+from .relay import choose_relay, join_relay
+from .topic_ids import topic_frames
+from .topic_directory import TopicDirectory
+from kazoo.exceptions import NoNodeError
 import zmq
 import logging
 import json
 import time
 import pickle
+import collections
 import netifaces
 import sys
 
@@ -18,7 +27,10 @@ class Subscriber(ZookeeperClient):
     def __init__(self, broker_address='127.0.0.1', filename=None,
         topics=[], indefinite=False,
         max_event_count=15, centralized=False, zookeeper_hosts=["127.0.0.1:2181"],
-        verbose=False):
+        topic_ttls={}, heartbeat_interval=None, replay_from_offsets={}, replay_from_times={},
+        use_relay=False, use_directory=False, reconnect_policy=None,
+        broker_heartbeat_interval=None, broker_heartbeat_timeout=None, zk_namespace=None,
+        barrier=None, transport=None, verbose=False):
         """ Constructor
         args:
         - broker_address - IP address of broker
@@ -26,8 +38,33 @@ class Subscriber(ZookeeperClient):
         - topics (list) - list of topics this subscriber should subscribe to / 'is interested in'
         - indefinite (boolean) - whether to listen for published updates indefinitely
         - max_event_count (int) - if not (indefinite), max number of relevant published updates to receive
+        - topic_ttls (dict) - per-topic time-to-live in seconds; expired updates are dropped, not recorded
+        - heartbeat_interval (float) - optional seconds between heartbeats telling the broker
+          this subscriber is alive, so a broker reclaiming dead clients keeps its registration
+        - replay_from_offsets (dict) - topic -> log offset; before listening, fetch the topic's
+          logged messages from that offset (centralized broker with a topic log only)
+        - replay_from_times (dict) - topic -> unix time; like replay_from_offsets, starting
+          at the first message the broker logged at or after that time
+        - use_relay (boolean) - (centralized only) receive topics from the least loaded relay
+          serving them, assigned through ZooKeeper, instead of from the broker
+        - use_directory (boolean) - (decentralized only) find publishers in the ZooKeeper
+          topic directory instead of registering with the broker
+        - reconnect_policy (ReconnectPolicy) - when to reconnect after a broker change and
+          how to retry registrations; default: at once, waiting for replies forever
+        - broker_heartbeat_interval (float) - optional seconds between ZMTP heartbeats on
+          the connection to the broker; a dead or hung broker is noticed within
+          broker_heartbeat_timeout (default twice the interval) instead of when its
+          ZooKeeper session expires
+        - broker_heartbeat_timeout (float) - seconds without an answer that mean the broker is gone
+        - zk_namespace (str) - optional ZooKeeper namespace of this pub/sub system; every
+          znode lives under /<zk_namespace>, so several systems can share one ensemble
+        - barrier (str) - optional barrier znode of a run orchestrated by a test driver;
+          READY and DONE are signalled below it (see barrier.py)
+        - transport (Transport) - endpoints of the ZMQ sockets (see transport.py);
+          tcp:// by default, inproc:// in a local cluster
          """
         self.verbose = verbose
+        self.transport = transport or TCP_TRANSPORT
         self.id = id(self)
         self.filename = filename
         self.broker_address = broker_address
@@ -35,7 +72,11 @@ class Subscriber(ZookeeperClient):
         self.centralized = centralized
         self.topics = topics # topic subscriber is interested in
         self.set_logger()
-        super().__init__(zookeeper_hosts=zookeeper_hosts)
+        super().__init__(zookeeper_hosts=zookeeper_hosts, namespace=zk_namespace)
+        self.barrier = barrier
+        self.reconnect_policy = reconnect_policy or ReconnectPolicy(tier=TIERS['sub'])
+        self.broker_heartbeat_interval = broker_heartbeat_interval
+        self.broker_heartbeat_timeout = broker_heartbeat_timeout
 
         if self.centralized:
             self.debug("Initializing subscriber to centralized broker")
@@ -53,6 +94,10 @@ class Subscriber(ZookeeperClient):
         # key = topic, value = socket for that topic
         self.sub_socket_dict = {}
 
+        # Filter frame per topic: the compact topic ID handed out by the broker at
+        # registration; topics without one are subscribed to by name
+        self.topic_frames = {}
+
         # Socket for registering with broker
         self.broker_reg_socket = None
 
@@ -63,6 +108,46 @@ class Subscriber(ZookeeperClient):
         # a list to store all the messages received
         self.received_message_list = []
 
+        # Messages older than their TTL are dropped before being recorded
+        # key = topic, value = number of expired messages dropped for that topic
+        self.topic_ttls = topic_ttls
+        self.expired_counts = {}
+
+        # Heartbeats keep this subscriber's registration alive on a broker that
+        # reclaims clients it has not heard from
+        self.heartbeat_interval = heartbeat_interval
+        self.last_heartbeat = time.time()
+
+        # Replay of messages logged by the broker (centralized only). Once a topic has
+        # been replayed, live messages carry their log offset and next_offsets holds
+        # the next offset expected per topic: older live messages are duplicates, and
+        # a newer one means a gap that is filled from the log first.
+        self.replay_from_offsets = replay_from_offsets
+        self.replay_from_times = replay_from_times
+        self.replay_port = None
+        self.replay_socket = None
+        self.replay_chunk_bytes = 1024 * 1024
+        self.next_offsets = {}
+        # key = topic, value = number of messages received through replay
+        self.replayed_counts = {}
+
+        # Relay tier (centralized only): relay this subscriber was assigned to, its
+        # /relays info and our member znode; relay_lost is set by the ZooKeeper watch
+        # when the relay goes away, so the event loop moves to another one
+        self.use_relay = use_relay
+        self.relay_id = None
+        self.relay_info = None
+        self.relay_member = None
+        self.relay_lost = False
+
+        # Topic directory (decentralized only): publisher changes reported by the
+        # directory's watches, applied to our sockets by the event loop, which polls
+        # at most directory_poll_interval seconds at a time to pick them up
+        self.use_directory = use_directory
+        self.directory = None
+        self.directory_changes = collections.deque()
+        self.directory_poll_interval = 0.05
+
         # port on broker to listen for notifications about new hosts
         # without competition/stealing from other subscriber poll()s
         self.notify_port = None
@@ -95,28 +180,40 @@ class Subscriber(ZookeeperClient):
     def watch_znode_data_change(self):
         """  Watch callback function invoked upon change to znode of interest.
         Watch effective only once so the client has to set the watch every time.
-        Decorator zk.DataWatch used to overcome this. """
-        @self.zk.DataWatch(self.zk_name)
+        The cached znode watch (see ZookeeperClient.watch_znode) re-arms itself and
+        hands over the new value, so following the broker costs one read per change. """
         def dump_data_change (data, stat, event):
             if event == None:
                 self.WATCH_FLAG = True
                 self.debug("No ZNODE Event - First Watch Call! Initializing subscriber...")
+                # Remember the epoch of the broker we start with
+                self.is_new_broker(data, stat)
                 self.configure()
                 self.WATCH_FLAG = False
-            elif event.type == 'CHANGED':
-                self.WATCH_FLAG = True
-                self.debug("ZNODE CHANGED")
-                self.debug("Broker Changed! Destroying context and clearing topic connection dict")
-                self.sub_socket_dict.clear()
-                self.context.destroy()
-                self.debug(f"Data changed for znode: data={data},stat={stat}")
-                self.get_znode_value()
-                self.update_broker_info()
-                self.debug("Reconfiguring...")
-                self.configure()
-                self.WATCH_FLAG = False
+            elif event.type in ('CHANGED', 'CREATED'):
+                self.debug(f"ZNODE {event.type}")
+                if self.is_new_broker(data, stat):
+                    self.switch_broker(data)
             elif event.type == 'DELETED':
                 self.debug("ZNODE DELETED")
+        self.watch_znode(self.zk_name, dump_data_change)
+
+    def switch_broker(self, data):
+        """ Reconnect to the broker named by a new /broker value """
+        self.WATCH_FLAG = True
+        self.debug("Broker Changed! Destroying context and clearing topic connection dict")
+        self.sub_socket_dict.clear()
+        # Offsets of a new leader only match ours for the prefix it replicated;
+        # start over rather than drop its messages as duplicates
+        self.next_offsets.clear()
+        self.context.destroy()
+        self.znode_value = data.decode('utf-8')
+        self.update_broker_info()
+        def reconnect():
+            self.debug("Reconfiguring...")
+            self.configure()
+            self.WATCH_FLAG = False
+        self.reconnect_after_broker_change(reconnect)
 
 
     def configure(self):
@@ -125,15 +222,19 @@ class Subscriber(ZookeeperClient):
         self.debug("Initializing")
         # Create a shared context object for all publisher connections
         self.debug("Setting the context object")
-        self.context = zmq.Context()
+        self.context = self.transport.context()
         # Poller for incoming data
         self.debug("Setting the poller objects")
         self.poller = zmq.Poller()
+        if self.use_directory:
+            # Publishers come from the topic directory; the broker is not involved
+            self.follow_directory()
+            self.debug("Configure Stop")
+            return
         # now create socket to register with broker
         self.debug("Connecting to register with broker")
 
-        self.broker_reg_socket = self.context.socket(zmq.REQ)
-        self.broker_reg_socket.connect(f"tcp://{self.broker_address}:{self.sub_reg_port}")
+        self.connect_broker_reg_socket()
 
         # Register self with broker on init
         self.register_sub()
@@ -146,20 +247,79 @@ class Subscriber(ZookeeperClient):
         Args:
         - notify_port (int) """
         self.notify_sub_socket = self.context.socket(zmq.REP)
-        self.notify_sub_socket.connect(f"tcp://{self.broker_address}:{self.notify_port}")
+        self.notify_sub_socket.connect(self.transport.endpoint(self.broker_address, self.notify_port))
         self.debug(f"Registering socket {self.notify_sub_socket} with poller")
         self.poller.register(self.notify_sub_socket, zmq.POLLIN)
 
+    def follow_directory(self):
+        """ DECENTRALIZED DISSEMINATION
+        Watch our topics' publishers in the topic directory and connect to the ones
+        advertised so far """
+        self.directory = TopicDirectory(self.zk, self.topics, self.publishers_changed)
+        self.directory.watch()
+        self.apply_directory_changes()
+        self.info("Following publishers in the topic directory")
+
+    def publishers_changed(self, topic, added, removed):
+        # Called from kazoo's threads; sockets are only touched by the event loop
+        self.directory_changes.append((topic, added, removed))
+
+    def apply_directory_changes(self):
+        """ Connect to the publishers that appeared in the topic directory and
+        disconnect from the ones that went away """
+        while self.directory_changes:
+            topic, added, removed = self.directory_changes.popleft()
+            if added:
+                self.setup_publisher_direct_connections(
+                    notification=[{'register_pub': {'addresses': added, 'topic': topic}}])
+            for p in removed:
+                self.debug(f'Publisher {p} of {topic} is gone')
+                try:
+                    self.sub_socket_dict[topic].disconnect(self.transport.endpoint(p))
+                except (KeyError, zmq.error.ZMQError):
+                    pass
+
+    def connect_broker_reg_socket(self):
+        """ (Re)create the REQ socket registering with the broker """
+        if self.broker_reg_socket is not None:
+            self.broker_reg_socket.close(linger=0)
+        self.broker_reg_socket = self.context.socket(zmq.REQ)
+        self.watch_broker_connection(self.broker_reg_socket)
+        self.broker_reg_socket.connect(self.transport.endpoint(self.broker_address, self.sub_reg_port))
+
     def register_sub(self):
-        """ Register self with broker """
+        """ Register self with broker. If the broker rejects the registration with a
+        retry_after hint (admission control), wait at least that long plus a jittered
+        exponential backoff and try again. Without a reply within the reconnect
+        policy's registration timeout, retry on a new socket after a jittered
+        exponential backoff. """
         self.debug(f"Registering with broker at {self.broker_address}:{self.sub_reg_port}")
         message_dict = {'address': self.get_host_address(), 'id': self.id, 'topics': self.topics}
+        if self.centralized and self.use_relay and self.assign_relay():
+            # The broker keeps no lane for us; our topics come from the relay
+            message_dict['relay'] = self.relay_id
         message = json.dumps(message_dict, indent=4)
-        self.broker_reg_socket.send_string(message)
-        self.debug(f"Sent registration message: {json.dumps(message)}")
-        received_message = self.broker_reg_socket.recv_string()
-        received_message = json.loads(received_message)
+        attempt = 0
+        while True:
+            self.broker_reg_socket.send_string(message)
+            self.debug(f"Sent registration message: {json.dumps(message)}")
+            if not self.reconnect_policy.wait_reply(self.broker_reg_socket):
+                delay = self.reconnect_policy.retry_delay(attempt)
+                self.info(f"No reply to registration; retrying in {delay:.2f}s")
+                self.connect_broker_reg_socket()
+                time.sleep(delay)
+                attempt += 1
+                continue
+            received_message = self.broker_reg_socket.recv_string()
+            received_message = json.loads(received_message)
+            if 'retry_after' not in received_message:
+                break
+            delay = self.reconnect_policy.retry_delay(attempt, retry_after=received_message['retry_after'])
+            self.info(f"Registration rejected ({received_message['error']}); retrying in {delay:.2f}s")
+            time.sleep(delay)
+            attempt += 1
         self.debug(f"Registration start msg from broker: {received_message}")
+        self.topic_frames = topic_frames(received_message.get('topic_ids', {}))
         # Structure: {'register_sub': {'notify_port': notify_port}}
         if not self.centralized:
             # Get the port that was allocated for notifications to this subscriber
@@ -170,10 +330,124 @@ class Subscriber(ZookeeperClient):
             self.setup_notification_polling()
         else:
             # Get topics/ports mapping from received_message
-            self.setup_broker_topic_port_connections(received_message)
+            self.replay_port = received_message.get('replay_port')
+            if self.relay_id:
+                self.setup_relay_connections()
+            else:
+                self.setup_broker_topic_port_connections(received_message)
             self.debug(f"Successfully set up broker topic/port connections")
         self.info("Registration successful")
 
+    def heartbeat(self):
+        """ Tell the broker this subscriber is alive. If the broker has reclaimed the
+        registration (or one of its topics) meanwhile, drop the connections it had
+        handed out and register again. """
+        msg = {'heartbeat': {'id': self.id, 'topics': self.topics}}
+        self.broker_reg_socket.send_string(json.dumps(msg))
+        self.last_heartbeat = time.time()
+        # The broker may be blocked notifying this subscriber about a new publisher
+        # before it gets to the heartbeat; answer notifications while waiting
+        def answer_notifications():
+            if self.notify_sub_socket is not None and self.notify_sub_socket.poll(0):
+                self.parse_notification()
+        if not self.wait_heartbeat_reply(answer_notifications):
+            return
+        response = json.loads(self.broker_reg_socket.recv_string())
+        if response.get('reregister'):
+            self.info("Broker no longer knows this subscriber; registering again")
+            self.reset_connections()
+            self.register_sub()
+
+    def heartbeat_due(self):
+        """ Return True if heartbeats are enabled and the next one is due """
+        return (self.heartbeat_interval is not None and self.broker_reg_socket is not None
+            and time.time() - self.last_heartbeat >= self.heartbeat_interval)
+
+    def poll_timeout(self):
+        """ Max milliseconds to block in poll(); None (forever) without heartbeats """
+        if self.use_directory:
+            return self.directory_poll_interval * 1000
+        intervals = [interval for interval in [self.heartbeat_interval, self.broker_heartbeat_interval]
+            if interval is not None]
+        if not intervals:
+            return None
+        return min(intervals) * 1000
+
+    def reset_connections(self):
+        """ Close the topic and notification sockets set up from a previous registration """
+        for socket in self.sub_socket_dict.values():
+            self.poller.unregister(socket)
+            socket.close(linger=0)
+        self.sub_socket_dict.clear()
+        if self.notify_sub_socket is not None:
+            self.poller.unregister(self.notify_sub_socket)
+            self.notify_sub_socket.close(linger=0)
+            self.notify_sub_socket = None
+        if self.replay_socket is not None:
+            self.replay_socket.close(linger=0)
+            self.replay_socket = None
+        self.leave_relay()
+
+    def assign_relay(self):
+        """ CENTRALIZED DISSEMINATION
+        Join the relay serving all our topics with the fewest members and watch it,
+        so we move elsewhere if it goes away. Returns False if no relay fits """
+        if self.zk is None:
+            return False
+        choice = choose_relay(self.zk, self.topics)
+        if choice is None:
+            self.info("No relay serves our topics; receiving from the broker")
+            return False
+        self.relay_id, self.relay_info = choice
+        self.relay_member = join_relay(self.zk, self.relay_id)
+        self.relay_lost = False
+        relay_id = self.relay_id
+        def relay_changed(data, stat, event):
+            # The session re-arms the watch, so a change does not hide a later deletion
+            if relay_id != self.relay_id:
+                return False
+            if stat is None:
+                self.relay_lost = True
+                return False
+        self.watch_znode(f'/relays/{relay_id}', relay_changed)
+        self.info(f"Assigned to relay {relay_id} at "
+            f"{self.relay_info['address']}:{self.relay_info['port']}")
+        return True
+
+    def leave_relay(self):
+        """ Withdraw our assignment to the current relay, if any """
+        if self.relay_member is not None:
+            try:
+                self.zk.delete(self.relay_member)
+            except NoNodeError:
+                pass
+        if self.relay_id is not None:
+            self.unwatch_znode(f'/relays/{self.relay_id}')
+        self.relay_id = self.relay_info = self.relay_member = None
+
+    def move_relay(self):
+        """ Our relay went away; register again to be assigned another one (or the broker) """
+        self.info(f"Relay {self.relay_id} is gone; moving to another relay")
+        self.reset_connections()
+        self.register_sub()
+
+    def topic_filter(self, topic):
+        """ Return the subscription filter of a topic: its ID frame, or its name if
+        the broker did not assign it an ID """
+        return self.topic_frames.get(topic, topic.encode('utf8'))
+
+    def setup_relay_connections(self):
+        """ CENTRALIZED DISSEMINATION
+        Like setup_broker_topic_port_connections, with every topic coming from the
+        PUB socket of the assigned relay """
+        endpoint = self.transport.endpoint(self.relay_info['address'], self.relay_info['port'])
+        for topic in self.topics:
+            self.sub_socket_dict[topic] = self.context.socket(zmq.SUB)
+            self.poller.register(self.sub_socket_dict[topic], zmq.POLLIN)
+            self.sub_socket_dict[topic].connect(endpoint)
+            self.sub_socket_dict[topic].setsockopt(zmq.SUBSCRIBE, self.topic_filter(topic))
+            self.debug(f"Getting Topic {topic} from relay at {endpoint}")
+
     def setup_publisher_direct_connections(self, notification=None):
         """ Method to set up direct connections with publishers
         provided by the broker based on the topic that a subscriber has
@@ -201,8 +475,8 @@ class Subscriber(ZookeeperClient):
                 for p in publisher_addresses:
                     self.debug(f'Adding publisher {p} to known publishers')
                     # p includes port!
-                    self.sub_socket_dict[topic].connect(f"tcp://{p}")
-                    self.sub_socket_dict[topic].setsockopt_string(zmq.SUBSCRIBE, topic)
+                    self.sub_socket_dict[topic].connect(self.transport.endpoint(p))
+                    self.sub_socket_dict[topic].setsockopt(zmq.SUBSCRIBE, self.topic_filter(topic))
 
 
         self.debug("Finished setting up direct publisher connections")
@@ -223,12 +497,11 @@ class Subscriber(ZookeeperClient):
             self.sub_socket_dict[topic] = self.context.socket(zmq.SUB)
             self.debug(f"Registering topic socket {self.sub_socket_dict[topic]} with poller")
             self.poller.register(self.sub_socket_dict[topic], zmq.POLLIN)
-            self.debug(
-                f"Connecting to broker for topic <{topic}> at "
-                f"tcp://{self.broker_address}:{broker_port}")
-            self.sub_socket_dict[topic].connect(f"tcp://{self.broker_address}:{broker_port}")
+            endpoint = self.transport.endpoint(self.broker_address, broker_port)
+            self.debug(f"Connecting to broker for topic <{topic}> at {endpoint}")
+            self.sub_socket_dict[topic].connect(endpoint)
             # Set filter <topic> on the socket
-            self.sub_socket_dict[topic].setsockopt_string(zmq.SUBSCRIBE, topic)
+            self.sub_socket_dict[topic].setsockopt(zmq.SUBSCRIBE, self.topic_filter(topic))
             self.debug(
                 f"Getting Topic {topic} from broker at "
                 f"{self.broker_address}:{broker_port}"
@@ -252,11 +525,37 @@ class Subscriber(ZookeeperClient):
     def parse_publish_event(self, topic=""):
         """ Method to parse a published event for a given topic
         Args: topic (string) - topic this publish event corresponds to
+        Returns True if the event was recorded, False if it was dropped as expired
          """
         self.debug(f"Waiting for publish event for topic {topic}")
         # received_message = self.sub_socket_dict[topic].recv_string()
-        [topic, received_message] = self.sub_socket_dict[topic].recv_multipart()
-        received_message = pickle.loads(received_message)
+        frames = self.sub_socket_dict[topic].recv_multipart()
+        if len(frames) > 2 and topic in self.next_offsets:
+            # Logged topic after a replay; frames[2] is the message's log offset
+            offset = int(frames[2])
+            if offset < self.next_offsets[topic]:
+                self.debug(f"Dropped duplicate of replayed offset {offset} for topic {topic}")
+                return False
+            if offset > self.next_offsets[topic]:
+                # Missed live messages (e.g. subscription not yet active); take them from the log
+                self.replay(topic, from_offset=self.next_offsets[topic], until_offset=offset)
+            self.next_offsets[topic] = offset + 1
+        return self.record_event(pickle.loads(frames[1]), topic)
+
+    def record_event(self, received_message, topic=None):
+        """ Record a received (live or replayed) event unless it has expired
+        Args:
+        - received_message (dict) - unpickled event
+        - topic (str) - topic the event was received on; events sent with a topic ID
+          frame do not carry their 'topic'
+        Returns True if the event was recorded, False if it was dropped as expired """
+        if topic is not None:
+            received_message.setdefault('topic', topic)
+        if is_expired(received_message, self.topic_ttls):
+            expired_topic = received_message['topic']
+            self.expired_counts[expired_topic] = self.expired_counts.get(expired_topic, 0) + 1
+            self.debug(f"Dropped expired event for topic {expired_topic}")
+            return False
         self.received_message_list.append(
             {
                 'publisher': received_message['publisher'],
@@ -264,9 +563,73 @@ class Subscriber(ZookeeperClient):
                 'total_time_seconds': time.time() - float(received_message['publish_time'])
             }
         )
-        self.debug(f'Received: <{json.dumps(received_message)}>')
-
-
+        if self.logger.isEnabledFor(logging.DEBUG):
+            # Serializing every event is costly at replay rates; only do it when logged
+            self.debug(f'Received: <{json.dumps(received_message)}>')
+        return True
+
+
+
+    def connect_replay(self):
+        """ Connect the socket used to request replay from the broker """
+        if self.replay_port is None:
+            raise RuntimeError('Broker did not offer replay; it needs --centralized and --log_dir')
+        self.replay_socket = self.context.socket(zmq.REQ)
+        self.replay_socket.connect(self.transport.endpoint(self.broker_address, self.replay_port))
+
+    def replay(self, topic, from_offset=None, from_time=None, until_offset=None):
+        """ CENTRALIZED DISSEMINATION
+        Fetch and record the messages the broker logged for a topic, in chunks of raw
+        log records, starting at from_offset (or at the first message logged at or after
+        from_time, or at the oldest retained message). Stops at until_offset if given,
+        otherwise once the end of the log is reached. Live messages of the topic
+        are then deduplicated against, and gaps filled from, the log by offset.
+        Returns the number of messages replayed """
+        if self.replay_socket is None:
+            self.connect_replay()
+        request = {'topic': topic, 'max_bytes': self.replay_chunk_bytes}
+        if from_offset is not None:
+            request['from_offset'] = from_offset
+        elif from_time is not None:
+            request['from_time'] = from_time
+        replayed = 0
+        while True:
+            self.replay_socket.send_string(json.dumps(request))
+            frames = self.replay_socket.recv_multipart(copy=False)
+            header = json.loads(frames[0].bytes)
+            if 'error' in header:
+                self.error(f"Replay of topic {topic} failed: {header['error']}")
+                break
+            expected = self.next_offsets.get(topic, request.get('from_offset', header['first_offset']))
+            if header['count'] and header['first_offset'] > expected:
+                self.info(f"Topic {topic}: offsets {expected}-{header['first_offset'] - 1} "
+                    "are no longer retained by the broker")
+            if len(frames) > 1:
+                for offset, _, payload in iter_records(frames[1].buffer):
+                    if until_offset is not None and offset >= until_offset:
+                        break
+                    if offset < self.next_offsets.get(topic, 0):
+                        continue
+                    self.next_offsets[topic] = offset + 1
+                    if self.record_event(pickle.loads(payload), topic):
+                        replayed += 1
+            self.next_offsets.setdefault(topic, header['next_offset'])
+            end = header['end_offset'] if until_offset is None else until_offset
+            if not header['count'] or header['next_offset'] >= end:
+                break
+            request = {'topic': topic, 'from_offset': header['next_offset'],
+                'max_bytes': self.replay_chunk_bytes}
+        self.replayed_counts[topic] = self.replayed_counts.get(topic, 0) + replayed
+        self.info(f"Replayed {replayed} messages of topic {topic}; "
+            f"live from offset {self.next_offsets.get(topic)}")
+        return replayed
+
+    def run_requested_replays(self):
+        """ Replay the topics given to the constructor in replay_from_offsets/replay_from_times """
+        for topic, offset in self.replay_from_offsets.items():
+            self.replay(topic, from_offset=offset)
+        for topic, from_time in self.replay_from_times.items():
+            self.replay(topic, from_time=from_time)
 
     def notify(self):
         """ Method to poll for published events (or notifications about
@@ -274,12 +637,13 @@ class Subscriber(ZookeeperClient):
         (if indefinite=True in constructor) or until max_event_count
         (passed to constructor) is reached. """
         self.debug("Subscribe Start")
+        self.run_requested_replays()
         self.debug("Start to receive message")
         if self.indefinite:
             while True:
                 if not self.WATCH_FLAG:
                     try:
-                        events = dict(self.poller.poll())
+                        events = dict(self.poller.poll(self.poll_timeout()))
                     except zmq.error.ZMQError as e:
                         # Socket operation on non socket error expected here
                         # due to race condition when broker is being switched out.
@@ -294,14 +658,21 @@ class Subscriber(ZookeeperClient):
                         for topic, socket in self.sub_socket_dict.items():
                             if socket in events:
                                 self.parse_publish_event(topic=topic)
+                    if self.directory_changes:
+                        self.apply_directory_changes()
+                    if self.heartbeat_due():
+                        self.heartbeat()
+                    if self.relay_lost:
+                        self.move_relay()
+                    self.broker_lost(self.switch_broker)
                 else:
-                    self.debug("SWITCHING BROKER")
+                    self.wait_for_switch()
         else:
             event_count = 0
             while event_count < self.max_event_count:
                 if not self.WATCH_FLAG:
                     try:
-                        events = dict(self.poller.poll())
+                        events = dict(self.poller.poll(self.poll_timeout()))
                     except zmq.error.ZMQError as e:
                         # Socket operation on non socket error expected here
                         # due to race condition when broker is being switched out.
@@ -314,15 +685,27 @@ class Subscriber(ZookeeperClient):
                     else:
                         for topic, socket in self.sub_socket_dict.items():
                             if socket in events and event_count < self.max_event_count:
-                                event_count += 1
-                                self.parse_publish_event(topic=topic)
+                                # Expired events do not count toward max_event_count
+                                if self.parse_publish_event(topic=topic):
+                                    event_count += 1
+                    if self.directory_changes:
+                        self.apply_directory_changes()
+                    if self.heartbeat_due():
+                        self.heartbeat()
+                    if self.relay_lost:
+                        self.move_relay()
+                    self.broker_lost(self.switch_broker)
                 else:
-                    self.debug("SWITCHING BROKER.")
+                    self.wait_for_switch()
 
 
     def write_stored_messages(self):
         """ Method to write all stored messages to filename passed to constructor """
         self.info(f"Writing all stored messages to {self.filename}")
+        if self.expired_counts:
+            self.info(f"Expired messages dropped per topic: {self.expired_counts}")
+        if self.replayed_counts:
+            self.info(f"Messages received through replay per topic: {self.replayed_counts}")
         if self.filename:
             with open(self.filename, 'w') as f:
                 header = "publisher,topic,total_time_seconds"
@@ -339,6 +722,9 @@ class Subscriber(ZookeeperClient):
         """ Method to return IP address of current host.
         If using a mininet topology, use netifaces (socket.gethost... fails on mininet hosts)
         Otherwise, local testing without mininet, use localhost 127.0.0.1 """
+        if self.transport.host is not None:
+            # Every entity of a local cluster has the same host name
+            return self.transport.host
         try:
             # Will succeed on mininet. Two interfaces, get second one.
             # Then get AF_INET address family with key = 2
@@ -353,13 +739,18 @@ class Subscriber(ZookeeperClient):
         """ Method to disconnect from the pub/sub network """
         # Close all sockets associated with this context
         # Tell broker publisher is disconnecting. Remove from storage.
-        msg = {'disconnect': {'id': self.id, 'address': self.get_host_address(),
-            'topics': self.topics, 'notify_port': self.notify_port}}
-        self.debug(f"Disconnecting, telling broker: {msg}")
-        self.broker_reg_socket.send_string(json.dumps(msg))
-        # Wait for response
-        response = self.broker_reg_socket.recv_string()
-        self.debug(f"Broker response: {response} ")
+        if self.use_directory:
+            self.debug("Disconnecting, no longer following the topic directory")
+            self.directory.stop()
+        else:
+            msg = {'disconnect': {'id': self.id, 'address': self.get_host_address(),
+                'topics': self.topics, 'notify_port': self.notify_port}}
+            self.debug(f"Disconnecting, telling broker: {msg}")
+            self.leave_relay()
+            self.broker_reg_socket.send_string(json.dumps(msg))
+            # Wait for response
+            response = self.broker_reg_socket.recv_string()
+            self.debug(f"Broker response: {response} ")
         try:
             self.debug(f'Destroying ZMQ context, closing all sockets')
             self.context.destroy()
@@ -0,0 +1,95 @@
+""" ZooKeeper topic directory for broker-less discovery (decentralized dissemination).
+With broker discovery every publisher registration makes the broker notify each
+interested subscriber in turn over its REQ/REP notify socket, so discovery time
+and broker work grow with the number of subscribers, and a crashed publisher
+stays known until it is reclaimed.
+
+In directory mode a publisher instead advertises every topic it publishes as an
+ephemeral sequential znode under /topics/<topic>/publishers (znode name:
+URL-quoted topic, value: the publisher's host:port). Subscribers watch the
+children of their topics' publishers znodes and connect to (or disconnect from)
+publishers as they come and go. ZooKeeper fans the change out to the watchers,
+the broker is not involved, and the znodes of a crashed publisher disappear with
+its session.
+"""
+from urllib.parse import quote
+from kazoo.exceptions import NoNodeError
+
+TOPICS_PATH = '/topics'
+
+def publishers_path(topic, root=TOPICS_PATH):
+    """ Return the znode under which the publishers of a topic advertise themselves """
+    return f'{root}/{quote(topic, safe="")}/publishers'
+
+def advertise_publisher(zk, topic, address, root=TOPICS_PATH):
+    """ Advertise a publisher of a topic; return its ephemeral znode path
+    Args:
+    - zk (KazooClient) - started ZooKeeper client
+    - topic (str) - topic published
+    - address (str) - host:port subscribers connect to
+    """
+    return zk.create(f'{publishers_path(topic, root)}/pub-', address.encode('utf-8'),
+        ephemeral=True, sequence=True, makepath=True)
+
+class TopicDirectory:
+    """ Follows the publishers of a set of topics in the directory """
+
+    def __init__(self, zk, topics, listener, root=TOPICS_PATH):
+        """ Constructor
+        args:
+        - zk (KazooClient) - started ZooKeeper client
+        - topics (list) - topics to follow
+        - listener (function) - listener(topic, added, removed) called with the lists
+          of publisher addresses that appeared and disappeared, from kazoo's threads
+          (and once from the caller's thread per topic with the current publishers)
+        - root (str) - znode holding the directory
+        """
+        self.zk = zk
+        self.topics = topics
+        self.listener = listener
+        self.root = root
+        # key = topic, value = {child znode name: publisher address}
+        self.publishers = {}
+        self.stopped = False
+
+    def watch(self):
+        """ Start following every topic's publishers """
+        for topic in self.topics:
+            path = publishers_path(topic, self.root)
+            self.zk.ensure_path(path)
+            self.publishers[topic] = {}
+            self.zk.ChildrenWatch(path, self.children_watcher(topic, path))
+
+    def stop(self):
+        """ Stop following the topics; the watches are dropped at their next event """
+        self.stopped = True
+
+    def children_watcher(self, topic, path):
+        def publishers_changed(children):
+            if self.stopped:
+                # Returning False removes the watch
+                return False
+            known = self.publishers[topic]
+            before = set(known.values())
+            for child in children:
+                if child in known:
+                    continue
+                try:
+                    data, _ = self.zk.get(f'{path}/{child}')
+                except NoNodeError:
+                    # Publisher went away again before we read it
+                    continue
+                known[child] = data.decode('utf-8')
+            for child in list(known):
+                if child not in children:
+                    known.pop(child)
+            # A publisher re-advertising (e.g. after a new session) keeps its address
+            after = set(known.values())
+            added, removed = sorted(after - before), sorted(before - after)
+            if added or removed:
+                self.listener(topic, added, removed)
+        return publishers_changed
+
+    def addresses(self, topic):
+        """ Return the addresses of the publishers of a topic known so far """
+        return sorted(set(self.publishers.get(topic, {}).values()))
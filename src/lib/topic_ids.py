@@ -0,0 +1,88 @@
+""" Compact integer topic IDs.
+Every published message used to carry its topic name twice: as the ZMQ filter
+frame and inside the pickled event. With long hierarchical topic names that is
+most of a small message, and every SUB filter walks the whole name. The leader
+broker instead hands out a small integer ID per topic at registration; clients
+send and subscribe with the ID packed as a fixed-width frame (TOPIC_ID) and
+drop the name from the event, so filtering compares 4 bytes and the name only
+crosses the network at registration.
+
+The name <-> ID table is kept in ZooKeeper, one persistent znode per topic under
+/topic_ids (znode name: URL-quoted topic, value: the ID), so a broker elected
+after a failover hands out the same IDs and clients keep their frames.
+"""
+import struct
+from urllib.parse import quote, unquote
+from kazoo.exceptions import NodeExistsError
+
+TOPIC_IDS_PATH = '/topic_ids'
+# Big-endian unsigned 32 bit ID; every ID frame has the same width, so a
+# subscription to one ID frame can never be a prefix of another topic's frame
+TOPIC_ID = struct.Struct('>I')
+
+def topic_id_frame(topic_id):
+    """ Return the filter frame carrying a topic ID """
+    return TOPIC_ID.pack(topic_id)
+
+def topic_frames(topic_ids):
+    """ Return topic -> filter frame for the topic -> ID mapping sent by the broker """
+    return {topic: topic_id_frame(topic_id) for topic, topic_id in topic_ids.items()}
+
+class TopicIdTable:
+    """ The broker's name <-> ID table, persisted in ZooKeeper when a client is given """
+
+    def __init__(self, zk=None, path=TOPIC_IDS_PATH):
+        """ Constructor
+        args:
+        - zk (KazooClient) - optional started ZooKeeper client holding the table
+        - path (str) - znode under which each topic's ID is stored
+        """
+        self.zk = zk
+        self.path = path
+        # key = topic, value = ID
+        self.ids = {}
+        # key = ID frame, value = topic
+        self.names = {}
+
+    def load(self, zk=None):
+        """ Read the IDs handed out so far (e.g. by a previous leader) from ZooKeeper
+        Args:
+        - zk (KazooClient) - started ZooKeeper client; replaces the one given before
+        """
+        if zk is not None:
+            self.zk = zk
+        if self.zk is None:
+            return
+        self.zk.ensure_path(self.path)
+        for child in self.zk.get_children(self.path):
+            data, _ = self.zk.get(f'{self.path}/{child}')
+            self.add(unquote(child), int(data))
+
+    def add(self, topic, topic_id):
+        self.ids[topic] = topic_id
+        self.names[topic_id_frame(topic_id)] = topic
+
+    def assign(self, topics):
+        """ Return topic -> ID for topics, handing out the next free ID to new topics """
+        for topic in topics:
+            if topic in self.ids:
+                continue
+            topic_id = max(self.ids.values(), default=0) + 1
+            if self.zk is not None:
+                try:
+                    self.zk.create(f'{self.path}/{quote(topic, safe="")}',
+                        b'%d' % topic_id, makepath=True)
+                except NodeExistsError:
+                    # Assigned meanwhile by another broker; use its ID
+                    data, _ = self.zk.get(f'{self.path}/{quote(topic, safe="")}')
+                    topic_id = int(data)
+            self.add(topic, topic_id)
+        return {topic: self.ids[topic] for topic in topics}
+
+    def frame(self, topic):
+        """ Return the filter frame of a topic, assigning it an ID if it has none """
+        return topic_id_frame(self.assign([topic])[topic])
+
+    def name(self, frame):
+        """ Return the topic of an ID frame, or None if the ID is unknown """
+        return self.names.get(frame)
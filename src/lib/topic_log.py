@@ -0,0 +1,464 @@
+""" Durable per-topic message log for the centralized broker. PUB/SUB is
+fire-and-forget, so anything published while a subscriber is reconnecting is
+lost; with a topic log the broker appends every message to disk before fanning
+it out, so it can be replayed later.
+
+Each topic log is a sequence of append-only segment files named after the
+offset of their first record. A segment is preallocated and written through
+mmap, so an append is a memory copy rather than a system call. Records are
+    offset (u64) | timestamp (f64) | payload length (u32) | crc32 (u32) | payload
+A sparse in-memory index (one entry every index_interval bytes) maps offsets
+and timestamps to file positions for fast seeking, and is rebuilt on restart
+by scanning the segments; the scan stops at the first torn or zeroed record.
+Durability uses group commit: dirty pages are flushed (msync) once
+fsync_messages appends are pending or fsync_interval seconds have passed,
+instead of once per message. Retention deletes whole sealed segments.
+"""
+import bisect
+import mmap
+import os
+import struct
+import time
+import zlib
+from urllib.parse import quote, unquote
+
+RECORD_HEADER = struct.Struct('<QdII')
+
+def iter_records(chunk):
+    """ Iterate over (offset, timestamp, payload) of the records in a raw chunk of
+    log bytes as returned by TopicLog.read_raw, e.g. after replay over the network
+    Args:
+    - chunk (buffer) - whole records exactly as stored in a segment
+    """
+    view = memoryview(chunk)
+    position = 0
+    while position < len(view):
+        offset, timestamp, length, _ = RECORD_HEADER.unpack_from(view, position)
+        start = position + RECORD_HEADER.size
+        yield offset, timestamp, view[start:start + length]
+        position = start + length
+
+class LogSegment:
+    """ One segment file of a topic log, written and read through mmap """
+
+    def __init__(self, path, base_offset, capacity, index_interval=4096):
+        """ Constructor; opens (and recovers) the segment file if it exists
+        args:
+        - path (str) - segment file path
+        - base_offset (int) - offset of the first record in the segment
+        - capacity (int) - size in bytes the file is preallocated to
+        - index_interval (int) - bytes between two sparse index entries
+        """
+        self.path = path
+        self.base_offset = base_offset
+        self.index_interval = index_interval
+        self.file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        self.capacity = max(capacity, os.path.getsize(path))
+        self.file.truncate(self.capacity)
+        self.map = mmap.mmap(self.file.fileno(), self.capacity)
+        # Sparse index: offsets, timestamps and file positions of indexed records
+        self.index_offsets = []
+        self.index_times = []
+        self.index_positions = []
+        self.size = 0
+        self.synced_size = 0
+        self.next_offset = base_offset
+        self.first_time = None
+        self.last_time = None
+        self.recover()
+
+    def __len__(self):
+        return self.next_offset - self.base_offset
+
+    def recover(self):
+        """ Rebuild size, next offset and index by scanning the records on disk """
+        position = 0
+        while position + RECORD_HEADER.size <= self.capacity:
+            offset, timestamp, length, crc = RECORD_HEADER.unpack_from(self.map, position)
+            end = position + RECORD_HEADER.size + length
+            if (offset != self.next_offset or length == 0 or end > self.capacity
+                    or zlib.crc32(self.map[position + RECORD_HEADER.size:end]) != crc):
+                break
+            self.add_to_index(offset, timestamp, position)
+            position = end
+            self.next_offset = offset + 1
+        self.size = self.synced_size = position
+
+    def add_to_index(self, offset, timestamp, position):
+        if self.first_time is None:
+            self.first_time = timestamp
+        self.last_time = timestamp
+        if not self.index_positions or position - self.index_positions[-1] >= self.index_interval:
+            self.index_offsets.append(offset)
+            self.index_times.append(timestamp)
+            self.index_positions.append(position)
+
+    def append(self, payload, timestamp):
+        """ Append a record; return its offset, or None if the segment is full """
+        end = self.size + RECORD_HEADER.size + len(payload)
+        if end > self.capacity:
+            return None
+        offset = self.next_offset
+        RECORD_HEADER.pack_into(
+            self.map, self.size, offset, timestamp, len(payload), zlib.crc32(payload))
+        self.map[self.size + RECORD_HEADER.size:end] = payload
+        self.add_to_index(offset, timestamp, self.size)
+        self.size = end
+        self.next_offset = offset + 1
+        return offset
+
+    def append_raw(self, chunk):
+        """ Append records encoded by another log (e.g. a chunk from read_raw on the
+        leader) with a single copy; the first must have offset next_offset.
+        Return the number of records appended, or None if they do not fit """
+        end = self.size + len(chunk)
+        if end > self.capacity:
+            return None
+        self.map[self.size:end] = chunk
+        position = self.size
+        count = 0
+        while position < end:
+            offset, timestamp, length, _ = RECORD_HEADER.unpack_from(self.map, position)
+            self.add_to_index(offset, timestamp, position)
+            position += RECORD_HEADER.size + length
+            count += 1
+        self.size = end
+        self.next_offset += count
+        return count
+
+    def truncate(self, offset):
+        """ Discard the records at and after offset """
+        position = self.position_of(offset)
+        # Zero the discarded records so they are not recovered after a restart
+        self.map[position:self.size] = bytes(self.size - position)
+        self.map.flush()
+        self.index_offsets, self.index_times, self.index_positions = [], [], []
+        self.next_offset = self.base_offset
+        self.first_time = self.last_time = None
+        self.recover()
+
+    def flush(self):
+        """ Write the pages dirtied since the last flush to disk """
+        if self.size == self.synced_size:
+            return
+        start = self.synced_size - self.synced_size % mmap.PAGESIZE
+        self.map.flush(start, self.size - start)
+        self.synced_size = self.size
+
+    def position_of(self, offset):
+        """ Return the file position of the first record with offset >= offset """
+        i = bisect.bisect_right(self.index_offsets, offset) - 1
+        position = self.index_positions[i] if i >= 0 else 0
+        while position < self.size:
+            record_offset, _, length, _ = RECORD_HEADER.unpack_from(self.map, position)
+            if record_offset >= offset:
+                break
+            position += RECORD_HEADER.size + length
+        return position
+
+    def position_of_time(self, timestamp):
+        """ Return the file position of the first record stamped at or after timestamp """
+        i = bisect.bisect_left(self.index_times, timestamp) - 1
+        position = self.index_positions[i] if i >= 0 else 0
+        while position < self.size:
+            _, record_time, length, _ = RECORD_HEADER.unpack_from(self.map, position)
+            if record_time >= timestamp:
+                break
+            position += RECORD_HEADER.size + length
+        return position
+
+    def read(self, position, max_bytes):
+        """ Return (records, next position) for records starting at a file position,
+        up to max_bytes of payload (at least one record). Each record is
+        (offset, timestamp, payload) where payload is a memoryview into the map,
+        so reading does not copy the message. """
+        records = []
+        view = memoryview(self.map)
+        total = 0
+        while position < self.size and (not records or total < max_bytes):
+            offset, timestamp, length, _ = RECORD_HEADER.unpack_from(self.map, position)
+            start = position + RECORD_HEADER.size
+            records.append((offset, timestamp, view[start:start + length]))
+            total += length
+            position = start + length
+        return records, position
+
+    def read_raw(self, position, max_bytes):
+        """ Return (first offset, record count, chunk) for whole records starting at a
+        file position, up to max_bytes (at least one record). The chunk is a zero-copy
+        view of the records exactly as stored, headers included, so it can be sent
+        as a single frame and parsed with iter_records. """
+        start = position
+        first_offset = None
+        count = 0
+        while position < self.size and (not count or position - start < max_bytes):
+            offset, _, length, _ = RECORD_HEADER.unpack_from(self.map, position)
+            if first_offset is None:
+                first_offset = offset
+            position += RECORD_HEADER.size + length
+            count += 1
+        return first_offset, count, memoryview(self.map)[start:position]
+
+    def close(self):
+        self.flush()
+        try:
+            self.map.close()
+        except BufferError:
+            # A reader still holds a view of the map; it is released with the view
+            pass
+        self.file.close()
+
+    def delete(self):
+        self.close()
+        os.remove(self.path)
+
+class TopicLog:
+    """ Append-only, segmented, memory-mapped log of the messages of one topic """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, retention_seconds=None,
+        retention_bytes=None, fsync_interval=0.05, fsync_messages=1000, index_interval=4096):
+        """ Constructor; recovers the segments already in directory
+        args:
+        - directory (str) - directory holding the segment files of this topic
+        - segment_bytes (int) - size of a segment before the log rolls to a new one
+        - retention_seconds (float) - delete sealed segments whose newest record is older
+        - retention_bytes (int) - delete the oldest sealed segments beyond this total size
+        - fsync_interval (float) - max seconds an appended message stays unflushed
+          (when maybe_sync is called regularly)
+        - fsync_messages (int) - flush as soon as this many appends are pending
+        - index_interval (int) - bytes between two sparse index entries
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.retention_seconds = retention_seconds
+        self.retention_bytes = retention_bytes
+        self.fsync_interval = fsync_interval
+        self.fsync_messages = fsync_messages
+        self.index_interval = index_interval
+        os.makedirs(directory, exist_ok=True)
+        self.segments = [
+            LogSegment(os.path.join(directory, name), int(name[:-4]), segment_bytes, index_interval)
+            for name in sorted(os.listdir(directory)) if name.endswith('.log')
+        ]
+        if not self.segments:
+            self.segments.append(self.new_segment(0, segment_bytes))
+        self.unsynced = 0
+        self.last_sync = time.time()
+        self.sync_count = 0
+
+    def new_segment(self, base_offset, capacity):
+        path = os.path.join(self.directory, f'{base_offset:020d}.log')
+        return LogSegment(path, base_offset, capacity, self.index_interval)
+
+    @property
+    def start_offset(self):
+        """ Offset of the oldest retained message """
+        return self.segments[0].base_offset
+
+    @property
+    def next_offset(self):
+        """ Offset the next appended message will get """
+        return self.segments[-1].next_offset
+
+    def append(self, payload, timestamp=None):
+        """ Append a message and return its offset
+        Args:
+        - payload (bytes) - serialized message
+        - timestamp (float) - append time used for time-based replay, defaults to now
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        offset = self.segments[-1].append(payload, timestamp)
+        if offset is None:
+            # Active segment full; seal it and roll over to a new one
+            self.segments[-1].flush()
+            self.segments.append(self.new_segment(self.next_offset,
+                max(self.segment_bytes, RECORD_HEADER.size + len(payload))))
+            offset = self.segments[-1].append(payload, timestamp)
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_messages:
+            self.sync()
+        return offset
+
+    def append_raw(self, chunk):
+        """ Append a chunk of encoded records (see LogSegment.append_raw) starting at
+        next_offset; return the number of records appended """
+        count = self.segments[-1].append_raw(chunk)
+        if count is None:
+            # Does not fit in the active segment; append one record at a time to roll over
+            count = 0
+            for _, timestamp, payload in iter_records(chunk):
+                self.append(payload, timestamp)
+                count += 1
+            return count
+        self.unsynced += count
+        if self.unsynced >= self.fsync_messages:
+            self.sync()
+        return count
+
+    def maybe_sync(self, now=None):
+        """ Flush pending appends if the oldest has waited fsync_interval seconds """
+        now = time.time() if now is None else now
+        if self.unsynced and now - self.last_sync >= self.fsync_interval:
+            self.sync(now)
+
+    def sync(self, now=None):
+        """ Flush all pending appends to disk (group commit) """
+        self.segments[-1].flush()
+        self.unsynced = 0
+        self.last_sync = time.time() if now is None else now
+        self.sync_count += 1
+
+    def truncate(self, offset):
+        """ Discard the messages at and after offset, e.g. a tail that a new leader
+        never had; truncating before the oldest retained message empties the log """
+        if offset <= self.start_offset:
+            self.reset(offset)
+            return
+        while self.segments[-1].base_offset >= offset:
+            self.segments.pop().delete()
+        self.segments[-1].truncate(offset)
+        self.unsynced = 0
+
+    def reset(self, offset):
+        """ Discard every message and restart the log, empty, at offset """
+        for segment in self.segments:
+            segment.delete()
+        self.segments = [self.new_segment(offset, self.segment_bytes)]
+        self.unsynced = 0
+
+    def segment_index(self, offset):
+        bases = [segment.base_offset for segment in self.segments]
+        return max(0, bisect.bisect_right(bases, offset) - 1)
+
+    def read(self, offset, max_bytes=1024 * 1024):
+        """ Return up to max_bytes of payload (at least one record if any) starting at
+        offset as a list of (offset, timestamp, payload memoryview). Offsets older than
+        the retained log start at the oldest retained message. """
+        offset = max(offset, self.start_offset)
+        records = []
+        remaining = max_bytes
+        for segment in self.segments[self.segment_index(offset):]:
+            if records and remaining <= 0:
+                break
+            chunk, _ = segment.read(segment.position_of(offset), remaining)
+            records.extend(chunk)
+            remaining -= sum(len(payload) for _, _, payload in chunk)
+            if chunk:
+                offset = chunk[-1][0] + 1
+        return records
+
+    def read_raw(self, offset, max_bytes=1024 * 1024):
+        """ Return (first offset, record count, chunk) of up to max_bytes of whole records
+        (at least one if any) starting at offset, from a single segment; see
+        LogSegment.read_raw. Offsets older than the retained log start at the oldest
+        retained message, so first offset > offset means messages were lost to retention. """
+        offset = max(offset, self.start_offset)
+        if offset >= self.next_offset:
+            return offset, 0, b''
+        segment = self.segments[self.segment_index(offset)]
+        return segment.read_raw(segment.position_of(offset), max_bytes)
+
+    def offset_for_time(self, timestamp):
+        """ Return the offset of the first retained message appended at or after timestamp """
+        for segment in self.segments:
+            if segment.last_time is not None and segment.last_time >= timestamp:
+                position = segment.position_of_time(timestamp)
+                if position < segment.size:
+                    return RECORD_HEADER.unpack_from(segment.map, position)[0]
+        return self.next_offset
+
+    def size(self):
+        return sum(segment.size for segment in self.segments)
+
+    def enforce_retention(self, now=None):
+        """ Delete the oldest sealed segments that are past the retention time or that
+        make the log exceed its retention size. Returns the number of deleted segments. """
+        now = time.time() if now is None else now
+        deleted = 0
+        while len(self.segments) > 1:
+            oldest = self.segments[0]
+            too_old = (self.retention_seconds is not None and oldest.last_time is not None
+                and oldest.last_time < now - self.retention_seconds)
+            too_big = self.retention_bytes is not None and self.size() > self.retention_bytes
+            if not (too_old or too_big):
+                break
+            self.segments.pop(0).delete()
+            deleted += 1
+        return deleted
+
+    def close(self):
+        self.sync()
+        for segment in self.segments:
+            segment.close()
+
+    def stats(self):
+        """ Return offsets, segment count, size and flush count of this log """
+        return {
+            'start_offset': self.start_offset,
+            'next_offset': self.next_offset,
+            'segments': len(self.segments),
+            'bytes': self.size(),
+            'syncs': self.sync_count
+        }
+
+class TopicLogStore:
+    """ The topic logs of a broker, one subdirectory per topic """
+
+    def __init__(self, directory, topics=[], **log_options):
+        """ Constructor
+        args:
+        - directory (str) - root directory of the logs
+        - topics (list) - topics to log; empty means every topic
+        - log_options - passed to every TopicLog
+        """
+        self.directory = directory
+        self.topics = set(topics)
+        self.log_options = log_options
+        # key = topic, value = TopicLog
+        self.logs = {}
+
+    def logs_topic(self, topic):
+        return not self.topics or topic in self.topics
+
+    def log(self, topic):
+        """ Return the log of a topic, opening (or recovering) it on first use """
+        if topic not in self.logs:
+            self.logs[topic] = TopicLog(
+                os.path.join(self.directory, quote(topic, safe='')), **self.log_options)
+        return self.logs[topic]
+
+    def append(self, topic, payload):
+        """ Append a message if its topic is logged; return its offset or None """
+        if not self.logs_topic(topic):
+            return None
+        return self.log(topic).append(payload)
+
+    def open_all(self):
+        """ Open (and recover) the log of every topic found in the directory """
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                self.log(unquote(name))
+        return self.logs
+
+    def next_offsets(self):
+        """ Return the offset the next message of each open topic log will get """
+        return {topic: log.next_offset for topic, log in self.logs.items()}
+
+    def close_log(self, topic):
+        """ Close a topic's log (it is reopened on the next append), e.g. when the topic is reclaimed """
+        if topic in self.logs:
+            self.logs.pop(topic).close()
+
+    def maybe_sync(self, now=None):
+        for log in self.logs.values():
+            log.maybe_sync(now)
+
+    def enforce_retention(self, now=None):
+        return sum(log.enforce_retention(now) for log in self.logs.values())
+
+    def close(self):
+        for log in self.logs.values():
+            log.close()
+
+    def stats(self):
+        return {topic: log.stats() for topic, log in self.logs.items()}
@@ -0,0 +1,106 @@
+""" Endpoints of the ZMQ sockets between the entities.
+
+Entities on different hosts talk over tcp:// (Transport, the default): they bind
+to tcp://*:<port> and advertise the address of their host, found with netifaces.
+
+Entities started as processes of one machine (see performance_tests/scenario.py)
+can talk over ipc:// (IpcTransport): Unix domain sockets in a directory, so
+several systems run side by side without sharing a port space.
+
+Entities started as threads of one process (see local_cluster.py) can talk over
+inproc:// instead (InprocTransport): no sockets of the operating system, no
+network stack and no ports to collide with other processes, so the costs left
+are those of the framework itself. inproc:// only connects sockets of the same
+ZMQ context, so every entity gets a shadow of one shared context; destroying it
+(as entities do on disconnect or on a broker change) closes only that entity's
+sockets. Every entity of the cluster has the same host name, and endpoints keep
+the host:port form, so the addresses exchanged in registrations and znodes are
+used unchanged.
+"""
+import zmq
+
+class Transport:
+    """ tcp:// endpoints between hosts """
+
+    def __init__(self, host=None):
+        """ Constructor
+        args:
+        - host (str) - address every entity advertises, e.g. 127.0.0.1 when every
+          entity runs on one machine; None: the address of the host it runs on
+        """
+        self.host = host
+
+    def context(self):
+        """ Return a new ZMQ context for an entity """
+        return zmq.Context()
+
+    def endpoint(self, address, port=None):
+        """ Return the endpoint to connect to
+        Args:
+        - address (str) - host, or host:port if port is None
+        - port (int) - optional port
+        """
+        return f'tcp://{address}' if port is None else f'tcp://{address}:{port}'
+
+    def bind_endpoint(self, port, address='*'):
+        """ Return the endpoint to bind to
+        Args:
+        - port (int) - port
+        - address (str) - local address to bind to; '*' for every interface
+        """
+        return f'tcp://{address}:{port}'
+
+class IpcTransport(Transport):
+    """ ipc:// endpoints between processes of one machine """
+
+    def __init__(self, directory, host='local'):
+        """ Constructor
+        args:
+        - directory (str) - directory of the Unix domain sockets; one per system
+        - host (str) - host name every entity advertises
+        """
+        self.directory = directory.rstrip('/')
+        self.host = host
+
+    def endpoint(self, address, port=None):
+        address = address if port is None else f'{address}:{port}'
+        return f'ipc://{self.directory}/{address}'
+
+    def bind_endpoint(self, port, address='*'):
+        return f"ipc://{self.directory}/{self.host if address == '*' else address}:{port}"
+
+class EntityContext(zmq.Context):
+    """ Shadow of a shared context: destroy() closes the entity's sockets, and the
+    shared context stays usable for the other entities """
+
+    def term(self):
+        # The shared context outlives every entity; its owner terminates it
+        pass
+
+class InprocTransport(Transport):
+    """ inproc:// endpoints between entities of one process """
+
+    def __init__(self, host='local', context=None):
+        """ Constructor
+        args:
+        - host (str) - host name every entity advertises
+        - context (zmq.Context) - shared context; a new one by default. The owner
+          terminates it once every entity disconnected
+        """
+        self.host = host
+        self.shared_context = context or zmq.Context()
+
+    def context(self):
+        context = EntityContext.shadow(self.shared_context.underlying)
+        # Nothing is in flight outside the process; closing never waits
+        context.setsockopt(zmq.LINGER, 0)
+        return context
+
+    def endpoint(self, address, port=None):
+        return f'inproc://{address}' if port is None else f'inproc://{address}:{port}'
+
+    def bind_endpoint(self, port, address='*'):
+        return f"inproc://{self.host if address == '*' else address}:{port}"
+
+# Transport of entities not given one
+TCP_TRANSPORT = Transport()
@@ -1,13 +1,367 @@
 """ All entities in pub/sub are clients of ZooKeeper, so they will each inherit from this class
-for basic zookeeper client functionality
+for basic zookeeper client functionality.
+
+Entities in one process share one ZooKeeper session (ZookeeperSession): one
+connection with its threads and heartbeats, and one watch per znode whose events
+are fanned out to the entities locally, so server load and client threads stay
+flat as entities per host grow. Brokers keep a session of their own, as their
+/broker znode belongs to the session that created it.
+
+Znodes a client reads repeatedly (the broker znode above all) are served from the
+session's cache, kept current by watch events: every watch event re-reads the
+znode once, with the watch re-armed by that same read, and hands the new value to
+the registered listeners, so nobody fetches it again. Writes are conditional sets
+against the cached version instead of exists-then-set-then-get. Every ZooKeeper
+operation issued through the session is counted (see get_zk_op_stats).
+
+The leader broker's /broker znode is ephemeral, so it disappears with the leader's
+session, and every leader creates it anew. Its creation zxid (czxid) therefore
+rises with every leadership and serves as the leader's epoch: clients follow a
+broker only if its epoch is newer than the one they follow, so a stale value can
+never send them back to a deposed leader.
+
+Every znode path is absolute (/broker, /electionpath, /topics, ...), so one
+ensemble serves one pub/sub system. Entities given a namespace connect with a
+kazoo chroot instead (hosts 'host:2181/namespace'), and all of their paths live
+under /namespace, so independent systems can share the ensemble.
+
+Hosts of the form memory://<name> select an in-memory ensemble in this process
+instead of a server (see memory_zookeeper.py), for tests and benchmarks.
 """
 import uuid
 import sys
+import threading
+import warnings
 from kazoo.client import KazooClient, KazooState
+from kazoo.handlers.threading import KazooTimeoutError
+from kazoo.exceptions import (NoNodeError, NodeExistsError, BadVersionError, ConnectionClosedError,
+    SessionExpiredError)
 import logging
+import time
+from .reconnect import ReconnectPolicy
+from .liveness import enable_heartbeats, PeerMonitor
+from .memory_zookeeper import MEMORY_SCHEME, MemoryKazooClient
+from .barrier import signal_barrier
+
+# ZooKeeper's default tickTime, in seconds: the server's unit of session timeouts
+TICK_TIME = 2.0
+# Seconds an event loop sleeps between looks at WATCH_FLAG while the broker is switched
+SWITCH_POLL_INTERVAL = 0.01
+
+def kazoo_client(hosts, timeout=10.0):
+    """ Return a KazooClient of the ensemble at hosts, or of the in-memory ensemble
+    for hosts of the form memory://<name>[/<chroot>]
+    Args:
+    - hosts (str) - comma separated host:port list, optionally followed by /<chroot>
+    - timeout (float) - session timeout in seconds
+    """
+    if hosts.startswith(MEMORY_SCHEME):
+        return MemoryKazooClient(hosts, timeout=timeout)
+    return KazooClient(hosts, timeout=timeout)
+
+def wait_for_zookeeper(hosts, timeout=30.0):
+    """ Return a started client of the ensemble at hosts as soon as it answers, e.g.
+    right after the server was launched; raises TimeoutError after timeout seconds
+    Args:
+    - hosts (str) - comma separated host:port list, optionally followed by /<chroot>
+    - timeout (float) - seconds to keep trying
+    """
+    deadline = time.time() + timeout
+    while True:
+        zk = kazoo_client(hosts)
+        try:
+            # Short attempts: kazoo's own retries back off to many seconds
+            zk.start(timeout=max(0.1, min(1.0, deadline - time.time())))
+            return zk
+        except KazooTimeoutError:
+            zk.close()
+            if time.time() >= deadline:
+                raise TimeoutError(f'ZooKeeper at {hosts} did not answer within {timeout}s')
+
+class ZookeeperSession:
+    """ A ZooKeeper connection and watch-driven znode cache shared by the entities
+    of a process that use the same ensemble """
+    # key = (hosts string, session timeout), value = shared ZookeeperSession
+    shared = {}
+    shared_lock = threading.Lock()
+
+    @classmethod
+    def acquire(cls, hosts, timeout=10.0):
+        """ Return the process-wide session for hosts and session timeout, creating
+        it on first use """
+        key = (hosts, timeout)
+        with cls.shared_lock:
+            session = cls.shared.get(key)
+            if session is None:
+                session = cls.shared[key] = cls(kazoo_client(hosts, timeout), key=key)
+            session.users += 1
+            return session
+
+    def __init__(self, zk, key=None):
+        """ Constructor
+        args:
+        - zk (KazooClient) - client of the ensemble, started by start()
+        - key (tuple) - key of the session in ZookeeperSession.shared, if shared
+        """
+        self.zk = zk
+        self.key = key
+        # Number of entities using the session; the last release stops it
+        self.users = 0
+        self.started = False
+        self.start_lock = threading.Lock()
+        # key = path, value = (data, ZnodeStat); (None, None) if the znode does not exist
+        self.znode_cache = {}
+        # key = path, value = list of (owner, listener(data, stat, event)) pairs
+        self.znode_listeners = {}
+        # key = path, value = set of owners (entities) interested in the znode; its
+        # watch is re-armed on every event while the set is not empty
+        self.znode_owners = {}
+        # key = path, value = watcher function (one per path, so kazoo keeps one watch)
+        self.znode_watchers = {}
+        # Guards the dicts above; never held while reading ZooKeeper or calling listeners
+        self.znode_lock = threading.RLock()
+        # key = path, value = RLock ordering the reads and listener calls of one znode,
+        # so listeners see its changes in order; other znodes are not held up
+        self.znode_path_locks = {}
+        self.lost = False
+        # key = operation ('get', 'exists', 'set', 'create', 'delete'), value = count
+        self.op_counts = {}
+        self.zk.add_listener(self.state_changed)
+
+    def start(self):
+        """ Start the session unless another entity already did """
+        with self.start_lock:
+            if not self.started:
+                with warnings.catch_warnings():
+                    # kazoo warns about a missing chroot, which is created next
+                    warnings.filterwarnings('ignore', message='No chroot path exists')
+                    self.zk.start()
+                if self.zk.chroot:
+                    # The chroot must exist before paths below it can be used; create
+                    # it with the chroot lifted, as kazoo prefixes every request path
+                    chroot, self.zk.chroot = self.zk.chroot, ''
+                    try:
+                        self.zk.ensure_path(chroot)
+                    finally:
+                        self.zk.chroot = chroot
+                self.started = True
+
+    def release(self):
+        """ An entity stops using the session; stop and close it after the last one """
+        with ZookeeperSession.shared_lock:
+            self.users -= 1
+            if self.users > 0:
+                return
+            if self.key is not None and ZookeeperSession.shared.get(self.key) is self:
+                ZookeeperSession.shared.pop(self.key)
+        if self.started:
+            self.zk.stop()
+            self.zk.close()
+            self.started = False
+
+    def state_changed(self, state):
+        if state == KazooState.LOST:
+            # Watches die with the session
+            self.lost = True
+        elif state == KazooState.CONNECTED and self.lost:
+            self.lost = False
+            # Re-read (and re-arm) the watched znodes outside the connection thread
+            for path in list(self.znode_owners):
+                self.zk.handler.spawn(self.refresh_znode, path)
+
+    def count_op(self, op):
+        self.op_counts[op] = self.op_counts.get(op, 0) + 1
+
+    def stats(self):
+        """ Return the number of ZooKeeper operations issued, per operation and in total,
+        and the number of entities and watched znodes sharing the session """
+        return dict(self.op_counts, total=sum(self.op_counts.values()), users=self.users,
+            watched=len(self.znode_owners))
+
+    def watch_znode(self, path, owner, listener=None):
+        """ Keep the cached value of a znode current from watch events and return it
+        as (data, stat). The first call reads the znode once and arms its watch;
+        later calls, by any entity of the session, are served from the cache.
+        Args:
+        - path (str) - znode path
+        - owner (object) - entity interested in the znode
+        - listener (function) - optional listener(data, stat, event) called now with
+          the cached value (event None) and again on every change; a listener
+          returning False is removed
+        """
+        with self.path_lock(path):
+            with self.znode_lock:
+                self.znode_owners.setdefault(path, set()).add(owner)
+                cached = path in self.znode_cache
+            if not cached:
+                self.refresh_znode(path)
+            with self.znode_lock:
+                data, stat = self.znode_cache.get(path, (None, None))
+            # No change of the znode is handed out before the listener is added
+            if listener is not None and listener(data, stat, None) is not False:
+                with self.znode_lock:
+                    self.znode_listeners.setdefault(path, []).append((owner, listener))
+        return data, stat
+
+    def expiry_time(self):
+        """ Return the seconds after which the server expires a session of ours: the
+        timeout negotiated with it (the requested one rounded to its tickTime), plus
+        a tick for the expiry to be processed """
+        return self.zk._session_timeout / 1000 + TICK_TIME
+
+    def path_lock(self, path):
+        """ Return the lock ordering the reads and listener calls of a znode """
+        with self.znode_lock:
+            return self.znode_path_locks.setdefault(path, threading.RLock())
+
+    def unwatch_znode(self, path, owner):
+        """ Drop an entity's interest (and listeners) in a znode. The watch is no
+        longer re-armed once nobody is interested; the cached value (e.g. the version
+        for a conditional set) is kept until the next event. """
+        with self.znode_lock:
+            owners = self.znode_owners.get(path, set())
+            owners.discard(owner)
+            if not owners:
+                self.znode_owners.pop(path, None)
+            self.znode_listeners[path] = [
+                (other, listener) for other, listener in self.znode_listeners.get(path, [])
+                if other is not owner
+            ]
+
+    def znode_watcher(self, path):
+        """ Return the watcher of a path; kazoo keeps one watch per watcher function """
+        if path not in self.znode_watchers:
+            def watcher(event):
+                # Do not block kazoo's event thread; listeners may use ZooKeeper themselves
+                self.zk.handler.spawn(self.refresh_znode, path, event)
+            self.znode_watchers[path] = watcher
+        return self.znode_watchers[path]
+
+    def refresh_znode(self, path, event=None):
+        """ Read a znode, re-arming its watch with the same request, update the
+        cache and hand the new value to the listeners of every entity. The listeners
+        are called without the session's lock, so a slow one only holds up later
+        changes of the same znode, and listeners may use the session themselves. """
+        with self.path_lock(path):
+            with self.znode_lock:
+                if event is not None and path not in self.znode_owners:
+                    # No longer of interest; let the watch lapse
+                    self.znode_cache.pop(path, None)
+                    return
+                watcher = self.znode_watcher(path)
+            try:
+                self.count_op('get')
+                data, stat = self.zk.get_async(path, watch=watcher).get()
+            except NoNodeError:
+                # Wait for it to be created
+                self.count_op('exists')
+                if self.zk.exists_async(path, watch=watcher).get() is not None:
+                    # Created in between; read it (the watch is already armed)
+                    self.count_op('get')
+                    data, stat = self.zk.get_async(path).get()
+                else:
+                    data, stat = None, None
+            except (ConnectionClosedError, SessionExpiredError):
+                # Session lost or stopped (kazoo fires the watches it drops); a new
+                # session re-reads every watched znode in state_changed
+                return
+            with self.znode_lock:
+                previous = self.znode_cache.get(path)
+                self.znode_cache[path] = (data, stat)
+                if event is None or previous == (data, stat):
+                    return
+                listeners = list(self.znode_listeners.get(path, []))
+            for owner, listener in listeners:
+                if listener(data, stat, event) is False:
+                    with self.znode_lock:
+                        if (owner, listener) in self.znode_listeners.get(path, []):
+                            self.znode_listeners[path].remove((owner, listener))
+
+    def set_znode(self, path, value):
+        """ Write a znode with a conditional set against its cached version, creating
+        it if it does not exist; a concurrent write (version mismatch) is re-read
+        and overwritten. Returns the new ZnodeStat or None if just created.
+        Args:
+        - path (str) - znode path
+        - value (bytes) - new value
+        """
+        while True:
+            data, stat = self.znode_cache.get(path, (None, None))
+            if stat is None:
+                try:
+                    self.count_op('create')
+                    self.zk.create_async(path, value).get()
+                    self.znode_cache[path] = (value, None)
+                    return None
+                except NodeExistsError:
+                    # Not cached (or created meanwhile): learn its version
+                    self.count_op('get')
+                    self.znode_cache[path] = self.zk.get_async(path).get()
+                    continue
+            try:
+                self.count_op('set')
+                stat = self.zk.set_async(path, value, version=stat.version).get()
+            except BadVersionError:
+                self.count_op('get')
+                self.znode_cache[path] = self.zk.get_async(path).get()
+                continue
+            except NoNodeError:
+                self.znode_cache[path] = (None, None)
+                continue
+            self.znode_cache[path] = (value, stat)
+            return stat
+
+    def create_ephemeral_znode(self, path, value):
+        """ Create a znode that lives as long as this session and return its ZnodeStat.
+        A znode left at path is only replaced if nobody else can be using it: a
+        persistent one (from an older version) or one of our own session. An ephemeral
+        znode of another session (e.g. a leader whose session is only now expiring)
+        goes with that session, so it is waited out for as long as our session lives;
+        SessionExpiredError is raised once our session is lost.
+        Args:
+        - path (str) - znode path
+        - value (bytes) - znode value
+        """
+        while True:
+            try:
+                self.count_op('create')
+                _, stat = self.zk.create_async(path, value, ephemeral=True, include_data=True).get()
+                break
+            except NodeExistsError:
+                pass
+            try:
+                self.count_op('get')
+                _, existing = self.zk.get_async(path).get()
+            except NoNodeError:
+                continue
+            if existing.ephemeralOwner in (0, self.zk.client_id[0]):
+                try:
+                    # Only the znode we looked at; a new one is looked at again
+                    self.count_op('delete')
+                    self.zk.delete_async(path, version=existing.version).get()
+                except (NoNodeError, BadVersionError):
+                    pass
+                continue
+            if self.lost:
+                raise SessionExpiredError(f'Session lost while waiting for {path} to go')
+            gone = threading.Event()
+            self.count_op('exists')
+            if self.zk.exists_async(path, watch=lambda event: gone.set()).get() is not None:
+                # Look again after the server had time to expire the other session, in
+                # case the watch event was lost with our connection
+                gone.wait(self.expiry_time())
+        with self.znode_lock:
+            self.znode_cache[path] = (value, stat)
+        return stat
+
 class ZookeeperClient:
-    def __init__(self, zookeeper_hosts=[]):
+    def __init__(self, zookeeper_hosts=[], namespace=None):
         self.zk_hosts = ','.join(zookeeper_hosts)
+        # Namespace of this pub/sub system on the ensemble (see the module docstring);
+        # it is part of the session key, so each namespace gets its own session
+        self.zk_namespace = namespace.strip('/') if namespace else None
+        if self.zk_namespace:
+            self.zk_hosts += f'/{self.zk_namespace}'
         # ZooKeeper client -> self.zk
         self.zk = None
         self.zk_instance_id = str(uuid.uuid4())
@@ -15,6 +369,147 @@ class ZookeeperClient:
         self.znode_value = None
         # The ZNode all entities will be interested in watching
         self.zk_name = '/broker'
+        # ZooKeeper session (shared with the other entities of this process unless
+        # share_zk_session is False) -> self.zk_session
+        self.share_zk_session = True
+        self.zk_session = None
+        # When to reconnect after the broker changed (see reconnect.py); entities
+        # replace it with the policy they were given
+        self.reconnect_policy = ReconnectPolicy()
+        self.reconnect_generation = 0
+        # Seconds without contact after which ZooKeeper expires our session (and
+        # with it our ephemeral znodes, e.g. the leader broker's /broker)
+        self.zk_session_timeout = 10.0
+        # Epoch (czxid of /broker) of the broker we follow, see is_new_broker
+        self.broker_epoch = None
+        # The watch thread and the heartbeat check in the event loop both follow /broker
+        self.broker_lock = threading.Lock()
+        # ZMTP heartbeats on the connection to the broker (see liveness.enable_heartbeats):
+        # seconds between heartbeats (None: off) and seconds of silence that mean the
+        # broker is dead. The monitor of the current connection -> self.broker_monitor
+        self.broker_heartbeat_interval = None
+        self.broker_heartbeat_timeout = None
+        self.broker_monitor = None
+        # Set when the broker left a heartbeat on the registration socket unanswered;
+        # the next call to broker_lost reports the broker as lost
+        self.heartbeat_unanswered = False
+        # Barrier znode of a run orchestrated by a test driver (see barrier.py); None: none
+        self.barrier = None
+
+    def signal_barrier(self, stage):
+        """ Tell the test driver orchestrating the run that we reached a stage
+        (barrier.READY or barrier.DONE), if we were given a barrier """
+        if self.barrier is None:
+            return
+        self.debug(f"Reached {stage} of barrier {self.barrier}")
+        signal_barrier(self.zk, self.barrier, stage, f'{type(self).__name__.lower()}-{self.zk_instance_id}')
+
+    def reconnect_after_broker_change(self, reconnect):
+        """ Call reconnect() once the reconnect policy's delay has passed, from a thread
+        of its own even without a delay: this runs in a watch listener, and
+        reconnecting blocks on the registration with the new broker, which would hold
+        up the other listeners of the znode. A reconnect superseded by a newer broker
+        change meanwhile is dropped.
+        Args:
+        - reconnect (function) - connects and registers with the new broker
+        """
+        self.reconnect_generation += 1
+        generation = self.reconnect_generation
+        delay = self.reconnect_policy.delay()
+        def delayed_reconnect():
+            if delay:
+                self.debug(f"Reconnecting to the new broker in {delay:.2f}s")
+                time.sleep(delay)
+            if generation == self.reconnect_generation:
+                reconnect()
+        self.zk.handler.spawn(delayed_reconnect)
+
+    def wait_for_switch(self):
+        """ Pause the event loop while the broker is being switched (WATCH_FLAG set): with
+        the reconnect policy's delay that takes seconds, and spinning meanwhile would
+        burn a core and contend with the reconnecting thread """
+        time.sleep(SWITCH_POLL_INTERVAL)
+
+    def is_new_broker(self, data, stat):
+        """ Return True (and follow it) if the /broker value names a broker we do not
+        follow yet. Values of an older epoch (a deposed leader) and of the leader we
+        already follow are not new.
+        Args:
+        - data (bytes) - /broker value
+        - stat (ZnodeStat) - its stat; czxid is the leader's epoch
+        """
+        if data is None or stat is None:
+            return False
+        with self.broker_lock:
+            if self.broker_epoch is not None:
+                if stat.czxid < self.broker_epoch:
+                    self.info(f"Ignoring broker {data.decode('utf-8')} of deposed epoch {stat.czxid}")
+                    return False
+                if stat.czxid == self.broker_epoch and data.decode('utf-8') == self.znode_value:
+                    return False
+            self.broker_epoch = stat.czxid
+            return True
+
+    def watch_broker_connection(self, socket):
+        """ Enable heartbeats on a socket about to connect to the broker and monitor
+        the connection, if broker heartbeats are configured """
+        if self.broker_monitor is not None:
+            self.broker_monitor.close()
+            self.broker_monitor = None
+        if self.broker_heartbeat_interval is not None:
+            enable_heartbeats(socket, self.broker_heartbeat_interval, self.broker_heartbeat_timeout)
+            self.broker_monitor = PeerMonitor(socket)
+
+    def wait_heartbeat_reply(self, service=None):
+        """ Wait for the broker's reply to a heartbeat sent on the registration socket;
+        return True once it can be received. Without a reply within the reconnect
+        policy's registration timeout (default two heartbeat intervals) the broker
+        counts as lost (see broker_lost) and the REQ socket, which cannot send again
+        before it received a reply, is created anew; return False.
+        Args:
+        - service (function) - optional; called while waiting (e.g. to answer
+          notifications the broker sends before it gets to the heartbeat)
+        """
+        timeout = self.reconnect_policy.registration_timeout or 2 * self.heartbeat_interval
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            wait = min(remaining, 0.01) if service is not None else remaining
+            if self.broker_reg_socket.poll(max(0.0, wait) * 1000):
+                return True
+            if remaining <= 0:
+                break
+            if service is not None:
+                service()
+        self.info(f"No reply to heartbeat from broker {self.znode_value} within {timeout}s")
+        self.heartbeat_unanswered = True
+        self.connect_broker_reg_socket()
+        return False
+
+    def broker_lost(self, switch_broker):
+        """ Return True if the heartbeats show the connection to the broker was lost
+        since the last call, or the broker left a heartbeat unanswered. If a newer
+        leader already wrote /broker, it is read now and handed to switch_broker
+        instead of waiting for the watch event.
+        Args:
+        - switch_broker (function) - called with the new /broker value; reconnects to
+          that broker (e.g. through reconnect_after_broker_change)
+        """
+        unanswered = self.heartbeat_unanswered
+        self.heartbeat_unanswered = False
+        monitor_lost = self.broker_monitor is not None and self.broker_monitor.lost()
+        if not (unanswered or monitor_lost):
+            return False
+        self.info(f"Lost the connection to broker {self.znode_value}; checking for a new leader")
+        try:
+            self.zk_session.count_op('get')
+            data, stat = self.zk.get_async(self.zk_name).get()
+        except NoNodeError:
+            # Gone with the leader's session; the watch reports the next leader
+            return True
+        if self.is_new_broker(data, stat):
+            switch_broker(data)
+        return True
 
     def listener4state (self, state):
         if state == KazooState.LOST:
@@ -27,10 +522,16 @@ class ZookeeperClient:
             self.debug ("Current state now = UNKNOWN !! Cannot happen")
 
     def connect_zk(self):
+        """ Join the process-wide session for our ensemble (or open a private one) """
         success = False
         try:
             self.debug(f"Try to connect with ZooKeeper server: hosts = {self.zk_hosts}")
-            self.zk = KazooClient(self.zk_hosts)
+            if self.share_zk_session:
+                self.zk_session = ZookeeperSession.acquire(self.zk_hosts, self.zk_session_timeout)
+            else:
+                self.zk_session = ZookeeperSession(kazoo_client(self.zk_hosts, self.zk_session_timeout))
+                self.zk_session.users = 1
+            self.zk = self.zk_session.zk
             self.zk.add_listener (self.listener4state)
             self.debug(f"ZooKeeper Current Status = {self.zk.state}")
             success = True
@@ -40,42 +541,57 @@ class ZookeeperClient:
 
 
     def start_session(self):
-        """ Start a Zookeeper Session """
+        """ Start a Zookeeper Session (a no-op if another entity already started it) """
         success = False
         try:
-            self.zk.start()
+            self.zk_session.start()
             success = True
         except:
             self.debug(f"Exception thrown in start (): {sys.exc_info()[0]}")
         return success
 
     def stop_session (self):
-        """ Stop a ZooKeeper Session """
+        """ Leave the ZooKeeper Session; it is stopped once no entity of the process uses it """
         success = False
         try:
-            self.zk.stop()
+            if self.zk_session is not None:
+                self.zk.remove_listener(self.listener4state)
+                self.zk_session.release()
+                self.zk_session = None
             success = True
         except:
             self.error(f"Exception thrown in stop (): {sys.exc_info()[0]}")
         return success
 
     def close_connection(self):
-        try:
-            # now disconnect from the server
-            self.zk.close()
-        except:
-            self.error(f"Exception thrown in close (): {sys.exc_info()[0]}")
-            return
+        """ Same as stop_session: the connection is closed with the session's last user """
+        return self.stop_session()
+
+    def get_zk_op_stats(self):
+        """ Return the ZooKeeper operations issued by this entity's session, which
+        is shared with the other entities of the process (see ZookeeperSession.stats) """
+        return self.zk_session.stats() if self.zk_session else {'total': 0}
+
+    def watch_znode(self, path, listener=None):
+        """ Return (data, stat) of a znode from the session's watch-driven cache and
+        optionally call listener(data, stat, event) now and on every change
+        (see ZookeeperSession.watch_znode) """
+        return self.zk_session.watch_znode(path, self, listener)
+
+    def unwatch_znode(self, path):
+        """ Stop following a znode (other entities of the session may still follow it) """
+        self.zk_session.unwatch_znode(path, self)
+
+    def set_znode(self, path, value):
+        """ Write a znode with a conditional set (see ZookeeperSession.set_znode) """
+        return self.zk_session.set_znode(path, value)
 
     def get_znode_value (self):
-        """ ******************* retrieve a znode value  ************************ """
+        """ ******************* retrieve a znode value  ************************
+        Served from the watch-driven cache; the first call reads the znode and arms its watch """
         try:
-            self.debug (f"Checking if {self.zk_name} exists (it should)")
-            if self.zk.exists (self.zk_name):
-                self.debug (f"{self.zk_name} znode indeed exists; get value")
-                # Now acquire the value and stats of that znode
-                #value,stat = self.zk.get (self.zk_name, watch=self.watch)
-                value, stat = self.zk.get (self.zk_name)
+            value, stat = self.watch_znode(self.zk_name)
+            if value is not None:
                 # ip, pub_reg_port, sub_reg_port
                 self.znode_value = value.decode("utf-8")
                 self.debug(
@@ -87,25 +603,20 @@ class ZookeeperClient:
                 self.debug (f"{self.zk_name} znode does not exist, why?")
             response = self.znode_value
         except Exception as e:
-            self.error(f"Exception thrown checking for exists/get: {sys.exc_info()[0]}")
+            self.error(f"Exception thrown getting {self.zk_name}: {sys.exc_info()[0]}")
             response = f"Error: {str(e)}"
         return response
 
     def create_znode (self, znode_value=None):
-        """ Create an ephemeral znode with name = self.zk_name and value =
-        self.znode_value. Used by the broker specifically.  """
+        """ Create the ephemeral znode self.zk_name with value self.znode_value (or
+        znode_value without one), as the leader broker does; it goes with our session
+        (see ZookeeperSession.create_ephemeral_znode) """
         success = False
         try:
-            self.debug(
-                f"Creating a znode {self.zk_name} with "
-                f"value {self.znode_value }")
-            if self.znode_value:
-                self.zk.create(self.zk_name, value=self.znode_value.encode('utf-8'),
-                    ephemeral=False)
-                success = True
-            elif znode_value:
-                self.zk.create(self.zk_name, value=znode_value.encode('utf-8'),
-                    ephemeral=False)
+            value = self.znode_value or znode_value
+            self.debug(f"Creating a znode {self.zk_name} with value {value}")
+            if value:
+                self.zk_session.create_ephemeral_znode(self.zk_name, value.encode('utf-8'))
                 success = True
         except Exception as e:
             self.error(str(e))
@@ -115,34 +626,26 @@ class ZookeeperClient:
     def delete_znode(self):
         success = False
         try:
+            self.zk_session.count_op('delete')
             self.zk.delete(self.zk_name)
+            self.zk_session.znode_cache.pop(self.zk_name, None)
             success = True
         except Exception as e:
             self.error(str(e))
         return success
 
     def modify_znode_value(self, new_val):
-        """ Modify a znode value
+        """ Modify a znode value with a conditional set (see set_znode)
         Args:
-        new_val (str): new value to set on the /broker znode """
+        new_val (str or bytes): new value to set on the /broker znode """
         try:
-            # Now let us change the data value on the znode and see if
-            # our watch gets invoked
             self.debug(f"Setting a new value = {new_val} on znode {self.zk_name}")
-            if self.zk.exists (self.zk_name):
-                self.debug(f"{self.zk_name} znode still exists :-)")
-                self.debug("Setting a new value on znode")
-                self.zk.set(self.zk_name, new_val)
-                # Now see if the value was changed
-                value,stat = self.zk.get(self.zk_name)
-                self.debug(
-                    f"New value at znode {self.zk_name}: "
-                    f"value = {value}, stat = {stat}"
-                    )
-            else:
-                self.debug(f"{self.zk_name} znode does not exist")
+            encoded = new_val.encode('utf-8') if isinstance(new_val, str) else new_val
+            stat = self.set_znode(self.zk_name, encoded)
+            self.debug(f"New value at znode {self.zk_name}: value = {new_val}, stat = {stat}")
+            value = new_val
         except Exception as e:
-            self.debug("Exception thrown checking for exists/set: ", sys.exc_info()[0])
+            self.debug(f"Exception thrown in set: {sys.exc_info()[0]}")
             value = str(e)
         return value
 
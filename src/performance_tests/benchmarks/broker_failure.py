@@ -0,0 +1,120 @@
+""" Benchmark of how fast a client notices that its broker failed. A stand-in broker
+(a REP socket answering registrations) runs in a child process; the client holds a
+REQ socket to it, as publishers and subscribers hold their registration socket,
+watched by a PeerMonitor. The broker then fails in one of two ways:
+- crash: SIGKILL, the kernel closes its connections
+- hang: SIGSTOP, the connections stay open but nothing answers (a stuck process,
+  or a host that dropped off the network)
+Measured per heartbeat setting (none, or interval/timeout pairs): time from the
+failure until the client reports the broker lost, over --trials failures each.
+Without heartbeats a hung broker is only noticed once its ZooKeeper session
+expires (--zk_session_timeout, 10 s by default), which this benchmark does not
+wait for.
+
+Run from the src directory:
+    python3 -m performance_tests.benchmarks.broker_failure --trials 20 --output broker_failure.json
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import time
+import zmq
+from lib.liveness import enable_heartbeats, PeerMonitor
+from .common import Benchmark
+
+def serve_registrations(port, ready):
+    """ Stand-in broker: answer every registration until killed """
+    context = zmq.Context()
+    socket = context.socket(zmq.REP)
+    socket.bind(f'tcp://127.0.0.1:{port}')
+    ready.set()
+    while True:
+        socket.send(socket.recv())
+
+class BrokerFailureBenchmark(Benchmark):
+
+    def __init__(self, trials=20, heartbeats=[(0.1, 0.3), (0.25, 0.75), (0.5, 1.5)], give_up=5.0):
+        """ Constructor
+        args:
+        - trials (int) - broker failures per failure mode and heartbeat setting
+        - heartbeats (list) - (interval, timeout) pairs in seconds to compare with no heartbeats
+        - give_up (float) - seconds after which a failure counts as not detected
+        """
+        super().__init__(name='BROKER-FAILURE-BENCH')
+        self.trials = trials
+        self.heartbeats = heartbeats
+        self.give_up = give_up
+
+    def run_once(self, mode, heartbeat, port):
+        """ Fail a fresh broker once; return the seconds until the client noticed, or None """
+        ready = multiprocessing.Event()
+        broker = multiprocessing.Process(target=serve_registrations, args=(port, ready), daemon=True)
+        broker.start()
+        ready.wait()
+        context = zmq.Context()
+        socket = context.socket(zmq.REQ)
+        if heartbeat:
+            enable_heartbeats(socket, *heartbeat)
+        monitor = PeerMonitor(socket)
+        socket.connect(f'tcp://127.0.0.1:{port}')
+        # Registered: the connection is up and the broker answers
+        socket.send(b'register')
+        socket.recv()
+        monitor.lost()
+        failed = time.time()
+        os.kill(broker.pid, signal.SIGKILL if mode == 'crash' else signal.SIGSTOP)
+        detected = None
+        while time.time() - failed < self.give_up:
+            if monitor.lost():
+                detected = monitor.lost_at - failed
+                break
+            time.sleep(0.001)
+        if mode == 'hang':
+            os.kill(broker.pid, signal.SIGKILL)
+        broker.join()
+        monitor.close()
+        context.destroy(linger=0)
+        return detected
+
+    def run(self):
+        """ Compare detection times without and with heartbeats for both failure modes """
+        results = {'trials': self.trials, 'give_up': self.give_up, 'runs': {}}
+        port = 46000
+        for heartbeat in [None] + self.heartbeats:
+            setting = 'none' if heartbeat is None else f'{heartbeat[0]}/{heartbeat[1]}'
+            for mode in ['crash', 'hang']:
+                detections = []
+                for _ in range(self.trials):
+                    # A fresh port per trial, so no old connection is reused
+                    port += 1
+                    detections.append(self.run_once(mode, heartbeat, port))
+                detected = [seconds for seconds in detections if seconds is not None]
+                stats = results['runs'][f'{setting}-{mode}'] = {
+                    'heartbeat': heartbeat,
+                    'mode': mode,
+                    'undetected': len(detections) - len(detected),
+                    'detection': self.summarize_latencies(detected)
+                }
+                summary = f"{stats['undetected']}/{self.trials} undetected after {self.give_up}s"
+                if detected:
+                    summary = (f"p50 {stats['detection']['p50'] * 1000:.1f} ms, "
+                        f"max {stats['detection']['max'] * 1000:.1f} ms, " + summary)
+                self.info(f"heartbeats {setting:<9} {mode:<5} detection {summary}")
+        return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Time for a client to notice a crashed or hung broker, with and without heartbeats')
+    parser.add_argument('--trials', type=int, default=20, help='failures per mode and heartbeat setting')
+    parser.add_argument('--heartbeat', action='append',
+        help='INTERVAL/TIMEOUT in seconds to compare; repeat for several (default: 0.1/0.3 0.25/0.75 0.5/1.5)')
+    parser.add_argument('--give_up', type=float, default=5.0,
+        help='seconds after which a failure counts as undetected')
+    parser.add_argument('--output', type=str, help='optional JSON file for the results')
+    args = parser.parse_args()
+    heartbeats = [(0.1, 0.3), (0.25, 0.75), (0.5, 1.5)]
+    if args.heartbeat:
+        heartbeats = [tuple(float(value) for value in setting.split('/')) for setting in args.heartbeat]
+    benchmark = BrokerFailureBenchmark(trials=args.trials, heartbeats=heartbeats, give_up=args.give_up)
+    benchmark.write_results(benchmark.run(), args.output)
@@ -0,0 +1,61 @@
+""" Shared helpers for the in-process benchmarks """
+import json
+import logging
+import math
+
+class Benchmark:
+    """ Base class for in-process benchmarks; provides logging, latency
+    summaries and machine-readable output """
+
+    def __init__(self, name='BENCHMARK'):
+        self.name = name
+        self.set_logger()
+
+    def set_logger(self):
+        self.prefix = {'prefix': f'{self.name} -'}
+        self.logger = logging.getLogger(self.name)
+        if not self.logger.handlers:
+            handler = logging.StreamHandler()
+            formatter = logging.Formatter('%(prefix)s - %(message)s')
+            handler.setFormatter(formatter)
+            self.logger.addHandler(handler)
+        self.logger.setLevel(logging.INFO)
+
+    def debug(self, msg):
+        self.logger.debug(msg, extra=self.prefix)
+
+    def info(self, msg):
+        self.logger.info(msg, extra=self.prefix)
+
+    def error(self, msg):
+        self.logger.error(msg, extra=self.prefix)
+
+    @staticmethod
+    def percentile(sorted_values, fraction):
+        """ Nearest-rank percentile of an already sorted list
+        Args:
+        - sorted_values (list) - ascending values
+        - fraction (float) - e.g. 0.99 for p99
+        """
+        if not sorted_values:
+            return None
+        rank = max(1, math.ceil(fraction * len(sorted_values)))
+        return sorted_values[rank - 1]
+
+    def summarize_latencies(self, latencies):
+        """ Return count, p50, p99, p999 and max of a list of latencies (seconds) """
+        values = sorted(latencies)
+        return {
+            'count': len(values),
+            'p50': self.percentile(values, 0.5),
+            'p99': self.percentile(values, 0.99),
+            'p999': self.percentile(values, 0.999),
+            'max': values[-1] if values else None
+        }
+
+    def write_results(self, results, output=None):
+        """ Write results as JSON to output if provided """
+        if output:
+            with open(output, 'w') as f:
+                json.dump(results, f, indent=4)
+            self.info(f"Results written to {output}")
@@ -0,0 +1,248 @@
+""" Benchmark suite of the ZooKeeper coordination layer, run through the entities'
+own code paths (ZookeeperClient watches, Broker.zk_run_election and
+Broker.take_leadership):
+- watch latency: time from a write of /broker until each of N subscribers (a
+  session each) saw it in its watch listener, for growing N
+- election: time until the first of N brokers contending in /electionpath leads,
+  i.e. wrote its /broker znode, for growing N
+- failover: time from the death of the leader (its session closed) until the next
+  leader wrote /broker, and until every watching subscriber saw it
+- ZooKeeper operations per client to start (subscribers and brokers) and per
+  client during a failover
+A closed session drops its ephemeral znodes at once; a crashed leader is only
+noticed after its session timeout (--zk_session_timeout), which adds to the
+failover times measured here.
+
+Each run uses its own ZooKeeper namespace (see --zk_namespace), so it neither
+disturbs nor is disturbed by a running system, and removes it at the end.
+Needs a running ZooKeeper server, or --zookeeper_hosts memory://<name> for the
+in-memory ensemble (see lib/memory_zookeeper.py), which times the coordination
+code paths without network round trips.
+
+Run from the src directory:
+    python3 -m performance_tests.benchmarks.coordination --output coordination.json
+"""
+import argparse
+import logging
+import queue
+import threading
+import time
+import uuid
+from lib.broker import Broker
+from lib.subscriber import Subscriber
+from lib.zookeeper_client import ZookeeperSession, kazoo_client
+from .common import Benchmark
+
+class ElectionContender(Broker):
+    """ Broker that, once elected, only takes over the coordination state and then
+    holds the leadership until released, instead of serving clients """
+
+    def __init__(self, elected, **kwargs):
+        """ Constructor
+        args:
+        - elected (queue.Queue) - receives the contender once it leads
+        - kwargs - Broker arguments
+        """
+        super().__init__(**kwargs)
+        self.logger.setLevel(logging.WARNING)
+        self.elected = elected
+        self.elected_at = None
+        self.released = threading.Event()
+
+    def leader_function(self):
+        self.take_leadership()
+        self.elected_at = time.time()
+        self.elected.put(self)
+        self.released.wait()
+
+    def contend(self):
+        try:
+            self.zk_run_election()
+        except Exception:
+            # The leader's session is closed under it to simulate its death
+            pass
+
+class CoordinationBenchmark(Benchmark):
+
+    def __init__(self, zookeeper_hosts=['127.0.0.1:2181'], watchers=[1, 10, 100, 500],
+        contenders=[2, 5, 20, 50], changes=5, failovers=5, failover_watchers=10):
+        """ Constructor
+        args:
+        - zookeeper_hosts (list) - ZooKeeper ensemble to use
+        - watchers (list) - subscriber counts for the watch latency
+        - contenders (list) - broker counts for the election and failover
+        - changes (int) - /broker writes timed per watcher count
+        - failovers (int) - leader deaths timed per contender count (at most contenders - 1)
+        - failover_watchers (int) - subscribers following /broker during the failovers
+        """
+        super().__init__(name='COORDINATION-BENCH')
+        self.zookeeper_hosts = zookeeper_hosts
+        self.watchers = watchers
+        self.contenders = contenders
+        self.changes = changes
+        self.failovers = failovers
+        self.failover_watchers = failover_watchers
+        self.namespace = f'benchmark-coordination-{uuid.uuid4().hex[:8]}'
+
+    def start_subscribers(self, count, seen, changed):
+        """ Start count subscribers following /broker, a session each; seen[i] gets
+        (value, time) of the last change subscriber i saw """
+        def listener(index):
+            def broker_changed(data, stat, event):
+                with changed:
+                    seen[index] = (data, time.time())
+                    changed.notify_all()
+            return broker_changed
+        subscribers = []
+        for i in range(count):
+            subscriber = Subscriber(topics=['A'], zookeeper_hosts=self.zookeeper_hosts,
+                zk_namespace=self.namespace)
+            subscriber.logger.setLevel(logging.WARNING)
+            subscriber.share_zk_session = False
+            subscriber.connect_zk()
+            subscriber.start_session()
+            subscriber.get_znode_value()
+            subscriber.watch_znode(subscriber.zk_name, listener(i))
+            subscribers.append(subscriber)
+        return subscribers
+
+    def wait_seen(self, seen, changed, count, value, timeout=30):
+        """ Wait until count subscribers saw value; return the times they saw it """
+        with changed:
+            while sum(1 for data, _ in seen.values() if data == value) < count:
+                if not changed.wait(timeout):
+                    raise RuntimeError(f'Subscribers did not see {value} within {timeout}s')
+            return [at for data, at in seen.values() if data == value]
+
+    def ops(self, clients):
+        return sum(client.get_zk_op_stats()['total'] for client in clients)
+
+    def watch_latency(self, admin, count):
+        """ Time /broker writes until every one of count subscribers saw them """
+        seen = {}
+        changed = threading.Condition()
+        subscribers = self.start_subscribers(count, seen, changed)
+        startup_ops = self.ops(subscribers)
+        latencies = []
+        for change in range(self.changes):
+            value = f'10.0.{change}.{count % 250},5555,5556'.encode('utf-8')
+            written = time.time()
+            admin.set_znode('/broker', value)
+            latencies += [at - written for at in self.wait_seen(seen, changed, count, value)]
+        for subscriber in subscribers:
+            subscriber.stop_session()
+        return {
+            'startup_ops_per_subscriber': startup_ops / count,
+            'notification_latency': self.summarize_latencies(latencies)
+        }
+
+    def election(self, count):
+        """ Elect a leader among count brokers, then kill leaders one after another """
+        seen = {}
+        changed = threading.Condition()
+        subscribers = self.start_subscribers(self.failover_watchers, seen, changed)
+        elected = queue.Queue()
+        contenders = []
+        for i in range(count):
+            contender = ElectionContender(elected, zookeeper_hosts=self.zookeeper_hosts,
+                zk_namespace=self.namespace, pub_reg_port=10000 + 2 * i, sub_reg_port=10001 + 2 * i)
+            contender.connect_zk()
+            contender.start_session()
+            contenders.append(contender)
+        started = time.time()
+        threads = [threading.Thread(target=contender.contend, daemon=True) for contender in contenders]
+        for thread in threads:
+            thread.start()
+        leader = elected.get(timeout=60)
+        first_leader = leader.elected_at - started
+        startup_ops = self.ops(contenders)
+        failovers = []
+        for _ in range(min(self.failovers, count - 1)):
+            watcher_ops = self.ops(subscribers)
+            contender_ops = self.ops(contender for contender in contenders if contender is not leader)
+            died = time.time()
+            # Leader death: its session, election lock and /broker znode are gone
+            leader.zk_session.zk.stop()
+            leader.released.set()
+            successor = elected.get(timeout=60)
+            value = successor.znode_value.encode('utf-8')
+            noticed = self.wait_seen(seen, changed, len(subscribers), value)
+            failovers.append({
+                'new_leader_seconds': successor.elected_at - died,
+                'subscribers_seconds': max(noticed) - died,
+                'ops_per_subscriber': (self.ops(subscribers) - watcher_ops) / len(subscribers),
+                'ops_per_contender': (self.ops(contender for contender in contenders
+                    if contender is not leader) - contender_ops) / (len(contenders) - 1)
+            })
+            leader = successor
+        leader.released.set()
+        for client in subscribers + contenders:
+            client.stop_session()
+        return {
+            'first_leader_seconds': first_leader,
+            'startup_ops_per_contender': startup_ops / count,
+            'failovers': failovers,
+            'new_leader': self.summarize_latencies([f['new_leader_seconds'] for f in failovers]),
+            'subscribers_noticed': self.summarize_latencies([f['subscribers_seconds'] for f in failovers])
+        }
+
+    def run(self):
+        """ Run every part of the suite in a fresh namespace """
+        admin = ZookeeperSession(kazoo_client(','.join(self.zookeeper_hosts) + f'/{self.namespace}'))
+        admin.start()
+        admin.zk.ensure_path('/broker')
+        results = {'namespace': self.namespace, 'changes': self.changes,
+            'failover_watchers': self.failover_watchers, 'watch': {}, 'election': {}}
+        try:
+            for count in self.watchers:
+                stats = results['watch'][count] = self.watch_latency(admin, count)
+                latency = stats['notification_latency']
+                self.info(f"{count:>4} watchers: notification p50 {latency['p50'] * 1000:.1f} ms "
+                    f"p99 {latency['p99'] * 1000:.1f} ms max {latency['max'] * 1000:.1f} ms, "
+                    f"{stats['startup_ops_per_subscriber']:.1f} startup ops per subscriber")
+            # Elections start from an empty /broker
+            admin.zk.delete('/broker')
+            for count in self.contenders:
+                stats = results['election'][count] = self.election(count)
+                summary = (f"{count:>4} contenders: first leader after {stats['first_leader_seconds'] * 1000:.1f} ms, "
+                    f"{stats['startup_ops_per_contender']:.1f} startup ops per contender")
+                if stats['failovers']:
+                    summary += (f", failover p50 {stats['new_leader']['p50'] * 1000:.1f} ms to the new "
+                        f"/broker, {stats['subscribers_noticed']['p50'] * 1000:.1f} ms until "
+                        f"{self.failover_watchers} subscribers saw it, "
+                        f"{stats['failovers'][0]['ops_per_subscriber']:.1f} ops per subscriber, "
+                        f"{stats['failovers'][0]['ops_per_contender']:.1f} per contender")
+                self.info(summary)
+        finally:
+            admin.release()
+            root = kazoo_client(','.join(self.zookeeper_hosts))
+            root.start(timeout=10)
+            root.delete(f'/{self.namespace}', recursive=True)
+            root.stop()
+            root.close()
+        return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Watch latency, election time, failover time and operations of the ZooKeeper coordination')
+    parser.add_argument('--zookeeper_hosts', type=str, action='append',
+        help='ZooKeeper host:port; repeat for an ensemble (default 127.0.0.1:2181)')
+    parser.add_argument('--watchers', type=int, action='append',
+        help='subscriber count for the watch latency; repeat for several (default 1 10 100 500)')
+    parser.add_argument('--contenders', type=int, action='append',
+        help='broker count for election and failover; repeat for several (default 2 5 20 50)')
+    parser.add_argument('--changes', type=int, default=5, help='/broker writes timed per watcher count')
+    parser.add_argument('--failovers', type=int, default=5, help='leader deaths timed per contender count')
+    parser.add_argument('--failover_watchers', type=int, default=10,
+        help='subscribers following /broker during the failovers')
+    parser.add_argument('--output', type=str, help='optional JSON file for the results')
+    args = parser.parse_args()
+    benchmark = CoordinationBenchmark(
+        zookeeper_hosts=args.zookeeper_hosts or ['127.0.0.1:2181'],
+        watchers=args.watchers or [1, 10, 100, 500],
+        contenders=args.contenders or [2, 5, 20, 50],
+        changes=args.changes,
+        failovers=args.failovers,
+        failover_watchers=args.failover_watchers
+    )
+    benchmark.write_results(benchmark.run(), args.output)
@@ -0,0 +1,170 @@
+""" Benchmark of publisher discovery in decentralized mode, through the broker and
+through the ZooKeeper topic directory, for growing numbers of subscribers:
+- broker: a publisher registration makes the broker (Broker.notify_subscribers)
+  notify every subscriber in turn over its REQ/REP notify socket. The subscribers'
+  REP sockets are answered by a separate process.
+- directory: the publisher creates its ephemeral znode (advertise_publisher) and
+  every subscriber's TopicDirectory watch reports it. Needs a running ZooKeeper
+  server, or --zookeeper_hosts memory://<name> for the in-memory ensemble;
+  skipped otherwise.
+Measured per mode: discovery latency (until the last subscriber knows the
+publisher) and broker time spent on the registration.
+
+Run from the src directory:
+    python3 -m performance_tests.benchmarks.discovery --subscribers 10 --subscribers 100 --subscribers 1000 --output discovery.json
+"""
+import argparse
+import logging
+import multiprocessing
+import threading
+import time
+import zmq
+from lib.broker import Broker
+from lib.topic_directory import TopicDirectory, advertise_publisher, publishers_path
+from lib.zookeeper_client import kazoo_client
+from .common import Benchmark
+
+def answer_notifications(ports, rounds, conn):
+    """ Subscriber process: a REP socket per notify port; after each round of
+    notifications report to conn when the last subscriber received it """
+    context = zmq.Context()
+    poller = zmq.Poller()
+    sockets = []
+    for port in ports:
+        socket = context.socket(zmq.REP)
+        socket.connect(f'tcp://127.0.0.1:{port}')
+        poller.register(socket, zmq.POLLIN)
+        sockets.append(socket)
+    conn.send('ready')
+    for _ in range(rounds):
+        received = 0
+        while received < len(sockets):
+            for socket, _ in poller.poll():
+                socket.recv_string()
+                socket.send_string("Notification Acknowledged. New publishers added.")
+                received += 1
+        conn.send(time.time())
+    context.destroy(linger=0)
+
+class DiscoveryBenchmark(Benchmark):
+
+    def __init__(self, subscriber_counts=[10, 100, 1000], rounds=5, zookeeper_hosts=['127.0.0.1:2181']):
+        """ Constructor
+        args:
+        - subscriber_counts (list) - numbers of subscribers to measure discovery for
+        - rounds (int) - publisher registrations measured per count
+        - zookeeper_hosts (list) - ZooKeeper ensemble for the directory mode
+        """
+        super().__init__(name='DISCOVERY-BENCH')
+        self.subscriber_counts = subscriber_counts
+        self.rounds = rounds
+        self.zookeeper_hosts = zookeeper_hosts
+
+    def run_broker(self, subscribers):
+        """ Time Broker.notify_subscribers for a new publisher with subscribers notify sockets """
+        broker = Broker(centralized=False)
+        broker.logger.setLevel(logging.WARNING)
+        broker.context = zmq.Context()
+        ports = []
+        for i in range(subscribers):
+            socket = broker.notify_sub_sockets[i] = broker.context.socket(zmq.REQ)
+            ports.append(socket.bind_to_random_port('tcp://127.0.0.1'))
+        parent, child = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=answer_notifications, args=(ports, self.rounds, child))
+        process.start()
+        parent.recv()
+        latencies = []
+        broker_seconds = []
+        for i in range(self.rounds):
+            started = time.time()
+            broker.notify_subscribers(['A'], pub_address=f'127.0.0.1:{6000 + i}')
+            broker_seconds.append(time.time() - started)
+            latencies.append(parent.recv() - started)
+        process.join()
+        broker.context.destroy(linger=0)
+        return {'latency': self.summarize_latencies(latencies),
+            'broker_seconds': self.summarize_latencies(broker_seconds)}
+
+    def run_directory(self, zk, subscribers):
+        """ Time from a publisher's advertisement until every subscriber's directory saw it """
+        topic = f'discovery-benchmark-{time.time()}'
+        seen = {}
+        changed = threading.Condition()
+        def listener(index):
+            def publishers_changed(topic, added, removed):
+                with changed:
+                    seen[index] = added
+                    changed.notify_all()
+            return publishers_changed
+        directories = [TopicDirectory(zk, [topic], listener(i)) for i in range(subscribers)]
+        for directory in directories:
+            directory.watch()
+        latencies = []
+        publisher = kazoo_client(','.join(self.zookeeper_hosts))
+        publisher.start(timeout=10)
+        try:
+            for i in range(self.rounds):
+                address = f'127.0.0.1:{6000 + i}'
+                started = time.time()
+                advertise_publisher(publisher, topic, address)
+                with changed:
+                    while sum(1 for added in seen.values() if address in added) < subscribers:
+                        if not changed.wait(30):
+                            raise RuntimeError('Subscribers did not see the publisher within 30s')
+                latencies.append(time.time() - started)
+        finally:
+            for directory in directories:
+                directory.stop()
+            publisher.stop()
+            publisher.close()
+            zk.delete(publishers_path(topic).rsplit('/', 1)[0], recursive=True)
+        return {'latency': self.summarize_latencies(latencies), 'broker_seconds': None}
+
+    def connect_zookeeper(self):
+        """ Return a started client of the ensemble, or None if it is not reachable """
+        zk = kazoo_client(','.join(self.zookeeper_hosts))
+        try:
+            zk.start(timeout=5)
+            return zk
+        except Exception:
+            zk.close()
+            self.info(f"ZooKeeper not reachable at {self.zookeeper_hosts}; skipping the directory mode")
+            return None
+
+    def run(self):
+        """ Compare broker and directory discovery for every subscriber count """
+        zk = self.connect_zookeeper()
+        results = {'rounds': self.rounds, 'runs': {}}
+        try:
+            for subscribers in self.subscriber_counts:
+                modes = results['runs'][subscribers] = {'broker': self.run_broker(subscribers)}
+                if zk is not None:
+                    modes['directory'] = self.run_directory(zk, subscribers)
+                for mode, stats in modes.items():
+                    broker = (f"broker busy p50 {stats['broker_seconds']['p50'] * 1000:.1f} ms"
+                        if stats['broker_seconds'] else "broker not involved")
+                    self.info(f"{subscribers:>5} subscribers {mode:<9} discovery "
+                        f"p50 {stats['latency']['p50'] * 1000:.1f} ms max {stats['latency']['max'] * 1000:.1f} ms, "
+                        f"{broker}")
+        finally:
+            if zk is not None:
+                zk.stop()
+                zk.close()
+        return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Publisher discovery latency and broker load via the broker and via the topic directory')
+    parser.add_argument('--subscribers', type=int, action='append',
+        help='number of subscribers; repeat for several (default 10, 100 and 1000)')
+    parser.add_argument('--rounds', type=int, default=5, help='publisher registrations measured per count')
+    parser.add_argument('--zookeeper_hosts', type=str, action='append',
+        help='ZooKeeper host:port for the directory mode; repeat for an ensemble (default 127.0.0.1:2181)')
+    parser.add_argument('--output', type=str, help='optional JSON file for the results')
+    args = parser.parse_args()
+    benchmark = DiscoveryBenchmark(
+        subscriber_counts=args.subscribers or [10, 100, 1000],
+        rounds=args.rounds,
+        zookeeper_hosts=args.zookeeper_hosts or ['127.0.0.1:2181']
+    )
+    benchmark.write_results(benchmark.run(), args.output)
@@ -0,0 +1,342 @@
+""" Micro-benchmarks of the per-message hot paths, to catch regressions before
+they reach a Mininet run:
+- Publisher.generate_publish_event, without and with a 1 KiB payload
+- Broker.send: one event from a publisher's receive socket to the topic's PUB socket
+- Subscriber.parse_publish_event: one event from a socket into received_message_list
+- Subscriber.write_stored_messages, per message written
+- serialization of an event (dumps then loads) with pickle (what the entities
+  use), JSON and a fixed binary layout (struct)
+
+Each case runs in samples of n operations, with n calibrated so a sample takes at
+least --min_time seconds, and the garbage collector off as in timeit. After a
+warm-up sample, --repeats samples are timed. Reported per case are the median
+ns/op with a 95% confidence interval (distribution-free, from the order
+statistics of the samples), the minimum and the spread. Allocations are measured
+in a separate pass under tracemalloc, which slows the code down:
+- peak_bytes_per_op - peak of the memory traced during one operation, averaged
+- retained_blocks_per_op - blocks still allocated after the pass, per operation
+  (e.g. the record parse_publish_event appends)
+
+With --save_baseline the results are stored as a baseline. With --baseline the
+results are compared with a stored baseline. A case regresses in any of these cases:
+- both the lower bound of its ns/op confidence interval and its fastest sample
+  exceed the baseline's median and fastest sample by more than --threshold
+  (the machine's speed drifts between runs, more than within one)
+- its peak bytes per operation exceed the baseline by more than --threshold
+- it retains at least one more block per operation
+Then the exit status is 1. Baselines only compare within one machine and Python
+version, so every machine stores its own. unit_tests/test_hot_paths.py runs the
+comparison alongside the unit tests when HOT_PATHS_BASELINE names a baseline file.
+
+Run from the src directory:
+    python3 -m performance_tests.benchmarks.hot_paths --save_baseline hot_paths_baseline.json
+    python3 -m performance_tests.benchmarks.hot_paths --baseline hot_paths_baseline.json
+"""
+import argparse
+import gc
+import json
+import logging
+import math
+import os
+import pickle
+import platform
+import statistics
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+import zmq
+from lib.broker import Broker
+from lib.publisher import Publisher
+from lib.subscriber import Subscriber
+from .common import Benchmark
+
+# Publisher address, publish time and topic, as in the events the entities send
+EVENT_HEADER = struct.Struct('!dHH')
+
+def encode_binary(event):
+    """ Fixed binary layout of an event: publish time, the lengths of the publisher
+    and the topic, then both as UTF-8 """
+    publisher = event['publisher'].encode('utf8')
+    topic = event['topic'].encode('utf8')
+    return EVENT_HEADER.pack(event['publish_time'], len(publisher), len(topic)) + publisher + topic
+
+def decode_binary(data):
+    """ Inverse of encode_binary """
+    publish_time, publisher_length, topic_length = EVENT_HEADER.unpack_from(data)
+    start = EVENT_HEADER.size
+    return {
+        'publisher': data[start:start + publisher_length].decode('utf8'),
+        'publish_time': publish_time,
+        'topic': data[start + publisher_length:start + publisher_length + topic_length].decode('utf8')
+    }
+
+def quiet(entity):
+    """ Keep an entity's logging out of the measurements """
+    entity.logger.setLevel(logging.WARNING)
+    return entity
+
+class Case:
+    """ A hot path: prepare(n) sets up n operations outside the timing, run(n) performs them """
+
+    def __init__(self, name, run, prepare=None, close=None):
+        self.name = name
+        self.run = run
+        self.prepare = prepare or (lambda n: None)
+        self.close = close or (lambda: None)
+
+def publisher_case(name, payload_size=0):
+    publisher = quiet(Publisher(topics=['A', 'B'], payload_size=payload_size))
+    def run(n):
+        for i in range(n):
+            publisher.generate_publish_event(i)
+    return Case(name, run)
+
+def broker_send_case():
+    broker = quiet(Broker(centralized=True))
+    broker.context = zmq.Context()
+    publisher = broker.context.socket(zmq.PUSH)
+    publisher.setsockopt(zmq.SNDHWM, 0)
+    publisher.bind('inproc://hot-paths-broker-in')
+    receive_socket = broker.context.socket(zmq.PULL)
+    receive_socket.setsockopt(zmq.RCVHWM, 0)
+    receive_socket.connect('inproc://hot-paths-broker-in')
+    broker.receive_socket_dict['A'] = receive_socket
+    # No subscriber is connected, so the PUB socket drops after matching
+    broker.send_socket_dict['A'] = broker.create_send_socket('A')
+    broker.send_socket_dict['A'].bind('inproc://hot-paths-broker-out')
+    event = quiet(Publisher(topics=['A'])).generate_publish_event()
+    def prepare(n):
+        for _ in range(n):
+            publisher.send_multipart(event)
+        receive_socket.poll(1000)
+    def run(n):
+        for _ in range(n):
+            if not broker.send('A'):
+                raise RuntimeError('Broker.send found no message')
+    def close():
+        broker.context.destroy(linger=0)
+    return Case('broker_send', run, prepare, close)
+
+def subscriber_parse_case():
+    subscriber = quiet(Subscriber(topics=['A']))
+    context = zmq.Context()
+    publisher = context.socket(zmq.PUSH)
+    publisher.setsockopt(zmq.SNDHWM, 0)
+    publisher.bind('inproc://hot-paths-subscriber')
+    subscriber.sub_socket_dict['A'] = context.socket(zmq.PULL)
+    subscriber.sub_socket_dict['A'].setsockopt(zmq.RCVHWM, 0)
+    subscriber.sub_socket_dict['A'].connect('inproc://hot-paths-subscriber')
+    generator = quiet(Publisher(topics=['A']))
+    def prepare(n):
+        subscriber.received_message_list.clear()
+        for i in range(n):
+            publisher.send_multipart(generator.generate_publish_event(i))
+        subscriber.sub_socket_dict['A'].poll(1000)
+    def run(n):
+        for _ in range(n):
+            subscriber.parse_publish_event('A')
+    def close():
+        context.destroy(linger=0)
+    return Case('subscriber_parse', run, prepare, close)
+
+def subscriber_write_case():
+    directory = tempfile.TemporaryDirectory()
+    subscriber = quiet(Subscriber(topics=['A'], filename=os.path.join(directory.name, 'data.csv')))
+    def prepare(n):
+        subscriber.received_message_list = [
+            {'publisher': '10.0.0.1:6000', 'topic': 'A', 'total_time_seconds': 0.000123 + i * 1e-9}
+            for i in range(n)]
+    def run(n):
+        subscriber.write_stored_messages()
+    return Case('subscriber_write_per_message', run, prepare, directory.cleanup)
+
+def serialization_case(name, dumps, loads):
+    event = {'publisher': '10.0.0.1:6000', 'publish_time': time.time(), 'topic': 'A'}
+    def run(n):
+        for _ in range(n):
+            loads(dumps(event))
+    return Case(name, run)
+
+def cases():
+    """ Return every hot path case """
+    return [
+        publisher_case('publisher_generate'),
+        publisher_case('publisher_generate_1k_payload', payload_size=1024),
+        broker_send_case(),
+        subscriber_parse_case(),
+        subscriber_write_case(),
+        serialization_case('serialize_pickle', pickle.dumps, pickle.loads),
+        serialization_case('serialize_json', lambda event: json.dumps(event).encode('utf8'), json.loads),
+        serialization_case('serialize_binary', encode_binary, decode_binary)
+    ]
+
+class HotPathBenchmark(Benchmark):
+
+    def __init__(self, repeats=15, min_time=0.02, allocation_ops=1000, only=None):
+        """ Constructor
+        args:
+        - repeats (int) - timed samples per case
+        - min_time (float) - seconds a sample takes at least; sets the operations per sample
+        - allocation_ops (int) - operations of the tracemalloc pass
+        - only (list) - names of the cases to run (default all)
+        """
+        super().__init__(name='HOT-PATH-BENCH')
+        self.repeats = repeats
+        self.min_time = min_time
+        self.allocation_ops = allocation_ops
+        self.only = only
+
+    def sample(self, case, n):
+        """ Seconds case takes for n operations """
+        case.prepare(n)
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            case.run(n)
+            return time.perf_counter() - started
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def calibrate(self, case):
+        """ Operations per sample for a sample to take at least min_time """
+        n = 1
+        while True:
+            elapsed = self.sample(case, n)
+            if elapsed >= self.min_time:
+                return n
+            # Aim a little above min_time, at most 10 times as many
+            n = max(n + 1, min(n * 10, int(n * 1.2 * self.min_time / max(elapsed, 1e-9))))
+
+    @staticmethod
+    def median_interval(sorted_values):
+        """ 95% confidence interval of the median from the order statistics of the
+        samples (normal approximation of the binomial); no assumption on their distribution """
+        count = len(sorted_values)
+        half_width = 1.96 * math.sqrt(count) / 2
+        lower = max(0, math.floor(count / 2 - half_width))
+        upper = min(count - 1, math.ceil(count / 2 + half_width) - 1)
+        return sorted_values[lower], sorted_values[upper]
+
+    def allocations(self, case):
+        """ Peak traced bytes per operation and blocks retained per operation """
+        n = self.allocation_ops
+        case.prepare(n)
+        tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            peaks = 0
+            if case.name == 'subscriber_write_per_message':
+                # One call writes all n messages
+                current, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                case.run(n)
+                peaks = tracemalloc.get_traced_memory()[1] - current
+            else:
+                for _ in range(n):
+                    current, _ = tracemalloc.get_traced_memory()
+                    tracemalloc.reset_peak()
+                    case.run(1)
+                    peaks += tracemalloc.get_traced_memory()[1] - current
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        retained = sum(stat.count_diff for stat in
+            after.filter_traces(filters).compare_to(before.filter_traces(filters), 'filename'))
+        return peaks / n, retained / n
+
+    def run_case(self, case):
+        n = self.calibrate(case)
+        # Warm-up
+        self.sample(case, n)
+        per_op = sorted(self.sample(case, n) / n * 1e9 for _ in range(self.repeats))
+        lower, upper = self.median_interval(per_op)
+        median = statistics.median(per_op)
+        peak_bytes, retained_blocks = self.allocations(case)
+        result = {
+            'ops_per_sample': n,
+            'samples': self.repeats,
+            'ns_per_op': median,
+            'ns_per_op_ci95': [lower, upper],
+            'min_ns_per_op': per_op[0],
+            'spread': (per_op[-1] - per_op[0]) / median,
+            'peak_bytes_per_op': peak_bytes,
+            'retained_blocks_per_op': retained_blocks
+        }
+        self.info(f"{case.name}: {median:.0f} ns/op (95% CI {lower:.0f}-{upper:.0f}, min {per_op[0]:.0f}, "
+            f"spread {result['spread'] * 100:.0f}%), {peak_bytes:.0f} peak bytes/op, "
+            f"{retained_blocks:.2f} retained blocks/op")
+        return result
+
+    def run(self):
+        results = {}
+        for case in cases():
+            try:
+                if self.only is None or case.name in self.only:
+                    results[case.name] = self.run_case(case)
+            finally:
+                case.close()
+        return {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'repeats': self.repeats,
+            'min_time': self.min_time,
+            'cases': results
+        }
+
+    def compare(self, results, baseline, threshold=0.2):
+        """ Return the regressions of results against baseline, as messages
+        args:
+        - results (dict) - output of run()
+        - baseline (dict) - output of run() stored earlier
+        - threshold (float) - tolerated relative increase, e.g. 0.2 for 20%
+        """
+        if baseline.get('python') != results.get('python'):
+            self.info(f"Baseline is from Python {baseline.get('python')}, this is {results.get('python')}")
+        regressions = []
+        for name, result in results['cases'].items():
+            base = baseline['cases'].get(name)
+            if base is None:
+                self.info(f'{name}: no baseline')
+                continue
+            # Both the whole confidence interval of the median and the fastest sample must
+            # be above the tolerance: on a shared machine the speed drifts between runs
+            if (result['ns_per_op_ci95'][0] > base['ns_per_op'] * (1 + threshold) and
+                result['min_ns_per_op'] > base['min_ns_per_op'] * (1 + threshold)):
+                regressions.append(f"{name}: {result['ns_per_op']:.0f} ns/op, baseline {base['ns_per_op']:.0f}")
+            if result['peak_bytes_per_op'] > base['peak_bytes_per_op'] * (1 + threshold):
+                regressions.append(f"{name}: {result['peak_bytes_per_op']:.0f} peak bytes/op, "
+                    f"baseline {base['peak_bytes_per_op']:.0f}")
+            if result['retained_blocks_per_op'] >= base['retained_blocks_per_op'] + 1:
+                regressions.append(f"{name}: {result['retained_blocks_per_op']:.2f} retained blocks/op, "
+                    f"baseline {base['retained_blocks_per_op']:.2f}")
+        for regression in regressions:
+            self.error(f'Regression of more than {threshold * 100:.0f}%: {regression}')
+        return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ns/op and allocations/op of the per-message hot paths')
+    parser.add_argument('--repeats', type=int, default=15, help='timed samples per case')
+    parser.add_argument('--min_time', type=float, default=0.02, help='seconds a sample takes at least')
+    parser.add_argument('--allocation_ops', type=int, default=1000, help='operations of the tracemalloc pass')
+    parser.add_argument('--only', type=str, action='append', help='case to run; repeat (default all)')
+    parser.add_argument('--baseline', type=str, help='baseline file to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='tolerated relative regression')
+    parser.add_argument('--save_baseline', type=str, help='store the results as a baseline file')
+    parser.add_argument('--output', type=str, help='optional JSON file for the results')
+    args = parser.parse_args()
+    benchmark = HotPathBenchmark(repeats=args.repeats, min_time=args.min_time,
+        allocation_ops=args.allocation_ops, only=args.only)
+    results = benchmark.run()
+    benchmark.write_results(results, args.output)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        benchmark.write_results(results, args.save_baseline)
+    if args.baseline:
+        with open(args.baseline) as f:
+            if benchmark.compare(results, json.load(f), args.threshold):
+                sys.exit(1)
@@ -0,0 +1,142 @@
+""" Benchmark of the framework's own per-message cost: a whole system (broker,
+publishers, subscribers) runs as a local cluster (see lib/local_cluster.py), in
+one process over inproc:// with an in-memory ZooKeeper, so neither the network
+nor a ZooKeeper server adds to the numbers. Measured for centralized dissemination
+(through the broker) and direct dissemination (publishers to subscribers), over
+several runs each:
+- end-to-end latency of every event (p50/p99/p999/max)
+- delivery throughput and time per delivered event
+- spread of the throughput between runs, to see how repeatable the numbers are
+With --profile the entities are profiled and the functions with the most own
+time are reported per mode.
+
+Publishers publish as fast as they can (no sleep between events), so the
+latencies include the queueing of a saturated system; every entity shares the
+one interpreter, so the numbers are those of the framework on one core.
+
+Run from the src directory:
+    python3 -m performance_tests.benchmarks.local_cluster --events 10000 --output local_cluster.json
+"""
+import argparse
+import io
+import statistics
+from lib.local_cluster import LocalCluster
+from .common import Benchmark
+
+MODES = {'centralized': True, 'direct': False}
+
+class LocalClusterBenchmark(Benchmark):
+
+    def __init__(self, publishers=1, subscribers=1, events=10000, runs=3, profile=False, timeout=60.0):
+        """ Constructor
+        args:
+        - publishers (int) - publishers of the cluster
+        - subscribers (int) - subscribers of the cluster
+        - events (int) - events each publisher publishes per run
+        - runs (int) - runs per mode
+        - profile (boolean) - whether to profile the entities and report the costliest functions
+        - timeout (float) - upper bound in seconds of each stage of a run
+        """
+        super().__init__(name='LOCAL-CLUSTER-BENCH')
+        self.publishers = publishers
+        self.subscribers = subscribers
+        self.events = events
+        self.runs = runs
+        self.profile = profile
+        self.timeout = timeout
+
+    def run_mode(self, mode):
+        """ Run the cluster self.runs times with one dissemination mode """
+        latencies = []
+        throughputs = []
+        delivered = 0
+        expected = 0
+        stats = None
+        for run in range(self.runs):
+            cluster = LocalCluster(publishers=self.publishers, subscribers=self.subscribers,
+                max_event_count=self.events, sleep_period=0.0, centralized=MODES[mode],
+                timeout=self.timeout, profile=self.profile, quiet=True)
+            elapsed = cluster.run()
+            delivered += cluster.received_count()
+            expected += cluster.expected_count()
+            latencies.extend(cluster.latencies())
+            if elapsed is not None:
+                throughputs.append(cluster.received_count() / elapsed)
+            if self.profile:
+                if stats is None:
+                    stats = cluster.profile_stats()
+                else:
+                    stats.add(cluster.profile_stats())
+        result = {
+            'delivered': delivered,
+            'expected': expected,
+            'complete_runs': len(throughputs),
+            'latency': self.summarize_latencies(latencies),
+            'throughput_per_second': statistics.median(throughputs) if throughputs else None,
+            'throughput_spread': ((max(throughputs) - min(throughputs)) / statistics.median(throughputs)
+                if throughputs else None),
+            'us_per_event': 1e6 / statistics.median(throughputs) if throughputs else None
+        }
+        if stats is not None:
+            result['profile'] = self.top_functions(stats)
+        self.report(mode, result)
+        return result
+
+    def top_functions(self, stats, count=15):
+        """ Return the functions with the most own time, and print them """
+        stream = io.StringIO()
+        stats.stream = stream
+        stats.sort_stats('tottime').print_stats(count)
+        self.info(f'Profile:\n{stream.getvalue()}')
+        top = []
+        for function in stats.fcn_list[:count]:
+            calls, _, own, cumulative, _ = stats.stats[function]
+            top.append({
+                'function': f'{function[0]}:{function[1]}({function[2]})',
+                'calls': calls,
+                'tottime': own,
+                'cumtime': cumulative
+            })
+        return top
+
+    def report(self, mode, result):
+        latency = result['latency']
+        if result['throughput_per_second'] is None:
+            self.error(f"{mode}: no run completed; {result['delivered']} of {result['expected']} delivered")
+            return
+        self.info(f"{mode}: {result['delivered']}/{result['expected']} delivered, "
+            f"{result['throughput_per_second']:.0f} events/s ({result['us_per_event']:.1f} us/event, "
+            f"spread {result['throughput_spread'] * 100:.0f}%), latency p50 {latency['p50'] * 1000:.2f} ms "
+            f"p99 {latency['p99'] * 1000:.2f} ms p999 {latency['p999'] * 1000:.2f} ms "
+            f"max {latency['max'] * 1000:.2f} ms")
+
+    def run(self):
+        return {
+            'publishers': self.publishers,
+            'subscribers': self.subscribers,
+            'events': self.events,
+            'runs': self.runs,
+            'modes': {mode: self.run_mode(mode) for mode in MODES}
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Per-message latency and throughput of the framework in a local in-process cluster')
+    parser.add_argument('--publishers', type=int, default=1, help='publishers of the cluster')
+    parser.add_argument('--subscribers', type=int, default=1, help='subscribers of the cluster')
+    parser.add_argument('--events', type=int, default=10000, help='events each publisher publishes per run')
+    parser.add_argument('--runs', type=int, default=3, help='runs per dissemination mode')
+    parser.add_argument('--profile', action='store_true',
+        help='profile the entities and report the functions with the most own time')
+    parser.add_argument('--timeout', type=float, default=60.0, help='upper bound in seconds of each stage of a run')
+    parser.add_argument('--output', type=str, help='optional JSON file for the results')
+    args = parser.parse_args()
+    benchmark = LocalClusterBenchmark(
+        publishers=args.publishers,
+        subscribers=args.subscribers,
+        events=args.events,
+        runs=args.runs,
+        profile=args.profile,
+        timeout=args.timeout
+    )
+    benchmark.write_results(benchmark.run(), args.output)
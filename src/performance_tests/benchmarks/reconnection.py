@@ -0,0 +1,172 @@
+""" Benchmark of client reconnection after a broker change: N clients (subscribers
+and publishers) register with a new centralized leader running the broker's real
+event loop (parse_events) over inproc:// sockets. Each client registers at the
+delay its ReconnectPolicy gives it after the change:
+- herd: every client at once (the behaviour without a policy)
+- jitter: a random delay of up to --jitter seconds
+- staged: jitter plus tiers, subscribers first and publishers --jitter seconds later
+Measured per mode: time until every client is registered again, peak number of
+registrations queued at the broker, time each registration waited for its reply,
+and publishers back before every subscriber of their topic (publishing into the void).
+
+Run from the src directory:
+    python3 -m performance_tests.benchmarks.reconnection --clients 1000 --output reconnection.json
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+import zmq
+from lib.broker import Broker
+from lib.reconnect import ReconnectPolicy, TIERS
+from .common import Benchmark
+
+class ReconnectionBenchmark(Benchmark):
+
+    def __init__(self, clients=1000, publisher_share=0.25, topics=10, jitter=1.0):
+        """ Constructor
+        args:
+        - clients (int) - clients reconnecting after the broker change
+        - publisher_share (float) - share of the clients that are publishers
+        - topics (int) - topics, spread evenly over the clients
+        - jitter (float) - reconnect jitter window and tier interval in seconds
+        """
+        super().__init__(name='RECONNECT-BENCH')
+        self.clients = clients
+        self.publishers = int(clients * publisher_share)
+        self.topics = [f'topic-{i}' for i in range(topics)]
+        self.jitter = jitter
+
+    def create_broker(self, context, run_name):
+        """ Create a centralized broker with its registration sockets bound to inproc endpoints """
+        broker = Broker(centralized=True)
+        broker.logger.setLevel(logging.WARNING)
+        broker.context = context
+        broker.poller = zmq.Poller()
+        broker.pub_reg_socket = context.socket(zmq.REP)
+        broker.pub_reg_socket.bind(f'inproc://{run_name}-pub-reg')
+        broker.sub_reg_socket = context.socket(zmq.REP)
+        broker.sub_reg_socket.bind(f'inproc://{run_name}-sub-reg')
+        broker.poller.register(broker.pub_reg_socket, zmq.POLLIN)
+        broker.poller.register(broker.sub_reg_socket, zmq.POLLIN)
+        return broker
+
+    def run_broker(self, broker, stop):
+        i = 0
+        while not stop.is_set():
+            i += 1
+            broker.parse_events(i)
+
+    def schedule(self, policy):
+        """ Return (due seconds after the change, role, client index, topic) per client """
+        clients = []
+        for i in range(self.clients):
+            role = 'pub' if i < self.publishers else 'sub'
+            delay = ReconnectPolicy(tier=TIERS[role], **policy).delay()
+            clients.append((delay, role, i, self.topics[i % len(self.topics)]))
+        return sorted(clients)
+
+    def run_once(self, run_name, policy):
+        """ Reconnect every client at its scheduled time and track the broker's queue """
+        context = zmq.Context()
+        broker = self.create_broker(context, run_name)
+        # One DEALER per role can have every registration of its clients in flight
+        sockets = {}
+        for role in ['pub', 'sub']:
+            sockets[role] = context.socket(zmq.DEALER)
+            sockets[role].setsockopt(zmq.SNDHWM, 0)
+            sockets[role].setsockopt(zmq.RCVHWM, 0)
+            sockets[role].connect(f'inproc://{run_name}-{role}-reg')
+        poller = zmq.Poller()
+        for socket in sockets.values():
+            poller.register(socket, zmq.POLLIN)
+        stop = threading.Event()
+        thread = threading.Thread(target=self.run_broker, args=(broker, stop))
+        thread.start()
+
+        clients = self.schedule(policy)
+        # key = client index, value = time sent / time registered
+        sent = {}
+        registered = {}
+        # Requests wait in order per socket, so replies come back in order per role
+        in_flight = {'pub': [], 'sub': []}
+        peak_queue = 0
+        changed = time.time()
+        next_client = 0
+        while len(registered) < len(clients):
+            now = time.time()
+            while next_client < len(clients) and changed + clients[next_client][0] <= now:
+                _, role, i, topic = clients[next_client]
+                message = {'address': f'10.1.{i // 250}.{i % 250}:5556', 'id': f'client-{i}', 'topics': [topic]}
+                sockets[role].send_multipart([b'', json.dumps(message).encode('utf8')])
+                sent[i] = time.time()
+                in_flight[role].append(i)
+                next_client += 1
+            peak_queue = max(peak_queue, len(sent) - len(registered))
+            timeout = 100
+            if next_client < len(clients):
+                timeout = max(0, min(timeout, (changed + clients[next_client][0] - time.time()) * 1000))
+            for socket, _ in poller.poll(timeout):
+                role = 'pub' if socket is sockets['pub'] else 'sub'
+                while True:
+                    try:
+                        socket.recv_multipart(zmq.NOBLOCK)
+                    except zmq.Again:
+                        break
+                    registered[in_flight[role].pop(0)] = time.time()
+            if time.time() - changed > 120:
+                self.error(f"{run_name}: clients not registered within 120s")
+                break
+        stop.set()
+        thread.join()
+        context.destroy(linger=0)
+
+        # Publishers registered while a subscriber of their topic was still away
+        last_subscriber = {}
+        for _, role, i, topic in clients:
+            if role == 'sub' and i in registered:
+                last_subscriber[topic] = max(last_subscriber.get(topic, 0), registered[i])
+        early_publishers = sum(1 for _, role, i, topic in clients
+            if role == 'pub' and i in registered and registered[i] < last_subscriber.get(topic, 0))
+        return {
+            'recovery_seconds': max(registered.values()) - changed if registered else None,
+            'peak_queue': peak_queue,
+            'registration_wait': self.summarize_latencies([registered[i] - sent[i] for i in registered]),
+            'publishers_before_subscribers': early_publishers
+        }
+
+    def run(self):
+        """ Compare the herd with jittered and staged reconnection """
+        results = {'clients': self.clients, 'publishers': self.publishers,
+            'topics': len(self.topics), 'jitter': self.jitter, 'runs': {}}
+        modes = {
+            'herd': {},
+            'jitter': {'jitter': self.jitter},
+            'staged': {'jitter': self.jitter, 'tier_interval': self.jitter}
+        }
+        for run_name, policy in modes.items():
+            stats = results['runs'][run_name] = self.run_once(run_name, policy)
+            wait = stats['registration_wait']
+            self.info(f"{run_name:<7} recovery {stats['recovery_seconds']:.2f}s, peak queue {stats['peak_queue']}, "
+                f"registration wait p50 {wait['p50'] * 1000:.1f} ms p99 {wait['p99'] * 1000:.1f} ms, "
+                f"{stats['publishers_before_subscribers']} publishers back before their subscribers")
+        return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Recovery time and broker queue depth of clients reconnecting after a broker change')
+    parser.add_argument('--clients', type=int, default=1000, help='clients reconnecting')
+    parser.add_argument('--publisher_share', type=float, default=0.25, help='share of clients that are publishers')
+    parser.add_argument('--topics', type=int, default=10, help='topics spread over the clients')
+    parser.add_argument('--jitter', type=float, default=1.0,
+        help='reconnect jitter window, and tier interval of the staged run, in seconds')
+    parser.add_argument('--output', type=str, help='optional JSON file for the results')
+    args = parser.parse_args()
+    benchmark = ReconnectionBenchmark(
+        clients=args.clients,
+        publisher_share=args.publisher_share,
+        topics=args.topics,
+        jitter=args.jitter
+    )
+    benchmark.write_results(benchmark.run(), args.output)
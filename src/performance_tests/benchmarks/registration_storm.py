@@ -0,0 +1,175 @@
+""" Benchmark of forwarding latency on an established topic while a storm of
+subscriber registrations hits a centralized broker. Runs the broker's real event
+loop (parse_events) in one process over inproc:// sockets, once without admission
+control and once with a client limit and a capped control-plane time share.
+
+Run from the src directory:
+    python3 -m performance_tests.benchmarks.registration_storm --registrations 10000 --output storm.json
+"""
+import argparse
+import json
+import pickle
+import threading
+import time
+import zmq
+from lib.broker import Broker
+from .common import Benchmark
+
+class RegistrationStormBenchmark(Benchmark):
+
+    def __init__(self, registrations=10000, rate=200, max_clients=100, control_share=0.2,
+        retry_after=1.0):
+        """ Constructor
+        args:
+        - registrations (int) - number of registration requests in the storm
+        - rate (int) - messages per second published on the forwarding topic
+        - max_clients (int) - client limit of the admission controlled run
+        - control_share (float) - control-plane time share of the admission controlled run
+        - retry_after (float) - retry hint sent with rejections
+        """
+        super().__init__(name='STORM-BENCH')
+        self.registrations = registrations
+        self.rate = rate
+        self.max_clients = max_clients
+        self.control_share = control_share
+        self.retry_after = retry_after
+
+    def create_broker(self, context, run_name, **admission):
+        """ Create a centralized broker forwarding one topic, with its subscriber
+        registration socket bound to an inproc endpoint """
+        broker = Broker(centralized=True, **admission)
+        broker.logger.setLevel('WARNING')
+        broker.context = context
+        broker.poller = zmq.Poller()
+        broker.pub_reg_socket = context.socket(zmq.REP)
+        broker.pub_reg_socket.bind(f'inproc://{run_name}-pub-reg')
+        broker.sub_reg_socket = context.socket(zmq.REP)
+        broker.sub_reg_socket.bind(f'inproc://{run_name}-sub-reg')
+        broker.poller.register(broker.pub_reg_socket, zmq.POLLIN)
+        broker.poller.register(broker.sub_reg_socket, zmq.POLLIN)
+        receive_socket = context.socket(zmq.SUB)
+        receive_socket.connect(f'inproc://{run_name}-pub-live')
+        receive_socket.setsockopt_string(zmq.SUBSCRIBE, 'live')
+        broker.receive_socket_dict['live'] = receive_socket
+        broker.poller.register(receive_socket, zmq.POLLIN)
+        broker.send_socket_dict['live'] = broker.create_send_socket('live')
+        broker.send_socket_dict['live'].bind(f'inproc://{run_name}-sub-live')
+        broker.send_port_dict['live'] = 0
+        broker.subscribers['live'] = []
+        return broker
+
+    def publish(self, socket, stop):
+        """ Publish events on the forwarding topic at self.rate until stopped """
+        i = 0
+        while not stop.is_set():
+            event = {'publisher': 'bench', 'topic': 'live', 'seq': i, 'publish_time': time.time()}
+            socket.send_multipart([b'live', pickle.dumps(event)])
+            i += 1
+            time.sleep(1 / self.rate)
+
+    def storm(self, socket, replies):
+        """ Send every registration of the storm without waiting for replies, then
+        count the replies until all are answered (or 60s pass) """
+        for i in range(self.registrations):
+            message = {'address': f'10.1.{i // 250}.{i % 250}', 'id': f'storm-{i}', 'topics': ['live']}
+            socket.send_multipart([b'', json.dumps(message).encode('utf8')])
+        deadline = time.time() + 60
+        while replies['accepted'] + replies['rejected'] < self.registrations:
+            if time.time() > deadline:
+                self.error("Storm did not drain within 60s")
+                return
+            if socket.poll(100):
+                reply = json.loads(socket.recv_multipart()[1])
+                replies['rejected' if 'retry_after' in reply else 'accepted'] += 1
+
+    def run_broker(self, broker, stop):
+        i = 0
+        while not stop.is_set():
+            i += 1
+            broker.parse_events(i)
+
+    def run_once(self, run_name, **admission):
+        """ Fire the registration storm at a broker; return forwarding latency during
+        the storm, time for the broker to answer every registration and reply counts """
+        context = zmq.Context()
+        pub_socket = context.socket(zmq.PUB)
+        pub_socket.bind(f'inproc://{run_name}-pub-live')
+        broker = self.create_broker(context, run_name, **admission)
+        sub_socket = context.socket(zmq.SUB)
+        sub_socket.connect(f'inproc://{run_name}-sub-live')
+        sub_socket.setsockopt_string(zmq.SUBSCRIBE, 'live')
+        # A DEALER can have every registration of the storm in flight at once
+        storm_socket = context.socket(zmq.DEALER)
+        storm_socket.setsockopt(zmq.SNDHWM, 0)
+        storm_socket.setsockopt(zmq.RCVHWM, 0)
+        storm_socket.connect(f'inproc://{run_name}-sub-reg')
+        # Let subscriptions propagate before traffic starts
+        time.sleep(0.2)
+
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=self.run_broker, args=(broker, stop)),
+            threading.Thread(target=self.publish, args=(pub_socket, stop))
+        ]
+        for thread in threads:
+            thread.start()
+        # Steady state before the storm; discard its traffic
+        time.sleep(0.5)
+        while sub_socket.poll(0):
+            sub_socket.recv_multipart()
+
+        started = time.time()
+        replies = {'accepted': 0, 'rejected': 0}
+        storm = threading.Thread(target=self.storm, args=(storm_socket, replies))
+        storm.start()
+        latencies = []
+        while storm.is_alive():
+            if sub_socket.poll(100):
+                event = pickle.loads(sub_socket.recv_multipart()[1])
+                latencies.append(time.time() - event['publish_time'])
+        drain_time = time.time() - started
+        stop.set()
+        for thread in threads:
+            thread.join()
+        context.destroy(linger=0)
+        return {
+            'drain_time': drain_time,
+            'replies': replies,
+            'admission': broker.get_admission_stats(),
+            'latency': self.summarize_latencies(latencies)
+        }
+
+    def run(self):
+        """ Compare an unprotected broker against one with admission control """
+        results = {'registrations': self.registrations, 'rate': self.rate, 'runs': {}}
+        results['runs']['unlimited'] = self.run_once('unlimited')
+        results['runs']['admission'] = self.run_once('admission',
+            max_clients=self.max_clients, control_share=self.control_share,
+            retry_after=self.retry_after)
+        for run_name, summary in results['runs'].items():
+            stats = summary['latency']
+            self.info(
+                f"{run_name:<10} drain={summary['drain_time']:.2f}s replies={summary['replies']} "
+                f"p50={stats['p50']} p99={stats['p99']} max={stats['max']}")
+        return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Forwarding latency through a centralized broker during a registration storm')
+    parser.add_argument('--registrations', type=int, default=10000,
+        help='number of registration requests in the storm')
+    parser.add_argument('--rate', type=int, default=200,
+        help='messages per second published on the forwarding topic')
+    parser.add_argument('--max_clients', type=int, default=100,
+        help='client limit of the admission controlled run')
+    parser.add_argument('--control_share', type=float, default=0.2,
+        help='control-plane time share of the admission controlled run')
+    parser.add_argument('--output', type=str, help='optional JSON file for the results')
+    args = parser.parse_args()
+    benchmark = RegistrationStormBenchmark(
+        registrations=args.registrations,
+        rate=args.rate,
+        max_clients=args.max_clients,
+        control_share=args.control_share
+    )
+    benchmark.write_results(benchmark.run(), args.output)
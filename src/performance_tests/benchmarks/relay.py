@@ -0,0 +1,236 @@
+""" Benchmark of the fan-out relay tier: N subscriber sockets receive a topic
+either straight from the broker's PUB socket or through R relay processes
+(each running the real Relay forwarding code) over TCP on loopback. Measured:
+- broker send time: time the broker thread spends in send_multipart per message,
+  i.e. the per-message fan-out work the relay tier takes off the broker
+- delivery: time until every subscriber has every message, and deliveries/s
+- hop latency: end-to-end latency at a low publish rate, to bound what the extra
+  hop through a relay costs
+
+Relays and subscribers run in separate processes, so on a multi-core host fan-out
+work spreads over the relays; on a single core it only moves between processes.
+
+Run from the src directory:
+    python3 -m performance_tests.benchmarks.relay --subscribers 256 --relays 2 --relays 4 --output relay.json
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import struct
+import time
+import zmq
+from lib.relay import Relay
+from .common import Benchmark
+
+STAMP = struct.Struct('<cd')
+
+def run_relay(upstream, stop, conn):
+    """ Relay process: forward topic A from upstream to a PUB socket on a free port,
+    reported to conn """
+    relay = Relay(topics=['A'])
+    relay.logger.setLevel(logging.WARNING)
+    relay.context = zmq.Context()
+    relay.poller = zmq.Poller()
+    relay.pub_socket = relay.context.socket(zmq.PUB)
+    relay.pub_socket.setsockopt(zmq.SNDHWM, 0)
+    relay.port = relay.pub_socket.bind_to_random_port('tcp://127.0.0.1')
+    conn.send(relay.port)
+    relay.connect_upstream({'A': upstream})
+    for socket in relay.upstream_sockets.values():
+        socket.setsockopt(zmq.RCVHWM, 0)
+    while not stop.is_set():
+        relay.poll_once(timeout=50)
+    relay.context.destroy(linger=0)
+
+def run_subscribers(endpoints, count, messages, latency_messages, conn):
+    """ Subscriber process: count sockets spread over endpoints; report to conn when
+    every socket is ready, has all measured messages, and has all latency messages """
+    context = zmq.Context()
+    poller = zmq.Poller()
+    # key = socket, value = its index
+    sockets = {}
+    for i in range(count):
+        socket = context.socket(zmq.SUB)
+        socket.setsockopt(zmq.RCVHWM, 0)
+        socket.connect(endpoints[i % len(endpoints)])
+        socket.setsockopt(zmq.SUBSCRIBE, b'A')
+        poller.register(socket, zmq.POLLIN)
+        sockets[socket] = i
+    warm = set()
+    measured = [0] * count
+    latency_counts = [0] * count
+    latencies = []
+    done_measured = done_latency = False
+    while not done_latency:
+        for socket, _ in poller.poll(1000):
+            index = sockets[socket]
+            while True:
+                try:
+                    _, payload = socket.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                kind, sent = STAMP.unpack_from(payload)
+                if kind == b'w':
+                    if index not in warm:
+                        warm.add(index)
+                        if len(warm) == count:
+                            conn.send('ready')
+                elif kind == b'm':
+                    measured[index] += 1
+                    if not done_measured and measured[index] == messages and min(measured) == messages:
+                        done_measured = True
+                        conn.send(('delivered', time.time()))
+                elif kind == b'l':
+                    latencies.append(time.time() - sent)
+                    latency_counts[index] += 1
+                    if min(latency_counts) == latency_messages:
+                        done_latency = True
+    conn.send(('latencies', latencies))
+    context.destroy(linger=0)
+
+class RelayBenchmark(Benchmark):
+
+    def __init__(self, subscribers=256, relay_counts=[2, 4], messages=2000,
+        latency_messages=100, latency_rate=50, payload_bytes=100, subscriber_processes=2):
+        """ Constructor
+        args:
+        - subscribers (int) - subscriber sockets receiving the topic
+        - relay_counts (list) - numbers of relays to compare with direct fan-out
+        - messages (int) - messages delivered to every subscriber in the delivery run
+        - latency_messages (int) - messages sent at latency_rate to measure latency
+        - latency_rate (float) - messages per second during the latency run
+        - payload_bytes (int) - size of each message
+        - subscriber_processes (int) - processes the subscriber sockets are spread over
+        """
+        super().__init__(name='RELAY-BENCH')
+        self.subscribers = subscribers
+        self.relay_counts = relay_counts
+        self.messages = messages
+        self.latency_messages = latency_messages
+        self.latency_rate = latency_rate
+        self.payload_bytes = payload_bytes
+        self.subscriber_processes = subscriber_processes
+
+    def payload(self, kind):
+        return STAMP.pack(kind, time.time()) + bytes(self.payload_bytes - STAMP.size)
+
+    def run_topology(self, relays):
+        """ Measure one topology: direct fan-out (relays=0) or through relays """
+        context = zmq.Context()
+        broker = context.socket(zmq.PUB)
+        broker.setsockopt(zmq.SNDHWM, 0)
+        broker_port = broker.bind_to_random_port('tcp://127.0.0.1')
+        upstream = f'tcp://127.0.0.1:{broker_port}'
+        stop = multiprocessing.Event()
+        relay_processes = []
+        endpoints = [upstream]
+        if relays:
+            endpoints = []
+            for i in range(relays):
+                parent, child = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=run_relay, args=(upstream, stop, child))
+                process.start()
+                relay_processes.append(process)
+                endpoints.append(f'tcp://127.0.0.1:{parent.recv()}')
+        connections = []
+        subscriber_processes = []
+        for i in range(self.subscriber_processes):
+            count = self.subscribers // self.subscriber_processes
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_subscribers,
+                args=(endpoints[i::self.subscriber_processes] or endpoints, count, self.messages,
+                    self.latency_messages, child))
+            process.start()
+            subscriber_processes.append(process)
+            connections.append(parent)
+        # Warm up until every subscriber (through its relay) receives the topic
+        ready = 0
+        deadline = time.time() + 60
+        while ready < len(connections):
+            if time.time() > deadline:
+                raise RuntimeError('Subscribers did not receive the topic within 60s')
+            broker.send_multipart([b'A', self.payload(b'w')])
+            time.sleep(0.01)
+            ready += sum(1 for conn in connections if conn.poll() and conn.recv() == 'ready')
+        time.sleep(0.2)
+
+        started = time.time()
+        send_time = 0
+        for _ in range(self.messages):
+            payload = self.payload(b'm')
+            before = time.perf_counter()
+            broker.send_multipart([b'A', payload])
+            send_time += time.perf_counter() - before
+        delivered = max(conn.recv()[1] for conn in connections)
+        delivery_seconds = delivered - started
+
+        interval = 1.0 / self.latency_rate
+        for _ in range(self.latency_messages):
+            broker.send_multipart([b'A', self.payload(b'l')])
+            time.sleep(interval)
+        latencies = []
+        for conn in connections:
+            latencies.extend(conn.recv()[1])
+        for process in subscriber_processes:
+            process.join()
+        stop.set()
+        for process in relay_processes:
+            process.join()
+        context.destroy(linger=0)
+        return {
+            'relays': relays,
+            'broker_send_us': send_time / self.messages * 1e6,
+            'delivery_seconds': delivery_seconds,
+            'deliveries_per_second': self.messages * self.subscribers / delivery_seconds,
+            'latency': self.summarize_latencies(latencies)
+        }
+
+    def run(self):
+        """ Compare direct fan-out with fan-out through each number of relays """
+        results = {
+            'subscribers': self.subscribers, 'messages': self.messages,
+            'cpus': os.cpu_count(), 'runs': {}
+        }
+        for relays in [0] + list(self.relay_counts):
+            name = f'{relays}_relays' if relays else 'direct'
+            stats = results['runs'][name] = self.run_topology(relays)
+            self.info(f"{name:<9} broker send {stats['broker_send_us']:.1f} us/msg, "
+                f"delivery {stats['delivery_seconds']:.2f}s = {stats['deliveries_per_second']:.0f} deliveries/s, "
+                f"latency p50 {stats['latency']['p50'] * 1000:.2f} ms "
+                f"p99 {stats['latency']['p99'] * 1000:.2f} ms")
+        direct = results['runs']['direct']['latency']
+        for name, stats in results['runs'].items():
+            if name != 'direct':
+                stats['added_p99_ms'] = (stats['latency']['p99'] - direct['p99']) * 1000
+                self.info(f"{name:<9} adds {stats['added_p99_ms']:.2f} ms at p99")
+        if results['cpus'] == 1:
+            self.info("Single CPU: relays and subscribers share one core, so delivery "
+                "throughput cannot scale with relays on this host")
+        return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Broker fan-out cost, delivery throughput and hop latency with and without relays')
+    parser.add_argument('--subscribers', type=int, default=256, help='subscriber sockets')
+    parser.add_argument('--relays', type=int, action='append',
+        help='number of relays to compare with direct fan-out; repeat for several (default 2 and 4)')
+    parser.add_argument('--messages', type=int, default=2000, help='messages per delivery run')
+    parser.add_argument('--latency_messages', type=int, default=100,
+        help='messages sent at --latency_rate to measure latency')
+    parser.add_argument('--latency_rate', type=float, default=50, help='messages per second in the latency run')
+    parser.add_argument('--payload_bytes', type=int, default=100, help='size of each message')
+    parser.add_argument('--subscriber_processes', type=int, default=2,
+        help='processes the subscriber sockets are spread over')
+    parser.add_argument('--output', type=str, help='optional JSON file for the results')
+    args = parser.parse_args()
+    benchmark = RelayBenchmark(
+        subscribers=args.subscribers,
+        relay_counts=args.relays if args.relays else [2, 4],
+        messages=args.messages,
+        latency_messages=args.latency_messages,
+        latency_rate=args.latency_rate,
+        payload_bytes=args.payload_bytes,
+        subscriber_processes=args.subscriber_processes
+    )
+    benchmark.write_results(benchmark.run(), args.output)
@@ -0,0 +1,161 @@
+""" Benchmark of subscriber catch-up through replay from the broker's topic log:
+time for a Subscriber to replay N missed messages (1M by default) with the real
+Broker.serve_replay and Subscriber.replay over inproc:// sockets, compared with
+the rate at which the same process moves live messages through Broker.send to
+Subscriber.parse_publish_event.
+
+Run from the src directory:
+    python3 -m performance_tests.benchmarks.replay --messages 1000000 --output replay.json
+"""
+import argparse
+import logging
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import zmq
+from lib.broker import Broker
+from lib.subscriber import Subscriber
+from lib.topic_log import TopicLog
+from .common import Benchmark
+
+class ReplayBenchmark(Benchmark):
+
+    def __init__(self, messages=1000000, live_messages=100000, chunk_bytes=1024 * 1024,
+        directory=None):
+        """ Constructor
+        args:
+        - messages (int) - number of missed messages to catch up on
+        - live_messages (int) - messages used to measure the live forwarding rate
+        - chunk_bytes (int) - max bytes of log records per replay request
+        - directory (str) - where to create the log; a temporary directory by default
+        """
+        super().__init__(name='REPLAY-BENCH')
+        self.messages = messages
+        self.live_messages = live_messages
+        self.chunk_bytes = chunk_bytes
+        self.directory = directory
+
+    def event(self, i):
+        return pickle.dumps({'publisher': 'bench', 'topic': 'A', 'seq': i, 'publish_time': time.time()})
+
+    def create_broker(self, context, directory):
+        broker = Broker(centralized=True, log_dir=directory)
+        broker.logger.setLevel(logging.WARNING)
+        broker.context = context
+        broker.replay_socket = context.socket(zmq.ROUTER)
+        broker.replay_socket.bind('inproc://bench-replay')
+        return broker
+
+    def create_subscriber(self, context):
+        subscriber = Subscriber(topics=['A'], centralized=True)
+        subscriber.logger.setLevel(logging.WARNING)
+        subscriber.context = context
+        subscriber.replay_chunk_bytes = self.chunk_bytes
+        return subscriber
+
+    def run_catch_up(self, directory):
+        """ Fill the log with the missed messages, then time the subscriber's replay """
+        log = TopicLog(f'{directory}/A')
+        started = time.time()
+        for i in range(self.messages):
+            log.append(self.event(i))
+        log.close()
+        self.info(f"Logged {self.messages} messages in {time.time() - started:.2f}s")
+
+        context = zmq.Context()
+        broker = self.create_broker(context, directory)
+        subscriber = self.create_subscriber(context)
+        subscriber.replay_socket = context.socket(zmq.REQ)
+        subscriber.replay_socket.connect('inproc://bench-replay')
+        stop = threading.Event()
+        def serve():
+            while not stop.is_set():
+                if broker.replay_socket.poll(10):
+                    broker.serve_replay()
+        server = threading.Thread(target=serve)
+        server.start()
+        started = time.time()
+        replayed = subscriber.replay('A', from_offset=0)
+        elapsed = time.time() - started
+        stop.set()
+        server.join()
+        broker.topic_logs.close()
+        context.destroy(linger=0)
+        return {
+            'messages': replayed,
+            'seconds': elapsed,
+            'rate': replayed / elapsed,
+            'requests': broker.replay_requests
+        }
+
+    def run_live(self, directory):
+        """ Time live messages through Broker.send (logging them) to Subscriber.parse_publish_event """
+        context = zmq.Context()
+        broker = self.create_broker(context, directory)
+        subscriber = self.create_subscriber(context)
+        publisher = context.socket(zmq.PUSH)
+        publisher.setsockopt(zmq.SNDHWM, 0)
+        publisher.bind('inproc://bench-live-in')
+        broker.receive_socket_dict['A'] = context.socket(zmq.PULL)
+        broker.receive_socket_dict['A'].setsockopt(zmq.RCVHWM, 0)
+        broker.receive_socket_dict['A'].connect('inproc://bench-live-in')
+        broker.send_socket_dict['A'] = broker.create_send_socket('A')
+        broker.send_socket_dict['A'].bind('inproc://bench-live-out')
+        subscriber.sub_socket_dict['A'] = context.socket(zmq.SUB)
+        subscriber.sub_socket_dict['A'].connect('inproc://bench-live-out')
+        subscriber.sub_socket_dict['A'].setsockopt_string(zmq.SUBSCRIBE, 'A')
+        time.sleep(0.1)
+        for i in range(self.live_messages):
+            publisher.send_multipart([b'A', self.event(i)])
+        broker.receive_socket_dict['A'].poll(1000)
+        started = time.time()
+        received = 0
+        while received < self.live_messages:
+            if not broker.send('A') and not broker.receive_socket_dict['A'].poll(1000):
+                break
+            while subscriber.sub_socket_dict['A'].poll(0):
+                subscriber.parse_publish_event(topic='A')
+                received += 1
+        elapsed = time.time() - started
+        broker.topic_logs.close()
+        context.destroy(linger=0)
+        return {'messages': received, 'seconds': elapsed, 'rate': received / elapsed}
+
+    def run(self):
+        """ Compare catch-up through replay with the live forwarding rate """
+        directory = self.directory or tempfile.mkdtemp(prefix='replay-bench-')
+        results = {'messages': self.messages, 'chunk_bytes': self.chunk_bytes, 'runs': {}}
+        try:
+            results['runs']['catch_up'] = self.run_catch_up(f'{directory}/catch-up')
+            results['runs']['live'] = self.run_live(f'{directory}/live')
+        finally:
+            if not self.directory:
+                shutil.rmtree(directory)
+        for run_name, stats in results['runs'].items():
+            self.info(f"{run_name:<9} {stats['messages']} msgs in {stats['seconds']:.2f}s "
+                f"= {stats['rate']:.0f} msgs/s")
+        results['speedup'] = results['runs']['catch_up']['rate'] / results['runs']['live']['rate']
+        self.info(f"Replay is {results['speedup']:.1f}x the live forwarding rate")
+        return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Catch-up time of a subscriber replaying missed messages from the topic log')
+    parser.add_argument('--messages', type=int, default=1000000, help='missed messages to replay')
+    parser.add_argument('--live_messages', type=int, default=100000,
+        help='messages used to measure the live forwarding rate')
+    parser.add_argument('--chunk_bytes', type=int, default=1024 * 1024,
+        help='max bytes of log records per replay request')
+    parser.add_argument('--directory', type=str,
+        help='directory for the log (use the disk you want to measure); temporary by default')
+    parser.add_argument('--output', type=str, help='optional JSON file for the results')
+    args = parser.parse_args()
+    benchmark = ReplayBenchmark(
+        messages=args.messages,
+        live_messages=args.live_messages,
+        chunk_bytes=args.chunk_bytes,
+        directory=args.directory
+    )
+    benchmark.write_results(benchmark.run(), args.output)
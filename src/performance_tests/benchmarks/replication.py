@@ -0,0 +1,220 @@
+""" Benchmark of topic log replication from the leader broker to a standby:
+- overhead: forwarding throughput of the leader (Broker.send logging every message,
+  plus Broker.service_replication) without replication, in async mode and in
+  'one' mode (fan-out held until the standby acknowledged)
+- loss window: the leader forwards at full speed and "crashes" at a random time;
+  the messages subscribers may have received that the standby did not hold at
+  that instant would be missing on the new leader
+
+The standby runs the real Broker.standby_replication_loop in a thread, connected
+to the leader over TCP on the loopback interface; everything else uses inproc://.
+
+Run from the src directory:
+    python3 -m performance_tests.benchmarks.replication --messages 200000 --output replication.json
+"""
+import argparse
+import logging
+import pickle
+import random
+import shutil
+import tempfile
+import threading
+import time
+import zmq
+from lib.broker import Broker
+from lib.replication import ReplicationLeader
+from .common import Benchmark
+
+class ReplicationBenchmark(Benchmark):
+
+    def __init__(self, messages=200000, failovers=5, ack_timeout=1.0, directory=None):
+        """ Constructor
+        args:
+        - messages (int) - messages forwarded per throughput run
+        - failovers (int) - number of simulated leader crashes per mode
+        - ack_timeout (float) - 'one' mode ack timeout of the leader
+        - directory (str) - where to create the logs; a temporary directory by default
+        """
+        super().__init__(name='REPLICATION-BENCH')
+        self.messages = messages
+        self.failovers = failovers
+        self.ack_timeout = ack_timeout
+        self.directory = directory
+        self.payload = pickle.dumps({'publisher': 'bench', 'topic': 'A', 'seq': 0, 'publish_time': 0})
+
+    def start(self, directory, mode):
+        """ Create a leader broker (and a following standby if mode) over fresh sockets """
+        context = zmq.Context()
+        leader = Broker(centralized=True, log_dir=f'{directory}/leader', replication_mode=mode,
+            replication_ack_timeout=self.ack_timeout)
+        leader.logger.setLevel(logging.WARNING)
+        leader.context = context
+        publisher = context.socket(zmq.PUSH)
+        publisher.setsockopt(zmq.SNDHWM, 0)
+        publisher.bind('inproc://bench-in')
+        leader.receive_socket_dict['A'] = context.socket(zmq.PULL)
+        leader.receive_socket_dict['A'].setsockopt(zmq.RCVHWM, 0)
+        leader.receive_socket_dict['A'].connect('inproc://bench-in')
+        leader.send_socket_dict['A'] = leader.create_send_socket('A')
+        leader.send_socket_dict['A'].bind('inproc://bench-out')
+        subscriber = context.socket(zmq.SUB)
+        subscriber.setsockopt(zmq.RCVHWM, 0)
+        subscriber.connect('inproc://bench-out')
+        subscriber.setsockopt(zmq.SUBSCRIBE, b'')
+        standby = None
+        if mode:
+            leader.replication_socket = context.socket(zmq.ROUTER)
+            port = leader.replication_socket.bind_to_random_port('tcp://127.0.0.1')
+            leader.replication = ReplicationLeader(leader.replication_socket, leader.topic_logs,
+                mode=mode, ack_timeout=self.ack_timeout)
+            standby = Broker(centralized=True, log_dir=f'{directory}/standby', replication_mode=mode)
+            standby.logger.setLevel(logging.WARNING)
+            standby.leader_replication_endpoint = f'tcp://127.0.0.1:{port}'
+            standby.standby_thread = threading.Thread(target=standby.standby_replication_loop)
+            standby.standby_thread.start()
+            while not leader.replication.standbys:
+                leader.service_replication({leader.replication_socket: zmq.POLLIN})
+                time.sleep(0.001)
+        # Count fanned out messages (what subscribers may have seen)
+        fan_out = leader.fan_out
+        leader.fanned_out = 0
+        def counting_fan_out(topic, frames, key=None):
+            leader.fanned_out += 1
+            fan_out(topic, frames, key)
+        leader.fan_out = counting_fan_out
+        time.sleep(0.1)
+        return context, leader, standby, publisher, subscriber
+
+    def step(self, leader, subscriber, sent):
+        """ One leader loop iteration: forward a batch, service replication, drain the subscriber """
+        budget = 64
+        while budget and leader.send('A'):
+            budget -= 1
+        if leader.replication is not None:
+            leader.service_replication({leader.replication_socket: zmq.POLLIN})
+        received = 0
+        while subscriber.poll(0):
+            subscriber.recv_multipart()
+            received += 1
+        return received
+
+    def stop(self, context, leader, standby):
+        if standby is not None:
+            standby.stop_standby_replication()
+            standby.topic_logs.close()
+        leader.topic_logs.close()
+        context.destroy(linger=0)
+
+    def run_throughput(self, directory, mode):
+        """ Time self.messages through the leader until subscribers received all of them """
+        context, leader, standby, publisher, subscriber = self.start(directory, mode)
+        for i in range(self.messages):
+            publisher.send_multipart([b'A', self.payload])
+        leader.receive_socket_dict['A'].poll(1000)
+        started = time.time()
+        received = 0
+        deadline = started + 120
+        while received < self.messages and time.time() < deadline:
+            received += self.step(leader, subscriber, received)
+        elapsed = time.time() - started
+        stats = leader.get_replication_stats()
+        self.stop(context, leader, standby)
+        return {'messages': received, 'seconds': elapsed, 'rate': received / elapsed,
+            'released_unacked': stats.get('released_unacked', 0)}
+
+    def run_failover(self, directory, mode):
+        """ Forward at full speed, crash the leader at a random time and count the
+        messages fanned out by the leader that the standby did not hold yet """
+        context, leader, standby, publisher, subscriber = self.start(directory, mode)
+        feeding = threading.Event()
+        feeding.set()
+        publisher.setsockopt(zmq.SNDHWM, 10000)
+        def feed():
+            # Only this thread uses the publisher socket from now on
+            while feeding.is_set():
+                try:
+                    for i in range(1000):
+                        publisher.send_multipart([b'A', self.payload], zmq.NOBLOCK)
+                except zmq.Again:
+                    # The leader is saturated
+                    pass
+                time.sleep(0.001)
+        feeder = threading.Thread(target=feed)
+        feeder.start()
+        crash_at = time.time() + random.uniform(0.5, 1.5)
+        started = time.time()
+        while time.time() < crash_at:
+            self.step(leader, subscriber, 0)
+        # Crash in the middle of a loop pass, after fan-out and before streaming to the
+        # standby: whatever the standby has not appended by now is gone with the leader
+        budget = 64
+        while budget and leader.send('A'):
+            budget -= 1
+        standby_next = standby.topic_logs.log('A').next_offset
+        elapsed = time.time() - started
+        leader_next = leader.topic_logs.log('A').next_offset
+        fanned_out = leader.fanned_out
+        feeding.clear()
+        feeder.join()
+        self.stop(context, leader, standby)
+        rate = leader_next / elapsed
+        return {
+            'logged': leader_next,
+            'fanned_out': fanned_out,
+            'standby': standby_next,
+            # Seen (or seeable) by subscribers but missing on the new leader
+            'lost': max(0, fanned_out - standby_next),
+            'lost_ms': max(0, fanned_out - standby_next) / rate * 1000
+        }
+
+    def run(self):
+        """ Compare leader throughput and failover loss without replication, async and one """
+        directory = self.directory or tempfile.mkdtemp(prefix='replication-bench-')
+        results = {'messages': self.messages, 'throughput': {}, 'failover': {}}
+        try:
+            for mode in [None, 'async', 'one']:
+                name = mode or 'none'
+                results['throughput'][name] = self.run_throughput(f'{directory}/{name}', mode)
+                stats = results['throughput'][name]
+                self.info(f"{name:<5} {stats['messages']} msgs in {stats['seconds']:.2f}s "
+                    f"= {stats['rate']:.0f} msgs/s")
+            for mode in ['async', 'one']:
+                trials = [self.run_failover(f'{directory}/failover-{mode}-{i}', mode)
+                    for i in range(self.failovers)]
+                results['failover'][mode] = {
+                    'trials': trials,
+                    'max_lost': max(trial['lost'] for trial in trials),
+                    'mean_lost': sum(trial['lost'] for trial in trials) / len(trials),
+                    'max_lost_ms': max(trial['lost_ms'] for trial in trials)
+                }
+                summary = results['failover'][mode]
+                self.info(f"{mode:<5} failover lost mean {summary['mean_lost']:.0f} / "
+                    f"max {summary['max_lost']} fanned out msgs (<= {summary['max_lost_ms']:.1f} ms)")
+        finally:
+            if not self.directory:
+                shutil.rmtree(directory)
+        base = results['throughput']['none']['rate']
+        for mode in ['async', 'one']:
+            overhead = 1 - results['throughput'][mode]['rate'] / base
+            results['throughput'][mode]['overhead'] = overhead
+            self.info(f"{mode:<5} replication costs {overhead * 100:.0f}% of leader throughput")
+        return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Leader throughput overhead and failover loss window of log replication')
+    parser.add_argument('--messages', type=int, default=200000, help='messages per throughput run')
+    parser.add_argument('--failovers', type=int, default=5, help='simulated leader crashes per mode')
+    parser.add_argument('--ack_timeout', type=float, default=1.0,
+        help="'one' mode: max seconds a message waits for the standby's ack")
+    parser.add_argument('--directory', type=str,
+        help='directory for the logs (use the disk you want to measure); temporary by default')
+    parser.add_argument('--output', type=str, help='optional JSON file for the results')
+    args = parser.parse_args()
+    benchmark = ReplicationBenchmark(
+        messages=args.messages,
+        failovers=args.failovers,
+        ack_timeout=args.ack_timeout,
+        directory=args.directory
+    )
+    benchmark.write_results(benchmark.run(), args.output)
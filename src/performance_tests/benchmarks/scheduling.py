@@ -0,0 +1,151 @@
+""" Benchmark of per-priority-class latency through a centralized broker while a
+bulk topic floods it. Runs the broker's real forwarding loop (parse_events) in
+one process over inproc:// sockets, once with the legacy one-message-per-topic
+round robin and once with topic priorities and weights.
+
+Run from the src directory:
+    python3 -m performance_tests.benchmarks.scheduling --duration 5 --output scheduling.json
+"""
+import argparse
+import pickle
+import threading
+import time
+import zmq
+from lib.broker import Broker
+from lib.scheduler import TopicScheduler
+from .common import Benchmark
+
+class SchedulingBenchmark(Benchmark):
+
+    def __init__(self, duration=5, critical_topics=['critical'], bulk_topics=['bulk'],
+        critical_rate=200, bulk_weight=1, critical_weight=4):
+        """ Constructor
+        args:
+        - duration (float) - seconds of traffic per run
+        - critical_topics (list) - latency-critical topics published at critical_rate
+        - bulk_topics (list) - topics published as fast as possible
+        - critical_rate (int) - messages per second per critical topic
+        - bulk_weight (int) - scheduler weight of bulk topics in the scheduled run
+        - critical_weight (int) - scheduler weight of critical topics in the scheduled run
+        """
+        super().__init__(name='SCHEDULING-BENCH')
+        self.duration = duration
+        self.critical_topics = critical_topics
+        self.bulk_topics = bulk_topics
+        self.critical_rate = critical_rate
+        self.bulk_weight = bulk_weight
+        self.critical_weight = critical_weight
+
+    def create_broker(self, context, run_name, scheduler):
+        """ Create a centralized broker wired to inproc publisher/subscriber endpoints """
+        broker = Broker(centralized=True)
+        broker.logger.setLevel('WARNING')
+        broker.context = context
+        broker.poller = zmq.Poller()
+        broker.scheduler = scheduler
+        for topic in self.critical_topics + self.bulk_topics:
+            receive_socket = context.socket(zmq.SUB)
+            receive_socket.connect(f'inproc://{run_name}-pub-{topic}')
+            receive_socket.setsockopt_string(zmq.SUBSCRIBE, topic)
+            broker.receive_socket_dict[topic] = receive_socket
+            broker.poller.register(receive_socket, zmq.POLLIN)
+            broker.send_socket_dict[topic] = broker.create_send_socket(topic)
+            broker.send_socket_dict[topic].bind(f'inproc://{run_name}-sub-{topic}')
+        return broker
+
+    def publish(self, socket, topic, interval, stop):
+        """ Publish events for a topic every interval seconds (0 = flood) until stopped """
+        i = 0
+        while not stop.is_set():
+            event = {'publisher': 'bench', 'topic': topic, 'seq': i, 'publish_time': time.time()}
+            socket.send_multipart([topic.encode('utf8'), pickle.dumps(event)])
+            i += 1
+            if interval:
+                time.sleep(interval)
+
+    def run_broker(self, broker, stop):
+        i = 0
+        while not stop.is_set():
+            i += 1
+            broker.parse_events(i)
+
+    def run_once(self, run_name, scheduler):
+        """ Run one traffic mix through a broker using the given scheduler;
+        return latency summaries per priority class """
+        context = zmq.Context()
+        topics = self.critical_topics + self.bulk_topics
+        pub_sockets = {}
+        for topic in topics:
+            pub_sockets[topic] = context.socket(zmq.PUB)
+            pub_sockets[topic].bind(f'inproc://{run_name}-pub-{topic}')
+        broker = self.create_broker(context, run_name, scheduler)
+        sub_socket = context.socket(zmq.SUB)
+        for topic in topics:
+            sub_socket.connect(f'inproc://{run_name}-sub-{topic}')
+            sub_socket.setsockopt_string(zmq.SUBSCRIBE, topic)
+        # Let subscriptions propagate before traffic starts
+        time.sleep(0.2)
+
+        stop = threading.Event()
+        threads = [threading.Thread(target=self.run_broker, args=(broker, stop))]
+        for topic in self.critical_topics:
+            threads.append(threading.Thread(target=self.publish,
+                args=(pub_sockets[topic], topic, 1 / self.critical_rate, stop)))
+        for topic in self.bulk_topics:
+            threads.append(threading.Thread(target=self.publish,
+                args=(pub_sockets[topic], topic, 0, stop)))
+        for thread in threads:
+            thread.start()
+
+        latencies = {'critical': [], 'bulk': []}
+        end = time.time() + self.duration
+        while time.time() < end:
+            if sub_socket.poll(100):
+                topic, payload = sub_socket.recv_multipart()
+                event = pickle.loads(payload)
+                latency_class = 'critical' if event['topic'] in self.critical_topics else 'bulk'
+                latencies[latency_class].append(time.time() - event['publish_time'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        context.destroy(linger=0)
+        return {
+            latency_class: self.summarize_latencies(values)
+            for latency_class, values in latencies.items()
+        }
+
+    def run(self):
+        """ Compare the legacy round robin (one message per ready topic per poll)
+        against strict priority plus weighted deficit round robin """
+        results = {'duration': self.duration, 'critical_rate': self.critical_rate, 'runs': {}}
+        results['runs']['round_robin'] = self.run_once(
+            'round-robin', TopicScheduler(quantum=1))
+        priorities = {topic: 0 for topic in self.critical_topics}
+        weights = {topic: self.critical_weight for topic in self.critical_topics}
+        weights.update({topic: self.bulk_weight for topic in self.bulk_topics})
+        results['runs']['priority_drr'] = self.run_once(
+            'priority-drr', TopicScheduler(topic_priorities=priorities, topic_weights=weights))
+        for run_name, summary in results['runs'].items():
+            for latency_class, stats in summary.items():
+                self.info(
+                    f"{run_name:<12} {latency_class:<8} count={stats['count']} "
+                    f"p50={stats['p50']} p99={stats['p99']} max={stats['max']}")
+        return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Per-priority-class latency through a flooded centralized broker')
+    parser.add_argument('--duration', type=float, default=5,
+        help='seconds of traffic per run')
+    parser.add_argument('--critical_rate', type=int, default=200,
+        help='messages per second published on each critical topic')
+    parser.add_argument('--bulk_topics', type=int, default=1,
+        help='number of bulk topics flooding the broker')
+    parser.add_argument('--output', type=str, help='optional JSON file for the results')
+    args = parser.parse_args()
+    benchmark = SchedulingBenchmark(
+        duration=args.duration,
+        critical_rate=args.critical_rate,
+        bulk_topics=[f'bulk{i}' for i in range(args.bulk_topics)]
+    )
+    benchmark.write_results(benchmark.run(), args.output)
@@ -0,0 +1,217 @@
+""" Benchmark of the capacity of the system: the throughput at which it saturates
+and the latency on the way there, for centralized dissemination (through the
+broker) and direct dissemination (publishers to subscribers).
+
+Each sweep varies one dimension around a base point (1 publisher, 1 subscriber,
+1 topic, no payload) and keeps the others at the base:
+- payload size of the events (bytes)
+- number of topics, published round robin and all subscribed to
+- fan-out: number of subscribers receiving every event
+For every point the offered rate ramps up: every publisher publishes at
+--start_rate events/s, then at twice that, and so on, and finally as fast as it
+can. The ramp skips to the last step once the subscribers fall behind (they
+receive less than --sustained of what was published, or events are lost) or the
+publisher falls short of the offered rate: the publisher sleeps after every
+event, and at high rates the time it takes to publish and sleep exceeds the
+period. Each step reports the offered and published rates, the deliveries per
+second (one event received by one subscriber is one delivery), lost events and
+the latency (p50/p99/p999/max). The saturation throughput of a point is the
+highest throughput of its ramp, and its sustained publish rate is the highest
+publish rate the subscribers kept up with.
+
+The systems run as local clusters (see lib/local_cluster.py): in one process,
+over inproc://, with an in-memory ZooKeeper. That isolates the cost of the
+framework from the network, but every entity shares one interpreter, so the
+envelope is that of the framework on one core. For the envelope across processes
+or hosts, run the same points with the scenario runner (performance_tests/scenario.py).
+
+Run from the src directory:
+    python3 -m performance_tests.benchmarks.throughput --output throughput.json --csv throughput.csv
+"""
+import argparse
+from lib.local_cluster import LocalCluster
+from .common import Benchmark
+
+MODES = {'centralized': True, 'direct': False}
+BASE = {'payload_size': 0, 'topics': 1, 'subscribers': 1}
+CSV_COLUMNS = ['mode', 'dimension', 'value', 'payload_size', 'topics', 'subscribers', 'offered_rate',
+    'published_rate', 'offered_per_second', 'throughput_per_second', 'delivered', 'expected', 'lost', 'p50', 'p99',
+    'p999', 'max']
+
+class ThroughputBenchmark(Benchmark):
+
+    def __init__(self, payload_sizes=[0, 1024, 16384], topic_counts=[1, 8, 64], fan_outs=[1, 4, 16],
+        start_rate=500, sustained=0.9, duration=1.0, max_events=20000, modes=list(MODES)):
+        """ Constructor
+        args:
+        - payload_sizes (list) - payload sizes (bytes) swept
+        - topic_counts (list) - numbers of topics swept
+        - fan_outs (list) - numbers of subscribers swept
+        - start_rate (float) - events/s per publisher of the first step of a ramp
+        - sustained (float) - fraction of the offered deliveries that must be achieved
+          for a rate to count as sustained
+        - duration (float) - seconds of publishing per step
+        - max_events (int) - cap on the events a publisher publishes per step
+        - modes (list) - dissemination modes: centralized, direct
+        """
+        super().__init__(name='THROUGHPUT-BENCH')
+        self.payload_sizes = payload_sizes
+        self.topic_counts = topic_counts
+        self.fan_outs = fan_outs
+        self.start_rate = start_rate
+        self.sustained = sustained
+        self.duration = duration
+        self.max_events = max_events
+        self.modes = modes
+        self.rows = []
+        # key = (mode, payload size, topics, subscribers); the base point is in every sweep
+        self.points = {}
+
+    def run_step(self, mode, point, rate):
+        """ Run one step of a ramp; rate None publishes as fast as possible """
+        events = self.max_events if rate is None else max(100, min(self.max_events, int(rate * self.duration)))
+        cluster = LocalCluster(publishers=1, subscribers=point['subscribers'],
+            topics=[f'T{i}' for i in range(point['topics'])], max_event_count=events,
+            sleep_period=0.0 if rate is None else 1.0 / rate, centralized=MODES[mode],
+            # A step losing events ends soon after the publisher finished; the timeout
+            # only bounds slow steps, which deliver every event eventually
+            timeout=max(30.0, 10 * self.duration), quiet=True,
+            publisher_options={'payload_size': point['payload_size']})
+        elapsed = cluster.run()
+        delivered = cluster.received_count()
+        published = cluster.publish_rate()
+        step = {
+            'offered_rate': rate,
+            # The publisher's pacing (a sleep after every event) falls short of fast rates
+            'published_rate': published,
+            # Deliveries per second published: every subscriber receives every event
+            'offered_per_second': None if published is None else published * point['subscribers'],
+            'throughput_per_second': delivered / elapsed if elapsed else None,
+            'delivered': delivered,
+            'expected': cluster.expected_count(),
+            'lost': cluster.expected_count() - delivered,
+            'latency': self.summarize_latencies(cluster.latencies())
+        }
+        return step
+
+    def keeps_up(self, step):
+        """ Whether the system delivered what the publisher published """
+        if step['lost'] or step['throughput_per_second'] is None:
+            return False
+        return step['throughput_per_second'] >= self.sustained * step['offered_per_second']
+
+    def paced(self, step):
+        """ Whether the publisher published at the rate offered; past that, higher
+        rates are no different from publishing as fast as it can """
+        return step['published_rate'] is not None and step['published_rate'] >= self.sustained * step['offered_rate']
+
+    def run_point(self, mode, dimension, point):
+        """ Ramp the offered rate at one point of a sweep """
+        steps = []
+        rate = self.start_rate
+        while True:
+            step = self.run_step(mode, point, rate)
+            steps.append(step)
+            self.report_step(mode, point, step)
+            if not (self.keeps_up(step) and self.paced(step)):
+                break
+            rate *= 2
+        # As fast as the publisher can
+        step = self.run_step(mode, point, None)
+        steps.append(step)
+        self.report_step(mode, point, step)
+        throughputs = [step['throughput_per_second'] for step in steps if step['throughput_per_second']]
+        sustained = [step['published_rate'] for step in steps if self.keeps_up(step)]
+        result = dict(point, **{
+            'saturation_throughput_per_second': max(throughputs) if throughputs else None,
+            # Highest publish rate every subscriber kept up with
+            'sustained_publish_rate': max(sustained) if sustained else None,
+            'steps': steps
+        })
+        self.info(f"{mode} {dimension}={point[dimension]}: saturates at "
+            f"{result['saturation_throughput_per_second'] or 0:.0f} deliveries/s, keeps up with "
+            f"{result['sustained_publish_rate'] or 0:.0f} events/s per publisher")
+        for step in steps:
+            latency = step['latency']
+            self.rows.append([mode, dimension, point[dimension], point['payload_size'], point['topics'],
+                point['subscribers'], step['offered_rate'], step['published_rate'], step['offered_per_second'],
+                step['throughput_per_second'], step['delivered'], step['expected'], step['lost'],
+                latency['p50'], latency['p99'], latency['p999'], latency['max']])
+        return result
+
+    def report_step(self, mode, point, step):
+        latency = step['latency']
+        offered = 'max' if step['offered_rate'] is None else f"{step['offered_rate']:.0f}/s"
+        achieved = step['throughput_per_second']
+        self.info(f"{mode} payload={point['payload_size']} topics={point['topics']} "
+            f"subscribers={point['subscribers']} offered {offered}: "
+            + (f"published {step['published_rate']:.0f}/s, " if step['published_rate'] else '')
+            + (f"delivered {achieved:.0f}/s" if achieved else 'incomplete')
+            + f", lost {step['lost']}"
+            + (f", p50 {latency['p50'] * 1000:.2f} ms p99 {latency['p99'] * 1000:.2f} ms "
+                f"p999 {latency['p999'] * 1000:.2f} ms" if latency['count'] else ''))
+
+    def sweeps(self):
+        """ Return (dimension, point) for every point of the sweeps """
+        points = []
+        for dimension, values in [('payload_size', self.payload_sizes), ('topics', self.topic_counts),
+            ('subscribers', self.fan_outs)]:
+            for value in values:
+                points.append((dimension, dict(BASE, **{dimension: value})))
+        return points
+
+    def run(self):
+        results = {mode: [] for mode in self.modes}
+        for mode in self.modes:
+            for dimension, point in self.sweeps():
+                key = (mode, point['payload_size'], point['topics'], point['subscribers'])
+                if key not in self.points:
+                    self.points[key] = self.run_point(mode, dimension, point)
+                results[mode].append(dict(self.points[key], dimension=dimension))
+        return {
+            'start_rate': self.start_rate,
+            'sustained': self.sustained,
+            'duration': self.duration,
+            'max_events': self.max_events,
+            'modes': results
+        }
+
+    def write_csv(self, output=None):
+        """ Write a line per step of every ramp as CSV to output if provided """
+        if output:
+            with open(output, 'w') as f:
+                f.write(','.join(CSV_COLUMNS) + '\n')
+                for row in self.rows:
+                    f.write(','.join('' if value is None else str(value) for value in row) + '\n')
+            self.info(f"CSV written to {output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Saturation throughput and latency of centralized and direct dissemination')
+    parser.add_argument('--payload_size', type=int, action='append',
+        help='payload size in bytes to sweep; repeat (default 0, 1024, 16384)')
+    parser.add_argument('--topics', type=int, action='append',
+        help='number of topics to sweep; repeat (default 1, 8, 64)')
+    parser.add_argument('--subscribers', type=int, action='append',
+        help='fan-out (subscribers) to sweep; repeat (default 1, 4, 16)')
+    parser.add_argument('--start_rate', type=float, default=500, help='events/s per publisher of the first step')
+    parser.add_argument('--sustained', type=float, default=0.9,
+        help='fraction of the offered deliveries a sustained rate achieves')
+    parser.add_argument('--duration', type=float, default=1.0, help='seconds of publishing per step')
+    parser.add_argument('--max_events', type=int, default=20000, help='cap on events per publisher per step')
+    parser.add_argument('--mode', choices=list(MODES), action='append', help='mode to run; repeat (default both)')
+    parser.add_argument('--output', type=str, help='optional JSON file for the results')
+    parser.add_argument('--csv', type=str, help='optional CSV file with a line per step')
+    args = parser.parse_args()
+    benchmark = ThroughputBenchmark(
+        payload_sizes=args.payload_size or [0, 1024, 16384],
+        topic_counts=args.topics or [1, 8, 64],
+        fan_outs=args.subscribers or [1, 4, 16],
+        start_rate=args.start_rate,
+        sustained=args.sustained,
+        duration=args.duration,
+        max_events=args.max_events,
+        modes=args.mode or list(MODES)
+    )
+    benchmark.write_results(benchmark.run(), args.output)
+    benchmark.write_csv(args.csv)
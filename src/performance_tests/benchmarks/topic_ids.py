@@ -0,0 +1,152 @@
+""" Benchmark of compact topic IDs against topic names as the filter frame, with
+long hierarchical topic names (64 characters by default):
+- bytes on the wire: size of the events generated by Publisher.generate_publish_event
+  with and without an assigned topic ID, including ZMTP 3 frame headers (2 bytes
+  for frames up to 255 bytes, 9 bytes above)
+- filter cost: a PUB socket fans a round robin over all topics out to SUB sockets
+  each subscribed to a disjoint share of them, so every message is matched against
+  every subscription by the PUB socket and again by the receiving SUB socket.
+  Measured are the publisher's send time and the subscribers' receive time per message.
+
+Run from the src directory:
+    python3 -m performance_tests.benchmarks.topic_ids --topics 256 --messages 200000 --output topic_ids.json
+"""
+import argparse
+import logging
+import time
+import zmq
+from lib.publisher import Publisher
+from lib.topic_ids import TopicIdTable
+from .common import Benchmark
+
+def zmtp_bytes(frames):
+    """ Bytes of a multipart message on the wire: ZMTP 3 flags and size per frame, plus the frame """
+    return sum((2 if len(frame) <= 255 else 9) + len(frame) for frame in frames)
+
+class TopicIdBenchmark(Benchmark):
+
+    def __init__(self, topics=256, name_length=64, messages=200000, subscribers=16, rounds=3):
+        """ Constructor
+        args:
+        - topics (int) - number of distinct topics
+        - name_length (int) - length of every topic name
+        - messages (int) - messages published per filter run
+        - subscribers (int) - SUB sockets, each subscribed to topics/subscribers topics
+        - rounds (int) - filter runs per mode; the fastest is reported
+        """
+        super().__init__(name='TOPIC-ID-BENCH')
+        self.topics = [self.topic_name(i, name_length) for i in range(topics)]
+        self.messages = messages
+        self.subscribers = subscribers
+        self.rounds = rounds
+        self.table = TopicIdTable()
+        self.table.assign(self.topics)
+
+    @staticmethod
+    def topic_name(index, length):
+        """ Hierarchical topic name of exactly length characters; names share long
+        prefixes like real topic trees, which is what prefix filters walk through """
+        suffix = f'/sensor-{index:06d}'
+        prefix = f'fleet/region-{index % 4:02d}/site-{index % 16:03d}/building-07'
+        return prefix.ljust(length - len(suffix), '_')[:length - len(suffix)] + suffix
+
+    def wire_sizes(self):
+        """ Average event size on the wire with topic names and with topic IDs """
+        publisher = Publisher(topics=self.topics)
+        publisher.logger.setLevel(logging.WARNING)
+        sizes = {}
+        for mode in ['names', 'ids']:
+            publisher.topic_frames = (
+                {topic: self.table.frame(topic) for topic in self.topics} if mode == 'ids' else {})
+            events = [publisher.generate_publish_event(iteration=i) for i in range(len(self.topics))]
+            sizes[mode] = {
+                'filter_frame': sum(len(event[0]) for event in events) / len(events),
+                'payload': sum(len(event[1]) for event in events) / len(events),
+                'wire': sum(zmtp_bytes(event) for event in events) / len(events)
+            }
+        return sizes
+
+    def run_filter(self, mode):
+        """ Publish self.messages over all topics and time sending and receiving them """
+        frames = {
+            topic: self.table.frame(topic) if mode == 'ids' else topic.encode('utf8')
+            for topic in self.topics
+        }
+        context = zmq.Context()
+        publisher = context.socket(zmq.PUB)
+        publisher.setsockopt(zmq.SNDHWM, 0)
+        publisher.bind('inproc://topic-ids')
+        sockets = []
+        for i in range(self.subscribers):
+            socket = context.socket(zmq.SUB)
+            socket.setsockopt(zmq.RCVHWM, 0)
+            socket.connect('inproc://topic-ids')
+            for topic in self.topics[i::self.subscribers]:
+                socket.setsockopt(zmq.SUBSCRIBE, frames[topic])
+            sockets.append(socket)
+        # Let the subscriptions reach the PUB socket
+        time.sleep(0.2)
+        messages = [[frames[topic], b'x' * 100] for topic in self.topics]
+        count = len(messages)
+        started = time.perf_counter()
+        for i in range(self.messages):
+            publisher.send_multipart(messages[i % count])
+        send_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        received = 0
+        for socket in sockets:
+            while True:
+                try:
+                    socket.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                received += 1
+        receive_seconds = time.perf_counter() - started
+        context.destroy(linger=0)
+        return {
+            'received': received,
+            'send_us': send_seconds / self.messages * 1e6,
+            'receive_us': receive_seconds / max(received, 1) * 1e6,
+            'rate': received / (send_seconds + receive_seconds)
+        }
+
+    def run(self):
+        """ Compare wire size and filter cost of topic names and topic IDs """
+        results = {'topics': len(self.topics), 'name_length': len(self.topics[0]),
+            'messages': self.messages, 'subscribers': self.subscribers,
+            'wire': self.wire_sizes(), 'filter': {}}
+        for mode in ['names', 'ids']:
+            wire = results['wire'][mode]
+            self.info(f"{mode:<5} filter frame {wire['filter_frame']:.0f} B, payload {wire['payload']:.0f} B, "
+                f"{wire['wire']:.0f} B per message on the wire")
+        results['wire']['saved'] = 1 - results['wire']['ids']['wire'] / results['wire']['names']['wire']
+        self.info(f"IDs save {results['wire']['saved'] * 100:.0f}% of the bytes per message")
+        for mode in ['names', 'ids']:
+            runs = [self.run_filter(mode) for _ in range(self.rounds)]
+            stats = results['filter'][mode] = max(runs, key=lambda run: run['rate'])
+            self.info(f"{mode:<5} send {stats['send_us']:.2f} us/msg, receive {stats['receive_us']:.2f} us/msg, "
+                f"{stats['rate']:.0f} msgs/s ({stats['received']} received)")
+        results['filter']['send_speedup'] = (
+            results['filter']['names']['send_us'] / results['filter']['ids']['send_us'])
+        self.info(f"Publisher send is {results['filter']['send_speedup']:.2f}x faster with IDs")
+        return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Bytes on the wire and filter cost of topic IDs vs topic names')
+    parser.add_argument('--topics', type=int, default=256, help='number of distinct topics')
+    parser.add_argument('--name_length', type=int, default=64, help='characters per topic name')
+    parser.add_argument('--messages', type=int, default=200000, help='messages per filter run')
+    parser.add_argument('--subscribers', type=int, default=16,
+        help='SUB sockets, each subscribed to an equal share of the topics')
+    parser.add_argument('--rounds', type=int, default=3, help='filter runs per mode; the fastest is reported')
+    parser.add_argument('--output', type=str, help='optional JSON file for the results')
+    args = parser.parse_args()
+    benchmark = TopicIdBenchmark(
+        topics=args.topics,
+        name_length=args.name_length,
+        messages=args.messages,
+        subscribers=args.subscribers,
+        rounds=args.rounds
+    )
+    benchmark.write_results(benchmark.run(), args.output)
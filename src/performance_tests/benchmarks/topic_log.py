@@ -0,0 +1,137 @@
+""" Benchmark of the durable topic log: raw append throughput of a TopicLog,
+and forwarding throughput of the centralized broker's send path (the real
+Broker.send over inproc:// sockets) with and without appending every message
+to the log before fan-out. The log is measured with group commit and with a
+flush after every message.
+
+Run from the src directory:
+    python3 -m performance_tests.benchmarks.topic_log --messages 200000 --output topic_log.json
+"""
+import argparse
+import pickle
+import shutil
+import tempfile
+import time
+import zmq
+from lib.broker import Broker
+from lib.topic_log import TopicLog
+from .common import Benchmark
+
+class TopicLogBenchmark(Benchmark):
+
+    def __init__(self, messages=200000, payload_bytes=200, fsync_messages=1000,
+        unbatched_messages=5000, directory=None):
+        """ Constructor
+        args:
+        - messages (int) - messages per run
+        - payload_bytes (int) - approximate size of each pickled event
+        - fsync_messages (int) - group commit batch size of the logged runs
+        - unbatched_messages (int) - messages of the runs flushing after every message
+          (much slower, so fewer)
+        - directory (str) - where to create the logs; a temporary directory by default
+        """
+        super().__init__(name='TOPIC-LOG-BENCH')
+        self.messages = messages
+        self.payload_bytes = payload_bytes
+        self.fsync_messages = fsync_messages
+        self.unbatched_messages = unbatched_messages
+        self.directory = directory
+
+    def payload(self, i):
+        event = {'publisher': 'bench', 'topic': 'A', 'seq': i, 'publish_time': time.time()}
+        event['padding'] = 'x' * max(0, self.payload_bytes - len(pickle.dumps(event)))
+        return pickle.dumps(event)
+
+    def run_append(self, directory, messages, fsync_messages):
+        """ Append messages straight to a TopicLog; return messages per second """
+        log = TopicLog(directory, fsync_messages=fsync_messages)
+        payload = self.payload(0)
+        started = time.time()
+        for _ in range(messages):
+            log.append(payload)
+        log.sync()
+        elapsed = time.time() - started
+        log.close()
+        return {'messages': messages, 'seconds': elapsed, 'rate': messages / elapsed}
+
+    def run_forwarding(self, run_name, messages, log_dir=None, fsync_messages=None):
+        """ Queue messages on the broker's receive socket, then time Broker.send
+        forwarding all of them; return messages per second """
+        context = zmq.Context()
+        broker = Broker(centralized=True, log_dir=log_dir)
+        broker.logger.setLevel('WARNING')
+        broker.context = context
+        if log_dir and fsync_messages:
+            broker.topic_logs.log_options['fsync_messages'] = fsync_messages
+        publisher = context.socket(zmq.PUSH)
+        publisher.setsockopt(zmq.SNDHWM, 0)
+        publisher.bind(f'inproc://{run_name}-in')
+        receive_socket = context.socket(zmq.PULL)
+        receive_socket.setsockopt(zmq.RCVHWM, 0)
+        receive_socket.connect(f'inproc://{run_name}-in')
+        broker.receive_socket_dict['A'] = receive_socket
+        broker.send_socket_dict['A'] = broker.create_send_socket('A')
+        broker.send_socket_dict['A'].bind(f'inproc://{run_name}-out')
+        for i in range(messages):
+            publisher.send_multipart([b'A', self.payload(i)])
+        receive_socket.poll(1000)
+        started = time.time()
+        forwarded = 0
+        while forwarded < messages:
+            if broker.send('A'):
+                forwarded += 1
+            elif not receive_socket.poll(1000):
+                break
+        if broker.topic_logs:
+            broker.topic_logs.close()
+        elapsed = time.time() - started
+        context.destroy(linger=0)
+        return {'messages': forwarded, 'seconds': elapsed, 'rate': forwarded / elapsed}
+
+    def run(self):
+        """ Compare in-memory forwarding against forwarding with the topic log """
+        directory = self.directory or tempfile.mkdtemp(prefix='topic-log-bench-')
+        results = {'messages': self.messages, 'payload_bytes': self.payload_bytes,
+            'fsync_messages': self.fsync_messages, 'runs': {}}
+        try:
+            results['runs']['append_group_commit'] = self.run_append(
+                f'{directory}/append-batched', self.messages, self.fsync_messages)
+            results['runs']['append_fsync_each'] = self.run_append(
+                f'{directory}/append-each', self.unbatched_messages, 1)
+            results['runs']['forward_in_memory'] = self.run_forwarding(
+                'in-memory', self.messages)
+            results['runs']['forward_logged_group_commit'] = self.run_forwarding(
+                'logged', self.messages, log_dir=f'{directory}/forward-batched',
+                fsync_messages=self.fsync_messages)
+            results['runs']['forward_logged_fsync_each'] = self.run_forwarding(
+                'logged-each', self.unbatched_messages, log_dir=f'{directory}/forward-each',
+                fsync_messages=1)
+        finally:
+            if not self.directory:
+                shutil.rmtree(directory)
+        for run_name, stats in results['runs'].items():
+            self.info(f"{run_name:<28} {stats['messages']} msgs in {stats['seconds']:.2f}s "
+                f"= {stats['rate']:.0f} msgs/s")
+        return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Append throughput of the durable topic log vs in-memory forwarding')
+    parser.add_argument('--messages', type=int, default=200000, help='messages per run')
+    parser.add_argument('--payload_bytes', type=int, default=200, help='size of each event')
+    parser.add_argument('--fsync_messages', type=int, default=1000,
+        help='group commit batch size of the logged runs')
+    parser.add_argument('--unbatched_messages', type=int, default=5000,
+        help='messages of the runs that flush after every message')
+    parser.add_argument('--directory', type=str,
+        help='directory for the logs (use the disk you want to measure); temporary by default')
+    parser.add_argument('--output', type=str, help='optional JSON file for the results')
+    args = parser.parse_args()
+    benchmark = TopicLogBenchmark(
+        messages=args.messages,
+        payload_bytes=args.payload_bytes,
+        fsync_messages=args.fsync_messages,
+        unbatched_messages=args.unbatched_messages,
+        directory=args.directory
+    )
+    benchmark.write_results(benchmark.run(), args.output)
@@ -0,0 +1,140 @@
+""" Benchmark of the process-wide ZooKeeper session: N subscriber entities in one
+process follow the broker znode either through one shared session or through a
+session each (the previous behaviour). Measured for both:
+- sessions, client threads and ZooKeeper operations needed to start the entities
+- server-side connections and watches, if the server answers the 'mntr' command
+  (add it to 4lw.commands.whitelist)
+- fan-out latency: time from a write of the znode until every entity's watch
+  callback has seen the new value
+
+Unlike the other benchmarks this one needs a running ZooKeeper server. It uses
+its own znode (/benchmark_broker) so it does not disturb a running system.
+With --zookeeper_hosts memory://<name> it runs against the in-memory ensemble,
+which counts sessions and watches the same way but has no network or server
+threads, so only the client-side numbers carry over.
+
+Run from the src directory:
+    python3 -m performance_tests.benchmarks.zk_sessions --entities 500 --output zk_sessions.json
+"""
+import argparse
+import logging
+import threading
+import time
+from lib.subscriber import Subscriber
+from lib.zookeeper_client import kazoo_client
+from .common import Benchmark
+
+class ZkSessionBenchmark(Benchmark):
+
+    def __init__(self, entities=500, zookeeper_hosts=['127.0.0.1:2181'], changes=5):
+        """ Constructor
+        args:
+        - entities (int) - subscriber entities in this process
+        - zookeeper_hosts (list) - ZooKeeper ensemble to use
+        - changes (int) - znode writes timed for the fan-out latency
+        """
+        super().__init__(name='ZK-SESSION-BENCH')
+        self.entities = entities
+        self.zookeeper_hosts = zookeeper_hosts
+        self.changes = changes
+        self.path = '/benchmark_broker'
+
+    def server_stats(self, zk):
+        """ Return connection and watch counts from the server's 'mntr' output, if allowed """
+        try:
+            lines = zk.command(b'mntr').splitlines()
+        except Exception:
+            return {}
+        stats = dict(line.split('\t', 1) for line in lines if '\t' in line)
+        return {key: int(stats[key]) for key in ['zk_num_alive_connections', 'zk_watch_count']
+            if key in stats}
+
+    def run_mode(self, admin, shared):
+        """ Start self.entities entities following self.path and time znode changes """
+        threads_before = threading.active_count()
+        server_before = self.server_stats(admin)
+        seen = {}
+        changed = threading.Condition()
+        def listener(index):
+            def changed_znode(data, stat, event):
+                with changed:
+                    seen[index] = data
+                    changed.notify_all()
+            return changed_znode
+        entities = []
+        started = time.time()
+        for i in range(self.entities):
+            entity = Subscriber(topics=['A'], zookeeper_hosts=self.zookeeper_hosts)
+            entity.logger.setLevel(logging.WARNING)
+            entity.zk_name = self.path
+            entity.share_zk_session = shared
+            entity.connect_zk()
+            entity.start_session()
+            entity.get_znode_value()
+            entity.watch_znode(self.path, listener(i))
+            entities.append(entity)
+        startup_seconds = time.time() - started
+        sessions = {id(entity.zk_session): entity.zk_session for entity in entities}
+        ops = sum(session.stats()['total'] for session in sessions.values())
+        threads = threading.active_count() - threads_before
+        server = self.server_stats(admin)
+        latencies = []
+        for change in range(self.changes):
+            value = f'10.0.0.{change},5555,5556'.encode('utf-8')
+            written = time.time()
+            admin.set(self.path, value)
+            with changed:
+                while sum(1 for data in seen.values() if data == value) < self.entities:
+                    if not changed.wait(30):
+                        raise RuntimeError('Entities did not see the znode change within 30s')
+            latencies.append(time.time() - written)
+        for entity in entities:
+            entity.stop_session()
+        return {
+            'sessions': len(sessions),
+            'client_threads': threads,
+            'startup_ops': ops,
+            'startup_seconds': startup_seconds,
+            'server_connections': server.get('zk_num_alive_connections', 0)
+                - server_before.get('zk_num_alive_connections', 0) if server else None,
+            'server_watches': server.get('zk_watch_count', 0)
+                - server_before.get('zk_watch_count', 0) if server else None,
+            'fan_out_latency': self.summarize_latencies(latencies)
+        }
+
+    def run(self):
+        """ Compare a session per entity with one session shared by all entities """
+        admin = kazoo_client(','.join(self.zookeeper_hosts))
+        admin.start(timeout=10)
+        admin.ensure_path(self.path)
+        admin.set(self.path, b'10.0.0.254,5555,5556')
+        results = {'entities': self.entities, 'modes': {}}
+        try:
+            for name, shared in [('per_entity', False), ('shared', True)]:
+                stats = results['modes'][name] = self.run_mode(admin, shared)
+                self.info(f"{name:<10} {stats['sessions']} sessions, {stats['client_threads']} client threads, "
+                    f"{stats['startup_ops']} ZooKeeper ops to start in {stats['startup_seconds']:.2f}s, "
+                    f"server connections {stats['server_connections']} watches {stats['server_watches']}, "
+                    f"fan-out p50 {stats['fan_out_latency']['p50'] * 1000:.1f} ms "
+                    f"max {stats['fan_out_latency']['max'] * 1000:.1f} ms")
+        finally:
+            admin.delete(self.path)
+            admin.stop()
+            admin.close()
+        return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='ZooKeeper sessions, threads, operations and watch fan-out of N in-process entities')
+    parser.add_argument('--entities', type=int, default=500, help='subscriber entities in the process')
+    parser.add_argument('--zookeeper_hosts', type=str, action='append',
+        help='ZooKeeper host:port; repeat for an ensemble (default 127.0.0.1:2181)')
+    parser.add_argument('--changes', type=int, default=5, help='znode writes timed for fan-out latency')
+    parser.add_argument('--output', type=str, help='optional JSON file for the results')
+    args = parser.parse_args()
+    benchmark = ZkSessionBenchmark(
+        entities=args.entities,
+        zookeeper_hosts=args.zookeeper_hosts or ['127.0.0.1:2181'],
+        changes=args.changes
+    )
+    benchmark.write_results(benchmark.run(), args.output)
@@ -15,7 +15,8 @@ class CentralizedPerformanceTest(PerformanceTest):
         self.ZOOKEEPER_INDEX = 0
         self.BROKER_1_INDEX = 1
         self.BROKER_2_INDEX = 2
-        self.WAIT_FOR_ZK_START = 5
+        # Upper bound; the test goes on as soon as the server answers
+        self.WAIT_FOR_ZK_START = 30
 
     def set_logger(self):
         self.prefix = {'prefix': f'CENTRALTEST-'}
@@ -33,6 +34,7 @@ class CentralizedPerformanceTest(PerformanceTest):
             f'python3 driver.py '
             '--broker 1 --verbose '
             f'--zookeeper_host {zookeeper_host} '
+            f'--barrier {self.barrier} '
             f'--indefinite ' # max event count only matters for subscribers who write files at end.
             f'--centralized ' # CENTRALIZED TESTING
             # ZooKeeper test - autokill first broker after 15 seconds to allow second leader election
@@ -50,6 +52,7 @@ class CentralizedPerformanceTest(PerformanceTest):
             f'python3 driver.py '
             '--broker 1 --verbose '
             f'--zookeeper_host {zookeeper_host} '
+            f'--barrier {self.barrier} '
             f'--indefinite ' # max event count only matters for subscribers who write files at end.
             f'--centralized ' # CENTRALIZED TESTING
             f'&> {log_folder}/broker2.log &'
@@ -72,6 +75,7 @@ class CentralizedPerformanceTest(PerformanceTest):
                 'python3 driver.py '
                 '--subscriber 1 '
                 f'--zookeeper_host {zookeeper_host} '
+                f'--barrier {self.barrier} '
                 '--topics A --topics B --topics C '
                 f'--max_event_count {self.num_events} '
                 f'--broker_address {broker_ip} '
@@ -94,6 +98,7 @@ class CentralizedPerformanceTest(PerformanceTest):
                 f'python3 driver.py '
                 '--publisher 1 '
                 f'--zookeeper_host {zookeeper_host} '
+                f'--barrier {self.barrier} '
                 f'--sleep {self.event_interval} '
                 f'--max_event_count {self.num_events} '
                 f'--indefinite ' # max event count only matters for subscribers who write files at end.
@@ -123,11 +128,12 @@ class CentralizedPerformanceTest(PerformanceTest):
             f.write('pass,fail,comments\n')
             f.write(f'{self.successes},{self.failures},{",".join(self.comments)}')
 
-    def wait_for_execution(self):
-        # Scale the wait time by a constant factor and with number of hosts
+    def wait_for_execution(self, network, zookeeper_host, num_subscribers):
+        # Scale the upper bound by a constant factor and with number of hosts; every
+        # subscriber signals done once its data file is written
         wait_time = self.wait_factor * (self.num_events * self.event_interval)
-        self.debug(f"Waiting for {wait_time} seconds for data to generate...")
-        time.sleep(wait_time)
+        self.debug(f"Waiting for data to generate (at most {wait_time} seconds)...")
+        self.wait_for_barrier(network, zookeeper_host, 'done', num_subscribers, wait_time, 'subscriber')
         self.debug(f"Finished waiting!")
         self.debug("Verifying that expected data was written...")
 
@@ -171,6 +177,7 @@ class CentralizedPerformanceTest(PerformanceTest):
         network_name - alias of network, used to create folders for data/logs
         """
         self.prefix['prefix'] = f'CENTRAL-NET-{network_name}-TEST - '
+        self.barrier = f'/barriers/centralized/{network_name}'
         self.successes = 0
         self.failures = 0
         self.comments = []
@@ -189,13 +196,18 @@ class CentralizedPerformanceTest(PerformanceTest):
             )
             zookeeper_host = f'{self.setup_zookeeper_server(network, log_folder, self.WAIT_FOR_ZK_START)}:2181'
             broker_ip_1, broker_ip_2 = self.setup_brokers(network,log_folder, zookeeper_host)
+            # Clients start once a broker leads
+            self.wait_for_barrier(network, zookeeper_host, 'ready', 1, self.READY_TIMEOUT, 'broker')
             subscribers = self.setup_subscribers(network,num_subscribers,broker_ip_1,
                 data_folder,log_folder, zookeeper_host
             )
+            # Publishers start once every subscriber listens, so none misses the first events
+            self.wait_for_barrier(network, zookeeper_host, 'ready', num_subscribers, self.READY_TIMEOUT,
+                'subscriber')
             publishers = self.setup_publishers(network, num_subscribers, num_hosts,
                 num_publishers, broker_ip_1, log_folder, zookeeper_host)
 
-            self.wait_for_execution()
+            self.wait_for_execution(network, zookeeper_host, num_subscribers)
             self.verify_data_written(subscribers,data_folder,test_results_file)
             self.kill_zookeeper_server(network, log_folder)
             self.terminate_test(subscribers, publishers, network_name, network)
@@ -15,7 +15,8 @@ class DecentralizedPerformanceTest(PerformanceTest):
         self.ZOOKEEPER_INDEX = 0
         self.BROKER_1_INDEX = 1
         self.BROKER_2_INDEX = 2
-        self.WAIT_FOR_ZK_START = 5
+        # Upper bound; the test goes on as soon as the server answers
+        self.WAIT_FOR_ZK_START = 30
 
 
     def set_logger(self):
@@ -33,6 +34,7 @@ class DecentralizedPerformanceTest(PerformanceTest):
             f'python3 driver.py '
             '--broker 1 --verbose '
             f'--zookeeper_host {zookeeper_host} '
+            f'--barrier {self.barrier} '
             f'--indefinite ' # max event count only matters for subscribers who write files at end.
             # Zookeeper test - autokill first broker after 15 seconds to allow second leader election
             f'--autokill 15'
@@ -47,6 +49,7 @@ class DecentralizedPerformanceTest(PerformanceTest):
             f'python3 driver.py '
             '--broker 1 --verbose '
             f'--zookeeper_host {zookeeper_host} '
+            f'--barrier {self.barrier} '
             f'--indefinite ' # max event count only matters for subscribers who write files at end.
             f'&> {log_folder}/broker2.log &'
         )
@@ -68,6 +71,7 @@ class DecentralizedPerformanceTest(PerformanceTest):
                 '--publisher 1 '
                 f'--sleep {self.event_interval} '
                 f'--zookeeper_host {zookeeper_host} '
+                f'--barrier {self.barrier} '
                 f'--indefinite ' # max event count only matters for subscribers who write files at end.
                 '--topics A --topics B --topics C '
                 f'--broker_address {broker_ip} '
@@ -89,6 +93,7 @@ class DecentralizedPerformanceTest(PerformanceTest):
                 '--subscriber 1 '
                 '--topics A --topics B --topics C '
                 f'--zookeeper_host {zookeeper_host} '
+                f'--barrier {self.barrier} '
                 f'--max_event_count {self.num_events} '
                 f'--broker_address {broker_ip} '
                 f'--filename {data_folder}/subscriber-{index}.csv '
@@ -110,11 +115,12 @@ class DecentralizedPerformanceTest(PerformanceTest):
         network.stop()
         self.debug(f"Network '{network_name}' stopped!")
 
-    def wait_for_execution(self):
-        # Scale the wait time by a constant factor and with number of hosts
+    def wait_for_execution(self, network, zookeeper_host, num_subscribers):
+        # Scale the upper bound by a constant factor and with number of hosts; every
+        # subscriber signals done once its data file is written
         wait_time = self.wait_factor * (self.num_events * self.event_interval)
-        self.debug(f"Waiting for {wait_time} seconds for data to generate...")
-        time.sleep(wait_time)
+        self.debug(f"Waiting for data to generate (at most {wait_time} seconds)...")
+        self.wait_for_barrier(network, zookeeper_host, 'done', num_subscribers, wait_time, 'subscriber')
         self.debug(f"Finished waiting!")
 
     def verify_data_written(self, subscribers, data_folder, test_results_file):
@@ -164,6 +170,7 @@ class DecentralizedPerformanceTest(PerformanceTest):
         network_name - alias of network, used to create folders for data/logs
         """
         self.prefix['prefix'] = f'DECENTRAL-NET-{network_name}-TEST - '
+        self.barrier = f'/barriers/decentralized/{network_name}'
         self.successes = 0
         self.failures = 0
         self.comments = []
@@ -185,12 +192,17 @@ class DecentralizedPerformanceTest(PerformanceTest):
             # First host is zookeeper server.
             zookeeper_host = f'{self.setup_zookeeper_server(network, log_folder, self.WAIT_FOR_ZK_START)}:2181'
             broker_ip_1, broker_ip_2 = self.setup_brokers(log_folder, network, zookeeper_host)
+            # Clients start once a broker leads
+            self.wait_for_barrier(network, zookeeper_host, 'ready', 1, self.READY_TIMEOUT, 'broker')
             subscribers = self.setup_subscribers(num_subscribers, network,
                 broker_ip_1, data_folder, log_folder, zookeeper_host)
+            # Publishers start once every subscriber listens, so none misses the first events
+            self.wait_for_barrier(network, zookeeper_host, 'ready', num_subscribers, self.READY_TIMEOUT,
+                'subscriber')
             publishers = self.setup_publishers(num_publishers, network, num_subscribers,
                                 num_hosts, broker_ip_1, log_folder,zookeeper_host)
 
-            self.wait_for_execution()
+            self.wait_for_execution(network, zookeeper_host, num_subscribers)
             self.verify_data_written(subscribers, data_folder, test_results_file)
             self.kill_zookeeper_server(network, log_folder)
             self.terminate_test(subscribers, publishers, network_name, network)
@@ -10,10 +10,15 @@ class PerformanceTest:
     def __init__(self, num_events=50, event_interval=0.3, wait_factor=10):
         self.num_events = num_events
         self.event_interval = event_interval
-        # Sleep self.wait_factor times longer than num events * event interval
-        # to allow the network to initialize and all events to run.
-        # Files not written by subscriber until it reaches num_events.
+        # Wait at most self.wait_factor times longer than num events * event interval
+        # for all events to run. Files not written by subscriber until it reaches
+        # num_events; each subscriber signals the barrier once its file is written.
         self.wait_factor = wait_factor
+        # Barrier znode of the current run (see lib/barrier.py); entities signal
+        # ready and done below it and the test proceeds as soon as they have
+        self.barrier = None
+        # Upper bound in seconds for the brokers and subscribers to be ready
+        self.READY_TIMEOUT = 30
         self.prefix = {'prefix': ''}
         self.successes = 0
         self.failures = 0
@@ -42,18 +47,52 @@ class PerformanceTest:
         self.wait_factor = factor
 
     def setup_zookeeper_server(self, network, log_folder, zkStartWait):
-        """ Make the first host in the network the zookeeper server. MUST be created first."""
+        """ Make the first host in the network the zookeeper server. MUST be created first.
+        Returns as soon as the server answers (at most zkStartWait seconds), with the
+        barrier of the run cleared of signals left by an earlier run. """
         self.debug("Starting zookeeper service, just a moment...")
         zookeeper_start_command = (
             '/opt/zookeeper/bin/zkServer.sh start '
             f'&> {log_folder}/zkServer.log &'
         )
         network.hosts[self.ZOOKEEPER_INDEX].cmd(zookeeper_start_command)
-        time.sleep(zkStartWait)
-        return network.hosts[self.ZOOKEEPER_INDEX].IP()
+        zookeeper_ip = network.hosts[self.ZOOKEEPER_INDEX].IP()
+        if not self.orchestrate(network, f'{zookeeper_ip}:2181',
+            f'--wait_zookeeper --remove_barrier --barrier {self.barrier} --barrier_timeout {zkStartWait}'):
+            self.error(f"ZooKeeper did not answer within {zkStartWait} seconds")
+        return zookeeper_ip
+
+    def orchestrate(self, network, zookeeper_host, options):
+        """ Run a driver.py orchestration command (--wait_zookeeper, --wait_barrier,
+        --remove_barrier) on the ZooKeeper host, which every entity can reach, and
+        return True if it succeeded. Blocks until the command returns. """
+        out = network.hosts[self.ZOOKEEPER_INDEX].cmd(
+            'python3 driver.py '
+            f'--zookeeper_host {zookeeper_host} '
+            f'{options} ; echo $?'
+        )
+        lines = out.strip().splitlines()
+        return bool(lines) and lines[-1].strip() == '0'
+
+    def wait_for_barrier(self, network, zookeeper_host, stage, count, timeout, role):
+        """ Wait until count entities of a role (broker, publisher, subscriber or relay)
+        reached a stage (ready or done) of the run's barrier or timeout seconds passed;
+        return True if they did """
+        self.debug(f"Waiting for {count} {role}s to be {stage} (at most {timeout} seconds)...")
+        started = time.time()
+        reached = self.orchestrate(network, zookeeper_host,
+            f'--barrier {self.barrier} --wait_barrier {stage} --barrier_role {role} '
+            f'--barrier_count {count} --barrier_timeout {timeout}')
+        if reached:
+            self.debug(f"{count} {role}s {stage} after {time.time() - started:.1f} seconds")
+        else:
+            self.error(f"Fewer than {count} {role}s {stage} after {timeout} seconds")
+        return reached
 
     def kill_zookeeper_server(self, network, log_folder):
         self.debug("Stopping zookeeper service, just a moment...")
+        zookeeper_ip = network.hosts[self.ZOOKEEPER_INDEX].IP()
+        self.orchestrate(network, f'{zookeeper_ip}:2181', f'--remove_barrier --barrier {self.barrier}')
         zookeeper_stop_command = (
             '/opt/zookeeper/bin/zkServer.sh stop '
             f'&> {log_folder}/zkServer.log &'
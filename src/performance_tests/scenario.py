@@ -0,0 +1,387 @@
+""" Scenario runner: the performance tests of centralized.py and decentralized.py
+without Mininet. A declarative spec (JSON) describes each pub/sub system (brokers
+and when they are autokilled, publishers, subscribers, topics, publish rate,
+payload size, dissemination mode), and the runner starts the same driver.py
+entities as processes of this machine, talking over ipc:// (or tcp:// on
+loopback). Runs need neither root nor Mininet, only a ZooKeeper server, and
+several scenarios can run at once: each one gets a ZooKeeper namespace, a socket
+directory (or a port range) and an output folder of its own.
+
+A run is orchestrated with the barriers of the Mininet tests (see
+lib/barrier.py): the brokers start, then the subscribers once a broker leads,
+then the publishers once every subscriber is ready. The run ends when every
+subscriber is done (its data file written), when every subscriber process has
+exited, or at the scenario's timeout; the processes still running are then
+terminated. Per scenario the runner writes to <output>/<name>/:
+- data/subscriber-<i>.csv - the subscribers' data files
+- logs/<entity>-<i>.log - the entities' output
+- results.json - pass/fail per subscriber, exit codes, throughput and latency
+and, for all scenarios, <output>/summary.csv.
+
+Spec: a JSON object with a list of "scenarios" and optional "defaults" applied
+to each of them (see Scenario for the fields), e.g. scenarios/example.json.
+Run from the src directory:
+    python3 -m performance_tests.scenario performance_tests/scenarios/example.json --parallel 2
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from kazoo.exceptions import NoNodeError
+from lib.barrier import READY, DONE, wait_barrier
+from lib.zookeeper_client import wait_for_zookeeper
+from .benchmarks.common import Benchmark
+
+__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+# driver.py and the lib package
+SRC_DIR = os.path.dirname(__location__)
+
+MODES = ['centralized', 'decentralized']
+TRANSPORTS = ['ipc', 'tcp']
+
+class Scenario:
+    """ One pub/sub system to run """
+
+    def __init__(self, name, mode='centralized', brokers=1, publishers=1, subscribers=1,
+        topics=['A'], events=100, rate=10.0, payload_size=0, autokill=[], transport='ipc',
+        timeout=120.0, broker_args=[], publisher_args=[], subscriber_args=[]):
+        """ Constructor
+        args:
+        - name (str) - name of the scenario and of its output folder
+        - mode (str) - 'centralized' (through the broker) or 'decentralized' (direct)
+        - brokers (int) - brokers contending for leadership; the others are warm backups
+        - publishers (int) - publishers, a process each
+        - subscribers (int) - subscribers, a process each
+        - topics (list) - topics every publisher publishes and every subscriber subscribes to
+        - events (int) - events each subscriber receives before it writes its data file
+        - rate (float) - events per second each publisher publishes (until the run ends)
+        - payload_size (int) - bytes of payload carried by every event
+        - autokill (list) - seconds after which broker i stops (driver.py --autokill);
+          null or a missing entry: it runs until the end
+        - transport (str) - 'ipc' (Unix domain sockets) or 'tcp' (loopback)
+        - timeout (float) - upper bound in seconds of each stage of the run
+        - broker_args (list) - further driver.py arguments of the brokers
+        - publisher_args (list) - further driver.py arguments of the publishers
+        - subscriber_args (list) - further driver.py arguments of the subscribers
+        """
+        if mode not in MODES:
+            raise ValueError(f'Scenario {name}: mode must be one of {MODES}, not {mode}')
+        if transport not in TRANSPORTS:
+            raise ValueError(f'Scenario {name}: transport must be one of {TRANSPORTS}, not {transport}')
+        if brokers < 1 or publishers < 1 or subscribers < 1:
+            raise ValueError(f'Scenario {name}: needs at least one broker, publisher and subscriber')
+        if rate <= 0:
+            raise ValueError(f'Scenario {name}: rate must be positive')
+        if publishers > ScenarioRunner.PORTS_PER_SCENARIO - ScenarioRunner.FIRST_PUBLISHER_PORT:
+            raise ValueError(f'Scenario {name}: too many publishers for its port range')
+        self.name = name
+        self.mode = mode
+        self.brokers = brokers
+        self.publishers = publishers
+        self.subscribers = subscribers
+        self.topics = topics
+        self.events = events
+        self.rate = rate
+        self.payload_size = payload_size
+        self.autokill = autokill
+        self.transport = transport
+        self.timeout = timeout
+        self.broker_args = broker_args
+        self.publisher_args = publisher_args
+        self.subscriber_args = subscriber_args
+
+    @classmethod
+    def from_dict(cls, spec, defaults={}):
+        """ Return the Scenario a spec entry describes; raises ValueError for unknown fields """
+        fields = dict(defaults, **spec)
+        try:
+            return cls(**fields)
+        except TypeError as e:
+            raise ValueError(f"Invalid scenario {fields.get('name')}: {e}")
+
+def load_scenarios(filename):
+    """ Return the scenarios of a spec file """
+    with open(filename) as f:
+        spec = json.load(f)
+    defaults = spec.get('defaults', {})
+    scenarios = [Scenario.from_dict(entry, defaults) for entry in spec['scenarios']]
+    names = [scenario.name for scenario in scenarios]
+    if len(set(names)) != len(names):
+        raise ValueError('Scenario names must be unique; they name the output folders')
+    return scenarios
+
+class ScenarioRunner(Benchmark):
+    """ Runs scenarios as processes of this machine and collects their data files """
+    # tcp: scenario i uses ports FIRST_PORT + i * PORTS_PER_SCENARIO and up; above
+    # the range the broker picks its own ports from (10000-20000)
+    FIRST_PORT = 20000
+    PORTS_PER_SCENARIO = 100
+    # Offset of the first publisher's port within a scenario's range
+    FIRST_PUBLISHER_PORT = 10
+    # Seconds between checks on the processes while waiting for the subscribers
+    SUPERVISE_INTERVAL = 1.0
+    # Seconds a terminated process gets before it is killed
+    TERMINATE_TIMEOUT = 5.0
+
+    def __init__(self, zookeeper_hosts='127.0.0.1:2181', output='scenario_results', parallel=1):
+        """ Constructor
+        args:
+        - zookeeper_hosts (str) - ZooKeeper ensemble every scenario uses, each in a namespace of its own
+        - output (str) - folder of the results
+        - parallel (int) - scenarios run at once
+        """
+        super().__init__(name='SCENARIO')
+        self.zookeeper_hosts = zookeeper_hosts
+        # Absolute: the entities run in the src directory
+        self.output = os.path.abspath(output)
+        self.parallel = parallel
+        self.zk = None
+
+    def driver_command(self, run, role_args):
+        """ Return the driver.py command line of an entity of a run """
+        scenario = run['scenario']
+        command = [sys.executable, 'driver.py'] + role_args + [
+            '--zookeeper_hosts', self.zookeeper_hosts,
+            '--zk_namespace', run['namespace'],
+            '--barrier', run['barrier'],
+            '--transport', scenario.transport,
+            '--host_address', '127.0.0.1' if scenario.transport == 'tcp' else 'local'
+        ]
+        if scenario.transport == 'ipc':
+            command += ['--ipc_dir', run['ipc_dir']]
+        if scenario.mode == 'centralized':
+            command.append('--centralized')
+        return command
+
+    def broker_args(self, run, i):
+        scenario = run['scenario']
+        port = run['first_port']
+        args = ['--broker', '1', '--indefinite', '--pub_reg_port', str(port),
+            '--sub_reg_port', str(port + 1), '--replay_port', str(port + 2),
+            '--replication_port', str(port + 3)]
+        if i < len(scenario.autokill) and scenario.autokill[i] is not None:
+            args += ['--autokill', str(int(scenario.autokill[i]))]
+        return args + scenario.broker_args
+
+    def subscriber_args(self, run, i):
+        scenario = run['scenario']
+        args = ['--subscriber', '1', '--max_event_count', str(scenario.events),
+            '--filename', self.data_file(run, i)]
+        for topic in scenario.topics:
+            args += ['--topics', topic]
+        return args + scenario.subscriber_args
+
+    def publisher_args(self, run, i):
+        scenario = run['scenario']
+        # Publishers publish until the run ends, like in the Mininet tests
+        args = ['--publisher', '1', '--indefinite', '--sleep', str(1.0 / scenario.rate),
+            '--bind_port', str(run['first_port'] + self.FIRST_PUBLISHER_PORT + i),
+            '--payload_size', str(scenario.payload_size)]
+        for topic in scenario.topics:
+            args += ['--topics', topic]
+        return args + scenario.publisher_args
+
+    def data_file(self, run, i):
+        return os.path.join(run['folder'], 'data', f'subscriber-{i}.csv')
+
+    def start(self, run, role, i, role_args):
+        """ Start an entity of a run as a process, its output going to its log file """
+        log = open(os.path.join(run['folder'], 'logs', f'{role}-{i}.log'), 'w')
+        process = subprocess.Popen(self.driver_command(run, role_args), cwd=SRC_DIR,
+            stdout=log, stderr=subprocess.STDOUT)
+        log.close()
+        run['processes'].append((f'{role}-{i}', process))
+        return process
+
+    def wait(self, run, stage, count, role):
+        """ Wait until count entities of a role of a run reached a stage; return True if they did """
+        scenario = run['scenario']
+        names = wait_barrier(self.zk, run['barrier_path'], stage, count, scenario.timeout, role=role)
+        if len(names) < count:
+            self.error(f'{scenario.name}: {len(names)} of {count} {role}s {stage} '
+                f'after {scenario.timeout}s')
+        return len(names) >= count
+
+    def supervise(self, run, subscribers):
+        """ Wait until every subscriber is done, every subscriber process has exited,
+        or the timeout passed; return True if every subscriber is done """
+        scenario = run['scenario']
+        deadline = time.time() + scenario.timeout
+        while True:
+            # Brokers (e.g. autokilled ones) and publishers signal done too
+            names = wait_barrier(self.zk, run['barrier_path'], DONE, len(subscribers),
+                max(0.0, min(self.SUPERVISE_INTERVAL, deadline - time.time())), role='subscriber')
+            if len(names) >= len(subscribers):
+                return True
+            if all(process.poll() is not None for process in subscribers):
+                self.error(f'{scenario.name}: every subscriber exited, {len(names)} done')
+                return False
+            if time.time() >= deadline:
+                self.error(f'{scenario.name}: {len(names)} of {len(subscribers)} subscribers done '
+                    f'after {scenario.timeout}s')
+                return False
+
+    def terminate(self, run):
+        """ Stop the processes of a run still running; return their exit codes """
+        for name, process in run['processes']:
+            if process.poll() is None:
+                process.terminate()
+        exit_codes = {}
+        for name, process in run['processes']:
+            try:
+                exit_codes[name] = process.wait(self.TERMINATE_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                exit_codes[name] = process.wait()
+        return exit_codes
+
+    def run_scenario(self, scenario, index):
+        """ Run one scenario and return its results """
+        folder = os.path.join(self.output, scenario.name)
+        for subfolder in ['data', 'logs']:
+            os.makedirs(os.path.join(folder, subfolder), exist_ok=True)
+        namespace = f'scenarios/{scenario.name}-{uuid.uuid4().hex[:8]}'
+        run = {
+            'scenario': scenario,
+            'folder': folder,
+            'namespace': namespace,
+            # Relative to the namespace for the entities, absolute for us
+            'barrier': '/barrier',
+            'barrier_path': f'/{namespace}/barrier',
+            # Short: Unix domain socket paths are limited to about 100 characters
+            'ipc_dir': tempfile.mkdtemp(prefix='pubsub-'),
+            'first_port': self.FIRST_PORT + index * self.PORTS_PER_SCENARIO,
+            'processes': []
+        }
+        self.info(f'{scenario.name}: {scenario.mode}, {scenario.brokers} brokers, '
+            f'{scenario.publishers} publishers, {scenario.subscribers} subscribers over {scenario.transport}')
+        self.zk.ensure_path(f'/{namespace}')
+        complete = False
+        started = time.time()
+        try:
+            for i in range(scenario.brokers):
+                self.start(run, 'broker', i, self.broker_args(run, i))
+            # Clients start once a broker leads
+            if self.wait(run, READY, 1, 'broker'):
+                subscribers = [self.start(run, 'subscriber', i, self.subscriber_args(run, i))
+                    for i in range(scenario.subscribers)]
+                # Publishers start once every subscriber listens
+                if self.wait(run, READY, scenario.subscribers, 'subscriber'):
+                    started = time.time()
+                    for i in range(scenario.publishers):
+                        self.start(run, 'publisher', i, self.publisher_args(run, i))
+                    complete = self.supervise(run, subscribers)
+            elapsed = time.time() - started
+        finally:
+            exit_codes = self.terminate(run)
+            try:
+                self.zk.delete(f'/{namespace}', recursive=True)
+            except NoNodeError:
+                pass
+            shutil.rmtree(run['ipc_dir'], ignore_errors=True)
+        results = self.collect(run, complete, elapsed, exit_codes)
+        self.write_results(results, os.path.join(folder, 'results.json'))
+        return results
+
+    def read_data_file(self, filename):
+        """ Return the latencies of a subscriber's data file, or None if it was not written """
+        if not os.path.exists(filename):
+            return None
+        with open(filename) as f:
+            return [float(row['total_time_seconds']) for row in csv.DictReader(f)]
+
+    def collect(self, run, complete, elapsed, exit_codes):
+        """ Check and summarize the data files of a run """
+        scenario = run['scenario']
+        latencies = []
+        passed = 0
+        comments = []
+        for i in range(scenario.subscribers):
+            filename = self.data_file(run, i)
+            values = self.read_data_file(filename)
+            if values is None:
+                comments.append(f'File {filename} DNE')
+                continue
+            # As in the Mininet tests: a subscriber passes if it wrote every event
+            if len(values) == scenario.events:
+                passed += 1
+            comments.append(f'Line count in data file {filename}: {len(values)}')
+            latencies.extend(values)
+        results = {
+            'name': scenario.name,
+            'mode': scenario.mode,
+            'complete': complete,
+            'passed': passed,
+            'failed': scenario.subscribers - passed,
+            'comments': comments,
+            'elapsed_seconds': elapsed,
+            # Events received per second by all subscribers together, from the start
+            # of the publishers until the last subscriber was done
+            'throughput_per_second': len(latencies) / elapsed if complete and elapsed > 0 else None,
+            'latency': self.summarize_latencies(latencies),
+            'exit_codes': exit_codes
+        }
+        latency = results['latency']
+        self.info(f"{scenario.name}: {passed}/{scenario.subscribers} subscribers passed in {elapsed:.1f}s"
+            + (f", latency p50 {latency['p50'] * 1000:.2f} ms p99 {latency['p99'] * 1000:.2f} ms"
+                if latencies else ''))
+        return results
+
+    def write_summary(self, results):
+        """ Write one line per scenario to <output>/summary.csv """
+        filename = os.path.join(self.output, 'summary.csv')
+        with open(filename, 'w') as f:
+            f.write('name,mode,passed,failed,elapsed_seconds,throughput_per_second,p50,p99,p999,max\n')
+            for result in results:
+                latency = result['latency']
+                values = [result['name'], result['mode'], result['passed'], result['failed'],
+                    result['elapsed_seconds'], result['throughput_per_second'], latency['p50'],
+                    latency['p99'], latency['p999'], latency['max']]
+                f.write(','.join('' if value is None else str(value) for value in values) + '\n')
+        self.info(f'Summary written to {filename}')
+
+    def run(self, scenarios):
+        """ Run scenarios, self.parallel at a time, and return their results in order """
+        os.makedirs(self.output, exist_ok=True)
+        self.zk = wait_for_zookeeper(self.zookeeper_hosts)
+        try:
+            with ThreadPoolExecutor(max_workers=self.parallel) as executor:
+                results = list(executor.map(self.run_scenario, scenarios, range(len(scenarios))))
+        finally:
+            self.zk.stop()
+            self.zk.close()
+        self.write_summary(results)
+        return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Run pub/sub scenarios from a declarative spec as local processes, without Mininet')
+    parser.add_argument('spec', type=str, help='JSON spec of the scenarios (see scenarios/example.json)')
+    parser.add_argument('--zookeeper_hosts', type=str, default='127.0.0.1:2181',
+        help='ZooKeeper ensemble shared by the scenarios, each in a namespace of its own')
+    parser.add_argument('--start_zookeeper', action='store_true',
+        help='start the local ZooKeeper server (/opt/zookeeper) before the runs and stop it after')
+    parser.add_argument('--parallel', type=int, default=1, help='scenarios run at once')
+    parser.add_argument('--only', action='append', help='run only the scenario with this name; repeatable')
+    parser.add_argument('--output', type=str, default=os.path.join(__location__, 'scenario_results'),
+        help='folder of the results')
+    args = parser.parse_args()
+    scenarios = load_scenarios(args.spec)
+    if args.only:
+        scenarios = [scenario for scenario in scenarios if scenario.name in args.only]
+    if args.start_zookeeper:
+        subprocess.run(['/opt/zookeeper/bin/zkServer.sh', 'start'], check=True)
+    try:
+        results = ScenarioRunner(zookeeper_hosts=args.zookeeper_hosts, output=args.output,
+            parallel=args.parallel).run(scenarios)
+    finally:
+        if args.start_zookeeper:
+            subprocess.run(['/opt/zookeeper/bin/zkServer.sh', 'stop'])
+    sys.exit(0 if all(result['failed'] == 0 for result in results) else 1)
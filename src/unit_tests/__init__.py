@@ -0,0 +1,17 @@
+""" Helpers shared by the unit tests """
+from kazoo.client import KazooClient
+
+def zookeeper_running(hosts='127.0.0.1:2181'):
+    zk = KazooClient(hosts=hosts)
+    try:
+        zk.start(timeout=1)
+        zk.stop()
+        return True
+    except Exception:
+        return False
+    finally:
+        zk.close()
+
+# Tests that need ZooKeeper use the local server if it runs, else the in-memory
+# ensemble (see lib/memory_zookeeper.py)
+ZOOKEEPER_HOSTS = '127.0.0.1:2181' if zookeeper_running() else 'memory://unit-tests'
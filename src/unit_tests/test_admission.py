@@ -0,0 +1,50 @@
+""" Module to perform unit tests against registration admission control and client backoff """
+import unittest
+from src.unit_tests import *
+from src.lib.admission import AdmissionController
+from src.lib.backoff import backoff_delay
+
+class TestAdmission(unittest.TestCase):
+    def test_unlimited_by_default(self):
+        admission = AdmissionController()
+        assert admission.admit(True, 100, 100, 10**6, 10**6, 10**6) is None
+        assert admission.has_budget()
+
+    def test_limits(self):
+        admission = AdmissionController(max_clients=2, max_topics=3, max_sockets=10, retry_after=2)
+        assert admission.admit(True, 1, 1, clients=1, topics=2, sockets=5) is None
+        assert admission.admit(True, 0, 0, clients=2, topics=0, sockets=0) == 'max_clients'
+        # A known client re-registering does not count against max_clients
+        assert admission.admit(False, 0, 0, clients=2, topics=0, sockets=0) is None
+        assert admission.admit(False, 2, 0, clients=0, topics=2, sockets=0) == 'max_topics'
+        assert admission.admit(False, 0, 6, clients=0, topics=0, sockets=5) == 'max_sockets'
+        assert admission.rejection('max_clients') == {
+            'error': 'registration rejected: max_clients', 'retry_after': 2}
+        assert admission.stats() == {
+            'admitted': 2,
+            'rejected': {'max_clients': 1, 'max_topics': 1, 'max_sockets': 1},
+            'deferred': 0
+        }
+
+    def test_control_share(self):
+        admission = AdmissionController(control_share=0.1, window=1.0)
+        admission.window_start = 0
+        assert admission.has_budget(now=0.0)
+        admission.charge(0.1)
+        # Budget of 0.1s per 1s window used up; registrations wait for the next window
+        assert not admission.has_budget(now=0.5)
+        assert admission.stats()['deferred'] == 1
+        assert admission.has_budget(now=1.0)
+
+    def test_backoff_delay(self):
+        assert backoff_delay(0, base=0.1, jitter=False) == 0.1
+        assert backoff_delay(3, base=0.1, jitter=False) == 0.8
+        assert backoff_delay(20, base=0.1, cap=5, jitter=False) == 5
+        # Broker hint is always waited in full
+        assert backoff_delay(0, base=0.1, retry_after=2, jitter=False) == 2.1
+        for attempt in range(10):
+            delay = backoff_delay(attempt, base=0.1, cap=5)
+            assert min(5, 0.1 * 2 ** attempt) / 2 <= delay <= min(5, 0.1 * 2 ** attempt)
+
+if __name__ == '__main__':
+    unittest.main()
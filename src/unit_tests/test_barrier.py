@@ -0,0 +1,89 @@
+""" Module to perform unit tests against the ZooKeeper barriers that orchestrate
+performance test runs """
+import unittest
+import logging
+import threading
+import time
+import uuid
+from src.unit_tests import *
+from src.lib.barrier import READY, DONE, signal_barrier, wait_barrier, remove_barrier
+from src.lib.zookeeper_client import ZookeeperClient, kazoo_client
+
+class TestBarrier(unittest.TestCase):
+    def setUp(self):
+        self.barrier = f'/test-barriers/{uuid.uuid4().hex}'
+        self.zk = kazoo_client(ZOOKEEPER_HOSTS)
+        self.zk.start()
+        self.entities = []
+
+    def tearDown(self):
+        for entity in self.entities:
+            entity.stop()
+        remove_barrier(self.zk, self.barrier)
+        self.zk.stop()
+        self.zk.close()
+
+    def entity(self):
+        zk = kazoo_client(ZOOKEEPER_HOSTS)
+        zk.start()
+        self.entities.append(zk)
+        return zk
+
+    def test_wait_returns_once_count_reached(self):
+        entities = [self.entity() for _ in range(3)]
+        def signal_later():
+            for i, zk in enumerate(entities):
+                time.sleep(0.05)
+                signal_barrier(zk, self.barrier, READY, f'sub-{i}')
+        threading.Thread(target=signal_later).start()
+        started = time.time()
+        names = wait_barrier(self.zk, self.barrier, READY, 3, timeout=10)
+        assert(sorted(names) == ['sub-0', 'sub-1', 'sub-2'])
+        assert(time.time() - started < 5)
+
+    def test_wait_times_out(self):
+        signal_barrier(self.entity(), self.barrier, DONE, 'sub-0')
+        started = time.time()
+        names = wait_barrier(self.zk, self.barrier, DONE, 2, timeout=0.2)
+        assert(names == ['sub-0'])
+        assert(time.time() - started >= 0.2)
+
+    def test_wait_counts_one_role(self):
+        zk = self.entity()
+        # A broker ending its event loop is done too; it must not stand in for a subscriber
+        signal_barrier(zk, self.barrier, DONE, 'broker-0')
+        signal_barrier(zk, self.barrier, DONE, 'subscriber-0')
+        assert(wait_barrier(self.zk, self.barrier, DONE, 2, timeout=0.2, role='subscriber') ==
+            ['subscriber-0'])
+        signal_barrier(zk, self.barrier, DONE, 'subscriber-1')
+        assert(sorted(wait_barrier(self.zk, self.barrier, DONE, 2, timeout=1, role='subscriber')) ==
+            ['subscriber-0', 'subscriber-1'])
+
+    def test_ready_is_ephemeral_and_done_persistent(self):
+        zk = self.entity()
+        signal_barrier(zk, self.barrier, READY, 'sub-0')
+        signal_barrier(zk, self.barrier, DONE, 'sub-0')
+        # Signalling twice is harmless
+        signal_barrier(zk, self.barrier, DONE, 'sub-0')
+        zk.stop()
+        assert(wait_barrier(self.zk, self.barrier, READY, 1, timeout=0) == [])
+        assert(wait_barrier(self.zk, self.barrier, DONE, 1, timeout=0) == ['sub-0'])
+
+    def test_entity_signals_given_barrier(self):
+        client = ZookeeperClient(zookeeper_hosts=[ZOOKEEPER_HOSTS])
+        client.prefix = {'prefix': 'ZK-TEST'}
+        client.logger = logging.getLogger('ZK-TEST')
+        client.connect_zk()
+        client.start_session()
+        try:
+            # Without a barrier nothing is signalled
+            client.signal_barrier(READY)
+            client.barrier = self.barrier
+            client.signal_barrier(READY)
+            assert(wait_barrier(self.zk, self.barrier, READY, 1, timeout=1) ==
+                [f'zookeeperclient-{client.zk_instance_id}'])
+        finally:
+            client.stop_session()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,16 @@
 """ Module to perform unit tests against Broker class for methods that
 execute and can be tested independently of the publish/subscribe network """
 import unittest
+import json
+import shutil
+import tempfile
+import pickle
+import time
+import zmq
 from src.lib.broker import Broker
+from src.lib.topic_log import TopicLogStore
+from src.lib.replication import ReplicationLeader, ReplicationFollower
+from src.lib.lanes import SubscriberLane
 from src.unit_tests import *
 
 class TestBroker(unittest.TestCase):
@@ -18,3 +27,217 @@ class TestBroker(unittest.TestCase):
         p = self.broker.get_clear_port()
         assert p >= 10000 and p <= 20000
 
+    def test_conflation_with_slow_subscriber(self):
+        # Synthetic slow subscriber: a SUB socket with a tiny receive queue that
+        # does not read while 500 messages for 5 keys flow through the broker.
+        broker = Broker(centralized=True, conflate_topics=['A'])
+        broker.context = zmq.Context()
+        self.addCleanup(broker.context.destroy, linger=0)
+        publisher = broker.context.socket(zmq.PUSH)
+        publisher.bind('inproc://conflation-in')
+        broker.receive_socket_dict['A'] = broker.context.socket(zmq.PULL)
+        broker.receive_socket_dict['A'].connect('inproc://conflation-in')
+        broker.send_socket_dict['A'] = broker.create_send_socket('A')
+        broker.send_socket_dict['A'].bind('inproc://conflation-out')
+        subscriber = broker.context.socket(zmq.SUB)
+        subscriber.setsockopt(zmq.RCVHWM, 1)
+        subscriber.connect('inproc://conflation-out')
+        subscriber.setsockopt_string(zmq.SUBSCRIBE, 'A')
+        # Wait until the subscription reaches the broker's XPUB socket
+        assert broker.send_socket_dict['A'].poll(1000)
+        broker.send_socket_dict['A'].recv()
+
+        for i in range(500):
+            publisher.send_multipart([b'A', pickle.dumps(
+                {'publisher': 'p', 'key': f'key-{i % 5}', 'seq': i, 'publish_time': 0})])
+        while broker.receive_socket_dict['A'].poll(100):
+            broker.send('A')
+        # Backlog is bounded by the number of keys, not by the publish rate
+        buffer = broker.conflation_buffers['A']
+        assert len(buffer) <= 5
+        assert buffer.conflated_count > 0
+
+        # Subscriber catches up and receives the newest message for every key
+        latest = {}
+        while subscriber.poll(100) or broker.has_pending_conflated():
+            while subscriber.poll(0):
+                message = pickle.loads(subscriber.recv_multipart()[1])
+                latest[message['key']] = message['seq']
+            broker.flush_conflated('A')
+        assert latest == {f'key-{k}': 495 + k for k in range(5)}
+
+    def test_slow_consumer_isolated(self):
+        # One healthy and one slow subscriber on their own lanes; the slow one
+        # must not hold back the healthy one, and the broker's backlog stays bounded.
+        broker = Broker(centralized=True, slow_consumer_policy='drop-oldest', lane_backlog=50)
+        broker.context = zmq.Context()
+        self.addCleanup(broker.context.destroy, linger=0)
+        publisher = broker.context.socket(zmq.PUSH)
+        publisher.bind('inproc://lanes-in')
+        broker.receive_socket_dict['A'] = broker.context.socket(zmq.PULL)
+        broker.receive_socket_dict['A'].connect('inproc://lanes-in')
+        subscribers = {}
+        for sub_id in ['healthy', 'slow']:
+            socket = broker.context.socket(zmq.XPUB)
+            socket.setsockopt(zmq.SNDHWM, 100)
+            socket.setsockopt(zmq.XPUB_NODROP, 1)
+            socket.bind(f'inproc://lane-{sub_id}')
+            broker.add_lane(SubscriberLane(sub_id, socket, topics=['A'], policy='drop-oldest',
+                max_backlog=50, on_state_change=broker.lane_state_changed))
+            subscribers[sub_id] = broker.context.socket(zmq.SUB)
+            subscribers[sub_id].setsockopt(zmq.RCVHWM, 100)
+            subscribers[sub_id].connect(f'inproc://lane-{sub_id}')
+            subscribers[sub_id].setsockopt_string(zmq.SUBSCRIBE, 'A')
+            assert socket.poll(1000)
+            socket.recv()
+
+        for i in range(500):
+            publisher.send_multipart([b'A', pickle.dumps({'publisher': 'p', 'seq': i, 'publish_time': 0})])
+        received = 0
+        while broker.receive_socket_dict['A'].poll(100):
+            broker.send('A')
+            while subscribers['healthy'].poll(0):
+                subscribers['healthy'].recv_multipart()
+                received += 1
+        healthy_lane = broker.subscriber_lanes['healthy']
+        while subscribers['healthy'].poll(100) or healthy_lane.pending():
+            while subscribers['healthy'].poll(0):
+                subscribers['healthy'].recv_multipart()
+                received += 1
+            healthy_lane.flush()
+        assert received == 500
+        stats = broker.get_slow_consumer_stats()
+        assert stats['healthy']['state'] == 'healthy'
+        assert stats['slow']['state'] == 'slow'
+        assert stats['slow']['pending'] <= 50
+        assert stats['slow']['dropped'] > 0
+
+    def test_registration_rejected_over_limit(self):
+        broker = Broker(centralized=True, max_clients=1, retry_after=0.5)
+        broker.context = zmq.Context()
+        self.addCleanup(broker.context.destroy, linger=0)
+        broker.pub_reg_socket = broker.context.socket(zmq.REP)
+        broker.pub_reg_socket.bind('inproc://pub-reg')
+        client = broker.context.socket(zmq.REQ)
+        client.connect('inproc://pub-reg')
+        replies = []
+        for pub_id in ['p1', 'p2', 'p1']:
+            client.send_string(json.dumps({'address': pub_id, 'topics': ['A'], 'id': pub_id}))
+            broker.register_pub()
+            replies.append(json.loads(client.recv_string()))
+        assert 'success' in replies[0]
+        assert replies[1] == {'error': 'registration rejected: max_clients', 'retry_after': 0.5}
+        # Re-registration of an admitted publisher is not a new client
+        assert 'success' in replies[2]
+        stats = broker.get_admission_stats()
+        assert stats['clients'] == 1
+        assert stats['rejected'] == {'max_clients': 1}
+
+    def test_dead_publisher_reclaimed(self):
+        broker = Broker(centralized=True, client_timeout=10, idle_topic_timeout=60)
+        broker.context = zmq.Context()
+        self.addCleanup(broker.context.destroy, linger=0)
+        broker.poller = zmq.Poller()
+        broker.pub_reg_socket = broker.context.socket(zmq.REP)
+        broker.pub_reg_socket.bind('inproc://pub-reclaim')
+        client = broker.context.socket(zmq.REQ)
+        client.connect('inproc://pub-reclaim')
+
+        def request(message):
+            client.send_string(json.dumps(message))
+            broker.register_pub()
+            return json.loads(client.recv_string())
+
+        for pub_id in ['p1', 'p2']:
+            request({'address': f'127.0.0.1:{pub_id[1]}', 'topics': ['A', pub_id], 'id': pub_id})
+            broker.update_receive_socket()
+        now = broker.client_liveness.last_seen['p1']
+        assert request({'heartbeat': {'id': 'p2', 'topics': ['A', 'p2']}}) == {'heartbeat': 'ok'}
+        broker.client_liveness.touch('p2', now=now + 5)
+        # p1 crashed without disconnecting; p2 kept sending heartbeats
+        assert broker.reclaim(now=now + 11) == (['p1'], [])
+        assert broker.client_ids == {'p2'}
+        assert broker.publishers == {'A': ['127.0.0.1:2'], 'p2': ['127.0.0.1:2']}
+        assert set(broker.receive_socket_dict) == {'A', 'p2'}
+        assert broker.receive_connections['A'] == {'127.0.0.1:2'}
+        report = broker.last_reclamation
+        assert report['before']['clients'] == 2 and report['after']['clients'] == 1
+        assert report['after']['sockets'] == report['before']['sockets'] - 1
+        # A reclaimed client is told to register again
+        assert request({'heartbeat': {'id': 'p1', 'topics': ['A', 'p1']}}) == {'reregister': True}
+
+        # Everything goes idle; topics and the remaining publisher are reclaimed
+        broker.client_liveness.forget('p2')
+        clients, topics = broker.reclaim(now=now + 61)
+        assert sorted(topics) == ['A', 'p1', 'p2']
+        assert broker.publishers == {} and broker.receive_socket_dict == {}
+        assert broker.client_ids == set() and broker.client_registrations == {}
+        assert broker.get_reclamation_stats()['reclaimed_topics'] == 3
+
+    def test_messages_logged_before_fan_out(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        broker = Broker(centralized=True, log_dir=directory)
+        self.addCleanup(broker.topic_logs.close)
+        broker.context = zmq.Context()
+        self.addCleanup(broker.context.destroy, linger=0)
+        publisher = broker.context.socket(zmq.PUSH)
+        publisher.bind('inproc://log-in')
+        broker.receive_socket_dict['A'] = broker.context.socket(zmq.PULL)
+        broker.receive_socket_dict['A'].connect('inproc://log-in')
+        broker.send_socket_dict['A'] = broker.create_send_socket('A')
+        payloads = [pickle.dumps({'publisher': 'p', 'seq': i, 'publish_time': 0}) for i in range(10)]
+        for payload in payloads:
+            publisher.send_multipart([b'A', payload])
+        while broker.receive_socket_dict['A'].poll(100):
+            broker.send('A')
+        log = broker.topic_logs.log('A')
+        assert [bytes(p) for _, _, p in log.read(0)] == payloads
+        assert broker.get_topic_log_stats()['A']['next_offset'] == 10
+
+    def test_fan_out_waits_for_standby_in_one_mode(self):
+        directory, standby_directory = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(shutil.rmtree, standby_directory)
+        broker = Broker(centralized=True, log_dir=directory, replication_mode='one',
+            replication_ack_timeout=60)
+        self.addCleanup(broker.topic_logs.close)
+        broker.context = zmq.Context()
+        self.addCleanup(broker.context.destroy, linger=0)
+        broker.replication_socket = broker.context.socket(zmq.ROUTER)
+        broker.replication_socket.bind('inproc://replication')
+        broker.replication = ReplicationLeader(
+            broker.replication_socket, broker.topic_logs, mode='one', ack_timeout=60)
+        standby_logs = TopicLogStore(standby_directory)
+        self.addCleanup(standby_logs.close)
+        follower_socket = broker.context.socket(zmq.DEALER)
+        follower_socket.connect('inproc://replication')
+        follower = ReplicationFollower(follower_socket, standby_logs)
+        follower.hello()
+        publisher = broker.context.socket(zmq.PUSH)
+        publisher.bind('inproc://replicated-in')
+        broker.receive_socket_dict['A'] = broker.context.socket(zmq.PULL)
+        broker.receive_socket_dict['A'].connect('inproc://replicated-in')
+        broker.send_socket_dict['A'] = broker.create_send_socket('A')
+        broker.send_socket_dict['A'].bind('inproc://replicated-out')
+        subscriber = broker.context.socket(zmq.SUB)
+        subscriber.connect('inproc://replicated-out')
+        subscriber.setsockopt(zmq.SUBSCRIBE, b'')
+        time.sleep(0.05)
+        while not broker.replication.standbys:
+            broker.service_replication({broker.replication_socket: zmq.POLLIN})
+        for i in range(5):
+            publisher.send_multipart([b'A', pickle.dumps({'publisher': 'p', 'seq': i, 'publish_time': 0})])
+        while broker.receive_socket_dict['A'].poll(100):
+            broker.send('A')
+        # Logged, but held back from subscribers until the standby acks
+        assert broker.replication.stats()['held'] == 5
+        assert not subscriber.poll(50)
+        deadline = time.time() + 2
+        while broker.replication.has_pending() and time.time() < deadline:
+            broker.service_replication({broker.replication_socket: zmq.POLLIN})
+            follower.poll(10)
+        received = [pickle.loads(subscriber.recv_multipart()[1])['seq'] for _ in range(5)]
+        assert received == list(range(5))
+        assert standby_logs.log('A').next_offset == 5
+        assert broker.get_replication_stats()['released_unacked'] == 0
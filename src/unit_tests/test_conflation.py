@@ -0,0 +1,37 @@
+""" Module to perform unit tests against the ConflationBuffer used by the broker
+for conflated topics """
+import unittest
+from src.unit_tests import *
+from src.lib.conflation import ConflationBuffer
+
+class TestConflationBuffer(unittest.TestCase):
+    def setUp(self):
+        self.buffer = ConflationBuffer(max_keys=3)
+
+    def test_keeps_newest_per_key(self):
+        for i in range(10):
+            self.buffer.put('key-a', [b'A', f'{i}'.encode()])
+        assert len(self.buffer) == 1
+        assert self.buffer.peek() == ('key-a', [b'A', b'9'])
+        assert self.buffer.conflated_count == 9
+
+    def test_order_follows_last_update(self):
+        self.buffer.put('key-a', [b'A', b'1'])
+        self.buffer.put('key-b', [b'A', b'2'])
+        self.buffer.put('key-a', [b'A', b'3'])
+        assert self.buffer.peek()[0] == 'key-b'
+        self.buffer.pop('key-b')
+        assert self.buffer.peek() == ('key-a', [b'A', b'3'])
+
+    def test_max_keys_bounds_memory(self):
+        for i in range(10):
+            self.buffer.put(f'key-{i}', [b'A', b''])
+        assert len(self.buffer) == 3
+        assert self.buffer.evicted_count == 7
+        assert self.buffer.peek()[0] == 'key-7'
+
+    def test_clear(self):
+        self.buffer.put('key-a', [b'A', b'1'])
+        self.buffer.put('key-b', [b'A', b'2'])
+        self.buffer.clear()
+        assert len(self.buffer) == 0
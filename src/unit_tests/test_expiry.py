@@ -0,0 +1,28 @@
+""" Module to perform unit tests against the message time-to-live helpers """
+import unittest
+from src.unit_tests import *
+from src.lib.expiry import is_expired, parse_topic_ttls
+
+class TestExpiry(unittest.TestCase):
+    def test_parse_topic_ttls(self):
+        assert parse_topic_ttls(['A=0.5', 'B=2']) == {'A': 0.5, 'B': 2.0}
+        with self.assertRaises(ValueError):
+            parse_topic_ttls(['0.5'])
+
+    def test_topic_ttl(self):
+        message = {'topic': 'A', 'publish_time': 100.0}
+        assert not is_expired(message, {'A': 1}, now=100.5)
+        assert is_expired(message, {'A': 1}, now=101.5)
+        # No TTL for topic B, so never expires
+        assert not is_expired({'topic': 'B', 'publish_time': 0.0}, {'A': 1}, now=1000)
+
+    def test_topic_of_event_without_topic(self):
+        # Events sent with a topic ID frame carry no 'topic'; the caller passes it
+        message = {'publish_time': 100.0}
+        assert is_expired(message, {'A': 1}, now=101.5, topic='A')
+        assert not is_expired(message, {'A': 1}, now=101.5, topic='B')
+
+    def test_message_ttl_overrides_topic_ttl(self):
+        message = {'topic': 'A', 'publish_time': 100.0, 'ttl': 10}
+        assert not is_expired(message, {'A': 1}, now=105)
+        assert is_expired(message, {'A': 1}, now=111)
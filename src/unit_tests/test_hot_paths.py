@@ -0,0 +1,56 @@
+""" Module to run the micro-benchmarks of the per-message hot paths
+(performance_tests/benchmarks/hot_paths.py) alongside the unit tests. The
+comparison with a stored baseline only runs when HOT_PATHS_BASELINE names one
+(see --save_baseline); HOT_PATHS_THRESHOLD sets the tolerated regression (0.2) """
+import unittest
+import json
+import os
+import sys
+import time
+
+# The benchmarks import the entities as lib.*, from the src directory
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+from performance_tests.benchmarks.hot_paths import HotPathBenchmark, encode_binary, decode_binary
+
+class TestHotPaths(unittest.TestCase):
+    def test_cases(self):
+        results = HotPathBenchmark(repeats=3, min_time=0.001, allocation_ops=50).run()
+        assert(len(results['cases']) == 8)
+        for result in results['cases'].values():
+            lower, upper = result['ns_per_op_ci95']
+            assert(0 < result['min_ns_per_op'] <= lower <= result['ns_per_op'] <= upper)
+            assert(result['peak_bytes_per_op'] > 0)
+        # Every parsed event is kept as a record
+        assert(results['cases']['subscriber_parse']['retained_blocks_per_op'] >= 1)
+        assert(results['cases']['serialize_pickle']['retained_blocks_per_op'] < 1)
+
+    def test_binary_round_trip(self):
+        event = {'publisher': '10.0.0.1:6000', 'publish_time': time.time(), 'topic': 'A'}
+        assert(decode_binary(encode_binary(event)) == event)
+
+    def test_compare(self):
+        benchmark = HotPathBenchmark()
+        def results(median, lower, fastest, peak=100, retained=0.0):
+            return {'python': '3', 'cases': {'case': {'ns_per_op': median, 'ns_per_op_ci95': [lower, median],
+                'min_ns_per_op': fastest, 'peak_bytes_per_op': peak, 'retained_blocks_per_op': retained}}}
+        baseline = results(1000, 950, 900)
+        assert(not benchmark.compare(results(1100, 1050, 1000), baseline, 0.2))
+        assert(len(benchmark.compare(results(1500, 1400, 1300), baseline, 0.2)) == 1)
+        # A slow run with a fast sample is drift, not a regression
+        assert(not benchmark.compare(results(1500, 1400, 950), baseline, 0.2))
+        assert(len(benchmark.compare(results(1000, 950, 900, peak=200), baseline, 0.2)) == 1)
+        assert(len(benchmark.compare(results(1000, 950, 900, retained=1.0), baseline, 0.2)) == 1)
+
+    @unittest.skipUnless(os.environ.get('HOT_PATHS_BASELINE'), 'HOT_PATHS_BASELINE names no baseline')
+    def test_against_baseline(self):
+        with open(os.environ['HOT_PATHS_BASELINE']) as f:
+            baseline = json.load(f)
+        benchmark = HotPathBenchmark(repeats=baseline['repeats'], min_time=baseline['min_time'])
+        regressions = benchmark.compare(benchmark.run(), baseline,
+            float(os.environ.get('HOT_PATHS_THRESHOLD', 0.2)))
+        assert(not regressions), regressions
+
+if __name__ == '__main__':
+    unittest.main()
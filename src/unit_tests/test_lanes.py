@@ -0,0 +1,70 @@
+""" Module to perform unit tests against SubscriberLane, the per-subscriber
+delivery lane used by the broker to isolate slow consumers """
+import unittest
+import zmq
+from src.unit_tests import *
+from src.lib.lanes import SubscriberLane
+
+class TestSubscriberLane(unittest.TestCase):
+    def setUp(self):
+        self.context = zmq.Context()
+        self.state_changes = []
+
+    def tearDown(self):
+        self.context.destroy(linger=0)
+
+    def create_lane(self, name, policy):
+        """ Create a lane with a tiny queue and a connected subscriber that does not read """
+        socket = self.context.socket(zmq.XPUB)
+        socket.setsockopt(zmq.SNDHWM, 1)
+        socket.setsockopt(zmq.XPUB_NODROP, 1)
+        socket.bind(f'inproc://{name}')
+        subscriber = self.context.socket(zmq.SUB)
+        subscriber.setsockopt(zmq.RCVHWM, 1)
+        subscriber.connect(f'inproc://{name}')
+        subscriber.setsockopt_string(zmq.SUBSCRIBE, 'A')
+        # Wait until the subscription reaches the lane
+        assert socket.poll(1000)
+        socket.recv()
+        lane = SubscriberLane('sub', socket, topics=['A'], policy=policy, max_backlog=10,
+            on_state_change=lambda lane, old, new: self.state_changes.append(new))
+        return lane, subscriber
+
+    def offer_messages(self, lane, count=100):
+        for i in range(count):
+            lane.offer([b'A', f'{i}'.encode()], key=f'key-{i % 3}')
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            SubscriberLane('sub', None, policy='ignore')
+
+    def test_drop_oldest(self):
+        lane, subscriber = self.create_lane('lane-drop-oldest', 'drop-oldest')
+        self.offer_messages(lane)
+        assert lane.state == SubscriberLane.SLOW
+        assert len(lane.backlog) == 10
+        assert lane.dropped_count > 0
+        # The newest messages are the ones kept
+        assert lane.backlog[-1][1] == [b'A', b'99']
+
+    def test_disconnect(self):
+        lane, subscriber = self.create_lane('lane-disconnect', 'disconnect')
+        self.offer_messages(lane)
+        assert lane.state == SubscriberLane.DISCONNECTED
+        assert lane.pending() == 0
+        assert self.state_changes == [SubscriberLane.SLOW, SubscriberLane.DISCONNECTED]
+
+    def test_degrade_and_recover(self):
+        lane, subscriber = self.create_lane('lane-degrade', 'degrade')
+        self.offer_messages(lane)
+        assert lane.state == SubscriberLane.DEGRADED
+        # Only the newest message per key is held while degraded
+        assert lane.pending() == 3
+        # Subscriber catches up
+        received = []
+        while subscriber.poll(100) or lane.pending():
+            while subscriber.poll(0):
+                received.append(subscriber.recv_multipart()[1])
+            lane.flush()
+        assert lane.state == SubscriberLane.HEALTHY
+        assert received[-3:] == [b'97', b'98', b'99']
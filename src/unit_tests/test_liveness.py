@@ -0,0 +1,58 @@
+""" Module to perform unit tests against liveness tracking used for reclamation """
+import time
+import unittest
+import zmq
+from src.unit_tests import *
+from src.lib.liveness import LivenessTracker, resource_usage, enable_heartbeats, PeerMonitor
+
+class TestLiveness(unittest.TestCase):
+    def test_disabled_by_default(self):
+        tracker = LivenessTracker()
+        tracker.touch('c1', now=0)
+        assert not tracker.enabled
+        assert len(tracker) == 0
+        assert tracker.expired(now=10**6) == []
+
+    def test_expired(self):
+        tracker = LivenessTracker(timeout=10)
+        tracker.touch('c1', now=0)
+        tracker.touch('c2', now=5)
+        assert tracker.expired(now=10) == []
+        assert tracker.expired(now=12) == ['c1']
+        tracker.touch('c1', now=12)
+        assert sorted(tracker.expired(now=16)) == ['c2']
+        tracker.forget('c2')
+        assert 'c2' not in tracker
+        assert tracker.expired(now=16) == []
+
+    def test_resource_usage(self):
+        usage = resource_usage()
+        assert usage['rss_kb'] > 0
+        assert usage['fds'] is None or usage['fds'] > 0
+
+    def test_peer_monitor_reports_lost_peer(self):
+        context = zmq.Context()
+        self.addCleanup(context.destroy, linger=0)
+        broker = context.socket(zmq.REP)
+        port = broker.bind_to_random_port('tcp://127.0.0.1')
+        client = context.socket(zmq.REQ)
+        enable_heartbeats(client, 0.05)
+        assert client.getsockopt(zmq.HEARTBEAT_TIMEOUT) == 100
+        monitor = PeerMonitor(client)
+        client.connect(f'tcp://127.0.0.1:{port}')
+        deadline = time.time() + 2
+        while not monitor.connected and time.time() < deadline:
+            assert not monitor.lost()
+            time.sleep(0.01)
+        assert monitor.connected
+        broker.close(linger=0)
+        while not monitor.lost() and time.time() < deadline:
+            time.sleep(0.01)
+        assert monitor.lost_at is not None
+        # Reported once per loss
+        assert not monitor.lost()
+        monitor.close()
+        assert not monitor.lost()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+""" Module to perform unit tests against the local cluster, which runs a whole
+pub/sub system in one process over inproc:// """
+import unittest
+import os
+import tempfile
+import time
+import zmq
+from src.lib.local_cluster import LocalCluster
+from src.lib.transport import Transport, InprocTransport, IpcTransport, TCP_TRANSPORT
+
+class TestTransport(unittest.TestCase):
+    def test_endpoints(self):
+        assert(TCP_TRANSPORT.endpoint('10.0.0.1', 5555) == 'tcp://10.0.0.1:5555')
+        assert(TCP_TRANSPORT.endpoint('10.0.0.1:5555') == 'tcp://10.0.0.1:5555')
+        assert(TCP_TRANSPORT.bind_endpoint(5555) == 'tcp://*:5555')
+        transport = InprocTransport(host='cluster')
+        try:
+            assert(transport.endpoint('cluster', 5555) == 'inproc://cluster:5555')
+            # Binding to every interface binds the cluster's host name
+            assert(transport.bind_endpoint(5555) == 'inproc://cluster:5555')
+        finally:
+            transport.shared_context.term()
+
+    def test_ipc_endpoints(self):
+        transport = IpcTransport('/tmp/pubsub/run-1/')
+        assert(transport.endpoint('local', 5555) == 'ipc:///tmp/pubsub/run-1/local:5555')
+        assert(transport.endpoint('local:6000') == 'ipc:///tmp/pubsub/run-1/local:6000')
+        assert(transport.bind_endpoint(6000) == 'ipc:///tmp/pubsub/run-1/local:6000')
+        # Advertised by every entity, so it is the address peers connect to
+        assert(transport.host == 'local')
+        assert(Transport(host='127.0.0.1').host == '127.0.0.1' and TCP_TRANSPORT.host is None)
+
+    def test_entity_contexts_share_inproc(self):
+        transport = InprocTransport()
+        binder = transport.context()
+        connecter = transport.context()
+        pull = binder.socket(zmq.PULL)
+        pull.bind(transport.bind_endpoint(7000))
+        push = connecter.socket(zmq.PUSH)
+        push.connect(transport.endpoint(transport.host, 7000))
+        push.send(b'event')
+        assert(pull.recv() == b'event')
+        # An entity destroying its context leaves the shared one usable
+        connecter.destroy()
+        push = transport.context().socket(zmq.PUSH)
+        push.connect(transport.endpoint(transport.host, 7000))
+        push.send(b'again')
+        assert(pull.recv() == b'again')
+        push.close()
+        binder.destroy()
+        transport.shared_context.term()
+
+class TestLocalCluster(unittest.TestCase):
+    def run_cluster(self, centralized):
+        cluster = LocalCluster(publishers=2, subscribers=2, topics=['A', 'B'], max_event_count=50,
+            centralized=centralized, timeout=10, quiet=True)
+        assert(cluster.run() is not None)
+        assert(cluster.received_count() == cluster.expected_count() == 200)
+        assert(len(cluster.latencies()) == 200)
+        assert(not cluster.errors)
+        assert(not any(thread.is_alive() for thread in cluster.threads))
+        return cluster
+
+    def test_centralized(self):
+        self.run_cluster(centralized=True)
+
+    def test_direct(self):
+        self.run_cluster(centralized=False)
+
+    def test_publish_rate(self):
+        cluster = self.run_cluster(centralized=True)
+        assert(cluster.publish_rate() > 0)
+        assert(len(cluster.publish_starts) == len(cluster.publish_ends) == 2)
+
+    def test_stalled(self):
+        cluster = LocalCluster(publishers=1, subscribers=1, quiet=True)
+        cluster.last_progress = time.time()
+        # Still publishing
+        assert(not cluster.stalled())
+        cluster.publish_ends.append(time.time())
+        assert(not cluster.stalled())
+        # Publishers done and no event for IDLE_TIMEOUT
+        cluster.last_progress -= cluster.IDLE_TIMEOUT
+        assert(cluster.stalled())
+
+    def test_data_files_and_profile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cluster = LocalCluster(publishers=1, subscribers=2, max_event_count=10, centralized=True,
+                filename=os.path.join(directory, 'data.csv'), timeout=10, profile=True, quiet=True)
+            cluster.run()
+            for i in range(2):
+                with open(os.path.join(directory, f'data-{i}.csv')) as f:
+                    # Header and a line per event
+                    assert(len(f.readlines()) == 11)
+        stats = cluster.profile_stats()
+        assert(any(function[2] == 'publish' for function in stats.stats))
+
+if __name__ == '__main__':
+    unittest.main()
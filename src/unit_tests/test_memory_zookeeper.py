@@ -0,0 +1,191 @@
+""" Module to perform unit tests against the in-memory ZooKeeper ensemble, and the
+broker election and failover run on it """
+import unittest
+import logging
+import queue
+import threading
+import time
+import uuid
+import zmq
+from kazoo.exceptions import BadVersionError, NodeExistsError, NoNodeError, NotEmptyError
+from src.lib.broker import Broker
+from src.lib.memory_zookeeper import MemoryEnsemble
+from src.lib.zookeeper_client import ZookeeperClient, kazoo_client
+
+class TestMemoryZookeeper(unittest.TestCase):
+    def setUp(self):
+        # An ensemble per test
+        self.name = f'test-{uuid.uuid4().hex}'
+        self.hosts = f'memory://{self.name}'
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.stop()
+        MemoryEnsemble.discard(self.name)
+
+    def client(self, hosts=None):
+        zk = kazoo_client(hosts or self.hosts)
+        zk.start()
+        self.clients.append(zk)
+        return zk
+
+    def test_znode_operations(self):
+        zk = self.client()
+        zk.create('/a/b', b'one', makepath=True)
+        data, stat = zk.get('/a/b')
+        assert(data == b'one' and stat.version == 0)
+        zk.set('/a/b', b'two', version=0)
+        with self.assertRaises(BadVersionError):
+            zk.set('/a/b', b'three', version=0)
+        with self.assertRaises(NodeExistsError):
+            zk.create('/a/b')
+        with self.assertRaises(NotEmptyError):
+            zk.delete('/a')
+        assert(zk.get_children('/a') == ['b'])
+        zk.delete('/a', recursive=True)
+        assert(zk.exists('/a') is None)
+        with self.assertRaises(NoNodeError):
+            zk.get('/a/b')
+
+    def test_ephemeral_and_sequential_znodes(self):
+        zk = self.client()
+        owner = self.client()
+        zk.ensure_path('/locks')
+        first = owner.create('/locks/lock-', ephemeral=True, sequence=True)
+        second = owner.create('/locks/lock-', ephemeral=True, sequence=True)
+        assert(first < second and first.startswith('/locks/lock-'))
+        owner.create('/leader', b'owner', ephemeral=True)
+        # An expired session loses its ephemeral znodes and connects anew
+        owner.expire_session()
+        assert(zk.get_children('/locks') == [])
+        assert(zk.exists('/leader') is None)
+        owner.create('/leader', b'again', ephemeral=True)
+        owner.stop()
+        assert(zk.exists('/leader') is None)
+
+    def test_watches(self):
+        zk = self.client()
+        writer = self.client()
+        values = queue.Queue()
+        children = queue.Queue()
+        zk.DataWatch('/broker', lambda data, stat: values.put(data))
+        zk.ensure_path('/topics')
+        zk.ChildrenWatch('/topics', lambda names: children.put(sorted(names)))
+        assert(values.get(timeout=1) is None)
+        assert(children.get(timeout=1) == [])
+        writer.create('/broker', b'10.0.0.1,5555,5556')
+        writer.set('/broker', b'10.0.0.2,5555,5556')
+        writer.create('/topics/A')
+        assert(values.get(timeout=1) == b'10.0.0.1,5555,5556')
+        assert(values.get(timeout=1) == b'10.0.0.2,5555,5556')
+        assert(children.get(timeout=1) == ['A'])
+
+    def test_chroot(self):
+        root = self.client()
+        root.ensure_path('/system')
+        zk = self.client(f'{self.hosts}/system')
+        zk.ensure_path('/broker')
+        assert(root.exists('/system/broker') is not None)
+        assert(zk.get_children('/') == ['broker'])
+
+class ElectedBroker(Broker):
+    """ Broker that only takes over the coordination state once elected """
+
+    def __init__(self, elected, **kwargs):
+        super().__init__(**kwargs)
+        self.logger.setLevel(logging.WARNING)
+        self.elected = elected
+        self.released = threading.Event()
+        # Whether to exit once released, as a finished or killed broker does
+        self.exit_on_release = False
+
+    def leader_function(self):
+        self.take_leadership()
+        self.elected.put(self)
+        self.released.wait()
+        if self.exit_on_release:
+            self.context = zmq.Context()
+            self.disconnect()
+
+    def contend(self):
+        try:
+            self.zk_run_election()
+        except (Exception, SystemExit):
+            # The session was expired under the leader, or it exited
+            pass
+
+class TestMemoryElection(unittest.TestCase):
+    def setUp(self):
+        self.name = f'test-{uuid.uuid4().hex}'
+        self.hosts = [f'memory://{self.name}']
+        self.elected = queue.Queue()
+        self.brokers = []
+        for port in (10000, 10002):
+            # Sessions of the in-memory ensemble only end when stopped or expired, so
+            # a short session timeout shows nobody relies on it passing
+            broker = ElectedBroker(self.elected, zookeeper_hosts=self.hosts, pub_reg_port=port,
+                sub_reg_port=port + 1, zk_session_timeout=0.1)
+            broker.connect_zk()
+            broker.start_session()
+            self.brokers.append(broker)
+        self.follower = ZookeeperClient(zookeeper_hosts=self.hosts)
+        self.follower.prefix = {'prefix': 'ZK-TEST'}
+        self.follower.logger = logging.getLogger('ZK-TEST')
+        self.follower.share_zk_session = False
+        self.follower.connect_zk()
+        self.follower.start_session()
+
+    def tearDown(self):
+        for broker in self.brokers:
+            broker.released.set()
+            broker.stop_session()
+        self.follower.stop_session()
+        MemoryEnsemble.discard(self.name)
+
+    def test_failover_to_new_epoch(self):
+        # Each broker has its own session, and so its own /broker
+        assert(self.brokers[0].zk_session is not self.brokers[1].zk_session)
+        followed = queue.Queue()
+        def broker_changed(data, stat, event):
+            if self.follower.is_new_broker(data, stat):
+                followed.put(data.decode('utf-8'))
+        self.follower.watch_znode('/broker', broker_changed)
+        for broker in self.brokers:
+            threading.Thread(target=broker.contend, daemon=True).start()
+        leader = self.elected.get(timeout=5)
+        assert(followed.get(timeout=5) == leader.znode_value)
+        first_epoch = leader.epoch
+        # The leader's session expires: it is fenced and the other broker leads
+        leader.zk.expire_session()
+        assert(leader.fenced)
+        successor = self.elected.get(timeout=5)
+        assert(successor is not leader and successor.epoch > first_epoch)
+        assert(followed.get(timeout=5) == successor.znode_value)
+        assert(self.follower.broker_epoch == successor.epoch)
+
+    def test_standby_waits_out_the_old_leaders_session(self):
+        for broker in self.brokers:
+            threading.Thread(target=broker.contend, daemon=True).start()
+        leader = self.elected.get(timeout=5)
+        # The leader leaves the election but its session, and with it /broker, is
+        # held open well past the session timeout the standby was given
+        leader.released.set()
+        time.sleep(0.5)
+        assert(self.elected.empty())
+        leader.zk.expire_session()
+        successor = self.elected.get(timeout=5)
+        assert(successor is not leader and successor.epoch > leader.epoch)
+
+    def test_exiting_leader_hands_over_at_once(self):
+        for broker in self.brokers:
+            threading.Thread(target=broker.contend, daemon=True).start()
+        leader = self.elected.get(timeout=5)
+        leader.exit_on_release = True
+        leader.released.set()
+        # Its /broker went with its session, not when the server expires it
+        successor = self.elected.get(timeout=1)
+        assert(successor is not leader and successor.epoch > leader.epoch)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,8 +3,10 @@ execute and can be tested independently of the publish/subscribe network """
 import unittest
 import time
 import pickle
+import zmq
 from src.unit_tests import *
 from src.lib.publisher import Publisher
+from src.lib.transport import InprocTransport
 
 class TestPublisher(unittest.TestCase):
     def __init__(self, *args, **kwargs):
@@ -43,4 +45,33 @@ class TestPublisher(unittest.TestCase):
         assert event[0] == b'%b' % compare_topic_encoded
         assert (time.time() - unpickled_event_dict['publish_time']) < 2
 
+    def test_payload_size(self):
+        # No payload by default
+        assert 'payload' not in pickle.loads(self.publisher.generate_publish_event()[1])
+        publisher = Publisher(topics=self.topics, payload_size=1024)
+        event = pickle.loads(publisher.generate_publish_event()[1])
+        assert len(event['payload']) == 1024
 
+    def test_unanswered_heartbeat(self):
+        # A broker that dies between the heartbeat and its reply must not block the publisher
+        transport = InprocTransport(host='heartbeat')
+        broker = transport.shared_context.socket(zmq.ROUTER)
+        broker.bind(transport.bind_endpoint(5555))
+        publisher = Publisher(topics=self.topics, heartbeat_interval=0.05, transport=transport)
+        publisher.context = transport.context()
+        publisher.broker_address = transport.host
+        publisher.pub_reg_port = 5555
+        try:
+            publisher.connect_broker_reg_socket()
+            stuck_socket = publisher.broker_reg_socket
+            started = time.time()
+            publisher.heartbeat()
+            assert time.time() - started < 1
+            assert publisher.heartbeat_unanswered
+            # A new REQ socket, able to send again
+            assert publisher.broker_reg_socket is not stuck_socket
+            publisher.broker_reg_socket.send_string('{}')
+        finally:
+            publisher.context.destroy(linger=0)
+            broker.close(linger=0)
+            transport.shared_context.term()
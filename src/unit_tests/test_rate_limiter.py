@@ -0,0 +1,39 @@
+""" Module to perform unit tests against the token bucket ingress rate limiter """
+import unittest
+from src.unit_tests import *
+from src.lib.rate_limiter import IngressRateLimiter, TokenBucket
+
+class TestRateLimiter(unittest.TestCase):
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=10, burst=2, now=0)
+        assert bucket.consume(0)
+        assert bucket.consume(0)
+        assert not bucket.consume(0)
+        # 0.1 second at 10/s refills one token
+        assert bucket.consume(0.1)
+
+    def test_unlimited_by_default(self):
+        limiter = IngressRateLimiter()
+        assert not limiter.enabled
+        assert all(limiter.allow('p1', 'A', now=0) for _ in range(1000))
+
+    def test_noisy_publisher_dropped(self):
+        limiter = IngressRateLimiter(default_rate=10, burst_seconds=1)
+        # Noisy publisher floods 100 messages at once; well-behaved sends 5
+        noisy = sum(limiter.allow('noisy', 'A', now=0) for _ in range(100))
+        quiet = sum(limiter.allow('quiet', 'A', now=0) for _ in range(5))
+        assert noisy == 10
+        assert quiet == 5
+        stats = limiter.stats()
+        assert stats['noisy'] == {'allowed': 10, 'dropped': 90, 'throttled': 1}
+        assert stats['quiet'] == {'allowed': 5, 'dropped': 0, 'throttled': 0}
+
+    def test_limit_precedence_and_runtime_update(self):
+        limiter = IngressRateLimiter(default_rate=1, topic_rates={'A': 5})
+        assert limiter.rate('p1', 'A') == 5
+        assert limiter.rate('p1', 'B') == 1
+        limiter.update_limits_from_json('{"publishers": {"p1": 50}}')
+        assert limiter.rate('p1', 'A') == 50
+        assert limiter.rate('p2', 'A') is None
+        limiter.update_limits_from_json('{}')
+        assert not limiter.enabled
@@ -0,0 +1,84 @@
+""" Module to perform unit tests against staged reconnection after a broker change """
+import json
+import logging
+import socket as sock
+import threading
+import time
+import unittest
+import zmq
+from src.unit_tests import *
+from src.lib.reconnect import ReconnectPolicy, TIERS
+from src.lib.publisher import Publisher
+from src.lib.zookeeper_client import ZookeeperClient
+
+class SpawningZk:
+    """ Runs spawned work in threads, like kazoo's threading handler """
+    def __init__(self):
+        self.handler = self
+        self.threads = []
+
+    def spawn(self, func, *args):
+        thread = threading.Thread(target=func, args=args)
+        thread.start()
+        self.threads.append(thread)
+
+def free_port():
+    s = sock.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+class TestReconnect(unittest.TestCase):
+
+    def test_tiers_and_jitter(self):
+        assert ReconnectPolicy().delay() == 0
+        assert TIERS['sub'] < TIERS['pub']
+        for _ in range(100):
+            subscriber = ReconnectPolicy(jitter=0.5, tier=TIERS['sub'], tier_interval=1).delay()
+            publisher = ReconnectPolicy(jitter=0.5, tier=TIERS['pub'], tier_interval=1).delay()
+            assert 0 <= subscriber < 0.5
+            # Publishers start once every subscriber had its turn
+            assert 1 <= publisher < 1.5
+
+    def test_superseded_reconnect_dropped(self):
+        client = ZookeeperClient()
+        client.debug = lambda msg: None
+        client.zk = SpawningZk()
+        reconnected = []
+        client.reconnect_after_broker_change(lambda: reconnected.append('first'))
+        # Not in the watch listener, even without a delay
+        client.zk.threads[-1].join()
+        assert reconnected == ['first']
+        client.reconnect_policy = ReconnectPolicy(jitter=0.1, tier=1, tier_interval=0.1)
+        client.reconnect_after_broker_change(lambda: reconnected.append('second'))
+        # The broker changed again before the delayed reconnect ran
+        client.reconnect_after_broker_change(lambda: reconnected.append('third'))
+        for thread in client.zk.threads:
+            thread.join()
+        assert reconnected == ['first', 'third']
+
+    def test_registration_retried_until_broker_answers(self):
+        port = free_port()
+        context = zmq.Context()
+        self.addCleanup(context.destroy, linger=0)
+        publisher = Publisher(topics=['A'],
+            reconnect_policy=ReconnectPolicy(registration_timeout=0.05, backoff_base=0.01))
+        publisher.logger.setLevel(logging.WARNING)
+        publisher.context = context
+        publisher.pub_reg_port = port
+        publisher.connect_broker_reg_socket()
+        def broker():
+            # The new leader starts listening only after the first registration timed out
+            time.sleep(0.3)
+            reg_socket = context.socket(zmq.REP)
+            reg_socket.bind(f'tcp://127.0.0.1:{port}')
+            request = json.loads(reg_socket.recv_string())
+            reg_socket.send_string(json.dumps(
+                {'success': 'registration success', 'topic_ids': {topic: 1 for topic in request['topics']}}))
+            reg_socket.close(linger=0)
+        thread = threading.Thread(target=broker)
+        thread.start()
+        publisher.register_pub()
+        thread.join()
+        assert publisher.topic_frames == {'A': b'\x00\x00\x00\x01'}
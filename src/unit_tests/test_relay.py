@@ -0,0 +1,101 @@
+""" Module to perform unit tests against the fan-out relay tier """
+import json
+import logging
+import time
+import unittest
+import zmq
+from src.unit_tests import *
+from src.lib.subscriber import Subscriber
+from src.lib.relay import Relay, choose_relay, join_relay, RELAYS_PATH, RELAY_MEMBERS_PATH
+from src.lib.zookeeper_client import kazoo_client
+
+class TestRelay(unittest.TestCase):
+
+    def test_frames_passed_through(self):
+        relay = Relay(topics=['A', 'B'])
+        relay.context = zmq.Context()
+        self.addCleanup(relay.context.destroy, linger=0)
+        relay.poller = zmq.Poller()
+        broker = relay.context.socket(zmq.PUB)
+        broker.bind('inproc://relay-upstream')
+        relay.pub_socket = relay.context.socket(zmq.PUB)
+        relay.pub_socket.bind('inproc://relay-downstream')
+        relay.connect_upstream({'A': 'inproc://relay-upstream', 'B': 'inproc://relay-upstream'})
+        # Both topics come from the same broker port; one upstream socket serves them
+        assert len(relay.upstream_sockets) == 1
+        subscribers = []
+        for topic in ['A', 'B']:
+            subscriber = relay.context.socket(zmq.SUB)
+            subscriber.connect('inproc://relay-downstream')
+            subscriber.setsockopt_string(zmq.SUBSCRIBE, topic)
+            subscribers.append(subscriber)
+        time.sleep(0.05)
+        broker.send_multipart([b'A', b'message', b'7'])
+        broker.send_multipart([b'B', b'other'])
+        broker.send_multipart([b'C', b'not relayed'])
+        deadline = time.time() + 2
+        while relay.forwarded_count < 2 and time.time() < deadline:
+            relay.poll_once(timeout=50)
+        # Frames, including the log offset, arrive unchanged
+        assert subscribers[0].recv_multipart() == [b'A', b'message', b'7']
+        assert subscribers[1].recv_multipart() == [b'B', b'other']
+        assert relay.get_relay_stats()['forwarded'] == 2
+
+    def test_least_loaded_relay_chosen(self):
+        zk = kazoo_client(ZOOKEEPER_HOSTS)
+        zk.start()
+        self.addCleanup(zk.stop)
+        self.addCleanup(zk.delete, RELAY_MEMBERS_PATH, recursive=True)
+        self.addCleanup(zk.delete, RELAYS_PATH, recursive=True)
+        for relay_id, topics in [('r1', ['A', 'B']), ('r2', ['A']), ('r3', ['A', 'B'])]:
+            zk.ensure_path(f'{RELAY_MEMBERS_PATH}/{relay_id}')
+            info = {'address': '127.0.0.1', 'port': 6000, 'topics': topics}
+            zk.create(f'{RELAYS_PATH}/{relay_id}', json.dumps(info).encode(), ephemeral=True, makepath=True)
+        chosen = []
+        for _ in range(6):
+            relay_id, _ = choose_relay(zk, ['A', 'B'])
+            join_relay(zk, relay_id)
+            chosen.append(relay_id)
+        # Only relays serving both topics, balanced
+        assert sorted(chosen) == ['r1'] * 3 + ['r3'] * 3
+        assert choose_relay(zk, ['C']) is None
+
+    def test_withdraw_leaves_no_znodes(self):
+        relay = Relay(topics=['A'], zookeeper_hosts=[ZOOKEEPER_HOSTS])
+        relay.logger.setLevel(logging.WARNING)
+        assert relay.connect_zk() and relay.start_session()
+        self.addCleanup(relay.stop_session)
+        relay.advertise()
+        join_relay(relay.zk, relay.relay_id)
+        relay.withdraw()
+        assert relay.zk.exists(f'{RELAYS_PATH}/{relay.relay_id}') is None
+        assert relay.zk.exists(f'{RELAY_MEMBERS_PATH}/{relay.relay_id}') is None
+
+    def test_subscriber_notices_relay_deleted_after_change(self):
+        zk = kazoo_client(ZOOKEEPER_HOSTS)
+        zk.start()
+        self.addCleanup(zk.stop)
+        self.addCleanup(zk.delete, RELAY_MEMBERS_PATH, recursive=True)
+        self.addCleanup(zk.delete, RELAYS_PATH, recursive=True)
+        path = f'{RELAYS_PATH}/r1'
+        zk.ensure_path(f'{RELAY_MEMBERS_PATH}/r1')
+        info = {'address': '127.0.0.1', 'port': 6000, 'topics': ['A']}
+        zk.create(path, json.dumps(info).encode(), makepath=True)
+        subscriber = Subscriber(topics=['A'], zookeeper_hosts=[ZOOKEEPER_HOSTS])
+        subscriber.logger.setLevel(logging.WARNING)
+        assert subscriber.connect_zk() and subscriber.start_session()
+        self.addCleanup(subscriber.stop_session)
+        assert subscriber.assign_relay()
+        # A change of the relay's info must not use up the watch on its deletion
+        zk.set(path, json.dumps(dict(info, port=6001)).encode())
+        time.sleep(0.2)
+        assert not subscriber.relay_lost
+        zk.delete(path)
+        deadline = time.time() + 2
+        while not subscriber.relay_lost and time.time() < deadline:
+            time.sleep(0.05)
+        assert subscriber.relay_lost
+        subscriber.leave_relay()
+
+if __name__ == '__main__':
+    unittest.main()
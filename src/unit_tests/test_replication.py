@@ -0,0 +1,97 @@
+""" Module to perform unit tests against log replication between brokers """
+import shutil
+import tempfile
+import time
+import unittest
+import zmq
+from src.unit_tests import *
+from src.lib.topic_log import TopicLogStore
+from src.lib.replication import ReplicationLeader, ReplicationFollower
+
+class TestReplication(unittest.TestCase):
+    def setUp(self):
+        self.context = zmq.Context()
+        self.addCleanup(self.context.destroy, linger=0)
+
+    def store(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store = TopicLogStore(directory)
+        self.addCleanup(store.close)
+        return store
+
+    def pair(self, name, leader_store, follower_store, **kwargs):
+        router = self.context.socket(zmq.ROUTER)
+        router.bind(f'inproc://{name}')
+        dealer = self.context.socket(zmq.DEALER)
+        dealer.connect(f'inproc://{name}')
+        leader = ReplicationLeader(router, leader_store, **kwargs)
+        follower = ReplicationFollower(dealer, follower_store)
+        follower.hello()
+        self.wait_for(lambda: leader.handle_messages() is not None and leader.standbys)
+        return leader, follower
+
+    def wait_for(self, condition, timeout=2):
+        deadline = time.time() + timeout
+        while not condition():
+            assert time.time() < deadline, 'timed out'
+            time.sleep(0.001)
+
+    def append(self, store, topic, count):
+        for _ in range(count):
+            store.append(topic, f'{topic}-{store.log(topic).next_offset}'.encode())
+
+    def sync(self, leader, follower, topic, next_offset):
+        """ Stream and apply until the follower's log reaches next_offset """
+        self.wait_for(lambda: leader.stream() is not None and follower.poll(10) is not None
+            and follower.topic_logs.log(topic).next_offset == next_offset)
+
+    def test_stream_from_log(self):
+        leader_store, follower_store = self.store(), self.store()
+        self.append(leader_store, 'A', 300)
+        leader, follower = self.pair('stream', leader_store, follower_store, chunk_bytes=1024)
+        # Existing messages and new ones are sent from the log, in chunks
+        self.append(leader_store, 'A', 50)
+        self.sync(leader, follower, 'A', 350)
+        assert [bytes(r[2]) for r in follower_store.log('A').read(0, 10**6)] == \
+            [f'A-{i}'.encode() for i in range(350)]
+        self.append(leader_store, 'B', 10)
+        self.sync(leader, follower, 'B', 10)
+        assert leader.streamed_count == 360 and not leader.behind
+        # Same offsets and timestamps on both sides
+        assert follower_store.log('A').read(349) == leader_store.log('A').read(349)
+        # Pipelined cumulative acks
+        self.wait_for(lambda: leader.handle_messages() is not None
+            and leader.stats()['lag'][next(iter(leader.acked)).hex()] == {'A': 0, 'B': 0})
+
+    def test_one_mode_holds_until_acked(self):
+        leader_store, follower_store = self.store(), self.store()
+        leader, follower = self.pair('hold', leader_store, follower_store, mode='one', ack_timeout=60)
+        self.append(leader_store, 'A', 3)
+        for offset in range(3):
+            leader.hold('A', offset, offset)
+        assert leader.release() == []
+        self.sync(leader, follower, 'A', 3)
+        released = []
+        self.wait_for(lambda: released.extend(leader.handle_messages()) or len(released) == 3)
+        assert released == [('A', 0), ('A', 1), ('A', 2)]
+        assert leader.released_unacked == 0
+        # Without an ack, a held message is released after ack_timeout
+        leader.hold('A', 3, 3)
+        assert leader.release(now=time.time() + 61) == [('A', 3)]
+        assert leader.released_unacked == 1
+
+    def test_divergent_tail_truncated(self):
+        leader_store, follower_store = self.store(), self.store()
+        self.append(leader_store, 'A', 10)
+        # The standby holds messages the leader never had, e.g. as a previous leader
+        for i in range(15):
+            follower_store.append('A', b'old leader')
+        leader, follower = self.pair('diverge', leader_store, follower_store)
+        self.wait_for(lambda: follower.poll(10) is not None and follower_store.log('A').next_offset == 10)
+        self.append(leader_store, 'A', 1)
+        self.sync(leader, follower, 'A', 11)
+        assert bytes(follower_store.log('A').read(10)[0][2]) == b'A-10'
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+""" Module to perform unit tests against the TopicScheduler used by the broker
+to share the forwarding loop between topics """
+import unittest
+from src.unit_tests import *
+from src.lib.scheduler import TopicScheduler, parse_topic_options
+
+class TestTopicScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = TopicScheduler(
+            topic_priorities={'critical': 0},
+            topic_weights={'heavy': 3},
+            quantum=2
+        )
+
+    def test_parse_topic_options(self):
+        assert parse_topic_options(['A=0', 'B=4']) == {'A': 0, 'B': 4}
+
+    def test_priority_class_served_first(self):
+        for _ in range(3):
+            order = self.scheduler.order(['bulk', 'heavy', 'critical'])
+            assert order[0] == 'critical'
+            assert set(order[1:]) == {'bulk', 'heavy'}
+
+    def test_weighted_budget(self):
+        assert self.scheduler.budget('bulk') == 2
+        assert self.scheduler.budget('heavy') == 6
+
+    def test_deficit_carried_and_reset(self):
+        assert self.scheduler.budget('bulk') == 2
+        # Sent only one message but still has a backlog: keep the credit
+        self.scheduler.charge('bulk', 1, drained=False)
+        assert self.scheduler.budget('bulk') == 3
+        # Ran out of messages: an idle topic does not bank credit
+        self.scheduler.charge('bulk', 1, drained=True)
+        assert self.scheduler.budget('bulk') == 2
+
+    def test_lower_class_waits_for_backlog(self):
+        assert self.scheduler.order(['bulk', 'critical']) == ['critical', 'bulk']
+        # The critical topic used its whole budget and still has messages queued
+        self.scheduler.charge('critical', self.scheduler.budget('critical'), drained=False)
+        assert self.scheduler.blocked('bulk')
+        # Next round it drains: the bulk topic is served after it
+        self.scheduler.order(['bulk', 'critical'])
+        self.scheduler.charge('critical', 1, drained=True)
+        assert not self.scheduler.blocked('bulk')
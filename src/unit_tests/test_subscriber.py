@@ -2,8 +2,15 @@
 execute and can be tested independently of the publish/subscribe network """
 import unittest
 import os
+import time
+import pickle
+import shutil
+import tempfile
+import threading
+import zmq
 from src.unit_tests import *
 from src.lib.subscriber import Subscriber
+from src.lib.broker import Broker
 
 class TestSubscriber(unittest.TestCase):
     def __init__(self, *args, **kwargs):
@@ -55,3 +62,85 @@ class TestSubscriber(unittest.TestCase):
             os.remove(self.filename)
         except:
             assert False
+
+    def test_expired_events_dropped(self):
+        # Events older than the topic TTL are counted and not recorded
+        self.subscriber.topic_ttls = {'A': 1}
+        self.subscriber.context = zmq.Context()
+        self.addCleanup(self.subscriber.context.destroy, linger=0)
+        sender = self.subscriber.context.socket(zmq.PAIR)
+        sender.bind('inproc://ttl-test')
+        self.subscriber.sub_socket_dict['A'] = self.subscriber.context.socket(zmq.PAIR)
+        self.subscriber.sub_socket_dict['A'].connect('inproc://ttl-test')
+        for publish_time in [time.time() - 5, time.time()]:
+            sender.send_multipart([b'A', pickle.dumps(
+                {'publisher': 'p', 'topic': 'A', 'publish_time': publish_time})])
+        assert not self.subscriber.parse_publish_event(topic='A')
+        assert self.subscriber.parse_publish_event(topic='A')
+        assert self.subscriber.expired_counts == {'A': 1}
+        assert len(self.subscriber.received_message_list) == 1
+
+    def test_replay_then_live_without_gaps_or_duplicates(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        context = zmq.Context()
+        self.addCleanup(context.destroy, linger=0)
+        broker = Broker(centralized=True, log_dir=directory)
+        self.addCleanup(broker.topic_logs.close)
+        broker.context = context
+        publisher = context.socket(zmq.PUSH)
+        publisher.bind('inproc://replay-in')
+        broker.receive_socket_dict['A'] = context.socket(zmq.PULL)
+        broker.receive_socket_dict['A'].connect('inproc://replay-in')
+        broker.send_socket_dict['A'] = broker.create_send_socket('A')
+        broker.send_socket_dict['A'].bind('inproc://replay-out')
+        broker.replay_socket = context.socket(zmq.ROUTER)
+        broker.replay_socket.bind('inproc://replay')
+
+        def publish(seqs):
+            for seq in seqs:
+                publisher.send_multipart([b'A', pickle.dumps(
+                    {'publisher': 'p', 'topic': 'A', 'seq': seq, 'publish_time': time.time()})])
+            for _ in seqs:
+                assert broker.receive_socket_dict['A'].poll(1000)
+                broker.send('A')
+
+        # Published while the subscriber was away: only in the log
+        publish(range(100))
+        subscriber = Subscriber(topics=['A'], centralized=True)
+        subscriber.context = context
+        subscriber.replay_socket = context.socket(zmq.REQ)
+        subscriber.replay_socket.connect('inproc://replay')
+        subscriber.replay_chunk_bytes = 1000
+        live = subscriber.sub_socket_dict['A'] = context.socket(zmq.SUB)
+        live.connect('inproc://replay-out')
+        live.setsockopt_string(zmq.SUBSCRIBE, 'A')
+        time.sleep(0.1)
+        # Published after the subscriber connected: both in the log and live
+        publish(range(100, 120))
+
+        stop = threading.Event()
+        def serve():
+            while not stop.is_set():
+                if broker.replay_socket.poll(10):
+                    broker.serve_replay()
+        server = threading.Thread(target=serve)
+        server.start()
+        try:
+            assert subscriber.replay('A', from_offset=0) == 120
+            # The live copies of replayed messages are duplicates
+            while live.poll(100):
+                assert not subscriber.parse_publish_event(topic='A')
+            publish([120, 121])
+            # Message 122 is lost on the live path; 123 reveals the gap
+            publish([122, 123])
+            assert subscriber.parse_publish_event(topic='A')
+            assert subscriber.parse_publish_event(topic='A')
+            live.recv_multipart()
+            assert subscriber.parse_publish_event(topic='A')
+        finally:
+            stop.set()
+            server.join()
+        assert len(subscriber.received_message_list) == 124
+        assert subscriber.next_offsets == {'A': 124}
+        assert subscriber.replayed_counts == {'A': 121}
@@ -0,0 +1,107 @@
+""" Module to perform unit tests against the ZooKeeper topic directory used for
+broker-less discovery in decentralized mode """
+import logging
+import time
+import unittest
+import zmq
+from src.unit_tests import *
+from src.lib.topic_directory import TopicDirectory, advertise_publisher, publishers_path
+from src.lib.subscriber import Subscriber
+from src.lib.zookeeper_client import kazoo_client
+
+class StubZk:
+    """ Children watches and reads of the directory over a dict """
+    def __init__(self):
+        # key = path, value = data
+        self.nodes = {}
+        # key = path, value = children watch function
+        self.watchers = {}
+
+    def ensure_path(self, path):
+        pass
+
+    def get(self, path):
+        return self.nodes[path], None
+
+    def ChildrenWatch(self, path, func):
+        self.watchers[path] = func
+        self.changed(path)
+
+    def changed(self, path):
+        children = [node.rsplit('/', 1)[1] for node in self.nodes if node.startswith(f'{path}/')]
+        if self.watchers[path](children) is False:
+            self.watchers.pop(path)
+
+class TestTopicDirectory(unittest.TestCase):
+
+    def test_publishers_added_and_removed(self):
+        zk = StubZk()
+        path = publishers_path('fleet/a')
+        assert path == '/topics/fleet%2Fa/publishers'
+        zk.nodes[f'{path}/pub-0000000000'] = b'10.0.0.1:5556'
+        changes = []
+        directory = TopicDirectory(zk, ['fleet/a'], lambda *change: changes.append(change))
+        directory.watch()
+        # Publishers advertised before we started watching are reported first
+        assert changes == [('fleet/a', ['10.0.0.1:5556'], [])]
+        zk.nodes[f'{path}/pub-0000000001'] = b'10.0.0.2:5556'
+        zk.changed(path)
+        assert changes[-1] == ('fleet/a', ['10.0.0.2:5556'], [])
+        # The same publisher advertising again under a new session is no change
+        zk.nodes[f'{path}/pub-0000000002'] = b'10.0.0.1:5556'
+        zk.nodes.pop(f'{path}/pub-0000000000')
+        zk.changed(path)
+        assert len(changes) == 2
+        # Its session and ephemeral znodes went away
+        zk.nodes.pop(f'{path}/pub-0000000002')
+        zk.changed(path)
+        assert changes[-1] == ('fleet/a', [], ['10.0.0.1:5556'])
+        assert directory.addresses('fleet/a') == ['10.0.0.2:5556']
+        directory.stop()
+        zk.changed(path)
+        assert path not in zk.watchers
+
+    def test_subscriber_follows_directory_changes(self):
+        context = zmq.Context()
+        self.addCleanup(context.destroy, linger=0)
+        publisher = context.socket(zmq.PUB)
+        port = publisher.bind_to_random_port('tcp://127.0.0.1')
+        subscriber = Subscriber(topics=['A'], use_directory=True)
+        subscriber.logger.setLevel(logging.WARNING)
+        subscriber.context = context
+        subscriber.poller = zmq.Poller()
+        # As reported from the directory's watch thread
+        subscriber.publishers_changed('A', [f'127.0.0.1:{port}'], [])
+        assert subscriber.poll_timeout() == subscriber.directory_poll_interval * 1000
+        subscriber.apply_directory_changes()
+        socket = subscriber.sub_socket_dict['A']
+        deadline = time.time() + 2
+        while not socket.poll(50) and time.time() < deadline:
+            publisher.send_multipart([b'A', b'event'])
+        assert socket.recv_multipart() == [b'A', b'event']
+        subscriber.publishers_changed('A', [], [f'127.0.0.1:{port}'])
+        subscriber.apply_directory_changes()
+        assert not subscriber.directory_changes
+
+    def test_crashed_publisher_removed(self):
+        topic = f'directory-test-{time.time()}'
+        zk = kazoo_client(ZOOKEEPER_HOSTS)
+        zk.start()
+        self.addCleanup(zk.stop)
+        self.addCleanup(zk.delete, publishers_path(topic).rsplit('/', 1)[0], recursive=True)
+        changes = []
+        directory = TopicDirectory(zk, [topic], lambda *change: changes.append(change))
+        directory.watch()
+        publisher = kazoo_client(ZOOKEEPER_HOSTS)
+        publisher.start()
+        advertise_publisher(publisher, topic, '127.0.0.1:6000')
+        deadline = time.time() + 5
+        while not changes and time.time() < deadline:
+            time.sleep(0.01)
+        assert changes == [(topic, ['127.0.0.1:6000'], [])]
+        # Closing the session (like a crash) removes the ephemeral znode
+        publisher.stop()
+        publisher.close()
+        while len(changes) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        assert changes[-1] == (topic, [], ['127.0.0.1:6000'])
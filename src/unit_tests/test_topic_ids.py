@@ -0,0 +1,61 @@
+""" Module to perform unit tests against the compact topic ID table and the
+publish/forward/receive path using topic ID frames """
+import unittest
+import logging
+import pickle
+import time
+import zmq
+from src.unit_tests import *
+from src.lib.topic_ids import TopicIdTable, TOPIC_ID
+from src.lib.broker import Broker
+from src.lib.publisher import Publisher
+from src.lib.subscriber import Subscriber
+
+class TestTopicIds(unittest.TestCase):
+    def test_ids_are_stable_and_fixed_width(self):
+        table = TopicIdTable()
+        ids = table.assign(['fleet/a', 'fleet/b'])
+        assert ids == {'fleet/a': 1, 'fleet/b': 2}
+        # Known topics keep their ID, new ones get the next free one
+        assert table.assign(['fleet/c', 'fleet/a']) == {'fleet/c': 3, 'fleet/a': 1}
+        for topic in ['fleet/a', 'fleet/b', 'fleet/c']:
+            assert len(table.frame(topic)) == TOPIC_ID.size
+            assert table.name(table.frame(topic)) == topic
+        assert table.name(b'\xff\xff\xff\xff') is None
+
+    def test_events_forwarded_by_id(self):
+        topic = 'fleet/region-01/site-003/' + 'x' * 30 + '/sensor-7'
+        context = zmq.Context()
+        self.addCleanup(context.destroy, linger=0)
+        broker = Broker(centralized=True)
+        broker.logger.setLevel(logging.WARNING)
+        broker.context = context
+        broker.poller = zmq.Poller()
+        publisher = Publisher(topics=[topic])
+        publisher.logger.setLevel(logging.WARNING)
+        publisher.pub_socket = context.socket(zmq.PUB)
+        port = publisher.pub_socket.bind_to_random_port('tcp://127.0.0.1')
+        # What the broker hands out when the publisher registers
+        publisher.topic_frames = {topic: broker.topic_ids.frame(topic)}
+        broker.publishers[topic] = [f'127.0.0.1:{port}']
+        broker.update_receive_socket()
+        broker.send_socket_dict[topic] = broker.create_send_socket(topic)
+        broker.send_socket_dict[topic].bind('inproc://topic-ids-out')
+        subscriber = Subscriber(topics=[topic], centralized=True)
+        subscriber.logger.setLevel(logging.WARNING)
+        subscriber.topic_frames = {topic: broker.topic_ids.frame(topic)}
+        subscriber.sub_socket_dict[topic] = context.socket(zmq.SUB)
+        subscriber.sub_socket_dict[topic].connect('inproc://topic-ids-out')
+        subscriber.sub_socket_dict[topic].setsockopt(zmq.SUBSCRIBE, subscriber.topic_filter(topic))
+        time.sleep(0.2)
+
+        event = publisher.generate_publish_event()
+        # The name travels neither as the filter frame nor inside the event
+        assert event[0] == broker.topic_ids.frame(topic)
+        assert 'topic' not in pickle.loads(event[1])
+        publisher.pub_socket.send_multipart(event)
+        assert broker.receive_socket_dict[topic].poll(1000)
+        assert broker.send(topic)
+        assert subscriber.sub_socket_dict[topic].poll(1000)
+        assert subscriber.parse_publish_event(topic=topic)
+        assert subscriber.received_message_list[0]['topic'] == topic
@@ -0,0 +1,120 @@
+""" Module to perform unit tests against the durable memory-mapped topic log """
+import os
+import shutil
+import tempfile
+import unittest
+from src.unit_tests import *
+from src.lib.topic_log import TopicLog, TopicLogStore, RECORD_HEADER
+
+class TestTopicLog(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def fill(self, log, count):
+        for i in range(count):
+            log.append(f'message-{i}'.encode(), timestamp=float(i))
+
+    def test_append_and_read(self):
+        log = TopicLog(self.directory, segment_bytes=1024, index_interval=128)
+        self.addCleanup(log.close)
+        self.fill(log, 200)
+        # Small segments force the log to roll over
+        assert len(log.segments) > 1
+        assert (log.start_offset, log.next_offset) == (0, 200)
+        records = log.read(150, max_bytes=30)
+        assert [offset for offset, _, _ in records] == [150, 151, 152]
+        assert bytes(records[0][2]) == b'message-150'
+        # Reads continue across segment boundaries
+        assert [r[0] for r in log.read(0, max_bytes=10**6)] == list(range(200))
+        assert log.offset_for_time(99.5) == 100
+        assert log.offset_for_time(1000) == 200
+
+    def test_recovery_after_restart(self):
+        log = TopicLog(self.directory, segment_bytes=1024)
+        self.fill(log, 100)
+        log.close()
+        log = TopicLog(self.directory, segment_bytes=1024)
+        self.addCleanup(log.close)
+        assert log.next_offset == 100
+        assert log.append(b'after restart') == 100
+        assert bytes(log.read(100)[0][2]) == b'after restart'
+
+    def test_torn_write_discarded(self):
+        log = TopicLog(self.directory)
+        self.fill(log, 10)
+        segment = log.segments[-1]
+        # Corrupt the payload of the last record, as if the write was interrupted
+        segment.map[segment.size - 1] ^= 0xFF
+        log.close()
+        log = TopicLog(self.directory)
+        self.addCleanup(log.close)
+        assert log.next_offset == 9
+
+    def test_group_commit(self):
+        log = TopicLog(self.directory, fsync_messages=100, fsync_interval=0.05)
+        self.addCleanup(log.close)
+        self.fill(log, 250)
+        assert log.sync_count == 2 and log.unsynced == 50
+        log.maybe_sync(now=log.last_sync + 0.01)
+        assert log.unsynced == 50
+        log.maybe_sync(now=log.last_sync + 0.06)
+        assert log.unsynced == 0 and log.sync_count == 3
+
+    def test_retention(self):
+        log = TopicLog(self.directory, segment_bytes=1024, retention_seconds=50)
+        self.addCleanup(log.close)
+        self.fill(log, 200)
+        segments = len(log.segments)
+        assert log.enforce_retention(now=200) > 0
+        # Only segments whose newest message is older than 150 are gone
+        assert 140 <= log.start_offset <= 150
+        assert len(log.segments) < segments
+        assert len(os.listdir(self.directory)) == len(log.segments)
+        log.retention_bytes = 0
+        log.enforce_retention(now=200)
+        # The active segment is never deleted
+        assert len(log.segments) == 1
+
+    def test_truncate_and_reset(self):
+        log = TopicLog(self.directory, segment_bytes=1024)
+        self.fill(log, 100)
+        log.truncate(60)
+        assert log.next_offset == 60
+        assert log.append(b'new 60') == 60
+        log.close()
+        # The discarded tail does not come back after a restart
+        log = TopicLog(self.directory, segment_bytes=1024)
+        self.addCleanup(log.close)
+        assert log.next_offset == 61
+        assert bytes(log.read(60)[0][2]) == b'new 60'
+        log.reset(500)
+        assert (log.start_offset, log.next_offset) == (500, 500)
+        assert log.append(b'x') == 500
+
+    def test_append_raw(self):
+        source = TopicLog(os.path.join(self.directory, 'source'), segment_bytes=1024)
+        self.addCleanup(source.close)
+        self.fill(source, 100)
+        log = TopicLog(os.path.join(self.directory, 'copy'), segment_bytes=1024)
+        self.addCleanup(log.close)
+        offset = 0
+        while offset < source.next_offset:
+            first_offset, count, chunk = source.read_raw(offset, 300)
+            assert log.append_raw(chunk) == count
+            offset = first_offset + count
+        # Chunks that do not fit roll over to new segments like single appends
+        assert log.next_offset == 100 and len(log.segments) > 1
+        assert log.read(0, 10**6) == source.read(0, 10**6)
+        assert log.offset_for_time(42.5) == 43
+
+    def test_store(self):
+        store = TopicLogStore(self.directory, topics=['A/B'])
+        self.addCleanup(store.close)
+        assert store.append('A/B', b'x') == 0
+        assert store.append('C', b'x') is None
+        assert store.stats()['A/B']['next_offset'] == 1
+        assert os.listdir(self.directory) == ['A%2FB']
+
+if __name__ == '__main__':
+    unittest.main()
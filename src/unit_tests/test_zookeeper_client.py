@@ -1,52 +1,318 @@
 """ Module to perform unit tests against Subscriber class for methods that
 execute and can be tested independently of the publish/subscribe network """
 import unittest
+import logging
 import sys
+import threading
+import time
+import uuid
+from kazoo.client import KazooState
+from kazoo.exceptions import NoNodeError, NodeExistsError, BadVersionError, SessionExpiredError
+from kazoo.handlers.threading import SequentialThreadingHandler
+from kazoo.protocol.states import EventType, WatchedEvent, ZnodeStat
 from src.unit_tests import *
-from src.lib.zookeeper_client import ZookeeperClient
-connected = False
+from src.lib.zookeeper_client import ZookeeperClient, ZookeeperSession, kazoo_client
 class TestZookeeperClient(unittest.TestCase):
-    broker = None
-    def __init__(self, *args, **kwargs):
-        global connected
-        try:
-            zk = ZookeeperClient(zookeeper_hosts=['127.0.0.1:2181'])
-            connected = True
-        except Exception as e:
-            print(e)
-            print("You need to start the ZooKeeper service (port 2181) before running these tests")
-            sys.exit(1)
-        super(TestZookeeperClient, self).__init__(*args, **kwargs)
-
     def setUp(self):
-        self.zookeeper_client = ZookeeperClient(zookeeper_hosts=['127.0.0.1:2181'])
+        # A namespace per test, so tests do not see each other's znodes
+        self.zookeeper_client = ZookeeperClient(zookeeper_hosts=[ZOOKEEPER_HOSTS],
+            namespace=f'test-{uuid.uuid4().hex}')
+        self.zookeeper_client.prefix = {'prefix': 'ZK-TEST'}
+        self.zookeeper_client.logger = logging.getLogger('ZK-TEST')
         self.zookeeper_client.connect_zk()
 
-    @unittest.skipIf(not connected, "Not connected to ZooKeeper. You need to start ZK service.")
+    def tearDown(self):
+        self.zookeeper_client.stop_session()
+        root = kazoo_client(ZOOKEEPER_HOSTS)
+        root.start()
+        root.delete(f'/{self.zookeeper_client.zk_namespace}', recursive=True)
+        root.stop()
+        root.close()
+
     def test_start_session(self):
         assert(self.zookeeper_client.start_session())
 
-    @unittest.skipIf(not connected, "Not connected to ZooKeeper. You need to start ZK service.")
     def test_stop_session(self):
         assert(self.zookeeper_client.start_session())
         assert(self.zookeeper_client.stop_session())
 
-    @unittest.skipIf(not connected, "Not connected to ZooKeeper. You need to start ZK service.")
     def test_close_connection(self):
         assert(self.zookeeper_client.close_connection())
 
-    @unittest.skipIf(not connected, "Not connected to ZooKeeper. You need to start ZK service.")
     def test_create_znode(self):
-        assert(self.zookeeper_client.create_znode())
+        self.zookeeper_client.start_session()
+        assert(self.zookeeper_client.create_znode(znode_value="Test Value"))
+        # Goes with our session, like the leader's
+        zk = self.zookeeper_client.zk
+        assert(zk.exists('/broker').ephemeralOwner == zk.client_id[0])
 
-    @unittest.skipIf(not connected, "Not connected to ZooKeeper. You need to start ZK service.")
     def test_get_znode_value(self):
+        self.zookeeper_client.start_session()
         self.zookeeper_client.create_znode(znode_value="Test Value")
         assert(self.zookeeper_client.get_znode_value() == "Test Value")
 
-    @unittest.skipIf(not connected, "Not connected to ZooKeeper. You need to start ZK service.")
     def test_modify_znode_value(self):
         # Create a znode then set its value
-        self.zookeeper_client.create_znode()
+        self.zookeeper_client.start_session()
+        self.zookeeper_client.create_znode(znode_value="Test Value")
         assert(self.zookeeper_client.modify_znode_value(
             "this is a new value") == "this is a new value")
+
+class StubHandler:
+    """ Runs spawned work inline so watch events are handled deterministically """
+    def __init__(self):
+        self.handler = SequentialThreadingHandler()
+
+    def spawn(self, func, *args):
+        func(*args)
+
+    def async_result(self):
+        return self.handler.async_result()
+
+class StubZk:
+    """ Just enough of KazooClient's async API for the znode cache, over a dict """
+    def __init__(self):
+        self.handler = StubHandler()
+        # key = path, value = (data, ZnodeStat)
+        self.nodes = {}
+        # key = path, value = set of one-shot watchers
+        self.watches = {}
+        self.zxid = 0
+        # (session ID, password); owns the ephemeral znodes created through this stub
+        self.client_id = (1, b'')
+        # Session timeout negotiated with the server, in milliseconds
+        self._session_timeout = 10000
+
+    def add_listener(self, listener):
+        pass
+
+    def result(self, value=None, exception=None):
+        result = self.handler.async_result()
+        if exception is not None:
+            result.set_exception(exception)
+        else:
+            result.set(value)
+        return result
+
+    def fire(self, path, event_type):
+        for watcher in self.watches.pop(path, set()):
+            watcher(WatchedEvent(event_type, KazooState.CONNECTED, path))
+
+    def write(self, path, value, version, owner=None):
+        self.zxid += 1
+        # A znode keeps the zxid of its creation (czxid) and its owner until deleted
+        czxid = self.nodes[path][1].czxid if path in self.nodes else self.zxid
+        if owner is None:
+            owner = self.nodes[path][1].ephemeralOwner if path in self.nodes else 0
+        self.nodes[path] = (value, ZnodeStat(czxid, self.zxid, 0, 0, version, 0, 0, owner, len(value), 0, 0))
+        return self.nodes[path][1]
+
+    def get_async(self, path, watch=None):
+        if path not in self.nodes:
+            return self.result(exception=NoNodeError())
+        if watch is not None:
+            self.watches.setdefault(path, set()).add(watch)
+        return self.result(self.nodes[path])
+
+    def exists_async(self, path, watch=None):
+        if watch is not None:
+            self.watches.setdefault(path, set()).add(watch)
+        return self.result(self.nodes[path][1] if path in self.nodes else None)
+
+    def create_async(self, path, value, ephemeral=False, include_data=False):
+        if path in self.nodes:
+            return self.result(exception=NodeExistsError())
+        stat = self.write(path, value, 0, owner=self.client_id[0] if ephemeral else 0)
+        self.fire(path, EventType.CREATED)
+        return self.result((path, stat) if include_data else path)
+
+    def delete_async(self, path, version=-1):
+        if path not in self.nodes:
+            return self.result(exception=NoNodeError())
+        if version not in (-1, self.nodes[path][1].version):
+            return self.result(exception=BadVersionError())
+        self.nodes.pop(path)
+        self.fire(path, EventType.DELETED)
+        return self.result(True)
+
+    def set_async(self, path, value, version=-1):
+        if path not in self.nodes:
+            return self.result(exception=NoNodeError())
+        current = self.nodes[path][1].version
+        if version not in (-1, current):
+            return self.result(exception=BadVersionError())
+        stat = self.write(path, value, current + 1)
+        self.fire(path, EventType.CHANGED)
+        return self.result(stat)
+
+class TestZnodeCache(unittest.TestCase):
+    def client(self, zk, session=None):
+        client = ZookeeperClient()
+        client.prefix = {'prefix': 'ZK-TEST'}
+        client.logger = logging.getLogger('ZK-TEST')
+        client.zk_session = session or ZookeeperSession(zk)
+        client.zk = zk
+        return client
+
+    def test_watch_serves_reads_and_changes(self):
+        zk = StubZk()
+        zk.write('/broker', b'10.0.0.1,5555,5556', 0)
+        client = self.client(zk)
+        changes = []
+        # Startup: read the broker, then install the watch callback
+        assert client.get_znode_value() == '10.0.0.1,5555,5556'
+        client.watch_znode('/broker', lambda data, stat, event: changes.append((data, event)))
+        assert changes == [(b'10.0.0.1,5555,5556', None)]
+        assert client.get_zk_op_stats()['total'] == 1
+        # Failover: the new value comes with the one read that re-arms the watch
+        writer = self.client(zk)
+        writer.set_znode('/broker', b'10.0.0.2,5555,5556')
+        assert changes[-1][0] == b'10.0.0.2,5555,5556'
+        assert changes[-1][1].type == EventType.CHANGED
+        client.get_znode_value()
+        assert client.znode_value == '10.0.0.2,5555,5556'
+        assert client.get_zk_op_stats()['total'] == 2
+
+    def test_slow_listener_holds_up_only_its_znode(self):
+        zk = StubZk()
+        zk.write('/broker', b'10.0.0.1,5555,5556', 0)
+        zk.write('/config', b'a', 0)
+        session = ZookeeperSession(zk)
+        client = self.client(zk, session)
+        entered = threading.Event()
+        release = threading.Event()
+        def slow_listener(data, stat, event):
+            if event is not None:
+                entered.set()
+                release.wait(5)
+        client.watch_znode('/broker', slow_listener)
+        writer = threading.Thread(target=lambda: self.client(zk).set_znode('/broker', b'10.0.0.2,5555,5556'))
+        writer.start()
+        try:
+            assert entered.wait(5)
+            # Another entity of the session is not held up while the listener runs
+            started = time.time()
+            other = self.client(zk, session)
+            assert other.watch_znode('/config', lambda data, stat, event: None) == zk.nodes['/config']
+            other.zk_session.create_ephemeral_znode('/relays/1', b'x')
+            assert time.time() - started < 1 and not release.is_set()
+        finally:
+            release.set()
+            writer.join(5)
+        assert session.znode_cache['/broker'][0] == b'10.0.0.2,5555,5556'
+
+    def test_conditional_set(self):
+        zk = StubZk()
+        writer = self.client(zk)
+        # Missing znode: created with a single operation
+        assert writer.set_znode('/broker', b'first') is None
+        assert writer.get_zk_op_stats()['create'] == writer.get_zk_op_stats()['total'] == 1
+        standby = self.client(zk)
+        standby.watch_znode('/broker')
+        # Cached version: one conditional set
+        standby.set_znode('/broker', b'second')
+        assert standby.get_zk_op_stats()['set'] == 1
+        # Stale version: the set is refused, the znode read again and overwritten
+        standby.unwatch_znode('/broker')
+        writer.set_znode('/broker', b'third')
+        standby.zk_session.znode_cache['/broker'] = (b'second', zk.nodes['/broker'][1]._replace(version=0))
+        standby.set_znode('/broker', b'fourth')
+        assert zk.nodes['/broker'][0] == b'fourth'
+        assert standby.get_zk_op_stats()['set'] == 3
+
+    def test_entities_share_one_watch(self):
+        zk = StubZk()
+        zk.write('/broker', b'10.0.0.1,5555,5556', 0)
+        session = ZookeeperSession(zk)
+        clients = [self.client(zk, session) for _ in range(3)]
+        changes = []
+        for i, client in enumerate(clients):
+            assert client.get_znode_value() == '10.0.0.1,5555,5556'
+            client.watch_znode('/broker', lambda data, stat, event, i=i: changes.append(i))
+        # One read and one watch serve every entity
+        assert session.stats()['total'] == 1
+        assert len(zk.watches['/broker']) == 1
+        changes.clear()
+        self.client(zk).set_znode('/broker', b'10.0.0.2,5555,5556')
+        assert sorted(changes) == [0, 1, 2]
+        assert session.stats()['total'] == 2
+        # An entity that stops following the znode leaves the others' watch in place
+        clients[0].unwatch_znode('/broker')
+        changes.clear()
+        self.client(zk).set_znode('/broker', b'10.0.0.3,5555,5556')
+        assert sorted(changes) == [1, 2]
+
+    def test_shared_session_per_ensemble(self):
+        first = ZookeeperSession.acquire('10.9.9.9:2181')
+        assert ZookeeperSession.acquire('10.9.9.9:2181') is first
+        assert ZookeeperSession.acquire('10.9.9.8:2181') is not first
+        # Entities asking for another session timeout get a session of their own
+        short = ZookeeperSession.acquire('10.9.9.9:2181', timeout=0.8)
+        assert short is not first
+        short.release()
+        ZookeeperSession.shared[('10.9.9.8:2181', 10.0)].release()
+        first.release()
+        assert ZookeeperSession.shared[('10.9.9.9:2181', 10.0)] is first
+        first.release()
+        assert not ZookeeperSession.shared
+
+    def test_namespaces_get_own_session_and_chroot(self):
+        client = ZookeeperClient(['10.9.9.9:2181', '10.9.9.8:2181'], namespace='/run-1/')
+        assert client.zk_hosts == '10.9.9.9:2181,10.9.9.8:2181/run-1'
+        first = ZookeeperSession.acquire(client.zk_hosts)
+        second = ZookeeperSession.acquire(ZookeeperClient(['10.9.9.9:2181'], namespace='run-2').zk_hosts)
+        plain = ZookeeperSession.acquire(ZookeeperClient(['10.9.9.9:2181']).zk_hosts)
+        assert len({first, second, plain}) == 3
+        assert first.zk.chroot == '/run-1'
+        assert plain.zk.chroot == ''
+        for session in [first, second, plain]:
+            session.release()
+        assert not ZookeeperSession.shared
+
+    def test_broker_epoch_fences_deposed_leader(self):
+        zk = StubZk()
+        # A persistent /broker left by an older version is replaced
+        zk.write('/broker', b'10.0.0.9,5555,5556', 0)
+        leader = self.client(zk)
+        first = leader.zk_session.create_ephemeral_znode('/broker', b'10.0.0.1,5555,5556')
+        client = self.client(zk)
+        assert client.get_znode_value() == '10.0.0.1,5555,5556'
+        assert client.is_new_broker(*zk.nodes['/broker'])
+        assert client.broker_epoch == first.czxid
+        # The leader's session expired; the next leader creates the znode anew
+        zk.nodes.pop('/broker')
+        second = self.client(zk).zk_session.create_ephemeral_znode('/broker', b'10.0.0.2,5555,5556')
+        assert second.czxid > first.czxid
+        # Already following this leader, or a value of the deposed one: not new
+        assert client.is_new_broker(*zk.nodes['/broker'])
+        client.znode_value = '10.0.0.2,5555,5556'
+        assert not client.is_new_broker(*zk.nodes['/broker'])
+        assert not client.is_new_broker(b'10.0.0.1,5555,5556', first)
+
+    def test_ephemeral_znode_of_live_session_is_kept(self):
+        zk = StubZk()
+        # Created by another session that is still alive
+        zk.write('/broker', b'10.0.0.1,5555,5556', 0, owner=7)
+        contender = self.client(zk)
+        created = []
+        creating = threading.Thread(target=lambda: created.append(
+            contender.zk_session.create_ephemeral_znode('/broker', b'10.0.0.2,5555,5556')))
+        creating.start()
+        # Still waiting well past a short session timeout
+        creating.join(0.3)
+        assert creating.is_alive()
+        assert zk.nodes['/broker'][0] == b'10.0.0.1,5555,5556'
+        # The other session expires: its znode goes and ours is created
+        zk.delete_async('/broker')
+        creating.join(5)
+        stat = created[0]
+        assert zk.nodes['/broker'] == (b'10.0.0.2,5555,5556', stat)
+        assert stat.ephemeralOwner == zk.client_id[0]
+        # Our own znode (e.g. from before a retry) is replaced
+        again = contender.zk_session.create_ephemeral_znode('/broker', b'10.0.0.3,5555,5556')
+        assert again.czxid > stat.czxid
+        # Once our own session is lost we stop waiting
+        zk.write('/broker', b'10.0.0.1,5555,5556', 0, owner=7)
+        contender.zk_session.lost = True
+        with self.assertRaises(SessionExpiredError):
+            contender.zk_session.create_ephemeral_znode('/broker', b'10.0.0.2,5555,5556')